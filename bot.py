@@ -1,8 +1,13 @@
+import asyncio
+import functools
 import logging
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from telegram import BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram.ext import (Application, CallbackContext, CommandHandler, ContextTypes, MessageHandler,
+                          CallbackQueryHandler, filters)
 
-from database import create_tables
+from database import create_tables, request_session_scope
 from handlers.start_handler import (start_command, help_command, handle_language_setup,
                                     handle_name_setup, handle_name_input_setup, handle_help_callback,
                                     handle_main_menu_callback, return_to_main_menu, menu_command)
@@ -11,14 +16,22 @@ from handlers.categories_handler import categories_command, handle_categories_ca
 from handlers.stats_handler import stats_command, handle_stats_callback, handle_charts_callback, handle_stats_back
 from handlers.charts_handler import charts_command, handle_charts_callback as handle_new_charts_callback
 from handlers.limits_handler import limits_command, handle_limits_callback
-from handlers.export_handler import export_command
-from handlers.photo_handler import handle_photo, handle_document
+from handlers.export_handler import export_command, handle_export_callback
+from handlers.photo_handler import handle_photo, handle_document, handle_cached_receipt_callback
 from handlers.edit_handler import edit_command, handle_edit_callback
 from handlers.settings_handler import settings_command, handle_settings_callback
 from handlers.notifications_handler import (notifications_command, handle_notifications_callback,
                                             handle_time_input, handle_salary_date_input)
 from handlers.balance_handler import balance_command, handle_balance_callback
 from services.notification_scheduler import NotificationScheduler
+from services.user_profile_cache import user_profile_cache, UserProfile
+from services.chart_render_pool import chart_render_pool
+from services.categorization_cache import categorization_cache
+from services.category_classifier import category_classifier
+from services.category_memory_service import category_keyword_index
+from services.receipt_cache import receipt_cache
+from services.message_dispatcher import message_dispatcher
+from services.update_processor import PerUserUpdateProcessor
 import config
 
 logging.basicConfig(
@@ -30,12 +43,47 @@ logger = logging.getLogger(__name__)
 # Глобальный обработчик транзакций, используется в различных функциях
 transaction_handler = EnhancedTransactionHandler()
 
-import os
 
-if not os.path.exists("/app/data/budget_bot.db"):
-    from database import create_tables
+class BotContext(CallbackContext):
+    """Контекст обработчика с сессией БД и пользователем текущего обновления"""
 
-    create_tables()
+    def __init__(self, application, chat_id=None, user_id=None):
+        super().__init__(application, chat_id=chat_id, user_id=user_id)
+        self.db: Optional[AsyncSession] = None
+        self.current_user: Optional[UserProfile] = None
+
+
+def with_request_scope(callback):
+    """
+    Middleware для обработчика: открывает одну сессию на обновление (одно
+    соединение из пула), берет профиль пользователя из кэша (при промахе -
+    один запрос по telegram_id) и передает их через context.db и
+    context.current_user. Профиль неизменяем: для записи обработчик
+    загружает User через db.get() и сбрасывает кэш.
+    """
+    @functools.wraps(callback)
+    async def wrapper(update, context: BotContext):
+        async with request_session_scope() as db:
+            context.db = db
+            context.current_user = None
+
+            if update.effective_user:
+                context.current_user = await user_profile_cache.get_or_load(db, update.effective_user.id)
+
+            try:
+                return await callback(update, context)
+            finally:
+                context.db = None
+                context.current_user = None
+
+    return wrapper
+
+
+def install_request_scope(application: Application) -> None:
+    """Оборачивает все зарегистрированные обработчики в with_request_scope"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = with_request_scope(handler.callback)
 
 
 async def set_bot_commands(application: Application) -> None:
@@ -52,6 +100,35 @@ async def set_bot_commands(application: Application) -> None:
     await application.bot.set_my_commands(commands)
 
 
+async def start_services(application: Application) -> None:
+    """Запуск фоновых сервисов после инициализации бота"""
+    await set_bot_commands(application)
+
+    message_dispatcher.start(application.bot)
+    scheduler = NotificationScheduler(application.bot, message_dispatcher)
+    application.bot_data['notification_scheduler'] = scheduler
+    application.bot_data['notification_task'] = asyncio.create_task(scheduler.start())
+
+
+async def shutdown_services(application: Application) -> None:
+    """Остановка фоновых сервисов при завершении бота"""
+    scheduler = application.bot_data.pop('notification_scheduler', None)
+    task = application.bot_data.pop('notification_task', None)
+    if scheduler:
+        # Сначала завершается текущий проход, затем освобождаются шарды
+        await scheduler.stop(task)
+    await message_dispatcher.stop()
+    logger.info(f"Исходящие сообщения: {message_dispatcher.stats()}")
+    logger.info(f"Обработка обновлений: {application.update_processor.stats()}")
+
+    chart_render_pool.shutdown()
+    categorization_cache.close()
+    logger.info(f"Кэш категоризации: {categorization_cache.stats()}")
+    logger.info(f"Классификатор категорий: {category_classifier.stats()}")
+    logger.info(f"Индекс памяти категорий: {category_keyword_index.stats()}")
+    logger.info(f"Кэш чеков: {receipt_cache.stats()}")
+
+
 async def handle_callback(update, context):
     """Общий обработчик callback-кнопок"""
     from utils.telegram_utils import safe_answer_callback
@@ -145,6 +222,14 @@ async def handle_callback(update, context):
     # Обработка кнопок баланса
     elif data.startswith("balance_"):
         await handle_balance_callback(update, context)
+    
+    # Обработка выбора формата экспорта
+    elif data.startswith("export_"):
+        await handle_export_callback(update, context)
+    
+    # Повторно присланный чек: добавить распознанное ранее или нет
+    elif data.startswith("receipt_cached_"):
+        await handle_cached_receipt_callback(update, context)
 
 
 def main() -> None:
@@ -154,7 +239,11 @@ def main() -> None:
     application = (
         Application.builder()
         .token(config.TELEGRAM_BOT_TOKEN)
-        .post_init(set_bot_commands)
+        .context_types(ContextTypes(context=BotContext))
+        # Обновления разных пользователей - параллельно, одного пользователя - по очереди
+        .concurrent_updates(PerUserUpdateProcessor(config.CONCURRENT_UPDATES))
+        .post_init(start_services)
+        .post_shutdown(shutdown_services)
         .build()
     )
 
@@ -183,6 +272,9 @@ def main() -> None:
     # Обработчик текстовых сообщений (должен быть последним)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, transaction_handler.handle_message))
 
+    # Сессия БД и пользователь на каждое обновление
+    install_request_scope(application)
+
     application.run_polling()
 
 
@@ -10,4 +10,62 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///budget_bot.db")
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN is required")
 if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY is required")
\ No newline at end of file
+    raise ValueError("OPENAI_API_KEY is required")
+# Параллельная обработка обновлений (services/update_processor.py)
+# Каждое обновление держит соединение из пула БД: не больше pool_size + max_overflow (15 по умолчанию)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "10"))  # обновлений разных пользователей одновременно
+
+# Кэш профилей пользователей (services/user_profile_cache.py)
+USER_PROFILE_CACHE_SIZE = int(os.getenv("USER_PROFILE_CACHE_SIZE", "10000"))
+USER_PROFILE_CACHE_TTL = int(os.getenv("USER_PROFILE_CACHE_TTL", "300"))  # секунды
+
+# Индекс памяти категорий (services/category_memory_service.py)
+CATEGORY_INDEX_MAX_USERS = int(os.getenv("CATEGORY_INDEX_MAX_USERS", "1000"))  # индексов пользователей в памяти
+
+# Экспорт транзакций (services/export_service.py)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))  # строк за одну порцию курсора
+
+# Отрисовка графиков (services/chart_render_pool.py)
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2"))  # процессов в пуле
+CHART_RENDER_QUEUE_SIZE = int(os.getenv("CHART_RENDER_QUEUE_SIZE", "20"))  # графиков в ожидании
+
+# Запросы к OpenAI (services/openai_service.py)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))  # одновременных запросов на процесс
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "20"))  # секунды на попытку (категоризация)
+OPENAI_VISION_TIMEOUT = float(os.getenv("OPENAI_VISION_TIMEOUT", "60"))  # секунды на попытку (чеки)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1"))  # секунды
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))  # секунды
+
+# Кэш ответов OpenAI при категоризации (services/categorization_cache.py)
+CATEGORIZATION_CACHE_PATH = os.getenv("CATEGORIZATION_CACHE_PATH", "llm_cache.db")  # SQLite-файл
+CATEGORIZATION_CACHE_MEMORY_SIZE = int(os.getenv("CATEGORIZATION_CACHE_MEMORY_SIZE", "5000"))  # записей в памяти
+CATEGORIZATION_CACHE_MAX_ROWS = int(os.getenv("CATEGORIZATION_CACHE_MAX_ROWS", "100000"))  # записей на диске
+CATEGORIZATION_CACHE_TTL = int(os.getenv("CATEGORIZATION_CACHE_TTL", str(30 * 86400)))  # секунды
+
+# Локальный классификатор категорий (services/category_classifier.py)
+CLASSIFIER_MIN_DOCUMENTS = int(os.getenv("CLASSIFIER_MIN_DOCUMENTS", "30"))  # описаний в истории до первых предсказаний
+CLASSIFIER_MIN_PROBABILITY = float(os.getenv("CLASSIFIER_MIN_PROBABILITY", "0.9"))
+CLASSIFIER_CACHE_SIZE = int(os.getenv("CLASSIFIER_CACHE_SIZE", "1000"))  # моделей пользователей в памяти
+
+# Подготовка фото чеков перед OpenAI (services/receipt_image_service.py)
+RECEIPT_IMAGE_LONG_EDGE = int(os.getenv("RECEIPT_IMAGE_LONG_EDGE", "1600"))  # пикселей по длинной стороне
+RECEIPT_IMAGE_JPEG_QUALITY = int(os.getenv("RECEIPT_IMAGE_JPEG_QUALITY", "80"))
+RECEIPT_IMAGE_CROP = os.getenv("RECEIPT_IMAGE_CROP", "true").lower() == "true"  # обрезать поля
+
+# Кэш распознанных чеков (services/receipt_cache.py)
+RECEIPT_CACHE_TTL = int(os.getenv("RECEIPT_CACHE_TTL", str(30 * 86400)))  # секунды
+RECEIPT_CACHE_MAX_DISTANCE = int(os.getenv("RECEIPT_CACHE_MAX_DISTANCE", "48"))  # различающихся бит хэша из 1024
+
+# Исходящие сообщения: напоминания и рассылки (services/message_dispatcher.py)
+DISPATCHER_WORKERS = int(os.getenv("DISPATCHER_WORKERS", "4"))  # одновременных отправок
+DISPATCHER_GLOBAL_RATE = float(os.getenv("DISPATCHER_GLOBAL_RATE", "25"))  # сообщений в секунду на бота
+DISPATCHER_CHAT_RATE = float(os.getenv("DISPATCHER_CHAT_RATE", "1"))  # сообщений в секунду в один чат
+DISPATCHER_CHAT_BURST = int(os.getenv("DISPATCHER_CHAT_BURST", "3"))  # сообщений в чат подряд без паузы
+DISPATCHER_MAX_RETRIES = int(os.getenv("DISPATCHER_MAX_RETRIES", "3"))
+DISPATCHER_QUEUE_SIZE = int(os.getenv("DISPATCHER_QUEUE_SIZE", "10000"))
+
+# Несколько экземпляров планировщика уведомлений (services/scheduler_leases.py)
+SCHEDULER_SHARDS = int(os.getenv("SCHEDULER_SHARDS", "16"))  # шардов пользователей (user_id % SCHEDULER_SHARDS)
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "180"))  # секунды; больше интервала проверок (60 с)
+SCHEDULER_WORKER_ID = os.getenv("SCHEDULER_WORKER_ID") or None  # по умолчанию hostname:pid
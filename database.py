@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean, ForeignKey, Time
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, Float, Boolean, ForeignKey, Time, Index, UniqueConstraint
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Optional
 import config
 
 Base = declarative_base()
@@ -28,12 +32,22 @@ class User(Base):
     # Дата зачисления зарплаты
     salary_date = Column(Integer, nullable=True)  # День месяца (1-31)
     
+    # Следующие срабатывания уведомлений в UTC (services/notification_schedule.py),
+    # NULL - уведомление выключено
+    next_daily_reminder_utc = Column(DateTime, nullable=True)
+    next_budget_notification_utc = Column(DateTime, nullable=True)
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     
     transactions = relationship("Transaction", back_populates="user")
     categories = relationship("Category", back_populates="user")
     limits = relationship("Limit", back_populates="user")
-    balance = relationship("Balance", back_populates="user", uselist=False)
+    balances = relationship("Balance", back_populates="user")
+    
+    __table_args__ = (
+        Index("ix_users_next_daily_reminder", "next_daily_reminder_utc"),
+        Index("ix_users_next_budget_notification", "next_budget_notification_utc"),
+    )
 
 class Category(Base):
     __tablename__ = "categories"
@@ -78,6 +92,13 @@ class Transaction(Base):
     user = relationship("User", back_populates="transactions")
     category = relationship("Category", back_populates="transactions")
     subcategory = relationship("Subcategory", back_populates="transactions")
+    
+    # Составные индексы под горячие запросы (статистика, графики, лимиты, напоминания).
+    # Для уже существующих баз их создает миграция в migrations.py
+    __table_args__ = (
+        Index("ix_transactions_user_created", "user_id", "created_at"),
+        Index("ix_transactions_user_category_currency_created", "user_id", "category_id", "currency", "created_at"),
+    )
 
 class Limit(Base):
     __tablename__ = "limits"
@@ -93,17 +114,72 @@ class Limit(Base):
     
     user = relationship("User", back_populates="limits")
     category = relationship("Category")
+    
+    __table_args__ = (
+        Index("ix_limits_user_category", "user_id", "category_id"),
+    )
+
+class SpendCounter(Base):
+    """
+    Сумма расходов по категории за месяц. Поддерживается инкрементально
+    при создании, изменении и удалении транзакций (services/rollup_service.py),
+    чтобы проверка лимита не перечитывала всю историю. Дневные суммы
+    хранятся в daily_rollups.
+    """
+    __tablename__ = "spend_counters"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
+    currency = Column(String, nullable=False)
+    period_type = Column(String, nullable=False)  # month
+    period_start = Column(Date, nullable=False)  # Первое число месяца
+    spent = Column(Float, default=0.0, nullable=False)  # Сумма расходов (положительная)
+    transactions_count = Column(Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "category_id", "currency", "period_type", "period_start",
+                         name="uq_spend_counters_bucket"),
+    )
+
+class DailyRollup(Base):
+    """
+    Дневная сводка транзакций пользователя по категории и валюте.
+    Поддерживается инкрементально при создании, изменении и удалении
+    транзакций (services/rollup_service.py); статистика, графики и
+    уведомления читают ее вместо сырых transactions.
+    """
+    __tablename__ = "daily_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    date = Column(Date, nullable=False)  # Дата created_at транзакций
+    category_id = Column(Integer, nullable=False, default=0)  # 0 - без категории (NULL ломает уникальность)
+    currency = Column(String, nullable=False)
+    expense_sum = Column(Float, default=0.0, nullable=False)  # Сумма расходов (положительная)
+    expense_count = Column(Integer, default=0, nullable=False)
+    income_sum = Column(Float, default=0.0, nullable=False)
+    income_count = Column(Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", "category_id", "currency", name="uq_daily_rollups_key"),
+    )
 
 class Balance(Base):
     __tablename__ = "balances"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), unique=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
     amount = Column(Float, default=0.0)
     currency = Column(String, default="EUR")
     last_updated = Column(DateTime, default=datetime.utcnow)
     
-    user = relationship("User", back_populates="balance")
+    user = relationship("User", back_populates="balances")
+
+    __table_args__ = (
+        # Отдельный баланс в каждой валюте
+        UniqueConstraint("user_id", "currency", name="uq_balances_user_currency"),
+    )
 
 class CategoryMemory(Base):
     __tablename__ = "category_memory"
@@ -119,12 +195,114 @@ class CategoryMemory(Base):
     
     user = relationship("User")
     category = relationship("Category")
+    
+    __table_args__ = (
+        Index("ix_category_memory_user_pattern", "user_id", "description_pattern"),
+    )
+
+class CategoryModel(Base):
+    """
+    Классификатор категорий пользователя (services/category_classifier.py):
+    запись появляется, когда модель обучена на истории; сами счетчики
+    признаков - в category_feature_counts
+    """
+    __tablename__ = "category_models"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    documents = Column(Integer, default=0, nullable=False)  # Сколько описаний в обучении
+    trained_at = Column(DateTime, default=datetime.utcnow)  # Обучение на истории
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class CategoryFeatureCount(Base):
+    """
+    Счетчик признака наивного Байеса в категории пользователя. Дообучение
+    атомарно прибавляет счетчики (INSERT ... ON CONFLICT DO UPDATE), поэтому
+    экземпляры бота не перезаписывают изменения друг друга. Число описаний категории
+    хранится под признаком DOCUMENTS_FEATURE.
+    """
+    __tablename__ = "category_feature_counts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    category_id = Column(Integer, nullable=False)
+    feature = Column(String, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "category_id", "feature", name="uq_category_feature_counts_key"),
+    )
+
+class ReceiptCacheEntry(Base):
+    """
+    Распознанный чек (services/receipt_cache.py): повторно присланное фото
+    находится по file_unique_id Telegram или по перцептивному хэшу
+    изображения без нового запроса к OpenAI
+    """
+    __tablename__ = "receipt_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    file_unique_id = Column(String)  # Идентификатор файла в Telegram (одинаков при пересылке)
+    image_hash = Column(String(256))  # dHash 1024 бита, hex
+    transactions = Column(String, nullable=False)  # JSON распознанных транзакций
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_receipt_cache_user_file", "user_id", "file_unique_id"),
+        Index("ix_receipt_cache_user_created", "user_id", "created_at"),
+    )
+
+class SchedulerWorker(Base):
+    """Живой экземпляр планировщика уведомлений (services/scheduler_leases.py)"""
+    __tablename__ = "scheduler_workers"
+    
+    worker_id = Column(String, primary_key=True)
+    expires_at = Column(DateTime, nullable=False)  # UTC; после этого экземпляр считается упавшим
+
+class SchedulerLease(Base):
+    """Аренда шарда пользователей экземпляром планировщика"""
+    __tablename__ = "scheduler_leases"
+    
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String, nullable=True)  # worker_id или NULL, если шард свободен
+    expires_at = Column(DateTime, nullable=True)  # UTC
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    version = Column(Integer, primary_key=True)  # Номер миграции из migrations.py
+    name = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+def _async_database_url(url: str) -> str:
+    """Подобрать асинхронный драйвер для DATABASE_URL (aiosqlite / asyncpg)"""
+    scheme, separator, rest = url.partition("://")
+    driver = scheme.split("+")[0]
+    
+    if driver == "sqlite":
+        return f"sqlite+aiosqlite{separator}{rest}"
+    if driver in ("postgres", "postgresql"):
+        return f"postgresql+asyncpg{separator}{rest}"
+    return url
 
+# Синхронный движок: миграции, скрипты и тесты
 engine = create_engine(config.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок: обработчики и сервисы бота, запросы не блокируют event loop
+async_engine = create_async_engine(_async_database_url(config.DATABASE_URL))
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False  # Объекты остаются доступны после commit без ленивой подгрузки
+)
+
 def create_tables():
+    from migrations import run_migrations
+    
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 def get_db():
     db = SessionLocal()
@@ -134,4 +312,53 @@ def get_db():
         db.close()
 
 def get_db_session():
-    return SessionLocal()
\ No newline at end of file
+    return SessionLocal()
+
+def get_async_db_session() -> AsyncSession:
+    return AsyncSessionLocal()
+
+def increment_upsert(dialect_name: str, table, key: dict, increments: dict, assignments: Optional[dict] = None):
+    """
+    INSERT ... ON CONFLICT (ключ) DO UPDATE SET колонка = колонка + excluded.колонка.
+    Атомарно прибавляет increments к строке с ключом key, создавая ее при
+    отсутствии; колонки из assignments просто перезаписываются. Поддерживаются
+    PostgreSQL и SQLite (3.24+); на ключевых колонках должно быть уникальное
+    ограничение.
+    """
+    assignments = assignments or {}
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert(table).values(**key, **increments, **assignments)
+    set_ = {name: table.c[name] + stmt.excluded[name] for name in increments}
+    set_.update({name: stmt.excluded[name] for name in assignments})
+    return stmt.on_conflict_do_update(index_elements=list(key), set_=set_)
+
+@asynccontextmanager
+async def async_session_scope(db: Optional[AsyncSession] = None):
+    """
+    Сессия для сервисов: если вызывающий код передал свою сессию (например,
+    сессию запроса из bot.py), используется она, иначе открывается и
+    закрывается собственная.
+    """
+    if db is not None:
+        yield db
+        return
+
+    session = get_async_db_session()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+@asynccontextmanager
+async def request_session_scope():
+    """
+    Сессия на одно обновление Telegram: привязана к одному соединению,
+    которое берется из пула один раз и удерживается до конца обработки.
+    commit() внутри обработчика не возвращает соединение в пул.
+    """
+    async with async_engine.connect() as connection:
+        session = AsyncSessionLocal(bind=connection)
+        try:
+            yield session
+        finally:
+            await session.close()
\ No newline at end of file
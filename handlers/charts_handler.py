@@ -6,8 +6,8 @@ from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_db_session, User
 from services.chart_service import ChartService
+from services.chart_render_pool import ChartRenderQueueFull
 from utils.localization import get_message
 from utils.telegram_utils import safe_edit_message, safe_answer_callback, safe_delete_message
 
@@ -15,78 +15,68 @@ logger = logging.getLogger(__name__)
 
 async def charts_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Главное меню графиков"""
-    user_id = update.effective_user.id
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await update.message.reply_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("🥧 Расходы по категориям", callback_data="chart_pie"),
-             InlineKeyboardButton("📈 Тренд расходов", callback_data="chart_trends")],
-            [InlineKeyboardButton("📊 Сравнение по месяцам", callback_data="chart_monthly")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message = (
-            f"📊 **Графики и статистика**\n\n"
-            f"Выберите тип графика для просмотра:\n\n"
-            f"🥧 **Расходы по категориям** - круговая диаграмма\n"
-            f"📈 **Тренд расходов** - динамика по дням\n"
-            f"📊 **Сравнение по месяцам** - столбчатая диаграмма\n\n"
-            f"Для каждого графика можно выбрать период отображения."
-        )
-        
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await update.message.reply_text(
-            message,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            "Сначала выполните команду /start",
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-    finally:
-        db.close()
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton("🥧 Расходы по категориям", callback_data="chart_pie"),
+         InlineKeyboardButton("📈 Тренд расходов", callback_data="chart_trends")],
+        [InlineKeyboardButton("📊 Сравнение по месяцам", callback_data="chart_monthly")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message = (
+        f"📊 **Графики и статистика**\n\n"
+        f"Выберите тип графика для просмотра:\n\n"
+        f"🥧 **Расходы по категориям** - круговая диаграмма\n"
+        f"📈 **Тренд расходов** - динамика по дням\n"
+        f"📊 **Сравнение по месяцам** - столбчатая диаграмма\n\n"
+        f"Для каждого графика можно выбрать период отображения."
+    )
+    
+    await update.message.reply_text(
+        message,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
 
 async def handle_charts_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка callback-кнопок для графиков"""
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
     data = query.data
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await safe_edit_message(query, "Сначала выполните команду /start", reply_markup=InlineKeyboardMarkup(keyboard))
-            return
-        
-        if data == "chart_pie":
-            context.user_data['chart_type'] = 'pie'
-            await _show_period_selection(query, "🥧 Расходы по категориям")
-        elif data == "chart_trends":
-            context.user_data['chart_type'] = 'trends'
-            await _show_period_selection(query, "📈 Тренд расходов")
-        elif data == "chart_monthly":
-            context.user_data['chart_type'] = 'monthly'
-            await _show_monthly_period_selection(query)
-        elif data.startswith("period_"):
-            await _handle_period_selection(query, context, data)
-        elif data.startswith("monthly_"):
-            await _handle_monthly_period_selection(query, context, data)
-        
-    finally:
-        db.close()
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await safe_edit_message(query, "Сначала выполните команду /start", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+    
+    if data == "chart_pie":
+        context.user_data['chart_type'] = 'pie'
+        await _show_period_selection(query, "🥧 Расходы по категориям")
+    elif data == "chart_trends":
+        context.user_data['chart_type'] = 'trends'
+        await _show_period_selection(query, "📈 Тренд расходов")
+    elif data == "chart_monthly":
+        context.user_data['chart_type'] = 'monthly'
+        await _show_monthly_period_selection(query)
+    elif data.startswith("period_"):
+        await _handle_period_selection(query, context, data)
+    elif data.startswith("monthly_"):
+        await _handle_monthly_period_selection(query, context, data)
+    
 
 async def _show_period_selection(query, chart_name: str):
     """Показать выбор периода для ежедневных графиков"""
@@ -143,15 +133,19 @@ async def _handle_period_selection(query, context: ContextTypes.DEFAULT_TYPE, da
     
     try:
         if chart_type == 'pie':
-            chart_buffer = chart_service.generate_category_pie_chart(
+            chart_buffer = await chart_service.generate_category_pie_chart(
                 user_id=query.from_user.id,
-                period_days=period_days
+                period_days=period_days,
+                db=context.db,
+                user=context.current_user
             )
             chart_name = "расходов по категориям"
         elif chart_type == 'trends':
-            chart_buffer = chart_service.generate_spending_trends_chart(
+            chart_buffer = await chart_service.generate_spending_trends_chart(
                 user_id=query.from_user.id,
-                period_days=period_days
+                period_days=period_days,
+                db=context.db,
+                user=context.current_user
             )
             chart_name = "тренда расходов"
         else:
@@ -176,6 +170,14 @@ async def _handle_period_selection(query, context: ContextTypes.DEFAULT_TYPE, da
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
     
+    except ChartRenderQueueFull:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await safe_edit_message(query,
+            "⏳ Сейчас строится много графиков.\n"
+            "Попробуйте еще раз через минуту.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
     except Exception as e:
         logger.error(f"Ошибка при создании графика: {e}")
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
@@ -197,9 +199,11 @@ async def _handle_monthly_period_selection(query, context: ContextTypes.DEFAULT_
     chart_service = ChartService()
     
     try:
-        chart_buffer = chart_service.generate_monthly_comparison_chart(
+        chart_buffer = await chart_service.generate_monthly_comparison_chart(
             user_id=query.from_user.id,
-            months=months
+            months=months,
+            db=context.db,
+            user=context.current_user
         )
         
         if chart_buffer:
@@ -219,6 +223,14 @@ async def _handle_monthly_period_selection(query, context: ContextTypes.DEFAULT_
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
     
+    except ChartRenderQueueFull:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await safe_edit_message(query,
+            "⏳ Сейчас строится много графиков.\n"
+            "Попробуйте еще раз через минуту.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
     except Exception as e:
         logger.error(f"Ошибка при создании месячного графика: {e}")
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
@@ -235,38 +247,32 @@ async def charts_command_callback(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await safe_edit_message(query, "Сначала выполните команду /start", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton("🥧 Расходы по категориям", callback_data="chart_pie"),
+         InlineKeyboardButton("📈 Тренд расходов", callback_data="chart_trends")],
+        [InlineKeyboardButton("📊 Сравнение по месяцам", callback_data="chart_monthly")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message = (
+        f"📊 **Графики и статистика**\n\n"
+        f"Выберите тип графика для просмотра:\n\n"
+        f"🥧 **Расходы по категориям** - круговая диаграмма\n"
+        f"📈 **Тренд расходов** - динамика по дням\n"
+        f"📊 **Сравнение по месяцам** - столбчатая диаграмма\n\n"
+        f"Для каждого графика можно выбрать период отображения."
+    )
+    
+    await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await safe_edit_message(query, "Сначала выполните команду /start", reply_markup=InlineKeyboardMarkup(keyboard))
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("🥧 Расходы по категориям", callback_data="chart_pie"),
-             InlineKeyboardButton("📈 Тренд расходов", callback_data="chart_trends")],
-            [InlineKeyboardButton("📊 Сравнение по месяцам", callback_data="chart_monthly")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message = (
-            f"📊 **Графики и статистика**\n\n"
-            f"Выберите тип графика для просмотра:\n\n"
-            f"🥧 **Расходы по категориям** - круговая диаграмма\n"
-            f"📈 **Тренд расходов** - динамика по дням\n"
-            f"📊 **Сравнение по месяцам** - столбчатая диаграмма\n\n"
-            f"Для каждого графика можно выбрать период отображения."
-        )
-        
-        await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
-        
-    finally:
-        db.close()
 
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -3,7 +3,10 @@ from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_db_session, User, Category, Transaction
+from sqlalchemy import select
+
+from database import Category, Transaction
+from services.rollup_service import RollupService
 from utils.localization import get_message
 
 logger = logging.getLogger(__name__)
@@ -11,37 +14,32 @@ logger = logging.getLogger(__name__)
 
 async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда /edit для редактирования транзакций"""
-    user_id = update.effective_user.id
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await update.message.reply_text(
-                get_message("start_first", user.language if user else "ru"),
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        # Создаем клавиатуру выбора периода
-        keyboard = [
-            [InlineKeyboardButton(get_message("today", user.language), callback_data="edit_today")],
-            [InlineKeyboardButton(get_message("this_week", user.language), callback_data="edit_week")],
-            [InlineKeyboardButton(get_message("this_month", user.language), callback_data="edit_month")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await update.message.reply_text(
-            f"{get_message('edit_transactions', user.language)}\n\n{get_message('select_period', user.language)}",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            get_message("start_first", user.language if user else "ru"),
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-    finally:
-        db.close()
+        return
+    
+    # Создаем клавиатуру выбора периода
+    keyboard = [
+        [InlineKeyboardButton(get_message("today", user.language), callback_data="edit_today")],
+        [InlineKeyboardButton(get_message("this_week", user.language), callback_data="edit_week")],
+        [InlineKeyboardButton(get_message("this_month", user.language), callback_data="edit_month")],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await update.message.reply_text(
+        f"{get_message('edit_transactions', user.language)}\n\n{get_message('select_period', user.language)}",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
 
 
 async def edit_command_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -49,37 +47,31 @@ async def edit_command_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    user_id = update.effective_user.id
-    
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await query.edit_message_text(
-                get_message("start_first", user.language if user else "ru"),
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        # Создаем клавиатуру выбора периода
-        keyboard = [
-            [InlineKeyboardButton(get_message("today", user.language), callback_data="edit_today")],
-            [InlineKeyboardButton(get_message("this_week", user.language), callback_data="edit_week")],
-            [InlineKeyboardButton(get_message("this_month", user.language), callback_data="edit_month")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await query.edit_message_text(
-            f"{get_message('edit_transactions', user.language)}\n\n{get_message('select_period', user.language)}",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            get_message("start_first", user.language if user else "ru"),
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-    finally:
-        db.close()
+        return
+    
+    # Создаем клавиатуру выбора периода
+    keyboard = [
+        [InlineKeyboardButton(get_message("today", user.language), callback_data="edit_today")],
+        [InlineKeyboardButton(get_message("this_week", user.language), callback_data="edit_week")],
+        [InlineKeyboardButton(get_message("this_month", user.language), callback_data="edit_month")],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        f"{get_message('edit_transactions', user.language)}\n\n{get_message('select_period', user.language)}",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
 
 
 async def handle_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -87,148 +79,144 @@ async def handle_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     
-    user_id = update.effective_user.id
     data = query.data
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await query.edit_message_text(
-                get_message("start_first", user.language if user else "ru"),
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        # Определяем период
-        now = datetime.now()
-        if data == "edit_today":
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            period_name = get_message("today", user.language)
-        elif data == "edit_week":
-            start_date = now - timedelta(days=now.weekday())
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            period_name = get_message("this_week", user.language)
-        elif data == "edit_month":
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            period_name = get_message("this_month", user.language)
-        elif data.startswith("edit_transaction_"):
-            # Редактирование конкретной транзакции
-            transaction_id = int(data.split("_")[2])
-            await show_transaction_edit_options(query, user, transaction_id, db)
-            return
-        elif data.startswith("edit_amount_"):
-            # Изменение суммы
-            transaction_id = int(data.split("_")[2])
-            keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data=f"edit_transaction_{transaction_id}")]]
-            await query.edit_message_text(
-                f"{get_message('enter_new_amount', user.language)}\n\n"
-                f"💡 Или отправьте /cancel для отмены",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='Markdown'
-            )
-            context.user_data['editing_transaction'] = transaction_id
-            return
-        elif data.startswith("delete_transaction_"):
-            # Удаление транзакции - запрос подтверждения
-            transaction_id = int(data.split("_")[2])
-            
-            transaction = db.query(Transaction).filter(
-                Transaction.id == transaction_id,
-                Transaction.user_id == user.id
-            ).first()
-            
-            if not transaction:
-                keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-                await query.edit_message_text(
-                    "Транзакция не найдена.",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-                return
-                
-            # Показываем подтверждение удаления
-            keyboard = [
-                [InlineKeyboardButton("🗑 Да, удалить", callback_data=f"delete_confirm_{transaction_id}")],
-                [InlineKeyboardButton("❌ Отмена", callback_data=f"edit_transaction_{transaction_id}")]
-            ]
-            
-            await query.edit_message_text(
-                f"⚠️ **Подтверждение удаления**\n\n"
-                f"Вы уверены, что хотите удалить транзакцию?\n\n"
-                f"📝 {transaction.description}\n"
-                f"💰 {transaction.amount} {transaction.currency}\n\n"
-                f"Это действие нельзя отменить.",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='Markdown'
-            )
-            return
-            
-        elif data.startswith("delete_confirm_"):
-            # Подтвержденное удаление транзакции
-            transaction_id = int(data.split("_")[2])
-            await delete_transaction(query, user, transaction_id, db)
-            return
-        elif data == "edit_back":
-            context.user_data.pop('editing_transaction', None)
-            await edit_command(update, context)
-            return
-        else:
-            return
+    db = context.db
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await query.edit_message_text(
+            get_message("start_first", user.language if user else "ru"),
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    
+    # Определяем период
+    now = datetime.now()
+    if data == "edit_today":
+        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        period_name = get_message("today", user.language)
+    elif data == "edit_week":
+        start_date = now - timedelta(days=now.weekday())
+        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        period_name = get_message("this_week", user.language)
+    elif data == "edit_month":
+        start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        period_name = get_message("this_month", user.language)
+    elif data.startswith("edit_transaction_"):
+        # Редактирование конкретной транзакции
+        transaction_id = int(data.split("_")[2])
+        await show_transaction_edit_options(query, user, transaction_id, db)
+        return
+    elif data.startswith("edit_amount_"):
+        # Изменение суммы
+        transaction_id = int(data.split("_")[2])
+        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data=f"edit_transaction_{transaction_id}")]]
+        await query.edit_message_text(
+            f"{get_message('enter_new_amount', user.language)}\n\n"
+            f"💡 Или отправьте /cancel для отмены",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        context.user_data['editing_transaction'] = transaction_id
+        return
+    elif data.startswith("delete_transaction_"):
+        # Удаление транзакции - запрос подтверждения
+        transaction_id = int(data.split("_")[2])
         
-        # Получаем транзакции за период
-        transactions = db.query(Transaction).filter(
-            Transaction.user_id == user.id,
-            Transaction.created_at >= start_date
-        ).order_by(Transaction.created_at.desc()).limit(10).all()
+        transaction = (await db.execute(select(Transaction).filter(
+            Transaction.id == transaction_id,
+            Transaction.user_id == user.id
+        ))).scalars().first()
         
-        if not transactions:
+        if not transaction:
+            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
             await query.edit_message_text(
-                f"{period_name}\n\n{get_message('no_transactions', user.language)}",
-                parse_mode='Markdown'
+                "Транзакция не найдена.",
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
             return
-        
-        # Создаем список транзакций для редактирования
-        keyboard = []
-        for transaction in transactions:
-            category = db.query(Category).filter(Category.id == transaction.category_id).first()
             
-            # Форматируем строку транзакции
-            amount_str = f"{abs(transaction.amount)} {transaction.currency}"
-            type_emoji = "💰" if transaction.amount > 0 else "💸"
-            date_str = transaction.created_at.strftime("%d.%m")
-            
-            button_text = f"{type_emoji} {amount_str} - {category.name if category else 'Unknown'} ({date_str})"
-            
-            keyboard.append([
-                InlineKeyboardButton(
-                    button_text, 
-                    callback_data=f"edit_transaction_{transaction.id}"
-                )
-            ])
-        
-        # Кнопка "Назад"
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="edit_back")])
+        # Показываем подтверждение удаления
+        keyboard = [
+            [InlineKeyboardButton("🗑 Да, удалить", callback_data=f"delete_confirm_{transaction_id}")],
+            [InlineKeyboardButton("❌ Отмена", callback_data=f"edit_transaction_{transaction_id}")]
+        ]
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            f"⚠️ **Подтверждение удаления**\n\n"
+            f"Вы уверены, что хотите удалить транзакцию?\n\n"
+            f"📝 {transaction.description}\n"
+            f"💰 {transaction.amount} {transaction.currency}\n\n"
+            f"Это действие нельзя отменить.",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        return
         
+    elif data.startswith("delete_confirm_"):
+        # Подтвержденное удаление транзакции
+        transaction_id = int(data.split("_")[2])
+        await delete_transaction(query, user, transaction_id, db)
+        return
+    elif data == "edit_back":
+        context.user_data.pop('editing_transaction', None)
+        await edit_command(update, context)
+        return
+    else:
+        return
+    
+    # Получаем транзакции за период
+    transactions = (await db.execute(select(Transaction).filter(
+        Transaction.user_id == user.id,
+        Transaction.created_at >= start_date
+    ).order_by(Transaction.created_at.desc()).limit(10))).scalars().all()
+    
+    if not transactions:
         await query.edit_message_text(
-            f"{period_name}\n\n{get_message('select_transaction', user.language)}",
-            reply_markup=reply_markup,
+            f"{period_name}\n\n{get_message('no_transactions', user.language)}",
             parse_mode='Markdown'
         )
+        return
+    
+    # Создаем список транзакций для редактирования
+    keyboard = []
+    for transaction in transactions:
+        category = (await db.execute(select(Category).filter(Category.id == transaction.category_id))).scalars().first()
         
-    finally:
-        db.close()
+        # Форматируем строку транзакции
+        amount_str = f"{abs(transaction.amount)} {transaction.currency}"
+        type_emoji = "💰" if transaction.amount > 0 else "💸"
+        date_str = transaction.created_at.strftime("%d.%m")
+        
+        button_text = f"{type_emoji} {amount_str} - {category.name if category else 'Unknown'} ({date_str})"
+        
+        keyboard.append([
+            InlineKeyboardButton(
+                button_text, 
+                callback_data=f"edit_transaction_{transaction.id}"
+            )
+        ])
+    
+    # Кнопка "Назад"
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="edit_back")])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        f"{period_name}\n\n{get_message('select_transaction', user.language)}",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
 
 
 async def show_transaction_edit_options(query, user, transaction_id: int, db):
     """Показать опции редактирования для конкретной транзакции"""
-    transaction = db.query(Transaction).filter(
+    transaction = (await db.execute(select(Transaction).filter(
         Transaction.id == transaction_id,
         Transaction.user_id == user.id
-    ).first()
+    ))).scalars().first()
     
     if not transaction:
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
@@ -238,7 +226,7 @@ async def show_transaction_edit_options(query, user, transaction_id: int, db):
         )
         return
     
-    category = db.query(Category).filter(Category.id == transaction.category_id).first()
+    category = (await db.execute(select(Category).filter(Category.id == transaction.category_id))).scalars().first()
     
     # Информация о транзакции
     amount_str = f"{abs(transaction.amount)} {transaction.currency}"
@@ -276,10 +264,10 @@ async def show_transaction_edit_options(query, user, transaction_id: int, db):
 
 async def delete_transaction(query, user, transaction_id: int, db):
     """Удалить транзакцию"""
-    transaction = db.query(Transaction).filter(
+    transaction = (await db.execute(select(Transaction).filter(
         Transaction.id == transaction_id,
         Transaction.user_id == user.id
-    ).first()
+    ))).scalars().first()
     
     if not transaction:
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
@@ -294,8 +282,9 @@ async def delete_transaction(query, user, transaction_id: int, db):
     amount = transaction.amount
     currency = transaction.currency
     
-    db.delete(transaction)
-    db.commit()
+    await RollupService().remove_transaction(db, transaction)
+    await db.delete(transaction)
+    await db.commit()
     
     keyboard = [[InlineKeyboardButton("🔙 К редактированию", callback_data="edit_back")]]
     await query.edit_message_text(
@@ -314,7 +303,6 @@ async def handle_new_amount(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     transaction_id = context.user_data['editing_transaction']
-    user_id = update.effective_user.id
     
     try:
         new_amount = float(update.message.text.replace(',', '.'))
@@ -333,13 +321,13 @@ async def handle_new_amount(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
     
-    db = get_db_session()
+    db = context.db
     try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        transaction = db.query(Transaction).filter(
+        user = context.current_user
+        transaction = (await db.execute(select(Transaction).filter(
             Transaction.id == transaction_id,
             Transaction.user_id == user.id
-        ).first()
+        ))).scalars().first()
         
         if not transaction:
             keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
@@ -351,16 +339,17 @@ async def handle_new_amount(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # Сохраняем знак (доход/расход)
         is_income = transaction.amount > 0
+        old_amount = transaction.amount
         transaction.amount = new_amount if is_income else -new_amount
+        await RollupService().change_amount(db, transaction, old_amount)
         
-        db.commit()
+        await db.commit()
         
         await update.message.reply_text(
             f"✅ {get_message('amount_updated', user.language)}: {new_amount} {transaction.currency}"
         )
         
     finally:
-        db.close()
         context.user_data.pop('editing_transaction', None)
 
 
@@ -371,68 +360,63 @@ async def edit_command_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
+    db = context.db
+    user = context.current_user
+    if not user:
+        await safe_edit_message(query, get_message("start_first", user.language if user else "ru"))
+        return
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await safe_edit_message(query, get_message("start_first", user.language if user else "ru"))
-            return
-        
-        # Получаем последние 10 транзакций для редактирования
-        transactions = db.query(Transaction).filter(
-            Transaction.user_id == user.id
-        ).order_by(Transaction.created_at.desc()).limit(10).all()
-        
-        if not transactions:
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await safe_edit_message(query,
-                "📝 **Редактирование транзакций**\n\n"
-                "У вас пока нет транзакций для редактирования.",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            return
-        
-        # Создаем кнопки для каждой транзакции (по 2 в строке)
-        keyboard = []
-        for i in range(0, len(transactions), 2):
-            row = []
-            for j in range(2):
-                if i + j < len(transactions):
-                    transaction = transactions[i + j]
-                    category = db.query(Category).filter(Category.id == transaction.category_id).first()
-                    
-                    # Форматируем дату
-                    date_str = transaction.created_at.strftime("%d.%m")
-                    
-                    # Форматируем сумму
-                    amount_str = f"{transaction.amount:+.0f}"
-                    
-                    # Обрезаем описание
-                    description = transaction.description[:15] + "..." if len(transaction.description) > 15 else transaction.description
-                    
-                    button_text = f"{date_str} {amount_str} {description}"
-                    
-                    row.append(InlineKeyboardButton(
-                        button_text,
-                        callback_data=f"edit_select_{transaction.id}"
-                    ))
-            
-            keyboard.append(row)
-        
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")])
+    # Получаем последние 10 транзакций для редактирования
+    transactions = (await db.execute(select(Transaction).filter(
+        Transaction.user_id == user.id
+    ).order_by(Transaction.created_at.desc()).limit(10))).scalars().all()
+    
+    if not transactions:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await safe_edit_message(query,
             "📝 **Редактирование транзакций**\n\n"
-            "Выберите транзакцию для редактирования:",
+            "У вас пока нет транзакций для редактирования.",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
+        return
+    
+    # Создаем кнопки для каждой транзакции (по 2 в строке)
+    keyboard = []
+    for i in range(0, len(transactions), 2):
+        row = []
+        for j in range(2):
+            if i + j < len(transactions):
+                transaction = transactions[i + j]
+                category = (await db.execute(select(Category).filter(Category.id == transaction.category_id))).scalars().first()
+                
+                # Форматируем дату
+                date_str = transaction.created_at.strftime("%d.%m")
+                
+                # Форматируем сумму
+                amount_str = f"{transaction.amount:+.0f}"
+                
+                # Обрезаем описание
+                description = transaction.description[:15] + "..." if len(transaction.description) > 15 else transaction.description
+                
+                button_text = f"{date_str} {amount_str} {description}"
+                
+                row.append(InlineKeyboardButton(
+                    button_text,
+                    callback_data=f"edit_select_{transaction.id}"
+                ))
         
-    finally:
-        db.close()
\ No newline at end of file
+        keyboard.append(row)
+    
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await safe_edit_message(query,
+        "📝 **Редактирование транзакций**\n\n"
+        "Выберите транзакцию для редактирования:",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
\ No newline at end of file
@@ -3,13 +3,17 @@ from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_db_session, User, Category, Subcategory, Transaction, Limit, Balance
+from sqlalchemy import select
+
+from database import User, Category, Subcategory, Transaction, Limit, Balance
 from services.openai_service import OpenAIService
 from services.category_memory_service import CategoryMemoryService
+from services.category_classifier import category_classifier
 from utils.parsers import parse_transaction
 from utils.localization import get_message
 from services.emoji_service import EmojiService
 from services.balance_service import BalanceService
+from services.rollup_service import RollupService
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +23,7 @@ class EnhancedTransactionHandler:
         self.openai_service = OpenAIService()
         self.memory_service = CategoryMemoryService()
         self.balance_service = BalanceService()
+        self.rollups = RollupService()
     
     def _is_cancel_command(self, text: str) -> bool:
         """Проверка на команду отмены"""
@@ -33,15 +38,6 @@ class EnhancedTransactionHandler:
             reply_markup=None
         )
     
-    async def _get_user_from_telegram_id(self, telegram_id: int) -> User:
-        """Получить пользователя по telegram_id"""
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == telegram_id).first()
-            return user
-        finally:
-            db.close()
-    
     def _get_main_menu_keyboard(self) -> InlineKeyboardMarkup:
         """Получить клавиатуру с кнопкой главного меню"""
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
@@ -187,23 +183,30 @@ class EnhancedTransactionHandler:
         )
         
         db.add(transaction)
-        db.commit()
+        await self.rollups.add_transaction(db, transaction)
+        if not transaction_data['is_income']:
+            # Счетчики классификатора - в той же транзакции, что и трата
+            await category_classifier.learn(transaction_data['user_id'], transaction_data['description'], category.id, db=db)
         
-        # Обновляем баланс для расходов
+        # Обновляем баланс для расходов (одним commit с транзакцией)
         balance = None
         if not transaction_data['is_income']:
-            balance = self.balance_service.subtract_expense(
+            balance = await self.balance_service.subtract_expense(
                 transaction_data['user_id'], 
                 transaction_data['amount'], 
-                transaction_data['currency']
+                transaction_data['currency'],
+                db=db
             )
+        else:
+            await db.commit()
         
         # Запоминаем связь описания с категорией для будущих предложений
-        self.memory_service.remember_category(
+        await self.memory_service.remember_category(
             user_id=transaction_data['user_id'],
             description=transaction_data['description'],
             category_id=category.id,
-            confidence=1.0  # Максимальная уверенность для ручного выбора
+            confidence=1.0,  # Максимальная уверенность для ручного выбора
+            db=db
         )
         
         # Проверка лимитов для расходов
@@ -350,9 +353,9 @@ class EnhancedTransactionHandler:
         text = update.message.text.strip()
         user_id = update.effective_user.id
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = context.current_user
             if not user:
                 await update.message.reply_text(get_message("start_first", "ru"))
                 return
@@ -382,10 +385,10 @@ class EnhancedTransactionHandler:
                     description=description
                 )
                 db.add(transaction)
-                db.commit()
+                await self.rollups.add_transaction(db, transaction)
                 
-                # Добавляем к балансу
-                balance = self.balance_service.add_income(user.id, amount, currency)
+                # Добавляем к балансу (одним commit с транзакцией)
+                balance = await self.balance_service.add_income(user.id, amount, currency, db=db)
                 
                 # Показываем уведомление о добавлении дохода
                 name = user.name or "бро"
@@ -418,12 +421,10 @@ class EnhancedTransactionHandler:
         except Exception as e:
             logger.error(f"Ошибка при обработке сообщения: {e}")
             await update.message.reply_text(get_message("error_occurred", user.language if 'user' in locals() else "ru"))
-        finally:
-            db.close()
 
     async def _suggest_category(self, description: str, user_id: int, db) -> str:
         """Предложение категории с помощью OpenAI"""
-        categories = db.query(Category).filter(Category.user_id == user_id).all()
+        categories = (await db.execute(select(Category).filter(Category.user_id == user_id))).scalars().all()
         
         if not categories:
             return "Прочее"  # Fallback
@@ -431,12 +432,20 @@ class EnhancedTransactionHandler:
         category_names = [cat.name for cat in categories]
         
         # Сначала проверяем память
-        memory_suggestion = self.memory_service.suggest_category(user_id, description)
+        memory_suggestion = await self.memory_service.suggest_category(user_id, description, db=db)
         if memory_suggestion and memory_suggestion.get('confidence', 0) >= 0.8:
             logger.info(f"Найдено в памяти: {memory_suggestion['category_name']} (уверенность: {memory_suggestion['confidence']:.2f})")
             return memory_suggestion['category_name']
         
-        # Если в памяти нет подходящего варианта, используем OpenAI
+        # Затем локальный классификатор, обученный на истории пользователя
+        prediction = await category_classifier.predict(user_id, description, [cat.id for cat in categories], db=db)
+        if prediction:
+            category_id, probability = prediction
+            category_name = next(cat.name for cat in categories if cat.id == category_id)
+            logger.info(f"Категория предложена классификатором: {category_name} (вероятность: {probability:.2f})")
+            return category_name
+        
+        # Если ни память, ни классификатор не уверены, используем OpenAI
         try:
             suggested_category = await self.openai_service.categorize_transaction(
                 description, category_names
@@ -449,7 +458,7 @@ class EnhancedTransactionHandler:
 
     async def _show_category_selection(self, update: Update, suggested_category: str, user, db):
         """Показать диалог выбора категории"""
-        categories = db.query(Category).filter(Category.user_id == user.id).all()
+        categories = (await db.execute(select(Category).filter(Category.user_id == user.id))).scalars().all()
         reply_markup = self._create_category_keyboard(categories, suggested_category)
         
         # Сообщение с предлагаемой категорией
@@ -486,34 +495,31 @@ class EnhancedTransactionHandler:
         transaction_data = context.user_data['pending_transaction']
         category_name = query.data.replace('select_cat_', '')
         
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
-            
-            # Находим категорию
-            category = db.query(Category).filter(
-                Category.user_id == transaction_data['user_id'],
-                Category.name == category_name
-            ).first()
-            
-            if not category:
-                await query.edit_message_text("Категория не найдена.")
-                return
-            
-            # Сохраняем выбранную категорию
-            context.user_data['selected_category'] = category.id
-            
-            # Получаем подкатегории для выбранной категории
-            subcategories = db.query(Subcategory).filter(
-                Subcategory.category_id == category.id,
-                Subcategory.user_id == user.id
-            ).all()
-            
-            # Показываем выбор подкатегории
-            await self._show_subcategory_selection(query, category, subcategories, transaction_data['description'], user, db)
-            
-        finally:
-            db.close()
+        db = context.db
+        user = context.current_user
+        
+        # Находим категорию
+        category = (await db.execute(select(Category).filter(
+            Category.user_id == transaction_data['user_id'],
+            Category.name == category_name
+        ))).scalars().first()
+        
+        if not category:
+            await query.edit_message_text("Категория не найдена.")
+            return
+        
+        # Сохраняем выбранную категорию
+        context.user_data['selected_category'] = category.id
+        
+        # Получаем подкатегории для выбранной категории
+        subcategories = (await db.execute(select(Subcategory).filter(
+            Subcategory.category_id == category.id,
+            Subcategory.user_id == user.id
+        ))).scalars().all()
+        
+        # Показываем выбор подкатегории
+        await self._show_subcategory_selection(query, category, subcategories, transaction_data['description'], user, db)
+        
 
     async def _show_subcategory_selection(self, query, category, subcategories, description, user, db):
         """Показать диалог выбора подкатегории"""
@@ -540,10 +546,10 @@ class EnhancedTransactionHandler:
 
     async def _suggest_subcategory(self, description: str, category_id: int, user_id: int, db) -> str:
         """Предложение подкатегории с помощью OpenAI"""
-        subcategories = db.query(Subcategory).filter(
+        subcategories = (await db.execute(select(Subcategory).filter(
             Subcategory.category_id == category_id,
             Subcategory.user_id == user_id
-        ).all()
+        ))).scalars().all()
         
         if not subcategories:
             return None
@@ -552,7 +558,7 @@ class EnhancedTransactionHandler:
         
         try:
             # Получаем категорию для контекста
-            category = db.query(Category).filter(Category.id == category_id).first()
+            category = (await db.execute(select(Category).filter(Category.id == category_id))).scalars().first()
             category_name = category.name if category else "Неизвестная"
             
             suggested_subcategory = await self.openai_service.categorize_subcategory(
@@ -565,10 +571,10 @@ class EnhancedTransactionHandler:
 
     async def _check_limits(self, user_id: int, category_id: int, amount: float, currency: str, db) -> tuple[str, bool]:
         """Проверка лимитов расходов. Возвращает (warning_message, is_limit_exceeded)"""
-        limits = db.query(Limit).filter(
+        limits = (await db.execute(select(Limit).filter(
             Limit.user_id == user_id,
             Limit.category_id == category_id
-        ).all()
+        ))).scalars().all()
         
         warning_messages = []
         limit_exceeded = False
@@ -580,18 +586,10 @@ class EnhancedTransactionHandler:
             # Определяем период для расчета
             period_start, period_text = self._calculate_limit_period(limit)
             
-            period_expenses = db.query(Transaction).filter(
-                Transaction.user_id == user_id,
-                Transaction.category_id == category_id,
-                Transaction.currency == currency,
-                Transaction.amount < 0,
-                Transaction.created_at >= period_start
-            ).all()
-            
-            total_spent = sum(abs(transaction.amount) for transaction in period_expenses)
+            total_spent = await self.rollups.get_spent_since(db, user_id, category_id, currency, period_start)
             total_spent += amount  # Добавляем текущую трату
             
-            category = db.query(Category).filter(Category.id == category_id).first()
+            category = (await db.execute(select(Category).filter(Category.id == category_id))).scalars().first()
             
             if total_spent > limit.amount:
                 limit_exceeded = True
@@ -611,11 +609,11 @@ class EnhancedTransactionHandler:
     
     async def _get_limit_info(self, user_id: int, category_id: int, currency: str, db) -> str:
         """Получить информацию о лимите для отображения"""
-        limits = db.query(Limit).filter(
+        limits = (await db.execute(select(Limit).filter(
             Limit.user_id == user_id,
             Limit.category_id == category_id,
             Limit.currency == currency
-        ).all()
+        ))).scalars().all()
         
         if not limits:
             return ""
@@ -627,15 +625,7 @@ class EnhancedTransactionHandler:
             period_start, period_text = self._calculate_limit_period(limit)
             
             # Считаем потраченное
-            period_expenses = db.query(Transaction).filter(
-                Transaction.user_id == user_id,
-                Transaction.category_id == category_id,
-                Transaction.currency == currency,
-                Transaction.amount < 0,
-                Transaction.created_at >= period_start
-            ).all()
-            
-            total_spent = sum(abs(transaction.amount) for transaction in period_expenses)
+            total_spent = await self.rollups.get_spent_since(db, user_id, category_id, currency, period_start)
             
             # Формируем информацию о лимите
             limit_emoji = "💳"
@@ -661,15 +651,12 @@ class EnhancedTransactionHandler:
             
             transaction_data = context.user_data.get('pending_transaction')
             if transaction_data:
-                db = get_db_session()
-                try:
-                    user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
-                    if user:
-                        suggested_category = await self._suggest_category(transaction_data['description'], user.id, db)
-                        await self._show_category_selection_from_query(query, suggested_category, user, db)
-                        return
-                finally:
-                    db.close()
+                db = context.db
+                user = context.current_user
+                if user:
+                    suggested_category = await self._suggest_category(transaction_data['description'], user.id, db)
+                    await self._show_category_selection_from_query(query, suggested_category, user, db)
+                    return
             
             await query.edit_message_text("❌ Сессия истекла.")
             return
@@ -690,7 +677,7 @@ class EnhancedTransactionHandler:
 
     async def _show_category_selection_from_query(self, query, suggested_category: str, user, db):
         """Показать диалог выбора категории (из callback query)"""
-        categories = db.query(Category).filter(Category.user_id == user.id).all()
+        categories = (await db.execute(select(Category).filter(Category.user_id == user.id))).scalars().all()
         reply_markup = self._create_category_keyboard(categories, suggested_category)
         
         # Сообщение с предлагаемой категорией
@@ -715,30 +702,26 @@ class EnhancedTransactionHandler:
             await query.edit_message_text("❌ Ошибка: категория не выбрана.")
             return
         
-        db = get_db_session()
-        try:
-            category = db.query(Category).filter(Category.id == selected_category_id).first()
-            if not category:
-                await query.edit_message_text("❌ Ошибка: категория не найдена.")
-                return
-            
-            category_emoji = category.emoji if hasattr(category, 'emoji') and category.emoji else "📁"
-            await query.edit_message_text(
-                f"🏷️ **Создание новой подкатегории**\n\n"
-                f"Категория: {category_emoji} {category.name}\n\n"
-                f"Введите название для новой подкатегории:\n"
-                f"• Максимум 50 символов\n"
-                f"• Название должно быть уникальным в рамках категории\n\n"
-                f"Отправьте /cancel для отмены",
-                parse_mode='Markdown'
-            )
-        finally:
-            db.close()
+        db = context.db
+        category = (await db.execute(select(Category).filter(Category.id == selected_category_id))).scalars().first()
+        if not category:
+            await query.edit_message_text("❌ Ошибка: категория не найдена.")
+            return
+        
+        category_emoji = category.emoji if hasattr(category, 'emoji') and category.emoji else "📁"
+        await query.edit_message_text(
+            f"🏷️ **Создание новой подкатегории**\n\n"
+            f"Категория: {category_emoji} {category.name}\n\n"
+            f"Введите название для новой подкатегории:\n"
+            f"• Максимум 50 символов\n"
+            f"• Название должно быть уникальным в рамках категории\n\n"
+            f"Отправьте /cancel для отмены",
+            parse_mode='Markdown'
+        )
 
     async def handle_subcategory_name_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка ввода названия подкатегории"""
         subcategory_name = update.message.text.strip()
-        user_id = update.effective_user.id
         
         # Проверка на отмену
         if self._is_cancel_command(subcategory_name):
@@ -747,23 +730,20 @@ class EnhancedTransactionHandler:
             # Возвращаем к выбору подкатегории
             selected_category_id = context.user_data.get('selected_category')
             if selected_category_id:
-                db = get_db_session()
-                try:
-                    user = db.query(User).filter(User.telegram_id == user_id).first()
-                    category = db.query(Category).filter(Category.id == selected_category_id).first()
+                db = context.db
+                user = context.current_user
+                category = (await db.execute(select(Category).filter(Category.id == selected_category_id))).scalars().first()
+                
+                if user and category:
+                    subcategories = (await db.execute(select(Subcategory).filter(
+                        Subcategory.category_id == category.id,
+                        Subcategory.user_id == user.id
+                    ))).scalars().all()
                     
-                    if user and category:
-                        subcategories = db.query(Subcategory).filter(
-                            Subcategory.category_id == category.id,
-                            Subcategory.user_id == user.id
-                        ).all()
-                        
-                        transaction_data = context.user_data.get('pending_transaction')
-                        if transaction_data:
-                            await self._show_subcategory_selection_from_message(update, category, subcategories, transaction_data['description'], user, db)
-                            return
-                finally:
-                    db.close()
+                    transaction_data = context.user_data.get('pending_transaction')
+                    if transaction_data:
+                        await self._show_subcategory_selection_from_message(update, category, subcategories, transaction_data['description'], user, db)
+                        return
             
             await update.message.reply_text("❌ Создание подкатегории отменено.")
             return
@@ -781,38 +761,35 @@ class EnhancedTransactionHandler:
             await update.message.reply_text("❌ Ошибка: категория не выбрана.")
             return
         
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                await update.message.reply_text(get_message("start_first", "ru"))
-                return
-            
-            category = db.query(Category).filter(Category.id == selected_category_id).first()
-            if not category:
-                await update.message.reply_text("❌ Категория не найдена.")
-                return
-            
-            # Проверяем, не существует ли уже такая подкатегория
-            existing_subcategory = db.query(Subcategory).filter(
-                Subcategory.user_id == user.id,
-                Subcategory.category_id == selected_category_id,
-                Subcategory.name == subcategory_name
-            ).first()
-            
-            if existing_subcategory:
-                await update.message.reply_text(f"❌ Подкатегория '{subcategory_name}' уже существует в этой категории.")
-                return
-            
-            # Переходим к выбору смайлика
-            context.user_data['new_subcategory_name'] = subcategory_name
-            context.user_data.pop('waiting_for_subcategory_name', None)
-            context.user_data['waiting_for_subcategory_emoji'] = True
-            
-            await self._show_subcategory_emoji_selection(update, subcategory_name, category.name)
-            
-        finally:
-            db.close()
+        db = context.db
+        user = context.current_user
+        if not user:
+            await update.message.reply_text(get_message("start_first", "ru"))
+            return
+        
+        category = (await db.execute(select(Category).filter(Category.id == selected_category_id))).scalars().first()
+        if not category:
+            await update.message.reply_text("❌ Категория не найдена.")
+            return
+        
+        # Проверяем, не существует ли уже такая подкатегория
+        existing_subcategory = (await db.execute(select(Subcategory).filter(
+            Subcategory.user_id == user.id,
+            Subcategory.category_id == selected_category_id,
+            Subcategory.name == subcategory_name
+        ))).scalars().first()
+        
+        if existing_subcategory:
+            await update.message.reply_text(f"❌ Подкатегория '{subcategory_name}' уже существует в этой категории.")
+            return
+        
+        # Переходим к выбору смайлика
+        context.user_data['new_subcategory_name'] = subcategory_name
+        context.user_data.pop('waiting_for_subcategory_name', None)
+        context.user_data['waiting_for_subcategory_emoji'] = True
+        
+        await self._show_subcategory_emoji_selection(update, subcategory_name, category.name)
+        
 
     async def _show_subcategory_emoji_selection(self, update: Update, subcategory_name: str, category_name: str) -> None:
         """Показать выбор смайлика для подкатегории"""
@@ -922,10 +899,10 @@ class EnhancedTransactionHandler:
             await query.edit_message_text("❌ Данные транзакции не найдены.")
             return
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
-            category = db.query(Category).filter(Category.id == selected_category_id).first()
+            user = context.current_user
+            category = (await db.execute(select(Category).filter(Category.id == selected_category_id))).scalars().first()
             
             if not category:
                 await query.edit_message_text("❌ Категория не найдена.")
@@ -934,11 +911,11 @@ class EnhancedTransactionHandler:
             # Находим подкатегорию, если указана
             subcategory = None
             if subcategory_name:
-                subcategory = db.query(Subcategory).filter(
+                subcategory = (await db.execute(select(Subcategory).filter(
                     Subcategory.name == subcategory_name,
                     Subcategory.category_id == selected_category_id,
                     Subcategory.user_id == user.id
-                ).first()
+                ))).scalars().first()
             
             # Создаем и обрабатываем транзакцию
             balance, warning_msg, limit_exceeded, limit_info = await self._create_and_process_transaction(
@@ -967,14 +944,12 @@ class EnhancedTransactionHandler:
                 await query.message.reply_text(warning_msg, parse_mode='Markdown')
             
         finally:
-            db.close()
             context.user_data.pop('pending_transaction', None)
             context.user_data.pop('selected_category', None)
     
     async def handle_limit_edit_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка ввода данных для редактирования лимита"""
         text = update.message.text.strip()
-        user_id = update.effective_user.id
         edit_data = context.user_data.get('editing_limit')
         
         if not edit_data:
@@ -991,9 +966,9 @@ class EnhancedTransactionHandler:
             )
             return
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = context.current_user
             if not user:
                 keyboard = self._get_main_menu_keyboard()
                 await update.message.reply_text(
@@ -1002,10 +977,10 @@ class EnhancedTransactionHandler:
                 )
                 return
             
-            limit = db.query(Limit).filter(
+            limit = (await db.execute(select(Limit).filter(
                 Limit.id == edit_data['limit_id'],
                 Limit.user_id == user.id
-            ).first()
+            ))).scalars().first()
             
             if not limit:
                 keyboard = self._get_main_menu_keyboard()
@@ -1015,7 +990,7 @@ class EnhancedTransactionHandler:
                 )
                 return
             
-            category = db.query(Category).filter(Category.id == limit.category_id).first()
+            category = (await db.execute(select(Category).filter(Category.id == limit.category_id))).scalars().first()
             
             if edit_data['field'] == 'amount':
                 # Обработка изменения суммы
@@ -1037,7 +1012,7 @@ class EnhancedTransactionHandler:
                 # Обновляем лимит
                 limit.amount = amount
                 limit.currency = currency
-                db.commit()
+                await db.commit()
                 
                 period_text = "неделю" if limit.period == "weekly" else "месяц"
                 keyboard = [[InlineKeyboardButton("🔙 К лимитам", callback_data="settings_back")]]
@@ -1051,30 +1026,28 @@ class EnhancedTransactionHandler:
                 
                 
         finally:
-            db.close()
             context.user_data.pop('editing_limit', None)
 
     async def handle_new_category(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка добавления новой категории"""
         category_name = update.message.text.strip()
-        user_id = update.effective_user.id
         
         if len(category_name) > 50:
             await update.message.reply_text("Название категории слишком длинное (максимум 50 символов).")
             return
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = context.current_user
             if not user:
                 await update.message.reply_text(get_message("start_first", user.language if user else "ru"))
                 return
             
             # Проверяем, не существует ли уже такая категория
-            existing_category = db.query(Category).filter(
+            existing_category = (await db.execute(select(Category).filter(
                 Category.user_id == user.id,
                 Category.name == category_name
-            ).first()
+            ))).scalars().first()
             
             if existing_category:
                 await update.message.reply_text(
@@ -1094,7 +1067,7 @@ class EnhancedTransactionHandler:
                 emoji=suggested_emoji
             )
             db.add(new_category)
-            db.commit()
+            await db.commit()
             
             await update.message.reply_text(
                 f"✅ Категория создана!\n\n"
@@ -1103,7 +1076,6 @@ class EnhancedTransactionHandler:
             )
             
         finally:
-            db.close()
             context.user_data['waiting_for_category'] = None
 
     async def handle_new_limit(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1111,7 +1083,6 @@ class EnhancedTransactionHandler:
         from utils.parsers import parse_amount_and_currency
         
         text = update.message.text.strip()
-        user_id = update.effective_user.id
         limit_data = context.user_data.get('waiting_for_limit')
         
         # Поддерживаем старый формат для совместимости
@@ -1140,28 +1111,28 @@ class EnhancedTransactionHandler:
             await update.message.reply_text("Сумма лимита должна быть больше нуля.")
             return
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = context.current_user
             if not user:
                 await update.message.reply_text(get_message("start_first", user.language if user else "ru"))
                 return
             
-            category = db.query(Category).filter(
+            category = (await db.execute(select(Category).filter(
                 Category.id == category_id,
                 Category.user_id == user.id
-            ).first()
+            ))).scalars().first()
             
             if not category:
                 await update.message.reply_text("Категория не найдена.")
                 return
             
             # Проверяем, нет ли уже лимита для этой категории
-            existing_limit = db.query(Limit).filter(
+            existing_limit = (await db.execute(select(Limit).filter(
                 Limit.user_id == user.id,
                 Limit.category_id == category_id,
                 Limit.currency == currency
-            ).first()
+            ))).scalars().first()
             
             if existing_limit:
                 await update.message.reply_text("Для этой категории уже установлен лимит в данной валюте.")
@@ -1178,7 +1149,7 @@ class EnhancedTransactionHandler:
             )
             
             db.add(limit)
-            db.commit()
+            await db.commit()
             
             name = user.name or "бро"
             
@@ -1198,7 +1169,6 @@ class EnhancedTransactionHandler:
             )
             
         finally:
-            db.close()
             context.user_data['waiting_for_limit'] = None
 
     async def _start_category_creation(self, query, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1222,7 +1192,6 @@ class EnhancedTransactionHandler:
     async def handle_category_name_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка ввода названия категории"""
         category_name = update.message.text.strip()
-        user_id = update.effective_user.id
         
         # Проверка на отмену
         if self._is_cancel_command(category_name):
@@ -1234,15 +1203,12 @@ class EnhancedTransactionHandler:
                 context.user_data['pending_transaction'] = transaction_data
                 context.user_data.pop('pending_transaction_backup', None)
                 
-                db = get_db_session()
-                try:
-                    user = db.query(User).filter(User.telegram_id == user_id).first()
-                    if user:
-                        suggested_category = await self._suggest_category(transaction_data['description'], user.id, db)
-                        await self._show_category_selection(update, suggested_category, user, db)
-                        return
-                finally:
-                    db.close()
+                db = context.db
+                user = context.current_user
+                if user:
+                    suggested_category = await self._suggest_category(transaction_data['description'], user.id, db)
+                    await self._show_category_selection(update, suggested_category, user, db)
+                    return
             
             await update.message.reply_text("❌ Создание категории отменено.")
             return
@@ -1255,32 +1221,29 @@ class EnhancedTransactionHandler:
             await update.message.reply_text("❌ Название категории не может быть пустым.")
             return
         
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                await update.message.reply_text(get_message("start_first", "ru"))
-                return
-            
-            # Проверяем, не существует ли уже такая категория
-            existing_category = db.query(Category).filter(
-                Category.user_id == user.id,
-                Category.name == category_name
-            ).first()
-            
-            if existing_category:
-                await update.message.reply_text(f"❌ Категория '{category_name}' уже существует.")
-                return
-            
-            # Переходим к выбору смайлика
-            context.user_data['new_category_name'] = category_name
-            context.user_data.pop('waiting_for_category_name', None)
-            context.user_data['waiting_for_category_emoji'] = True
-            
-            await self._show_emoji_selection(update, category_name)
-            
-        finally:
-            db.close()
+        db = context.db
+        user = context.current_user
+        if not user:
+            await update.message.reply_text(get_message("start_first", "ru"))
+            return
+        
+        # Проверяем, не существует ли уже такая категория
+        existing_category = (await db.execute(select(Category).filter(
+            Category.user_id == user.id,
+            Category.name == category_name
+        ))).scalars().first()
+        
+        if existing_category:
+            await update.message.reply_text(f"❌ Категория '{category_name}' уже существует.")
+            return
+        
+        # Переходим к выбору смайлика
+        context.user_data['new_category_name'] = category_name
+        context.user_data.pop('waiting_for_category_name', None)
+        context.user_data['waiting_for_category_emoji'] = True
+        
+        await self._show_emoji_selection(update, category_name)
+        
 
     async def _show_emoji_selection(self, update: Update, category_name: str) -> None:
         """Показать выбор смайлика для категории"""
@@ -1343,23 +1306,20 @@ class EnhancedTransactionHandler:
             
             selected_category_id = context.user_data.get('selected_category')
             if selected_category_id:
-                db = get_db_session()
-                try:
-                    category = db.query(Category).filter(Category.id == selected_category_id).first()
-                    if category:
-                        category_emoji = category.emoji if hasattr(category, 'emoji') and category.emoji else "📁"
-                        await query.edit_message_text(
-                            f"🏷️ **Создание новой подкатегории**\n\n"
-                            f"Категория: {category_emoji} {category.name}\n\n"
-                            f"Введите название для новой подкатегории:\n"
-                            f"• Максимум 50 символов\n"
-                            f"• Название должно быть уникальным в рамках категории\n\n"
-                            f"Отправьте /cancel для отмены",
-                            parse_mode='Markdown'
-                        )
-                        return
-                finally:
-                    db.close()
+                db = context.db
+                category = (await db.execute(select(Category).filter(Category.id == selected_category_id))).scalars().first()
+                if category:
+                    category_emoji = category.emoji if hasattr(category, 'emoji') and category.emoji else "📁"
+                    await query.edit_message_text(
+                        f"🏷️ **Создание новой подкатегории**\n\n"
+                        f"Категория: {category_emoji} {category.name}\n\n"
+                        f"Введите название для новой подкатегории:\n"
+                        f"• Максимум 50 символов\n"
+                        f"• Название должно быть уникальным в рамках категории\n\n"
+                        f"Отправьте /cancel для отмены",
+                        parse_mode='Markdown'
+                    )
+                    return
             
             await query.edit_message_text("❌ Ошибка: категория не найдена.")
             return
@@ -1373,14 +1333,11 @@ class EnhancedTransactionHandler:
             
             selected_category_id = context.user_data.get('selected_category')
             if selected_category_id:
-                db = get_db_session()
-                try:
-                    category = db.query(Category).filter(Category.id == selected_category_id).first()
-                    if category:
-                        await self._show_subcategory_emoji_selection_from_query(query, subcategory_name, category.name)
-                        return
-                finally:
-                    db.close()
+                db = context.db
+                category = (await db.execute(select(Category).filter(Category.id == selected_category_id))).scalars().first()
+                if category:
+                    await self._show_subcategory_emoji_selection_from_query(query, subcategory_name, category.name)
+                    return
             
             await query.edit_message_text("❌ Ошибка: категория не найдена.")
             return
@@ -1425,20 +1382,19 @@ class EnhancedTransactionHandler:
         """Создать подкатегорию с выбранным смайликом"""
         subcategory_name = context.user_data.get('new_subcategory_name')
         selected_category_id = context.user_data.get('selected_category')
-        user_id = query.from_user.id
         
         if not subcategory_name or not selected_category_id:
             await query.edit_message_text("❌ Ошибка: данные подкатегории не найдены.")
             return
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = context.current_user
             if not user:
                 await query.edit_message_text(get_message("start_first", "ru"))
                 return
             
-            category = db.query(Category).filter(Category.id == selected_category_id).first()
+            category = (await db.execute(select(Category).filter(Category.id == selected_category_id))).scalars().first()
             if not category:
                 await query.edit_message_text("❌ Категория не найдена.")
                 return
@@ -1452,8 +1408,8 @@ class EnhancedTransactionHandler:
             )
             
             db.add(new_subcategory)
-            db.commit()
-            db.refresh(new_subcategory)
+            await db.commit()
+            await db.refresh(new_subcategory)
             
             # Очищаем временные данные
             context.user_data.pop('waiting_for_subcategory_emoji', None)
@@ -1465,8 +1421,6 @@ class EnhancedTransactionHandler:
         except Exception as e:
             logger.error(f"Ошибка при создании подкатегории: {e}")
             await query.edit_message_text(f"❌ Ошибка при создании подкатегории: {str(e)}")
-        finally:
-            db.close()
 
     async def _show_subcategory_emoji_selection_from_query(self, query, subcategory_name: str, category_name: str) -> None:
         """Показать выбор смайлика для подкатегории (из callback query)"""
@@ -1599,15 +1553,14 @@ class EnhancedTransactionHandler:
     async def _create_category_with_emoji(self, query, context: ContextTypes.DEFAULT_TYPE, emoji: str) -> None:
         """Создать категорию с выбранным смайликом"""
         category_name = context.user_data.get('new_category_name')
-        user_id = query.from_user.id
         
         if not category_name:
             await query.edit_message_text("❌ Ошибка: название категории не найдено.")
             return
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
+            user = context.current_user
             if not user:
                 await query.edit_message_text(get_message("start_first", "ru"))
                 return
@@ -1621,8 +1574,8 @@ class EnhancedTransactionHandler:
             )
             
             db.add(new_category)
-            db.commit()
-            db.refresh(new_category)
+            await db.commit()
+            await db.refresh(new_category)
             
             # Очищаем временные данные
             context.user_data.pop('waiting_for_category_emoji', None)
@@ -1646,8 +1599,6 @@ class EnhancedTransactionHandler:
         except Exception as e:
             logger.error(f"Ошибка при создании категории: {e}")
             await query.edit_message_text(f"❌ Ошибка при создании категории: {str(e)}")
-        finally:
-            db.close()
 
     async def _create_transaction_with_category(self, query, context: ContextTypes.DEFAULT_TYPE, category: Category) -> None:
         """Создать транзакцию с выбранной категорией"""
@@ -1656,9 +1607,9 @@ class EnhancedTransactionHandler:
             await query.edit_message_text("❌ Данные транзакции не найдены.")
             return
         
-        db = get_db_session()
+        db = context.db
         try:
-            user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
+            user = context.current_user
             
             # Создаем и обрабатываем транзакцию
             balance, warning_msg, limit_exceeded, limit_info = await self._create_and_process_transaction(
@@ -1687,5 +1638,4 @@ class EnhancedTransactionHandler:
                 await query.message.reply_text(warning_msg, parse_mode='Markdown')
             
         finally:
-            db.close()
             context.user_data.pop('pending_transaction', None)
\ No newline at end of file
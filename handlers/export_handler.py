@@ -1,23 +1,73 @@
 import logging
-import pandas as pd
-import io
+import os
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_db_session, User, Category, Transaction
+from sqlalchemy import select
+
+from database import Transaction
+from services.export_service import ExportService, FORMATS, XLSX, CSV, CSV_GZ
 from utils.telegram_utils import safe_edit_message, safe_answer_callback
 
 logger = logging.getLogger(__name__)
 
+# Аргумент команды /export -> формат
+COMMAND_FORMATS = {
+    "xlsx": XLSX,
+    "excel": XLSX,
+    "csv": CSV,
+    "gz": CSV_GZ,
+    "csv.gz": CSV_GZ,
+    "csvgz": CSV_GZ,
+}
+
+
+async def _send_export(message, context: ContextTypes.DEFAULT_TYPE, export_format: str) -> None:
+    """Потоковый экспорт транзакций пользователя и отправка файла"""
+    db = context.db
+    user = context.current_user
+    
+    has_transactions = (await db.execute(select(Transaction.id).filter(
+        Transaction.user_id == user.id
+    ).limit(1))).first()
+    
+    if not has_transactions:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await message.reply_text(
+            "У вас нет транзакций для экспорта.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    
+    await message.reply_text("📊 Подготавливаю экспорт данных...")
+    
+    result = await ExportService().export(user.id, export_format, db=db)
+    try:
+        current_date = datetime.now().strftime('%Y-%m-%d')
+        format_name = FORMATS[export_format][1]
+        
+        # Отправляем файл с диска, не загружая его в память целиком
+        with open(result.path, 'rb') as document:
+            await message.reply_document(
+                document=document,
+                filename=result.filename,
+                caption=f"📊 **Экспорт данных: {format_name}**\n\n"
+                        f"Файл содержит все ваши транзакции"
+                        f"{' и статистику' if export_format == XLSX else ''}.\n"
+                        f"Количество транзакций: {result.transactions_count}\n"
+                        f"Дата экспорта: {current_date}",
+                parse_mode='Markdown'
+            )
+    finally:
+        os.remove(result.path)
+
 
 async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка команды /export"""
-    user_id = update.effective_user.id
+    """Обработка команды /export [xlsx|csv|gz]"""
     
-    db = get_db_session()
     try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
+        user = context.current_user
         if not user:
             keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
             await update.message.reply_text(
@@ -26,83 +76,15 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return
         
-        # Получаем все транзакции пользователя
-        transactions = db.query(Transaction).filter(Transaction.user_id == user.id).all()
-        
-        if not transactions:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        requested = context.args[0].lower() if context.args else "xlsx"
+        export_format = COMMAND_FORMATS.get(requested)
+        if not export_format:
             await update.message.reply_text(
-                "У вас нет транзакций для экспорта.",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                "Неизвестный формат. Используйте: /export, /export csv или /export gz"
             )
             return
-            
-        await update.message.reply_text("📊 Подготавливаю экспорт данных...")
-        
-        # Создаем DataFrame для экспорта
-        data = []
-        for transaction in transactions:
-            category = db.query(Category).filter(Category.id == transaction.category_id).first()
-            
-            data.append({
-                'Дата': transaction.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'Тип': 'Доход' if transaction.amount > 0 else 'Расход',
-                'Сумма': abs(transaction.amount),
-                'Валюта': transaction.currency,
-                'Категория': category.name if category else 'Неизвестно',
-                'Описание': transaction.description
-            })
-        
-        df = pd.DataFrame(data)
         
-        # Создаем Excel файл в памяти
-        excel_buffer = io.BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            # Основной лист с транзакциями
-            df.to_excel(writer, sheet_name='Транзакции', index=False)
-            
-            # Лист со статистикой
-            stats_data = []
-            
-            # Общая статистика по валютам
-            stats_data.append({
-                'Показатель': 'Общий доход',
-                'EUR': df[(df['Тип'] == 'Доход') & (df['Валюта'] == 'EUR')]['Сумма'].sum(),
-                'USD': df[(df['Тип'] == 'Доход') & (df['Валюта'] == 'USD')]['Сумма'].sum()
-            })
-            
-            stats_data.append({
-                'Показатель': 'Общие расходы',
-                'EUR': df[(df['Тип'] == 'Расход') & (df['Валюта'] == 'EUR')]['Сумма'].sum(),
-                'USD': df[(df['Тип'] == 'Расход') & (df['Валюта'] == 'USD')]['Сумма'].sum()
-            })
-            
-            # Статистика по категориям
-            category_stats = df[df['Тип'] == 'Расход'].groupby('Категория')['Сумма'].sum().reset_index()
-            category_stats = category_stats.sort_values('Сумма', ascending=False)
-            
-            stats_df = pd.DataFrame(stats_data)
-            stats_df.to_excel(writer, sheet_name='Статистика', index=False)
-            
-            if not category_stats.empty:
-                category_stats.to_excel(writer, sheet_name='По категориям', index=False)
-        
-        excel_buffer.seek(0)
-        
-        # Создаем имя файла
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        filename = f"budget_export_{current_date}.xlsx"
-        
-        # Отправляем файл пользователю
-        await update.message.reply_document(
-            document=excel_buffer.getvalue(),
-            filename=filename,
-            caption=f"📊 **Экспорт данных**\n\n"
-                    f"Файл содержит все ваши транзакции и статистику.\n"
-                    f"Количество транзакций: {len(transactions)}\n"
-                    f"Дата экспорта: {current_date}",
-            parse_mode='Markdown'
-        )
+        await _send_export(update.message, context, export_format)
         
     except Exception as e:
         logger.error(f"Ошибка при экспорте: {e}")
@@ -111,8 +93,6 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "Произошла ошибка при создании экспорта. Попробуйте позже.",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-    finally:
-        db.close()
 
 
 async def export_command_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -120,13 +100,42 @@ async def export_command_callback(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await safe_answer_callback(query)
     
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]]
+    keyboard = [
+        [InlineKeyboardButton("📗 Excel", callback_data="export_xlsx")],
+        [InlineKeyboardButton("📄 CSV", callback_data="export_csv"),
+         InlineKeyboardButton("🗜 CSV (gzip)", callback_data="export_csv_gz")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+    ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await safe_edit_message(query,
         "📤 **Экспорт данных**\n\n"
-        "Экспорт данных пока доступен только через команду /export\n\n"
-        "Используйте команду /export для получения Excel файла с вашими транзакциями.",
+        "Выберите формат файла. CSV (gzip) - самый компактный вариант для большой истории.\n\n"
+        "Также можно использовать команды /export, /export csv и /export gz.",
         reply_markup=reply_markup,
         parse_mode='Markdown'
-    )
\ No newline at end of file
+    )
+
+
+async def handle_export_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка выбора формата экспорта"""
+    query = update.callback_query
+    await safe_answer_callback(query)
+    
+    export_format = query.data[len("export_"):]
+    if export_format not in FORMATS:
+        return
+    
+    if not context.current_user:
+        await safe_edit_message(query, "Сначала выполните команду /start")
+        return
+    
+    try:
+        await _send_export(query.message, context, export_format)
+    except Exception as e:
+        logger.error(f"Ошибка при экспорте: {e}")
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await query.message.reply_text(
+            "Произошла ошибка при создании экспорта. Попробуйте позже.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
@@ -7,7 +7,9 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import pytz
 
-from database import get_db_session, User
+from database import User
+from services.notification_schedule import refresh_notification_schedule
+from services.user_profile_cache import user_profile_cache
 from utils.localization import get_message
 from utils.telegram_utils import safe_edit_message, safe_answer_callback
 
@@ -15,95 +17,85 @@ logger = logging.getLogger(__name__)
 
 async def notifications_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Главное меню настроек уведомлений"""
-    user_id = update.effective_user.id
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await update.message.reply_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        # Статус настроек
-        daily_status = "✅ Включено" if user.daily_reminder_enabled else "❌ Выключено"
-        budget_status = "✅ Включено" if user.budget_notifications_enabled else "❌ Выключено"
-        
-        daily_time = user.daily_reminder_time.strftime("%H:%M") if user.daily_reminder_time else "не установлено"
-        budget_time = user.budget_notification_time.strftime("%H:%M") if user.budget_notification_time else "не установлено"
-        
-        salary_date = f"{user.salary_date} числа" if user.salary_date else "не установлена"
-        
-        keyboard = [
-            [InlineKeyboardButton("📅 Напоминания о тратах", callback_data="notif_daily")],
-            [InlineKeyboardButton("💰 Уведомления о бюджете", callback_data="notif_budget")],
-            [InlineKeyboardButton("💵 Дата зарплаты", callback_data="notif_salary")],
-            [InlineKeyboardButton("🌍 Часовой пояс", callback_data="notif_timezone")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message = (
-            f"🔔 **Настройки уведомлений**\n\n"
-            f"📅 **Напоминания о тратах**: {daily_status}\n"
-            f"⏰ Время: {daily_time}\n\n"
-            f"💰 **Уведомления о бюджете**: {budget_status}\n"
-            f"⏰ Время: {budget_time}\n"
-            f"📊 Частота: {user.budget_notification_frequency}\n\n"
-            f"💵 **Дата зарплаты**: {salary_date}\n"
-            f"🌍 **Часовой пояс**: {user.timezone}\n\n"
-            f"Выберите настройку для изменения:"
-        )
-        
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await update.message.reply_text(
-            message,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            "Сначала выполните команду /start",
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-    finally:
-        db.close()
+        return
+    
+    # Статус настроек
+    daily_status = "✅ Включено" if user.daily_reminder_enabled else "❌ Выключено"
+    budget_status = "✅ Включено" if user.budget_notifications_enabled else "❌ Выключено"
+    
+    daily_time = user.daily_reminder_time.strftime("%H:%M") if user.daily_reminder_time else "не установлено"
+    budget_time = user.budget_notification_time.strftime("%H:%M") if user.budget_notification_time else "не установлено"
+    
+    salary_date = f"{user.salary_date} числа" if user.salary_date else "не установлена"
+    
+    keyboard = [
+        [InlineKeyboardButton("📅 Напоминания о тратах", callback_data="notif_daily")],
+        [InlineKeyboardButton("💰 Уведомления о бюджете", callback_data="notif_budget")],
+        [InlineKeyboardButton("💵 Дата зарплаты", callback_data="notif_salary")],
+        [InlineKeyboardButton("🌍 Часовой пояс", callback_data="notif_timezone")],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message = (
+        f"🔔 **Настройки уведомлений**\n\n"
+        f"📅 **Напоминания о тратах**: {daily_status}\n"
+        f"⏰ Время: {daily_time}\n\n"
+        f"💰 **Уведомления о бюджете**: {budget_status}\n"
+        f"⏰ Время: {budget_time}\n"
+        f"📊 Частота: {user.budget_notification_frequency}\n\n"
+        f"💵 **Дата зарплаты**: {salary_date}\n"
+        f"🌍 **Часовой пояс**: {user.timezone}\n\n"
+        f"Выберите настройку для изменения:"
+    )
+    
+    await update.message.reply_text(
+        message,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
 
 async def handle_notifications_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка callback-кнопок для настроек уведомлений"""
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
     data = query.data
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await safe_edit_message(query, "Сначала выполните команду /start")
-            return
-        
-        if data == "notif_daily":
-            await _show_daily_reminder_settings(query, user)
-        elif data == "notif_budget":
-            await _show_budget_notification_settings(query, user)
-        elif data == "notif_salary":
-            await _show_salary_date_settings(query, user)
-        elif data == "notif_timezone":
-            await _show_timezone_settings(query, user)
-        elif data == "notif_back":
-            await _show_main_notifications_menu(query, user)
-        elif data.startswith("daily_"):
-            await _handle_daily_reminder_callback(query, context, user, data)
-        elif data.startswith("budget_"):
-            await _handle_budget_notification_callback(query, context, user, data)
-        elif data.startswith("salary_"):
-            await _handle_salary_date_callback(query, context, user, data)
-        elif data.startswith("tz_"):
-            await _handle_timezone_callback(query, context, user, data)
-        
-    finally:
-        db.close()
+    user = context.current_user
+    if not user:
+        await safe_edit_message(query, "Сначала выполните команду /start")
+        return
+    
+    if data == "notif_daily":
+        await _show_daily_reminder_settings(query, user)
+    elif data == "notif_budget":
+        await _show_budget_notification_settings(query, user)
+    elif data == "notif_salary":
+        await _show_salary_date_settings(query, user)
+    elif data == "notif_timezone":
+        await _show_timezone_settings(query, user)
+    elif data == "notif_back":
+        await _show_main_notifications_menu(query, user)
+    elif data.startswith("daily_"):
+        await _handle_daily_reminder_callback(query, context, user, data)
+    elif data.startswith("budget_"):
+        await _handle_budget_notification_callback(query, context, user, data)
+    elif data.startswith("salary_"):
+        await _handle_salary_date_callback(query, context, user, data)
+    elif data.startswith("tz_"):
+        await _handle_timezone_callback(query, context, user, data)
+    
 
 async def _show_daily_reminder_settings(query, user: User):
     """Показать настройки напоминаний о тратах"""
@@ -221,72 +213,68 @@ async def _show_timezone_settings(query, user: User):
 
 async def _handle_daily_reminder_callback(query, context: ContextTypes.DEFAULT_TYPE, user: User, data: str):
     """Обработка callback для напоминаний о тратах"""
-    db = get_db_session()
-    try:
-        # Получаем пользователя в текущей сессии
-        current_user = db.query(User).filter(User.telegram_id == user.telegram_id).first()
-        if not current_user:
-            return
-            
-        if data == "daily_toggle":
-            current_user.daily_reminder_enabled = not current_user.daily_reminder_enabled
-            db.commit()
-            await _show_daily_reminder_settings(query, current_user)
-        elif data == "daily_time":
-            context.user_data['setting_daily_time'] = True
-            await safe_edit_message(query,
-                "⏰ **Установка времени напоминания**\n\n"
-                "Отправьте время в формате ЧЧ:ММ (например, 20:00)\n\n"
-                "Отправьте /cancel для отмены",
-                parse_mode='Markdown'
-            )
-    finally:
-        db.close()
+    db = context.db
+    # Профиль из кэша неизменяем, для записи загружаем пользователя из БД
+    current_user = await db.get(User, user.id)
+        
+    if data == "daily_toggle":
+        current_user.daily_reminder_enabled = not current_user.daily_reminder_enabled
+        refresh_notification_schedule(current_user)
+        await db.commit()
+        user_profile_cache.invalidate(current_user.telegram_id)
+        await _show_daily_reminder_settings(query, current_user)
+    elif data == "daily_time":
+        context.user_data['setting_daily_time'] = True
+        await safe_edit_message(query,
+            "⏰ **Установка времени напоминания**\n\n"
+            "Отправьте время в формате ЧЧ:ММ (например, 20:00)\n\n"
+            "Отправьте /cancel для отмены",
+            parse_mode='Markdown'
+        )
 
 async def _handle_budget_notification_callback(query, context: ContextTypes.DEFAULT_TYPE, user: User, data: str):
     """Обработка callback для уведомлений о бюджете"""
-    db = get_db_session()
-    try:
-        # Получаем пользователя в текущей сессии
-        current_user = db.query(User).filter(User.telegram_id == user.telegram_id).first()
-        if not current_user:
-            return
-            
-        if data == "budget_toggle":
-            current_user.budget_notifications_enabled = not current_user.budget_notifications_enabled
-            db.commit()
-            await _show_budget_notification_settings(query, current_user)
-        elif data == "budget_time":
-            context.user_data['setting_budget_time'] = True
-            await safe_edit_message(query,
-                "⏰ **Установка времени уведомлений**\n\n"
-                "Отправьте время в формате ЧЧ:ММ (например, 09:00)\n\n"
-                "Отправьте /cancel для отмены",
-                parse_mode='Markdown'
-            )
-        elif data == "budget_frequency":
-            keyboard = [
-                [InlineKeyboardButton("📅 Ежедневно", callback_data="budget_freq_daily")],
-                [InlineKeyboardButton("📅 Еженедельно", callback_data="budget_freq_weekly")],
-                [InlineKeyboardButton("❌ Выключить", callback_data="budget_freq_none")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="settings_back")]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await safe_edit_message(query,
-                "📊 **Частота уведомлений о бюджете**\n\n"
-                "Выберите как часто получать уведомления:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        elif data.startswith("budget_freq_"):
-            frequency = data.replace("budget_freq_", "")
-            current_user.budget_notification_frequency = frequency
-            db.commit()
-            await _show_budget_notification_settings(query, current_user)
-    finally:
-        db.close()
+    db = context.db
+    # Профиль из кэша неизменяем, для записи загружаем пользователя из БД
+    current_user = await db.get(User, user.id)
+        
+    if data == "budget_toggle":
+        current_user.budget_notifications_enabled = not current_user.budget_notifications_enabled
+        refresh_notification_schedule(current_user)
+        await db.commit()
+        user_profile_cache.invalidate(current_user.telegram_id)
+        await _show_budget_notification_settings(query, current_user)
+    elif data == "budget_time":
+        context.user_data['setting_budget_time'] = True
+        await safe_edit_message(query,
+            "⏰ **Установка времени уведомлений**\n\n"
+            "Отправьте время в формате ЧЧ:ММ (например, 09:00)\n\n"
+            "Отправьте /cancel для отмены",
+            parse_mode='Markdown'
+        )
+    elif data == "budget_frequency":
+        keyboard = [
+            [InlineKeyboardButton("📅 Ежедневно", callback_data="budget_freq_daily")],
+            [InlineKeyboardButton("📅 Еженедельно", callback_data="budget_freq_weekly")],
+            [InlineKeyboardButton("❌ Выключить", callback_data="budget_freq_none")],
+            [InlineKeyboardButton("🔙 Назад", callback_data="settings_back")]
+        ]
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await safe_edit_message(query,
+            "📊 **Частота уведомлений о бюджете**\n\n"
+            "Выберите как часто получать уведомления:",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    elif data.startswith("budget_freq_"):
+        frequency = data.replace("budget_freq_", "")
+        current_user.budget_notification_frequency = frequency
+        refresh_notification_schedule(current_user)
+        await db.commit()
+        user_profile_cache.invalidate(current_user.telegram_id)
+        await _show_budget_notification_settings(query, current_user)
 
 async def _handle_salary_date_callback(query, context: ContextTypes.DEFAULT_TYPE, user: User, data: str):
     """Обработка callback для даты зарплаты"""
@@ -305,18 +293,15 @@ async def _handle_timezone_callback(query, context: ContextTypes.DEFAULT_TYPE, u
     if data.startswith("tz_"):
         timezone = data.replace("tz_", "")
         
-        db = get_db_session()
-        try:
-            # Получаем пользователя в текущей сессии
-            current_user = db.query(User).filter(User.telegram_id == user.telegram_id).first()
-            if not current_user:
-                return
-                
-            current_user.timezone = timezone
-            db.commit()
-            await _show_timezone_settings(query, current_user)
-        finally:
-            db.close()
+        db = context.db
+        # Профиль из кэша неизменяем, для записи загружаем пользователя из БД
+        current_user = await db.get(User, user.id)
+            
+        current_user.timezone = timezone
+        refresh_notification_schedule(current_user)
+        await db.commit()
+        user_profile_cache.invalidate(current_user.telegram_id)
+        await _show_timezone_settings(query, current_user)
 
 async def _show_main_notifications_menu(query, user: User):
     """Показать главное меню настроек уведомлений"""
@@ -354,7 +339,6 @@ async def _show_main_notifications_menu(query, user: User):
 
 async def handle_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE, setting_type: str) -> None:
     """Обработка ввода времени"""
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     # Проверка на отмену
@@ -377,36 +361,35 @@ async def handle_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return
     
     # Сохранение времени
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await update.message.reply_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        if setting_type == "daily":
-            user.daily_reminder_time = time_obj
-            message = f"✅ Время напоминаний установлено на {text}"
-        elif setting_type == "budget":
-            user.budget_notification_time = time_obj
-            message = f"✅ Время уведомлений о бюджете установлено на {text}"
-        
-        db.commit()
-        context.user_data.pop(f'setting_{setting_type}_time', None)
-        
+    db = context.db
+    user = context.current_user
+    if not user:
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-        await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
-        
-    finally:
-        db.close()
+        await update.message.reply_text(
+            "Сначала выполните команду /start",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    
+    user = await db.get(User, user.id)
+    if setting_type == "daily":
+        user.daily_reminder_time = time_obj
+        message = f"✅ Время напоминаний установлено на {text}"
+    elif setting_type == "budget":
+        user.budget_notification_time = time_obj
+        message = f"✅ Время уведомлений о бюджете установлено на {text}"
+    
+    refresh_notification_schedule(user)
+    await db.commit()
+    user_profile_cache.invalidate(user.telegram_id)
+    context.user_data.pop(f'setting_{setting_type}_time', None)
+    
+    keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+    await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+    
 
 async def handle_salary_date_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка ввода даты зарплаты"""
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     # Проверка на отмену
@@ -433,29 +416,29 @@ async def handle_salary_date_input(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Сохранение даты
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await update.message.reply_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        user.salary_date = day
-        db.commit()
-        context.user_data.pop('setting_salary_date', None)
-        
+    db = context.db
+    user = context.current_user
+    if not user:
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await update.message.reply_text(
-            f"✅ Дата зарплаты установлена на {day} число каждого месяца",
+            "Сначала выполните команду /start",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-    finally:
-        db.close()
+        return
+    
+    user = await db.get(User, user.id)
+    user.salary_date = day
+    refresh_notification_schedule(user)
+    await db.commit()
+    user_profile_cache.invalidate(user.telegram_id)
+    context.user_data.pop('setting_salary_date', None)
+    
+    keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+    await update.message.reply_text(
+        f"✅ Дата зарплаты установлена на {day} число каждого месяца",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    
 
 
 async def notifications_command_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -463,45 +446,39 @@ async def notifications_command_callback(update: Update, context: ContextTypes.D
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
+    user = context.current_user
+    if not user:
+        await safe_edit_message(query, "Сначала выполните команду /start")
+        return
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await safe_edit_message(query, "Сначала выполните команду /start")
-            return
-        
-        # Формируем статусы для отображения
-        daily_status = "✅ Включено" if user.daily_reminder_enabled else "❌ Выключено"
-        daily_time = user.daily_reminder_time.strftime("%H:%M") if user.daily_reminder_time else "не установлено"
-        
-        budget_status = "✅ Включено" if user.budget_notifications_enabled else "❌ Выключено"
-        budget_time = user.budget_notification_time.strftime("%H:%M") if user.budget_notification_time else "не установлено"
-        
-        keyboard = [
-            [InlineKeyboardButton("📅 Напоминания о тратах", callback_data="notif_daily")],
-            [InlineKeyboardButton("💰 Уведомления о бюджете", callback_data="notif_budget")],
-            [InlineKeyboardButton("💵 Дата зарплаты", callback_data="notif_salary")],
-            [InlineKeyboardButton("🌍 Часовой пояс", callback_data="notif_timezone")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message = (
-            f"🔔 **Настройки уведомлений**\n\n"
-            f"📅 **Напоминания о тратах**: {daily_status}\n"
-            f"⏰ Время: {daily_time}\n\n"
-            f"💰 **Уведомления о бюджете**: {budget_status}\n"
-            f"⏰ Время: {budget_time}\n"
-            f"📊 Частота: {user.budget_notification_frequency}\n\n"
-            f"💵 **Дата зарплаты**: {user.salary_date} числа\n"
-            f"🌍 **Часовой пояс**: {user.timezone}\n\n"
-            f"Настройте уведомления для лучшего контроля финансов."
-        )
-        
-        await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
-        
-    finally:
-        db.close()
\ No newline at end of file
+    # Формируем статусы для отображения
+    daily_status = "✅ Включено" if user.daily_reminder_enabled else "❌ Выключено"
+    daily_time = user.daily_reminder_time.strftime("%H:%M") if user.daily_reminder_time else "не установлено"
+    
+    budget_status = "✅ Включено" if user.budget_notifications_enabled else "❌ Выключено"
+    budget_time = user.budget_notification_time.strftime("%H:%M") if user.budget_notification_time else "не установлено"
+    
+    keyboard = [
+        [InlineKeyboardButton("📅 Напоминания о тратах", callback_data="notif_daily")],
+        [InlineKeyboardButton("💰 Уведомления о бюджете", callback_data="notif_budget")],
+        [InlineKeyboardButton("💵 Дата зарплаты", callback_data="notif_salary")],
+        [InlineKeyboardButton("🌍 Часовой пояс", callback_data="notif_timezone")],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message = (
+        f"🔔 **Настройки уведомлений**\n\n"
+        f"📅 **Напоминания о тратах**: {daily_status}\n"
+        f"⏰ Время: {daily_time}\n\n"
+        f"💰 **Уведомления о бюджете**: {budget_status}\n"
+        f"⏰ Время: {budget_time}\n"
+        f"📊 Частота: {user.budget_notification_frequency}\n\n"
+        f"💵 **Дата зарплаты**: {user.salary_date} числа\n"
+        f"🌍 **Часовой пояс**: {user.timezone}\n\n"
+        f"Настройте уведомления для лучшего контроля финансов."
+    )
+    
+    await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
+    
\ No newline at end of file
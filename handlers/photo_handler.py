@@ -1,124 +1,166 @@
 import logging
-from datetime import datetime
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import asyncio
 
-from database import get_db_session, User, Category, Transaction
+from sqlalchemy import select
+
+from database import Category
 from services.openai_service import OpenAIService
-from services.category_memory_service import CategoryMemoryService
+from services.receipt_cache import receipt_cache
+from services.receipt_ingest_service import ReceiptIngestService
 
 logger = logging.getLogger(__name__)
 
+# Сколько чеков из кэша одновременно ждут ответа пользователя
+MAX_PENDING_CACHED_RECEIPTS = 10
+
+
+def _format_receipt_response(saved_transactions: list, category, title: str) -> str:
+    """Ответ пользователю о добавленных транзакциях чека"""
+    if len(saved_transactions) == 1:
+        transaction = saved_transactions[0]
+        return (
+            f"✅ {title} обработан!\n\n"
+            f"💸 Расход: {abs(transaction.amount)} {transaction.currency}\n"
+            f"📁 Категория: {category.name}\n"
+            f"📝 Описание: {transaction.description}"
+        )
+
+    total_amount = sum(abs(t.amount) for t in saved_transactions)
+    currency = saved_transactions[0].currency if saved_transactions else "EUR"
+    return (
+        f"✅ {title} обработан!\n\n"
+        f"💸 Общая сумма: {total_amount} {currency}\n"
+        f"📊 Транзакций добавлено: {len(saved_transactions)}\n\n"
+        "Используйте /stats для просмотра статистики."
+    )
+
+
+async def _offer_cached_receipt(context: ContextTypes.DEFAULT_TYPE, processing_message, cached, file,
+                                file_unique_id: str, image_hash, title: str, not_recognized_text: str) -> None:
+    """
+    Предложить добавить ранее распознанный чек или распознать фото заново
+    (похожий снимок может оказаться другим чеком). Ожидающие ответа чеки
+    хранятся по id сообщения с кнопками, поэтому несколько чеков подряд
+    не затирают друг друга
+    """
+    pending = context.user_data.setdefault('cached_receipts', {})
+    pending[processing_message.message_id] = {
+        'transactions': cached.transactions,
+        'title': title,
+        'not_recognized_text': not_recognized_text,
+        'file_id': file.file_id,
+        'file_unique_id': file_unique_id,
+        'image_hash': image_hash,
+    }
+    while len(pending) > MAX_PENDING_CACHED_RECEIPTS:
+        pending.pop(next(iter(pending)))
+
+    total_amount = sum(abs(t['amount']) for t in cached.transactions)
+    currency = cached.transactions[0]['currency']
+    keyboard = [
+        [InlineKeyboardButton("✅ Добавить снова", callback_data=f"receipt_cached_add_{processing_message.message_id}")],
+        [InlineKeyboardButton("🔍 Распознать заново",
+                              callback_data=f"receipt_cached_recognize_{processing_message.message_id}")],
+        [InlineKeyboardButton("❌ Не добавлять", callback_data=f"receipt_cached_skip_{processing_message.message_id}")],
+    ]
+    await processing_message.edit_text(
+        f"🔁 Этот чек уже распознавался {cached.created_at.strftime('%d.%m.%Y')}\n\n"
+        f"💸 Сумма: {total_amount} {currency}\n"
+        f"📊 Транзакций: {len(cached.transactions)}\n\n"
+        "Добавить его еще раз? Если это другой чек, распознайте фото заново.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def _process_receipt(context: ContextTypes.DEFAULT_TYPE, processing_message, file, file_unique_id: str,
+                           title: str, not_recognized_text: str) -> None:
+    """Скачать изображение, распознать чек (или взять из кэша) и сохранить транзакции"""
+    db = context.db
+    user = context.current_user
+
+    # Тот же файл уже распознавался: результат находится без скачивания
+    cached = await receipt_cache.find_by_file(user.id, file_unique_id, db=db)
+    image_hash = None
+    image_data = None
+    if not cached:
+        # Скачиваем изображение и ищем похожий снимок по перцептивному хэшу
+        image_data = bytes(await file.download_as_bytearray())
+        image_hash = await receipt_cache.image_hash(image_data)
+        cached = await receipt_cache.find_similar(user.id, image_hash, db=db)
+
+    # Чек уже распознавался: предлагаем прошлый результат без запроса к OpenAI
+    if cached and cached.transactions:
+        await _offer_cached_receipt(
+            context, processing_message, cached, file, file_unique_id, image_hash, title, not_recognized_text
+        )
+        return
+
+    if image_data is None:
+        image_data = bytes(await file.download_as_bytearray())
+        image_hash = await receipt_cache.image_hash(image_data)
+
+    await _recognize_receipt(
+        context, processing_message, image_data, file_unique_id, image_hash, title, not_recognized_text
+    )
+
+
+async def _recognize_receipt(context: ContextTypes.DEFAULT_TYPE, processing_message, image_data: bytes,
+                             file_unique_id: str, image_hash, title: str, not_recognized_text: str) -> None:
+    """Распознать чек через OpenAI (без кэша), сохранить результат в кэш и добавить транзакции"""
+    db = context.db
+    user = context.current_user
+
+    # Получаем категории пользователя
+    categories = (await db.execute(select(Category).filter(Category.user_id == user.id))).scalars().all()
+    category_names = [cat.name for cat in categories]
+
+    # Обрабатываем чек через OpenAI
+    openai_service = OpenAIService()
+    transactions = await openai_service.process_receipt_photo(
+        image_data,
+        category_names,
+        user_id=user.id,
+        db=db
+    )
+
+    if not transactions:
+        await processing_message.edit_text(not_recognized_text)
+        return
+
+    await receipt_cache.put(user.id, file_unique_id, image_hash, transactions, db=db)
+
+    saved_transactions, category = await ReceiptIngestService().ingest(db, user.id, categories, transactions)
+    await processing_message.edit_text(_format_receipt_response(saved_transactions, category, title))
+
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка фотографий чеков"""
-    user_id = update.effective_user.id
-    
+
     if not update.message.photo:
         return
-    
+
     # Отправляем сообщение о начале обработки
     processing_message = await update.message.reply_text(
         "📸 Анализирую чек... Это может занять несколько секунд."
     )
-    
+
     try:
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                await processing_message.edit_text("Сначала выполните команду /start")
-                return
-            
-            # Получаем фото в лучшем качестве
-            photo = update.message.photo[-1]  # Самое большое изображение
-            file = await photo.get_file()
-            
-            # Скачиваем изображение
-            image_data = await file.download_as_bytearray()
-            
-            # Получаем категории пользователя
-            categories = db.query(Category).filter(Category.user_id == user.id).all()
-            category_names = [cat.name for cat in categories]
-            
-            # Обрабатываем чек через OpenAI
-            openai_service = OpenAIService()
-            memory_service = CategoryMemoryService()
-            transactions = await openai_service.process_receipt_photo(
-                bytes(image_data), 
-                category_names
-            )
-            
-            if not transactions:
-                await processing_message.edit_text(
-                    "❌ Не удалось распознать чек. Убедитесь, что фото четкое и содержит информацию о покупках."
-                )
-                return
-            
-            # Сохраняем транзакции в базу данных
-            saved_transactions = []
-            for transaction_data in transactions:
-                # Находим категорию
-                category = next(
-                    (cat for cat in categories if cat.name == transaction_data.get('category')), 
-                    categories[0] if categories else None
-                )
-                
-                if not category:
-                    # Создаем категорию "Прочее" если нет категорий
-                    category = Category(name="Прочее", user_id=user.id, is_default=True)
-                    db.add(category)
-                    db.commit()
-                
-                # Создаем транзакцию
-                transaction = Transaction(
-                    user_id=user.id,
-                    amount=-abs(transaction_data['amount']),  # Расходы всегда отрицательные
-                    currency=transaction_data['currency'],
-                    description=transaction_data['description'],
-                    category_id=category.id,
-                    created_at=datetime.now()
-                )
-                
-                db.add(transaction)
-                saved_transactions.append(transaction)
-            
-            db.commit()
-            
-            # Запоминаем связи описаний с категориями для всех транзакций
-            for transaction in saved_transactions:
-                memory_service.remember_category(
-                    user_id=user.id,
-                    description=transaction.description,
-                    category_id=transaction.category_id,
-                    confidence=0.8  # Немного меньше уверенности для автоматически распознанных
-                )
-            
-            # Формируем ответ пользователю
-            if len(saved_transactions) == 1:
-                transaction = saved_transactions[0]
-                response = (
-                    f"✅ Чек обработан!\n\n"
-                    f"💸 Расход: {abs(transaction.amount)} {transaction.currency}\n"
-                    f"📁 Категория: {category.name}\n"
-                    f"📝 Описание: {transaction.description}"
-                )
-            else:
-                total_amount = sum(abs(t.amount) for t in saved_transactions)
-                currency = saved_transactions[0].currency if saved_transactions else "EUR"
-                response = (
-                    f"✅ Чек обработан!\n\n"
-                    f"💸 Общая сумма: {total_amount} {currency}\n"
-                    f"📊 Транзакций добавлено: {len(saved_transactions)}\n\n"
-                    "Используйте /stats для просмотра статистики."
-                )
-            
-            await processing_message.edit_text(response)
-            
-        finally:
-            db.close()
-            
+        user = context.current_user
+        if not user:
+            await processing_message.edit_text("Сначала выполните команду /start")
+            return
+
+        # Получаем фото в лучшем качестве
+        photo = update.message.photo[-1]  # Самое большое изображение
+        file = await photo.get_file()
+
+        await _process_receipt(
+            context, processing_message, file, photo.file_unique_id, "Чек",
+            "❌ Не удалось распознать чек. Убедитесь, что фото четкое и содержит информацию о покупках."
+        )
+
     except Exception as e:
         logger.error(f"Ошибка при обработке фото чека: {e}")
         await processing_message.edit_text(
@@ -130,121 +172,89 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Обработка документов (если пользователь отправит изображение как файл)"""
     if not update.message.document:
         return
-    
+
     # Проверяем, что это изображение
     mime_type = update.message.document.mime_type
     if not mime_type or not mime_type.startswith('image/'):
         return
-    
+
     # Размер файла не должен превышать 20MB (ограничение OpenAI)
     if update.message.document.file_size > 20 * 1024 * 1024:
         await update.message.reply_text(
             "❌ Файл слишком большой. Максимальный размер: 20MB"
         )
         return
-    
-    user_id = update.effective_user.id
-    
+
     # Отправляем сообщение о начале обработки
     processing_message = await update.message.reply_text(
         "📄 Анализирую документ с чеком... Это может занять несколько секунд."
     )
-    
+
     try:
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                await processing_message.edit_text("Сначала выполните команду /start")
-                return
-            
-            # Скачиваем документ
-            file = await update.message.document.get_file()
-            image_data = await file.download_as_bytearray()
-            
-            # Получаем категории пользователя
-            categories = db.query(Category).filter(Category.user_id == user.id).all()
-            category_names = [cat.name for cat in categories]
-            
-            # Обрабатываем чек через OpenAI
-            openai_service = OpenAIService()
-            memory_service = CategoryMemoryService()
-            transactions = await openai_service.process_receipt_photo(
-                bytes(image_data), 
-                category_names
-            )
-            
-            if not transactions:
-                await processing_message.edit_text(
-                    "❌ Не удалось распознать чек в документе. Убедитесь, что изображение четкое и содержит информацию о покупках."
-                )
-                return
-            
-            # Сохраняем транзакции (аналогично handle_photo)
-            saved_transactions = []
-            for transaction_data in transactions:
-                # Находим категорию
-                category = next(
-                    (cat for cat in categories if cat.name == transaction_data.get('category')), 
-                    categories[0] if categories else None
-                )
-                
-                if not category:
-                    # Создаем категорию "Прочее" если нет категорий
-                    category = Category(name="Прочее", user_id=user.id, is_default=True)
-                    db.add(category)
-                    db.commit()
-                
-                # Создаем транзакцию
-                transaction = Transaction(
-                    user_id=user.id,
-                    amount=-abs(transaction_data['amount']),  # Расходы всегда отрицательные
-                    currency=transaction_data['currency'],
-                    description=transaction_data['description'],
-                    category_id=category.id,
-                    created_at=datetime.now()
-                )
-                
-                db.add(transaction)
-                saved_transactions.append(transaction)
-            
-            db.commit()
-            
-            # Запоминаем связи описаний с категориями для всех транзакций
-            for transaction in saved_transactions:
-                memory_service.remember_category(
-                    user_id=user.id,
-                    description=transaction.description,
-                    category_id=transaction.category_id,
-                    confidence=0.8  # Немного меньше уверенности для автоматически распознанных
-                )
-            
-            # Формируем ответ пользователю
-            if len(saved_transactions) == 1:
-                transaction = saved_transactions[0]
-                response = (
-                    f"✅ Документ обработан!\n\n"
-                    f"💸 Расход: {abs(transaction.amount)} {transaction.currency}\n"
-                    f"📁 Категория: {category.name}\n"
-                    f"📝 Описание: {transaction.description}"
-                )
-            else:
-                total_amount = sum(abs(t.amount) for t in saved_transactions)
-                currency = saved_transactions[0].currency if saved_transactions else "EUR"
-                response = (
-                    f"✅ Документ обработан!\n\n"
-                    f"💸 Общая сумма: {total_amount} {currency}\n"
-                    f"📊 Транзакций добавлено: {len(saved_transactions)}\n\n"
-                    "Используйте /stats для просмотра статистики."
-                )
-            
-            await processing_message.edit_text(response)
-            
-        finally:
-            db.close()
-            
+        user = context.current_user
+        if not user:
+            await processing_message.edit_text("Сначала выполните команду /start")
+            return
+
+        # Скачиваем документ
+        file = await update.message.document.get_file()
+
+        await _process_receipt(
+            context, processing_message, file, update.message.document.file_unique_id, "Документ",
+            "❌ Не удалось распознать чек в документе. Убедитесь, что изображение четкое и содержит информацию о покупках."
+        )
+
     except Exception as e:
         logger.error(f"Ошибка при обработке документа с чеком: {e}")
         await processing_message.edit_text(
             "❌ Произошла ошибка при обработке документа. Попробуйте еще раз или добавьте транзакцию вручную."
-        )
\ No newline at end of file
+        )
+
+
+async def handle_cached_receipt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Добавить ранее распознанный чек, отклонить его или распознать фото заново"""
+    query = update.callback_query
+    action, _, message_id = query.data[len("receipt_cached_"):].partition("_")
+    pending = context.user_data.get('cached_receipts', {})
+    cached = pending.pop(int(message_id), None) if message_id.isdigit() else None
+
+    if action == "skip":
+        await query.edit_message_text("👌 Чек не добавлен.")
+        return
+
+    if not cached:
+        await query.edit_message_text("Сессия истекла. Отправьте чек еще раз.")
+        return
+
+    if action == "recognize":
+        # Похожий снимок оказался другим чеком: распознаем фото, не глядя в кэш
+        await query.edit_message_text("📸 Распознаю чек заново... Это может занять несколько секунд.")
+        try:
+            file = await context.bot.get_file(cached['file_id'])
+            image_data = bytes(await file.download_as_bytearray())
+            image_hash = cached['image_hash'] or await receipt_cache.image_hash(image_data)
+            await _recognize_receipt(
+                context, query.message, image_data, cached['file_unique_id'], image_hash,
+                cached['title'], cached['not_recognized_text']
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при повторном распознавании чека: {e}")
+            await query.edit_message_text(
+                "❌ Произошла ошибка при обработке чека. Попробуйте еще раз или добавьте транзакцию вручную."
+            )
+        return
+
+    try:
+        db = context.db
+        user = context.current_user
+        categories = (await db.execute(select(Category).filter(Category.user_id == user.id))).scalars().all()
+
+        saved_transactions, category = await ReceiptIngestService().ingest(
+            db, user.id, categories, cached['transactions']
+        )
+        await query.edit_message_text(_format_receipt_response(saved_transactions, category, cached['title']))
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении чека из кэша: {e}")
+        await query.edit_message_text(
+            "❌ Произошла ошибка при добавлении чека. Попробуйте еще раз или добавьте транзакцию вручную."
+        )
@@ -2,7 +2,8 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_db_session, User
+from database import User
+from services.user_profile_cache import user_profile_cache
 from utils.localization import get_message, get_supported_languages
 from utils.telegram_utils import safe_edit_message, safe_answer_callback
 
@@ -11,51 +12,46 @@ logger = logging.getLogger(__name__)
 
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда /settings для настроек пользователя"""
-    user_id = update.effective_user.id
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await update.message.reply_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        # Создаем клавиатуру настроек
-        keyboard = [
-            [InlineKeyboardButton(
-                get_message("language_settings", user.language), 
-                callback_data="settings_language"
-            )],
-            [InlineKeyboardButton(
-                get_message("name_settings", user.language), 
-                callback_data="settings_name"
-            )]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Информация о текущих настройках
-        current_lang = get_supported_languages().get(user.language, "🇷🇺 Русский")
-        current_name = user.name or "Не указано"
-        
-        settings_text = (
-            f"{get_message('settings', user.language)}\n\n"
-            f"🌍 {get_message('language_settings', user.language)}: {current_lang}\n"
-            f"👤 {get_message('name_settings', user.language)}: {current_name}"
-        )
-        
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await update.message.reply_text(
-            settings_text,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            "Сначала выполните команду /start",
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-    finally:
-        db.close()
+        return
+    
+    # Создаем клавиатуру настроек
+    keyboard = [
+        [InlineKeyboardButton(
+            get_message("language_settings", user.language), 
+            callback_data="settings_language"
+        )],
+        [InlineKeyboardButton(
+            get_message("name_settings", user.language), 
+            callback_data="settings_name"
+        )]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    # Информация о текущих настройках
+    current_lang = get_supported_languages().get(user.language, "🇷🇺 Русский")
+    current_name = user.name or "Не указано"
+    
+    settings_text = (
+        f"{get_message('settings', user.language)}\n\n"
+        f"🌍 {get_message('language_settings', user.language)}: {current_lang}\n"
+        f"👤 {get_message('name_settings', user.language)}: {current_name}"
+    )
+    
+    await update.message.reply_text(
+        settings_text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
 
 
 async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -63,87 +59,85 @@ async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
     
-    user_id = update.effective_user.id
     data = query.data
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await query.edit_message_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
+    db = context.db
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await query.edit_message_text(
+            "Сначала выполните команду /start",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    
+    if data == "settings_language":
+        # Показать выбор языка
+        keyboard = []
+        languages = get_supported_languages()
         
-        if data == "settings_language":
-            # Показать выбор языка
-            keyboard = []
-            languages = get_supported_languages()
-            
-            for lang_code, lang_name in languages.items():
-                keyboard.append([InlineKeyboardButton(
-                    lang_name, 
-                    callback_data=f"set_lang_{lang_code}"
-                )])
-            
-            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="settings_back")])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                get_message("choose_language", user.language),
-                reply_markup=reply_markup
-            )
-            
-        elif data.startswith("set_lang_"):
-            # Установить язык
-            new_language = data.split("_")[2]
-            user.language = new_language
-            db.commit()
-            
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="settings_back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                get_message("language_changed", new_language),
-                reply_markup=reply_markup
-            )
-            
-        elif data == "settings_name":
-            # Запросить ввод имени
-            keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings_back")]]
-            await query.edit_message_text(
-                f"{get_message('enter_name', user.language)}\n\n"
-                f"💡 Или отправьте /cancel для отмены",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='Markdown'
-            )
-            context.user_data['setting_name'] = True
+        for lang_code, lang_name in languages.items():
+            keyboard.append([InlineKeyboardButton(
+                lang_name, 
+                callback_data=f"set_lang_{lang_code}"
+            )])
+        
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="settings_back")])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.edit_message_text(
+            get_message("choose_language", user.language),
+            reply_markup=reply_markup
+        )
+        
+    elif data.startswith("set_lang_"):
+        # Установить язык
+        new_language = data.split("_")[2]
+        user = await db.get(User, user.id)
+        user.language = new_language
+        await db.commit()
+        user_profile_cache.invalidate(user.telegram_id)
+        
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="settings_back")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.edit_message_text(
+            get_message("language_changed", new_language),
+            reply_markup=reply_markup
+        )
+        
+    elif data == "settings_name":
+        # Запросить ввод имени
+        keyboard = [[InlineKeyboardButton("❌ Отмена", callback_data="settings_back")]]
+        await query.edit_message_text(
+            f"{get_message('enter_name', user.language)}\n\n"
+            f"💡 Или отправьте /cancel для отмены",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        context.user_data['setting_name'] = True
 
-        elif data == "settings_categories":
-            # Перейти к категориям
-            from handlers.categories_handler import categories_command_callback
-            await categories_command_callback(update, context)
-            
-        elif data == "settings_limits":
-            # Перейти к лимитам
-            from handlers.limits_handler import limits_command_callback
-            await limits_command_callback(update, context)
-            
-        elif data == "settings_notifications":
-            # Перейти к уведомлениям
-            from handlers.notifications_handler import notifications_command_callback
-            await notifications_command_callback(update, context)
-            
-        elif data == "settings_back":
-            # Вернуться к настройкам
-            context.user_data.pop('setting_name', None)
-            await settings_command_callback(update, context)
-            
-    finally:
-        db.close()
+    elif data == "settings_categories":
+        # Перейти к категориям
+        from handlers.categories_handler import categories_command_callback
+        await categories_command_callback(update, context)
+        
+    elif data == "settings_limits":
+        # Перейти к лимитам
+        from handlers.limits_handler import limits_command_callback
+        await limits_command_callback(update, context)
+        
+    elif data == "settings_notifications":
+        # Перейти к уведомлениям
+        from handlers.notifications_handler import notifications_command_callback
+        await notifications_command_callback(update, context)
+        
+    elif data == "settings_back":
+        # Вернуться к настройкам
+        context.user_data.pop('setting_name', None)
+        await settings_command_callback(update, context)
+        
 
 
 async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -151,7 +145,6 @@ async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not context.user_data.get('setting_name'):
         return
     
-    user_id = update.effective_user.id
     name = update.message.text.strip()
     
     # Проверяем на отмену
@@ -171,9 +164,9 @@ async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
     
-    db = get_db_session()
+    db = context.db
     try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
+        user = context.current_user
         if not user:
             keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
             await update.message.reply_text(
@@ -182,8 +175,10 @@ async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             return
         
+        user = await db.get(User, user.id)
         user.name = name
-        db.commit()
+        await db.commit()
+        user_profile_cache.invalidate(user.telegram_id)
         
         keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await update.message.reply_text(
@@ -192,7 +187,6 @@ async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         
     finally:
-        db.close()
         context.user_data.pop('setting_name', None)
 
 
@@ -201,38 +195,32 @@ async def settings_command_callback(update: Update, context: ContextTypes.DEFAUL
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
+    user = context.current_user
+    if not user:
+        await safe_edit_message(query, get_message("start_first", "ru"))
+        return
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await safe_edit_message(query, get_message("start_first", "ru"))
-            return
-        
-        # Информация о текущих настройках
-        current_lang = get_supported_languages().get(user.language, "🇷🇺 Русский")
-        current_name = user.name or "Не указано"
-        
-        message = (
-            f"⚙️ **Настройки**\n\n"
-            f"👤 **Имя**: {current_name}\n"
-            f"🌍 **Язык**: {current_lang}\n\n"
-            f"Выберите что хотите изменить:"
-        )
-        
-        keyboard = [
-            [InlineKeyboardButton("📝 Изменить имя", callback_data="settings_name"),
-             InlineKeyboardButton("🌍 Изменить язык", callback_data="settings_language")],
-            [InlineKeyboardButton("📁 Категории", callback_data="settings_categories"),
-             InlineKeyboardButton("💰 Лимиты", callback_data="settings_limits")],
-            [InlineKeyboardButton("🔔 Уведомления", callback_data="settings_notifications")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
-        
-    finally:
-        db.close()
\ No newline at end of file
+    # Информация о текущих настройках
+    current_lang = get_supported_languages().get(user.language, "🇷🇺 Русский")
+    current_name = user.name or "Не указано"
+    
+    message = (
+        f"⚙️ **Настройки**\n\n"
+        f"👤 **Имя**: {current_name}\n"
+        f"🌍 **Язык**: {current_lang}\n\n"
+        f"Выберите что хотите изменить:"
+    )
+    
+    keyboard = [
+        [InlineKeyboardButton("📝 Изменить имя", callback_data="settings_name"),
+         InlineKeyboardButton("🌍 Изменить язык", callback_data="settings_language")],
+        [InlineKeyboardButton("📁 Категории", callback_data="settings_categories"),
+         InlineKeyboardButton("💰 Лимиты", callback_data="settings_limits")],
+        [InlineKeyboardButton("🔔 Уведомления", callback_data="settings_notifications")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
+    
\ No newline at end of file
@@ -2,7 +2,8 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_db_session, User, Category
+from database import User, Category
+from services.user_profile_cache import user_profile_cache
 from utils.localization import get_message, get_default_categories, get_supported_languages
 from utils.telegram_utils import safe_edit_message, safe_answer_callback
 
@@ -14,19 +15,15 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user_id = update.effective_user.id
     username = update.effective_user.username
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            # Новый пользователь - предлагаем выбрать язык
-            await show_language_selection(update, user_id, username)
-            return
-        else:
-            # Существующий пользователь - показываем главное меню
-            name = user.name or "бро"
-            await show_main_menu(update, user)
-    finally:
-        db.close()
+    user = context.current_user
+    if not user:
+        # Новый пользователь - предлагаем выбрать язык
+        await show_language_selection(update, user_id, username)
+        return
+    else:
+        # Существующий пользователь - показываем главное меню
+        name = user.name or "бро"
+        await show_main_menu(update, user)
 
 
 async def show_main_menu(update: Update, user: User) -> None:
@@ -99,38 +96,36 @@ async def handle_language_setup(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = int(data_parts[3])
     username = data_parts[4] if data_parts[4] != 'unknown' else None
     
-    db = get_db_session()
-    try:
-        # Создаем нового пользователя
-        user = User(
-            telegram_id=user_id, 
-            username=username,
-            language=language
-        )
-        db.add(user)
-        db.commit()
-        
-        # Добавляем базовые категории на выбранном языке
-        default_categories = get_default_categories(language)
-        for cat_name in default_categories:
-            category = Category(name=cat_name, user_id=user.id, is_default=True)
-            db.add(category)
-        db.commit()
-        
-        # Приветствие на выбранном языке
-        welcome_text = (
-            f"{get_message('welcome', language, name='бро')}\n\n"
-            f"{get_message('start_description', language)}\n\n"
-            f"{get_message('help_commands', language)}"
-        )
-        
-        await query.edit_message_text(welcome_text, parse_mode='Markdown')
-        
-        # Предлагаем указать имя
-        await ask_for_name(query, user, language)
-        
-    finally:
-        db.close()
+    db = context.db
+    # Создаем нового пользователя
+    user = User(
+        telegram_id=user_id, 
+        username=username,
+        language=language
+    )
+    db.add(user)
+    await db.commit()
+    context.current_user = user_profile_cache.put(user)
+    
+    # Добавляем базовые категории на выбранном языке
+    default_categories = get_default_categories(language)
+    for cat_name in default_categories:
+        category = Category(name=cat_name, user_id=user.id, is_default=True)
+        db.add(category)
+    await db.commit()
+    
+    # Приветствие на выбранном языке
+    welcome_text = (
+        f"{get_message('welcome', language, name='бро')}\n\n"
+        f"{get_message('start_description', language)}\n\n"
+        f"{get_message('help_commands', language)}"
+    )
+    
+    await query.edit_message_text(welcome_text, parse_mode='Markdown')
+    
+    # Предлагаем указать имя
+    await ask_for_name(query, user, language)
+    
 
 
 async def handle_main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -177,62 +172,51 @@ async def help_command_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
+    user = context.current_user
+    if not user:
+        await safe_edit_message(query, "Сначала выполните команду /start")
+        return
+    
+    # Показываем интерактивную справку
+    keyboard = [
+        [InlineKeyboardButton("💰 Добавление трат", callback_data="help_spending")],
+        [InlineKeyboardButton("📸 Фото чеков", callback_data="help_photos")],
+        [InlineKeyboardButton("🧠 Умная система", callback_data="help_memory")],
+        [InlineKeyboardButton("📊 Команды", callback_data="help_commands")],
+        [InlineKeyboardButton("🔔 Уведомления", callback_data="help_notifications")],
+        [InlineKeyboardButton("📈 Графики", callback_data="help_charts")],
+        [InlineKeyboardButton("🎯 Быстрый старт", callback_data="help_quickstart")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    name = user.name or "бро"
+    message = (
+        f"❓ **Справка Budget Bot**\n\n"
+        f"Привет, {name}! Выберите раздел для получения подробной информации:\n\n"
+        f"• 💰 **Добавление трат** - как правильно записывать операции\n"
+        f"• 📸 **Фото чеков** - автоматическое распознавание\n"
+        f"• 🧠 **Умная система** - как работает система памяти\n"
+        f"• 📊 **Команды** - все доступные команды\n"
+        f"• 🔔 **Уведомления** - настройка напоминаний\n"
+        f"• 📈 **Графики** - визуализация трат\n"
+        f"• 🎯 **Быстрый старт** - для новичков"
+    )
+    
+    await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await safe_edit_message(query, "Сначала выполните команду /start")
-            return
-        
-        # Показываем интерактивную справку
-        keyboard = [
-            [InlineKeyboardButton("💰 Добавление трат", callback_data="help_spending")],
-            [InlineKeyboardButton("📸 Фото чеков", callback_data="help_photos")],
-            [InlineKeyboardButton("🧠 Умная система", callback_data="help_memory")],
-            [InlineKeyboardButton("📊 Команды", callback_data="help_commands")],
-            [InlineKeyboardButton("🔔 Уведомления", callback_data="help_notifications")],
-            [InlineKeyboardButton("📈 Графики", callback_data="help_charts")],
-            [InlineKeyboardButton("🎯 Быстрый старт", callback_data="help_quickstart")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        name = user.name or "бро"
-        message = (
-            f"❓ **Справка Budget Bot**\n\n"
-            f"Привет, {name}! Выберите раздел для получения подробной информации:\n\n"
-            f"• 💰 **Добавление трат** - как правильно записывать операции\n"
-            f"• 📸 **Фото чеков** - автоматическое распознавание\n"
-            f"• 🧠 **Умная система** - как работает система памяти\n"
-            f"• 📊 **Команды** - все доступные команды\n"
-            f"• 🔔 **Уведомления** - настройка напоминаний\n"
-            f"• 📈 **Графики** - визуализация трат\n"
-            f"• 🎯 **Быстрый старт** - для новичков"
-        )
-        
-        await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
-        
-    finally:
-        db.close()
 
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда /menu для показа главного меню"""
-    user_id = update.effective_user.id
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await update.message.reply_text("Сначала выполните команду /start")
-            return
-        
-        await show_main_menu(update, user)
-    finally:
-        db.close()
+    user = context.current_user
+    if not user:
+        await update.message.reply_text("Сначала выполните команду /start")
+        return
+    
+    await show_main_menu(update, user)
 
 
 async def return_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -240,43 +224,37 @@ async def return_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
+    user = context.current_user
+    if not user:
+        await safe_edit_message(query, "Сначала выполните команду /start")
+        return
+    
+    # Создаем клавиатуру с основными функциями
+    keyboard = [
+        [InlineKeyboardButton("💳 Баланс", callback_data="main_balance"),
+         InlineKeyboardButton("📊 Статистика", callback_data="main_stats")],
+        [InlineKeyboardButton("📈 Графики", callback_data="main_charts"),
+         InlineKeyboardButton("📤 Экспорт", callback_data="main_export")],
+        [InlineKeyboardButton("✏️ Редактировать", callback_data="main_edit"),
+         InlineKeyboardButton("⚙️ Настройки", callback_data="main_settings")],
+        [InlineKeyboardButton("❓ Справка", callback_data="main_help")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    name = user.name or "бро"
+    message = (
+        f"👋 {get_message('welcome_back', user.language, name=name)}\n\n"
+        f"🎯 **Главное меню**\n\n"
+        f"Выберите действие или просто отправьте сообщение с тратой:\n"
+        f"• `35 продукты` - добавить расход\n"
+        f"• `+2000 зарплата` - добавить доход\n"
+        f"• 📸 **Фото чека** - автоматическое распознавание\n\n"
+        f"Доступны команды: /balance, /categories, /stats, /charts, /limits, /export, /settings, /notifications"
+    )
+    
+    await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await safe_edit_message(query, "Сначала выполните команду /start")
-            return
-        
-        # Создаем клавиатуру с основными функциями
-        keyboard = [
-            [InlineKeyboardButton("💳 Баланс", callback_data="main_balance"),
-             InlineKeyboardButton("📊 Статистика", callback_data="main_stats")],
-            [InlineKeyboardButton("📈 Графики", callback_data="main_charts"),
-             InlineKeyboardButton("📤 Экспорт", callback_data="main_export")],
-            [InlineKeyboardButton("✏️ Редактировать", callback_data="main_edit"),
-             InlineKeyboardButton("⚙️ Настройки", callback_data="main_settings")],
-            [InlineKeyboardButton("❓ Справка", callback_data="main_help")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        name = user.name or "бро"
-        message = (
-            f"👋 {get_message('welcome_back', user.language, name=name)}\n\n"
-            f"🎯 **Главное меню**\n\n"
-            f"Выберите действие или просто отправьте сообщение с тратой:\n"
-            f"• `35 продукты` - добавить расход\n"
-            f"• `+2000 зарплата` - добавить доход\n"
-            f"• 📸 **Фото чека** - автоматическое распознавание\n\n"
-            f"Доступны команды: /balance, /categories, /stats, /charts, /limits, /export, /settings, /notifications"
-        )
-        
-        await safe_edit_message(query, message, reply_markup=reply_markup, parse_mode='Markdown')
-        
-    finally:
-        db.close()
 
 
 async def ask_for_name(query, user, language: str) -> None:
@@ -325,13 +303,9 @@ async def handle_name_setup(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
     if query.data == "setup_back":
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
-            language = user.language if user else "ru"
-            await ask_for_name(query, user, language)
-        finally:
-            db.close()
+        user = context.current_user
+        language = user.language if user else "ru"
+        await ask_for_name(query, user, language)
         context.user_data.pop('setting_up_name', None)
         return
 
@@ -354,12 +328,14 @@ async def handle_name_input_setup(update: Update, context: ContextTypes.DEFAULT_
         )
         return
     
-    db = get_db_session()
+    db = context.db
     try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
+        user = context.current_user
         if user:
+            user = await db.get(User, user.id)
             user.name = name
-            db.commit()
+            await db.commit()
+            user_profile_cache.invalidate(user.telegram_id)
             
             keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
             await update.message.reply_text(
@@ -383,50 +359,44 @@ async def handle_name_input_setup(update: Update, context: ContextTypes.DEFAULT_
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
     finally:
-        db.close()
         context.user_data.pop('setting_up_name', None)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка команды /help с интерактивным меню"""
-    user_id = update.effective_user.id
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        language = user.language if user else "ru"
-        
-        # Основной текст справки
-        help_text = """
+    user = context.current_user
+    language = user.language if user else "ru"
+    
+    # Основной текст справки
+    help_text = """
 🤖 **Budget Bot - Умный помощник для финансов**
 
 Выберите раздел для получения подробной информации:
         """
-        
-        # Создаем интерактивные кнопки
-        keyboard = [
-            [
-                InlineKeyboardButton("💰 Добавление трат", callback_data="help_transactions"),
-                InlineKeyboardButton("📸 Фото чеков", callback_data="help_photos")
-            ],
-            [
-                InlineKeyboardButton("🧠 Умная система", callback_data="help_memory"),
-                InlineKeyboardButton("📊 Команды", callback_data="help_commands")
-            ],
-            [
-                InlineKeyboardButton("🔔 Уведомления", callback_data="help_notifications"),
-                InlineKeyboardButton("📈 Графики", callback_data="help_charts")
-            ],
-            [
-                InlineKeyboardButton("🎯 Быстрый старт", callback_data="help_quickstart")
-            ]
+    
+    # Создаем интерактивные кнопки
+    keyboard = [
+        [
+            InlineKeyboardButton("💰 Добавление трат", callback_data="help_transactions"),
+            InlineKeyboardButton("📸 Фото чеков", callback_data="help_photos")
+        ],
+        [
+            InlineKeyboardButton("🧠 Умная система", callback_data="help_memory"),
+            InlineKeyboardButton("📊 Команды", callback_data="help_commands")
+        ],
+        [
+            InlineKeyboardButton("🔔 Уведомления", callback_data="help_notifications"),
+            InlineKeyboardButton("📈 Графики", callback_data="help_charts")
+        ],
+        [
+            InlineKeyboardButton("🎯 Быстрый старт", callback_data="help_quickstart")
         ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(help_text, reply_markup=reply_markup, parse_mode='Markdown')
-        
-    finally:
-        db.close()
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(help_text, reply_markup=reply_markup, parse_mode='Markdown')
+    
 
 
 async def handle_help_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -505,7 +475,7 @@ EUR (по умолчанию), USD
 
 **Управление:**
 • `/limits` - 💳 лимиты расходов
-• `/export` - 📤 экспорт в Excel
+• `/export` - 📤 экспорт в Excel (`/export csv`, `/export gz` - CSV)
 • `/edit` - ✏️ редактировать транзакции
 
 **Настройки:**
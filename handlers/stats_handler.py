@@ -3,8 +3,9 @@ from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_db_session, User, Category, Transaction
 from services.chart_service import ChartService
+from services.chart_render_pool import ChartRenderQueueFull
+from services.stats_service import StatsService
 from utils.telegram_utils import safe_edit_message, safe_answer_callback
 
 logger = logging.getLogger(__name__)
@@ -12,37 +13,32 @@ logger = logging.getLogger(__name__)
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка команды /stats"""
-    user_id = update.effective_user.id
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await update.message.reply_text(
-                "Сначала выполните команду /start", 
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("📅 Сегодня", callback_data="stats_today"),
-             InlineKeyboardButton("📆 Эта неделя", callback_data="stats_week")],
-            [InlineKeyboardButton("📊 Этот месяц", callback_data="stats_month"),
-             InlineKeyboardButton("📈 Все время", callback_data="stats_all")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await update.message.reply_text(
-            "📊 **Статистика**\n\n"
-            "Выберите период для показа статистики:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            "Сначала выполните команду /start", 
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-    finally:
-        db.close()
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton("📅 Сегодня", callback_data="stats_today"),
+         InlineKeyboardButton("📆 Эта неделя", callback_data="stats_week")],
+        [InlineKeyboardButton("📊 Этот месяц", callback_data="stats_month"),
+         InlineKeyboardButton("📈 Все время", callback_data="stats_all")],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await update.message.reply_text(
+        "📊 **Статистика**\n\n"
+        "Выберите период для показа статистики:",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
 
 
 async def handle_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -50,116 +46,38 @@ async def handle_stats_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    user_id = update.effective_user.id
     data = query.data
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await query.edit_message_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        now = datetime.now()
-        
-        if data == "stats_today":
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            period_name = "Сегодня"
-        elif data == "stats_week":
-            start_date = now - timedelta(days=now.weekday())
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            period_name = "Эта неделя"
-        elif data == "stats_month":
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            period_name = "Этот месяц"
-        else:  # stats_all
-            start_date = datetime(2020, 1, 1)
-            period_name = "Все время"
-        
-        # Получаем транзакции за период
-        transactions = db.query(Transaction).filter(
-            Transaction.user_id == user.id,
-            Transaction.created_at >= start_date
-        ).all()
-        
-        if not transactions:
-            keyboard = [
-                [InlineKeyboardButton("🔙 Назад", callback_data="stats_back"),
-                 InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                f"📊 **{period_name}**\n\nНет транзакций за этот период.",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            return
-        
-        # Считаем доходы и расходы по валютам
-        currencies = {}
-        for transaction in transactions:
-            currency = transaction.currency
-            if currency not in currencies:
-                currencies[currency] = {'income': 0, 'expenses': 0}
-            
-            if transaction.amount > 0:
-                currencies[currency]['income'] += transaction.amount
-            else:
-                currencies[currency]['expenses'] += abs(transaction.amount)
-        
-        # Статистика по категориям (только расходы)
-        category_stats = {}
-        for transaction in transactions:
-            if transaction.amount < 0:
-                category = db.query(Category).filter(Category.id == transaction.category_id).first()
-                if category:
-                    if category.name not in category_stats:
-                        category_stats[category.name] = {}
-                    
-                    currency = transaction.currency
-                    if currency not in category_stats[category.name]:
-                        category_stats[category.name][currency] = 0
-                    category_stats[category.name][currency] += abs(transaction.amount)
-        
-        # Формируем текст ответа
-        text = f"📊 **{period_name}**\n\n"
-        
-        # Общая статистика по валютам
-        for currency, data in currencies.items():
-            income = data['income']
-            expenses = data['expenses']
-            balance = income - expenses
-            balance_emoji = "💚" if balance >= 0 else "❤️"
-            
-            text += f"**{currency}:**\n"
-            text += f"💰 Доходы: {income:.2f}\n"
-            text += f"💸 Расходы: {expenses:.2f}\n"
-            text += f"{balance_emoji} Баланс: {balance:.2f}\n\n"
-        
-        # Топ категорий расходов
-        if category_stats:
-            text += "**🏷️ Топ категорий расходов:**\n"
-            
-            # Сортируем категории по общей сумме расходов
-            category_totals = []
-            for cat_name, currencies_data in category_stats.items():
-                total = sum(currencies_data.values())
-                category_totals.append((cat_name, total, currencies_data))
-            
-            category_totals.sort(key=lambda x: x[1], reverse=True)
-            
-            for cat_name, total, currencies_data in category_totals[:5]:  # Топ 5
-                text += f"• {cat_name}: "
-                currency_texts = []
-                for currency, amount in currencies_data.items():
-                    currency_texts.append(f"{amount:.2f} {currency}")
-                text += ", ".join(currency_texts) + "\n"
-        
+    db = context.db
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
+        await query.edit_message_text(
+            "Сначала выполните команду /start",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    
+    now = datetime.now()
+    
+    if data == "stats_today":
+        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        period_name = "Сегодня"
+    elif data == "stats_week":
+        start_date = now - timedelta(days=now.weekday())
+        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        period_name = "Эта неделя"
+    elif data == "stats_month":
+        start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        period_name = "Этот месяц"
+    else:  # stats_all
+        start_date = datetime(2020, 1, 1)
+        period_name = "Все время"
+    
+    # Итоги по валютам и топ категорий - два агрегатных запроса
+    stats = await StatsService().get_period_stats(user.id, start_date.date(), db=db)
+    
+    if not stats.currencies:
         keyboard = [
             [InlineKeyboardButton("🔙 Назад", callback_data="stats_back"),
              InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
@@ -167,13 +85,48 @@ async def handle_stats_callback(update: Update, context: ContextTypes.DEFAULT_TY
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(
-            text,
+            f"📊 **{period_name}**\n\nНет транзакций за этот период.",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
+        return
+    
+    # Формируем текст ответа
+    text = f"📊 **{period_name}**\n\n"
+    
+    # Общая статистика по валютам
+    for currency, income, expenses in stats.currencies:
+        balance = income - expenses
+        balance_emoji = "💚" if balance >= 0 else "❤️"
+        
+        text += f"**{currency}:**\n"
+        text += f"💰 Доходы: {income:.2f}\n"
+        text += f"💸 Расходы: {expenses:.2f}\n"
+        text += f"{balance_emoji} Баланс: {balance:.2f}\n\n"
+    
+    # Топ категорий расходов (уже отсортирован по общей сумме)
+    if stats.top_categories:
+        text += "**🏷️ Топ категорий расходов:**\n"
         
-    finally:
-        db.close()
+        for cat_name, total, currencies_data in stats.top_categories:
+            text += f"• {cat_name}: "
+            currency_texts = []
+            for currency, amount in currencies_data.items():
+                currency_texts.append(f"{amount:.2f} {currency}")
+            text += ", ".join(currency_texts) + "\n"
+    
+    keyboard = [
+        [InlineKeyboardButton("🔙 Назад", callback_data="stats_back"),
+         InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    
 
 
 async def handle_stats_back(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -181,37 +134,31 @@ async def handle_stats_back(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     
-    user_id = update.effective_user.id
-    
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
-            await query.edit_message_text(
-                "Сначала выполните команду /start",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("📅 Сегодня", callback_data="stats_today"),
-             InlineKeyboardButton("📆 Эта неделя", callback_data="stats_week")],
-            [InlineKeyboardButton("📊 Этот месяц", callback_data="stats_month"),
-             InlineKeyboardButton("📈 Все время", callback_data="stats_all")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    user = context.current_user
+    if not user:
+        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]]
         await query.edit_message_text(
-            "📊 **Статистика**\n\n"
-            "Выберите период для показа статистики:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            "Сначала выполните команду /start",
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-    finally:
-        db.close()
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton("📅 Сегодня", callback_data="stats_today"),
+         InlineKeyboardButton("📆 Эта неделя", callback_data="stats_week")],
+        [InlineKeyboardButton("📊 Этот месяц", callback_data="stats_month"),
+         InlineKeyboardButton("📈 Все время", callback_data="stats_all")],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        "📊 **Статистика**\n\n"
+        "Выберите период для показа статистики:",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
 
 
 async def handle_charts_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -245,15 +192,24 @@ async def handle_charts_callback(update: Update, context: ContextTypes.DEFAULT_T
         chart_service = ChartService()
         buffer = None
         
-        if data == "chart_pie_30":
-            buffer = chart_service.generate_category_pie_chart(user_id, 30)
-            caption = "🍰 Расходы по категориям за последние 30 дней"
-        elif data == "chart_trend_30":
-            buffer = chart_service.generate_spending_trends_chart(user_id, 30)
-            caption = "📈 Тренд расходов по дням за последние 30 дней"
-        elif data == "chart_monthly_6":
-            buffer = chart_service.generate_monthly_comparison_chart(user_id, 6)
-            caption = "📊 Сравнение расходов по месяцам за последние 6 месяцев"
+        try:
+            if data == "chart_pie_30":
+                buffer = await chart_service.generate_category_pie_chart(user_id, 30, db=context.db, user=context.current_user)
+                caption = "🍰 Расходы по категориям за последние 30 дней"
+            elif data == "chart_trend_30":
+                buffer = await chart_service.generate_spending_trends_chart(user_id, 30, db=context.db, user=context.current_user)
+                caption = "📈 Тренд расходов по дням за последние 30 дней"
+            elif data == "chart_monthly_6":
+                buffer = await chart_service.generate_monthly_comparison_chart(user_id, 6, db=context.db, user=context.current_user)
+                caption = "📊 Сравнение расходов по месяцам за последние 6 месяцев"
+        except ChartRenderQueueFull:
+            keyboard = [[InlineKeyboardButton("🔙 К графикам", callback_data="back_to_charts")]]
+            await query.edit_message_text(
+                "⏳ Сейчас строится много графиков.\n"
+                "Попробуйте еще раз через минуту.",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return
         
         if buffer:
             keyboard = [[InlineKeyboardButton("🔙 К графикам", callback_data="back_to_charts")]]
@@ -305,30 +261,24 @@ async def stats_command_callback(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await safe_answer_callback(query)
     
-    user_id = update.effective_user.id
+    user = context.current_user
+    if not user:
+        await safe_edit_message(query, "Сначала выполните команду /start")
+        return
     
-    db = get_db_session()
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if not user:
-            await safe_edit_message(query, "Сначала выполните команду /start")
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("📅 Сегодня", callback_data="stats_today"),
-             InlineKeyboardButton("📆 Эта неделя", callback_data="stats_week")],
-            [InlineKeyboardButton("📊 Этот месяц", callback_data="stats_month"),
-             InlineKeyboardButton("📈 Все время", callback_data="stats_all")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await safe_edit_message(query,
-            "📊 **Статистика**\n\n"
-            "Выберите период для показа статистики:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-    finally:
-        db.close()
\ No newline at end of file
+    keyboard = [
+        [InlineKeyboardButton("📅 Сегодня", callback_data="stats_today"),
+         InlineKeyboardButton("📆 Эта неделя", callback_data="stats_week")],
+        [InlineKeyboardButton("📊 Этот месяц", callback_data="stats_month"),
+         InlineKeyboardButton("📈 Все время", callback_data="stats_all")],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await safe_edit_message(query,
+        "📊 **Статистика**\n\n"
+        "Выберите период для показа статистики:",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""
+Версионные миграции схемы базы данных
+
+Каждая миграция выполняется один раз: номер применённой миграции
+сохраняется в таблице schema_migrations. Миграции запускаются из
+database.create_tables() при старте бота или вручную через
+scripts/migrate_schema.py.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Index, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from database import (SchemaMigration, User, Transaction, Limit, CategoryMemory, SpendCounter, DailyRollup, CategoryModel,
+                      CategoryFeatureCount, ReceiptCacheEntry, Balance, SchedulerWorker, SchedulerLease)
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Регистрирует функцию как миграцию с указанным номером"""
+    def decorator(func):
+        MIGRATIONS.append(Migration(version, name, func))
+        return func
+    return decorator
+
+
+def create_index_online(engine, index: Index) -> None:
+    """
+    Создает индекс, не блокируя запись в таблицу.
+
+    PostgreSQL: CREATE INDEX CONCURRENTLY вне транзакции. Невалидный индекс,
+    оставшийся от прерванной попытки, удаляется и строится заново.
+    SQLite: CONCURRENTLY не поддерживается, поэтому индекс строится обычным
+    CREATE INDEX IF NOT EXISTS (запись блокируется на время построения).
+    """
+    columns = ", ".join(column.name for column in index.columns)
+    table = index.table.name
+
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            is_valid = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_class c "
+                "JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name"
+            ), {"name": index.name}).scalar()
+
+            if is_valid is False:
+                logger.warning(f"Индекс {index.name} невалиден после прерванного построения, пересоздаем")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {table} ({columns})"
+            ))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index.name} ON {table} ({columns})"))
+
+    logger.info(f"Индекс {index.name} ({table}: {columns}) готов")
+
+
+def _model_index(model, name: str) -> Index:
+    """Найти индекс, объявленный в __table_args__ модели"""
+    for index in model.__table__.indexes:
+        if index.name == name:
+            return index
+    raise KeyError(f"Индекс {name} не объявлен в модели {model.__name__}")
+
+
+@migration(1, "Составные индексы для горячих запросов")
+def _add_hot_path_indexes(engine) -> None:
+    for model, name in (
+        (Transaction, "ix_transactions_user_created"),
+        (Transaction, "ix_transactions_user_category_currency_created"),
+        (Limit, "ix_limits_user_category"),
+        (CategoryMemory, "ix_category_memory_user_pattern"),
+    ):
+        create_index_online(engine, _model_index(model, name))
+
+
+@migration(2, "Счетчики расходов по категориям для лимитов")
+def _backfill_spend_counters(engine) -> None:
+    from services.rollup_service import rebuild_spend_counters
+
+    SpendCounter.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        rebuild_spend_counters(conn)
+
+
+@migration(3, "Дневные сводки транзакций для статистики и графиков")
+def _backfill_daily_rollups(engine) -> None:
+    from services.rollup_service import rebuild_daily_rollups, MONTH
+
+    DailyRollup.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        rebuild_daily_rollups(conn)
+        # Дневные корзины spend_counters заменены строками daily_rollups
+        conn.execute(SpendCounter.__table__.delete().where(SpendCounter.period_type != MONTH))
+
+
+@migration(4, "Модели локального классификатора категорий")
+def _add_category_models(engine) -> None:
+    # Модели обучаются при первом обращении к классификатору, заполнять нечего
+    CategoryModel.__table__.create(bind=engine, checkfirst=True)
+
+
+@migration(5, "Кэш распознанных чеков")
+def _add_receipt_cache(engine) -> None:
+    ReceiptCacheEntry.__table__.create(bind=engine, checkfirst=True)
+
+
+@migration(6, "Баланс в каждой валюте")
+def _balances_per_currency(engine) -> None:
+    # balances.user_id был уникальным: баланс во второй валюте не создавался
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE balances DROP CONSTRAINT IF EXISTS balances_user_id_key"))
+            conn.execute(text("ALTER TABLE balances DROP CONSTRAINT IF EXISTS uq_balances_user_currency"))
+            conn.execute(text(
+                "ALTER TABLE balances ADD CONSTRAINT uq_balances_user_currency UNIQUE (user_id, currency)"
+            ))
+            return
+
+        # SQLite не умеет удалять ограничения: таблица пересоздается
+        conn.execute(text("ALTER TABLE balances RENAME TO balances_old"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_balances_id"))
+        Balance.__table__.create(bind=conn)
+        conn.execute(text(
+            "INSERT INTO balances (id, user_id, amount, currency, last_updated) "
+            "SELECT id, user_id, amount, currency, last_updated FROM balances_old"
+        ))
+        conn.execute(text("DROP TABLE balances_old"))
+
+
+@migration(7, "Аренда шардов планировщика уведомлений")
+def _add_scheduler_leases(engine) -> None:
+    # Строки шардов создает сам планировщик при первом запуске
+    SchedulerWorker.__table__.create(bind=engine, checkfirst=True)
+    SchedulerLease.__table__.create(bind=engine, checkfirst=True)
+
+
+@migration(8, "Время следующих уведомлений в UTC")
+def _add_next_notification_columns(engine) -> None:
+    from services.notification_schedule import next_daily_reminder_utc, next_budget_notification_utc
+
+    existing = {column["name"] for column in inspect(engine).get_columns("users")}
+    with engine.begin() as conn:
+        for column in (User.next_daily_reminder_utc, User.next_budget_notification_utc):
+            if column.name not in existing:
+                column_type = column.type.compile(engine.dialect)
+                conn.execute(text(f"ALTER TABLE users ADD COLUMN {column.name} {column_type}"))
+
+    for name in ("ix_users_next_daily_reminder", "ix_users_next_budget_notification"):
+        create_index_online(engine, _model_index(User, name))
+
+    # Заполняем для пользователей с уже включенными уведомлениями
+    users = User.__table__
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        rows = conn.execute(select(users).where(
+            (users.c.daily_reminder_enabled == True) | (users.c.budget_notifications_enabled == True)
+        )).all()
+        for row in rows:
+            conn.execute(users.update().where(users.c.id == row.id).values(
+                next_daily_reminder_utc=next_daily_reminder_utc(row, now),
+                next_budget_notification_utc=next_budget_notification_utc(row, now)
+            ))
+
+
+@migration(9, "Счетчики признаков классификатора категорий")
+def _add_category_feature_counts(engine) -> None:
+    # Модели больше не хранятся целиком: старые записи удаляются, модели
+    # пользователей заново обучаются на истории в фоне при первом обращении
+    columns = {column["name"] for column in inspect(engine).get_columns("category_models")}
+    if "model" in columns:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE category_models"))
+        CategoryModel.__table__.create(bind=engine)
+    CategoryFeatureCount.__table__.create(bind=engine, checkfirst=True)
+
+
+def get_applied_versions(engine) -> set:
+    """Получить номера уже примененных миграций"""
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        rows = conn.execute(SchemaMigration.__table__.select())
+        return {row.version for row in rows}
+
+
+def run_migrations(engine) -> List[int]:
+    """
+    Применить все еще не примененные миграции по возрастанию номера.
+    Возвращает список номеров миграций, примененных в этом запуске.
+    """
+    applied = get_applied_versions(engine)
+    newly_applied = []
+
+    for item in sorted(MIGRATIONS, key=lambda m: m.version):
+        if item.version in applied:
+            continue
+
+        logger.info(f"Применяется миграция {item.version}: {item.name}")
+        item.apply(engine)
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(SchemaMigration.__table__.insert().values(version=item.version, name=item.name))
+        except IntegrityError:
+            # Миграцию параллельно применил другой экземпляр бота, все шаги идемпотентны
+            logger.info(f"Миграция {item.version} уже отмечена другим процессом")
+
+        newly_applied.append(item.version)
+
+    return newly_applied
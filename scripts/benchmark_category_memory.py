@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поиска в памяти категорий: полный перебор против инвертированного индекса
+
+Создает отдельную SQLite базу с одним пользователем и --patterns паттернами
+из синтетического словаря, затем для набора описаний измеряет медианное
+время find_best_match в прежнем виде (все паттерны пользователя, ключевые
+слова каждого паттерна извлекаются заново) и через индекс. Показывает
+среднее число оцененных кандидатов и долю совпавших ответов.
+
+Использование:
+    python scripts/benchmark_category_memory.py [--patterns 10000] [--queries 200]
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, User, Category, CategoryMemory
+from services.category_memory_service import CategoryMemoryService, category_keyword_index
+
+USER_ID = 1
+CATEGORIES = 12
+VOCABULARY = 3000
+SYLLABLES = ["ка", "ро", "ми", "ла", "то", "не", "ва", "сто", "пре", "мар", "кет", "зин", "бар", "лек", "фар", "ман"]
+
+
+def make_vocabulary(rng: random.Random):
+    words = set()
+    while len(words) < VOCABULARY:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_description(rng: random.Random, words):
+    return " ".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+
+
+def build_memory(database_path: str, patterns: int, rng: random.Random, words):
+    """Пользователь с patterns записями памяти категорий"""
+    engine = create_engine(f"sqlite:///{database_path}")
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"id": USER_ID, "telegram_id": 10_001, "language": "ru"}])
+        conn.execute(Category.__table__.insert(), [
+            {"id": n + 1, "user_id": USER_ID, "name": f"Категория {n}"} for n in range(CATEGORIES)
+        ])
+
+        seen = set()
+        rows = []
+        while len(rows) < patterns:
+            pattern = make_description(rng, words)
+            if pattern in seen:
+                continue
+            seen.add(pattern)
+            rows.append({
+                "user_id": USER_ID,
+                "description_pattern": pattern,
+                "category_id": rng.randint(1, CATEGORIES),
+                "confidence": rng.uniform(0.8, 1.0),
+                "usage_count": rng.randint(1, 5),
+                "last_used": now,
+            })
+        conn.execute(CategoryMemory.__table__.insert(), rows)
+
+    engine.dispose()
+
+
+async def full_scan_match(service: CategoryMemoryService, db, user_id: int, description: str):
+    """find_best_match в прежнем виде: оценка каждой записи пользователя"""
+    normalized_desc = service.normalize_description(description)
+    keywords = service.extract_keywords(description)
+
+    memory_records = (await db.execute(select(CategoryMemory).filter(
+        CategoryMemory.user_id == user_id
+    ))).scalars().all()
+
+    best_match = None
+    best_score = 0.0
+    for record in memory_records:
+        pattern_similarity = service.calculate_similarity(normalized_desc, record.description_pattern)
+        record_keywords = service.extract_keywords(record.description_pattern)
+        keyword_matches = sum(1 for kw in keywords if kw in record_keywords)
+        keyword_score = keyword_matches / max(len(keywords), 1) if keywords else 0
+        popularity_boost = min(record.usage_count / 10, 0.2)
+        combined_score = (pattern_similarity * 0.6 + keyword_score * 0.4 + popularity_boost) * record.confidence
+        if combined_score > best_score and combined_score > service.min_confidence:
+            best_score = combined_score
+            best_match = (record.category_id, combined_score)
+    return best_match
+
+
+async def run(database_path: str, queries):
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    Session = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+    service = CategoryMemoryService()
+
+    try:
+        async with Session() as db:
+            full_scan_times, full_scan_results = [], []
+            for description in queries:
+                started = time.perf_counter()
+                full_scan_results.append(await full_scan_match(service, db, USER_ID, description))
+                full_scan_times.append((time.perf_counter() - started) * 1000)
+
+            category_keyword_index.invalidate(USER_ID)
+            started = time.perf_counter()
+            index = await service._get_user_index(db, USER_ID)
+            build_ms = (time.perf_counter() - started) * 1000
+
+            indexed_times, indexed_results, candidates = [], [], []
+            for description in queries:
+                started = time.perf_counter()
+                indexed_results.append(await service.find_best_match(USER_ID, description, db=db))
+                indexed_times.append((time.perf_counter() - started) * 1000)
+                candidates.append(len(index.candidates(service.extract_keywords(description))))
+    finally:
+        await async_engine.dispose()
+
+    agreement = sum(
+        1 for old, new in zip(full_scan_results, indexed_results)
+        if (old and old[0]) == (new and new[0])
+    ) / len(queries)
+
+    return {
+        "full_scan_ms": statistics.median(full_scan_times),
+        "indexed_ms": statistics.median(indexed_times),
+        "build_ms": build_ms,
+        "candidates": statistics.mean(candidates),
+        "agreement": agreement,
+    }
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска в памяти категорий")
+    parser.add_argument("--patterns", type=int, default=10000, help="Паттернов у пользователя")
+    parser.add_argument("--queries", type=int, default=200, help="Количество описаний для поиска")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = make_vocabulary(rng)
+    queries = [make_description(rng, words) for _ in range(args.queries)]
+
+    print("⏱️ Budget Bot - Бенчмарк памяти категорий")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database_path = os.path.join(temp_dir, "benchmark.db")
+        build_memory(database_path, args.patterns, rng, words)
+        result = asyncio.run(run(database_path, queries))
+
+    print(f"Паттернов у пользователя:      {args.patterns:,}")
+    print(f"Полный перебор, медиана:       {result['full_scan_ms']:.2f} мс")
+    print(f"Индекс, медиана:               {result['indexed_ms']:.2f} мс")
+    print(f"Построение индекса (один раз): {result['build_ms']:.2f} мс")
+    print(f"Кандидатов на запрос:          {result['candidates']:.1f}")
+    print(f"Совпадение категорий:          {result['agreement']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
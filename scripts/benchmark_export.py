@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк потокового экспорта: время, размер файла и пик памяти
+
+Для нескольких размеров истории создает отдельную SQLite базу,
+выполняет ExportService.export() в каждом формате и выводит пик
+выделенной Python-памяти (tracemalloc). Пик не должен расти вместе с
+количеством транзакций.
+
+Использование:
+    python scripts/benchmark_export.py [--sizes 10000,100000] [--chunk-size 1000]
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, User, Category, Transaction
+from services.export_service import ExportService, FORMATS
+
+CATEGORIES = 8
+
+
+def build_history(database_path: str, rows: int):
+    """Один пользователь с rows транзакциями"""
+    engine = create_engine(f"sqlite:///{database_path}")
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(rows)
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"id": 1, "telegram_id": 10_001, "language": "ru"}])
+        conn.execute(Category.__table__.insert(), [
+            {"id": n + 1, "user_id": 1, "name": f"Категория {n}"} for n in range(CATEGORIES)
+        ])
+
+    chunk_size = 50_000
+    for offset in range(0, rows, chunk_size):
+        with engine.begin() as conn:
+            conn.execute(Transaction.__table__.insert(), [
+                {
+                    "user_id": 1,
+                    "category_id": rng.randint(1, CATEGORIES),
+                    "amount": -rng.uniform(1, 150),
+                    "currency": rng.choice(["EUR", "USD"]),
+                    "description": f"синтетическая транзакция {offset + n}",
+                    "created_at": now - timedelta(seconds=rng.randint(0, 730 * 86400)),
+                }
+                for n in range(min(chunk_size, rows - offset))
+            ])
+
+    engine.dispose()
+
+
+async def measure(database_path: str, export_format: str, chunk_size: int):
+    """(секунды, размер файла в КБ, пик памяти в МБ)"""
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    Session = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+    try:
+        async with Session() as db:
+            tracemalloc.start()
+            started = time.perf_counter()
+            result = await ExportService(chunk_size=chunk_size).export(1, export_format, db=db)
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        await async_engine.dispose()
+
+    size = os.path.getsize(result.path)
+    os.remove(result.path)
+    return elapsed, size / 1024, peak / 1024 / 1024
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Бенчмарк потокового экспорта")
+    parser.add_argument("--sizes", default="10000,100000", help="Размеры истории через запятую")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("⏱️ Budget Bot - Бенчмарк экспорта")
+    print("=" * 60)
+    print(f"{'Транзакций':>12}{'Формат':>14}{'время, с':>11}{'файл, КБ':>12}{'пик, МБ':>10}")
+    print("-" * 60)
+
+    for rows in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            database_path = os.path.join(temp_dir, "benchmark.db")
+            build_history(database_path, rows)
+
+            for export_format, (_, format_name) in FORMATS.items():
+                elapsed, size_kb, peak_mb = asyncio.run(measure(database_path, export_format, args.chunk_size))
+                print(f"{rows:>12,}{format_name:>14}{elapsed:>11.2f}{size_kb:>12,.0f}{peak_mb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
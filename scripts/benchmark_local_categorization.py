@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк локальной категоризации: описаний в секунду
+
+Сравнивает прежний перебор категорий x ключевых слов (проверка `in` для
+каждого слова) с автоматом Ахо-Корасик, собранным при импорте, на
+синтетических описаниях. Прежний вариант здесь берет таблицы ключевых
+слов из модуля, а не собирает их заново на каждый вызов, поэтому его
+результат завышен.
+
+Использование:
+    python scripts/benchmark_local_categorization.py [--descriptions 20000] [--repeat 3]
+"""
+
+import sys
+import os
+import argparse
+import random
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.openai_service import OpenAIService, CATEGORY_KEYWORDS, SUBCATEGORY_KEYWORDS
+
+USER_CATEGORIES = ["Продукты", "Транспорт", "Развлечения", "Здоровье", "Одежда", "Ресторан", "Прочее"]
+USER_SUBCATEGORIES = ["Мясо", "Молочные", "Овощи", "Хлеб", "Топливо", "Такси", "Кино", "Кафе", "Доставка"]
+WORDS = ["оплата", "покупка", "заказ", "вечером", "центр", "онлайн", "подписка", "перевод", "сервис", "услуга"]
+
+
+def legacy_categorize_locally(description, existing_categories):
+    normalized_categories = {cat.lower(): cat for cat in existing_categories}
+    for category_key, keywords in CATEGORY_KEYWORDS.items():
+        for existing_cat_lower, existing_cat_original in normalized_categories.items():
+            if category_key in existing_cat_lower or existing_cat_lower in category_key:
+                for keyword in keywords:
+                    if keyword in description:
+                        return existing_cat_original
+    for category_key, keywords in CATEGORY_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword in description:
+                for cat in existing_categories:
+                    if category_key.lower() in cat.lower() or cat.lower() in category_key.lower():
+                        return cat
+    return None
+
+
+def legacy_categorize_subcategory_locally(description, category_name, existing_subcategories):
+    category_lower = category_name.lower()
+    for cat_key, subcats in SUBCATEGORY_KEYWORDS.items():
+        if cat_key in category_lower:
+            for subcat_name, keywords in subcats.items():
+                matching_subcategory = None
+                for existing_subcat in existing_subcategories:
+                    if subcat_name.lower() in existing_subcat.lower() or existing_subcat.lower() in subcat_name.lower():
+                        matching_subcategory = existing_subcat
+                        break
+                if matching_subcategory:
+                    for keyword in keywords:
+                        if keyword in description:
+                            return matching_subcategory
+            break
+    return None
+
+
+def make_descriptions(count, seed):
+    rng = random.Random(seed)
+    keywords = [kw for words in CATEGORY_KEYWORDS.values() for kw in words]
+    descriptions = []
+    for _ in range(count):
+        # Примерно половина описаний без ключевых слов - худший случай для перебора
+        parts = rng.sample(WORDS, rng.randint(1, 3))
+        if rng.random() < 0.5:
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(keywords))
+        descriptions.append(" ".join(parts))
+    return descriptions
+
+
+def rate(func, descriptions, repeat):
+    """Лучшее из repeat значение описаний в секунду"""
+    best = 0.0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for description in descriptions:
+            func(description)
+        best = max(best, len(descriptions) / (time.perf_counter() - started))
+    return best
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Микро-бенчмарк локальной категоризации")
+    parser.add_argument("--descriptions", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    descriptions = make_descriptions(args.descriptions, args.seed)
+    service = OpenAIService.__new__(OpenAIService)
+
+    cases = [
+        (
+            "Категории",
+            lambda d: legacy_categorize_locally(d, USER_CATEGORIES),
+            lambda d: OpenAIService._categorize_locally(d, USER_CATEGORIES),
+        ),
+        (
+            "Подкатегории",
+            lambda d: legacy_categorize_subcategory_locally(d, "Продукты", USER_SUBCATEGORIES),
+            lambda d: service._categorize_subcategory_locally(d, "Продукты", USER_SUBCATEGORIES),
+        ),
+    ]
+
+    print("⏱️ Budget Bot - Бенчмарк локальной категоризации")
+    print("=" * 60)
+    print(f"{'':<14}{'было, опис/с':>16}{'стало, опис/с':>17}{'ускорение':>12}")
+    print("-" * 60)
+
+    for name, legacy, compiled in cases:
+        mismatches = sum(1 for d in descriptions if legacy(d) != compiled(d))
+        if mismatches:
+            print(f"❌ {name}: {mismatches} расхождений с прежней реализацией")
+            sys.exit(1)
+
+        legacy_rate = rate(legacy, descriptions, args.repeat)
+        compiled_rate = rate(compiled, descriptions, args.repeat)
+        print(f"{name:<14}{legacy_rate:>16,.0f}{compiled_rate:>17,.0f}{compiled_rate / legacy_rate:>11.1f}x")
+
+    print("✅ Ответы совпадают с прежней реализацией")
+
+
+if __name__ == "__main__":
+    main()
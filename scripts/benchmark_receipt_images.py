@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Размер загрузки и токены изображения до и после подготовки фото чека
+
+Для каждого изображения из --fixtures (jpg/png/webp) выводит размер файла,
+разрешение и оценку токенов detail=high до и после
+preprocess_receipt_image. Если рядом с изображением лежит <имя>.json с
+ожидаемыми полями ({"total_amount": 12.5, "currency": "EUR"}) и передан
+--check-extraction, чек распознается через OpenAI в обоих вариантах и
+сравнивается с ожиданием (нужен OPENAI_API_KEY, запросы платные).
+
+Без --fixtures используются синтетические чеки (белая лента с текстом на
+темном фоне) - только для оценки размера.
+
+Использование:
+    python scripts/benchmark_receipt_images.py --fixtures path/to/receipts [--check-extraction]
+    python scripts/benchmark_receipt_images.py --synthetic 5
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import io
+import json
+import random
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+import config
+from services.receipt_image_service import preprocess_receipt_image, estimate_vision_tokens
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def synthetic_receipt(seed: int) -> bytes:
+    """Фото 3000x4000: чек с позициями на неоднородном темном столе"""
+    rng = random.Random(seed)
+    photo = Image.new("RGB", (3000, 4000), (60, 45, 35))
+    draw = ImageDraw.Draw(photo)
+    for _ in range(400):
+        x, y = rng.randrange(3000), rng.randrange(4000)
+        shade = rng.randint(40, 80)
+        draw.ellipse((x, y, x + 30, y + 30), fill=(shade, shade - 10, shade - 20))
+
+    left, top = rng.randint(700, 1000), rng.randint(200, 500)
+    draw.rectangle((left, top, left + 1300, top + 3300), fill=(245, 243, 238))
+    for line in range(60):
+        y = top + 80 + line * 52
+        draw.text((left + 60, y), f"ITEM {line:02d} {'X' * rng.randint(4, 14)}", fill=(20, 20, 20))
+        draw.text((left + 1050, y), f"{rng.uniform(0.5, 30):6.2f}", fill=(20, 20, 20))
+
+    output = io.BytesIO()
+    photo.save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+
+def load_fixtures(directory: str):
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            path = os.path.join(directory, name)
+            expected_path = os.path.splitext(path)[0] + ".json"
+            expected = None
+            if os.path.exists(expected_path):
+                with open(expected_path, encoding="utf-8") as f:
+                    expected = json.load(f)
+            with open(path, "rb") as f:
+                fixtures.append((name, f.read(), expected))
+    return fixtures
+
+
+async def extract_total(data: bytes):
+    """Сумма и валюта, распознанные OpenAI (без повторной подготовки изображения)"""
+    from services import openai_service as module
+
+    original_prepare = module.receipt_image_service.prepare
+
+    async def passthrough(image_data):
+        return image_data
+
+    module.receipt_image_service.prepare = passthrough
+    try:
+        transactions = await module.OpenAIService().analyze_receipt_image(data)
+    finally:
+        module.receipt_image_service.prepare = original_prepare
+
+    if not transactions:
+        return None
+    return round(transactions[0]['amount'], 2), transactions[0]['currency']
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Подготовка фото чеков: размер и токены")
+    parser.add_argument("--fixtures", help="Каталог с изображениями чеков")
+    parser.add_argument("--synthetic", type=int, default=3, help="Синтетических чеков, если нет --fixtures")
+    parser.add_argument("--long-edge", type=int, default=config.RECEIPT_IMAGE_LONG_EDGE)
+    parser.add_argument("--quality", type=int, default=config.RECEIPT_IMAGE_JPEG_QUALITY)
+    parser.add_argument("--no-crop", action="store_true")
+    parser.add_argument("--check-extraction", action="store_true", help="Сравнить распознавание через OpenAI")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        fixtures = load_fixtures(args.fixtures)
+    else:
+        fixtures = [(f"synthetic_{n}.jpg", synthetic_receipt(n), None) for n in range(args.synthetic)]
+
+    print("🧾 Budget Bot - Подготовка фото чеков")
+    print("=" * 78)
+    print(f"{'Файл':<24}{'было, КБ':>10}{'стало, КБ':>11}{'было, px':>13}{'стало, px':>13}{'токены':>15}")
+    print("-" * 78)
+
+    total_before = total_after = tokens_before = tokens_after = 0
+    mismatches = checked = 0
+    for name, data, expected in fixtures:
+        with Image.open(io.BytesIO(data)) as image:
+            before_size = image.size
+        prepared = preprocess_receipt_image(data, args.long_edge, args.quality, not args.no_crop)
+
+        before_tokens = estimate_vision_tokens(*before_size)
+        after_tokens = estimate_vision_tokens(*prepared.size)
+        total_before += len(data)
+        total_after += len(prepared.data)
+        tokens_before += before_tokens
+        tokens_after += after_tokens
+
+        print(
+            f"{name[:23]:<24}{len(data) / 1024:>10,.0f}{len(prepared.data) / 1024:>11,.0f}"
+            f"{'x'.join(map(str, before_size)):>13}{'x'.join(map(str, prepared.size)):>13}"
+            f"{f'{before_tokens} -> {after_tokens}':>15}"
+        )
+
+        if args.check_extraction and expected:
+            checked += 1
+            want = (round(float(expected['total_amount']), 2), expected.get('currency', 'EUR'))
+            original = asyncio.run(extract_total(data))
+            processed = asyncio.run(extract_total(prepared.data))
+            status = "✅" if processed == want else "❌"
+            mismatches += processed != want
+            print(f"   {status} ожидалось {want}, исходное {original}, подготовленное {processed}")
+
+    print("-" * 78)
+    print(f"Загрузка: {total_before / 1024:,.0f} -> {total_after / 1024:,.0f} КБ, "
+          f"токены изображений: {tokens_before} -> {tokens_after}")
+
+    if checked:
+        print(f"Распознавание: {checked - mismatches}/{checked} чеков совпали с ожиданием")
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
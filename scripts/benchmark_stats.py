@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Регрессионный бенчмарк /stats: количество SQL-запросов и задержка
+
+Для нескольких размеров истории пользователя считает запросы и медианное
+время одного вызова статистики "Все время" в прежнем виде (все транзакции
+периода + запрос категории на каждую транзакцию) и через StatsService.
+Завершается с кодом 1, если StatsService выполняет больше --max-statements
+запросов или их число растет вместе с историей.
+
+Использование:
+    python scripts/benchmark_stats.py [--sizes 100,1000,10000] [--repeat 20] [--max-statements 2]
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, User, Category, Transaction
+from services.rollup_service import rebuild_daily_rollups
+from services.stats_service import StatsService
+
+CURRENCIES = ["EUR", "EUR", "EUR", "USD"]
+CATEGORIES = 8
+HISTORY_DAYS = 730
+SINCE = date(2020, 1, 1)
+
+
+def build_history(engine, user_id: int, rows: int):
+    """Пользователь с rows транзакциями и пересчитанными сводками"""
+    rng = random.Random(user_id)
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"id": user_id, "telegram_id": 10_000 + user_id, "language": "ru"}])
+        conn.execute(Category.__table__.insert(), [
+            {"id": user_id * 100 + n, "user_id": user_id, "name": f"Категория {n}"}
+            for n in range(CATEGORIES)
+        ])
+
+        batch = []
+        for _ in range(rows):
+            is_income = rng.random() < 0.05
+            batch.append({
+                "user_id": user_id,
+                "category_id": None if is_income else user_id * 100 + rng.randrange(CATEGORIES),
+                "amount": rng.uniform(500, 3000) if is_income else -rng.uniform(1, 150),
+                "currency": rng.choice(CURRENCIES),
+                "description": "синтетическая транзакция",
+                "created_at": now - timedelta(seconds=rng.randint(0, HISTORY_DAYS * 86400)),
+            })
+        conn.execute(Transaction.__table__.insert(), batch)
+        rebuild_daily_rollups(conn, user_id)
+
+
+async def legacy_stats(db, user_id: int):
+    """Статистика в прежнем виде: N+1 запрос категорий"""
+    transactions = (await db.execute(select(Transaction).filter(
+        Transaction.user_id == user_id,
+        Transaction.created_at >= datetime.combine(SINCE, datetime.min.time())
+    ))).scalars().all()
+
+    category_stats = {}
+    for transaction in transactions:
+        if transaction.amount < 0:
+            category = (await db.execute(select(Category).filter(Category.id == transaction.category_id))).scalars().first()
+            if category:
+                amounts = category_stats.setdefault(category.name, {})
+                amounts[transaction.currency] = amounts.get(transaction.currency, 0) + abs(transaction.amount)
+    return category_stats
+
+
+async def rollup_stats(db, user_id: int):
+    return await StatsService().get_period_stats(user_id, SINCE, db=db)
+
+
+async def measure(async_engine, user_id: int, stats_func, repeat: int):
+    """(запросов за вызов, медианная задержка в мс)"""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    Session = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+    timings = []
+    calls = 0
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        for _ in range(repeat):
+            async with Session() as db:
+                started = time.perf_counter()
+                await stats_func(db, user_id)
+                timings.append((time.perf_counter() - started) * 1000)
+                calls += 1
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+
+    return len(statements) // calls, statistics.median(timings)
+
+
+async def run(database_path: str, sizes, repeat: int):
+    engine = create_engine(f"sqlite:///{database_path}")
+    Base.metadata.create_all(bind=engine)
+    for user_id, rows in enumerate(sizes, start=1):
+        build_history(engine, user_id, rows)
+    engine.dispose()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    results = []
+    try:
+        for user_id, rows in enumerate(sizes, start=1):
+            legacy = await measure(async_engine, user_id, legacy_stats, max(1, repeat // 10))
+            current = await measure(async_engine, user_id, rollup_stats, repeat)
+            results.append((rows, legacy, current))
+    finally:
+        await async_engine.dispose()
+
+    return results
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов статистики /stats")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Размеры истории через запятую")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-statements", type=int, default=2)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print("⏱️ Budget Bot - Бенчмарк /stats")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = asyncio.run(run(os.path.join(temp_dir, "benchmark.db"), sizes, args.repeat))
+
+    print(f"{'Транзакций':>12}{'было запросов':>16}{'было, мс':>11}{'стало запросов':>17}{'стало, мс':>12}")
+    print("-" * 68)
+    for rows, (legacy_count, legacy_ms), (count, ms) in results:
+        print(f"{rows:>12,}{legacy_count:>16,}{legacy_ms:>11.2f}{count:>17}{ms:>12.2f}")
+
+    counts = {count for _, _, (count, _) in results}
+    if len(counts) > 1 or max(counts) > args.max_statements:
+        print(f"❌ Регрессия: запросов за вызов {sorted(counts)}, ожидалось не больше {args.max_statements} и без роста")
+        sys.exit(1)
+
+    print(f"✅ {max(counts)} запроса на вызов при любом размере истории")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Оценка локального классификатора категорий на истории расходов
+
+Проигрывает расходы пользователя по времени: для каждого описания сначала
+запрашивает предсказание (как _suggest_category перед OpenAI), затем
+дообучает модель правильной категорией. Выводит долю описаний, для
+которых классификатор ответил сам (не понадобился бы запрос к OpenAI),
+точность этих ответов, время предсказания и размер сохраненной модели.
+
+Использование:
+    python scripts/evaluate_category_classifier.py --telegram-id 123456789
+    python scripts/evaluate_category_classifier.py --synthetic 3000
+"""
+
+import sys
+import os
+import argparse
+import random
+import statistics
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from database import get_db_session, User, Transaction
+from services.category_classifier import CategoryClassifier, NaiveBayesModel
+
+SYNTHETIC_CATEGORIES = {
+    1: ["пятерочка", "перекресток", "lidl", "хлеб", "молоко", "сыр", "овощи", "продукты"],
+    2: ["такси", "bolt", "uber", "метро", "бензин", "парковка"],
+    3: ["кафе", "кофе", "обед", "ужин", "пицца", "суши", "ресторан"],
+    4: ["аптека", "лекарства", "врач", "анализы", "витамины"],
+    5: ["кино", "театр", "концерт", "спортзал", "бассейн"],
+    6: ["интернет", "телефон", "электричество", "аренда", "коммуналка"],
+}
+SHARED_WORDS = ["оплата", "покупка", "вечером", "с друзьями", "онлайн", "доставка", "карта", "центр"]
+
+
+def load_history(telegram_id: int):
+    """[(описание, category_id)] расходов пользователя по времени"""
+    db = get_db_session()
+    try:
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        if not user:
+            print(f"❌ Пользователь с telegram_id {telegram_id} не найден")
+            sys.exit(1)
+        rows = db.query(Transaction.description, Transaction.category_id).filter(
+            Transaction.user_id == user.id,
+            Transaction.amount < 0,
+            Transaction.category_id.isnot(None),
+            Transaction.description.isnot(None)
+        ).order_by(Transaction.created_at).all()
+        return [(description, category_id) for description, category_id in rows]
+    finally:
+        db.close()
+
+
+def synthetic_history(count: int, seed: int):
+    rng = random.Random(seed)
+    history = []
+    for _ in range(count):
+        category_id = rng.choice(list(SYNTHETIC_CATEGORIES))
+        words = rng.sample(SYNTHETIC_CATEGORIES[category_id], rng.randint(1, 2))
+        words += rng.sample(SHARED_WORDS, rng.randint(0, 2))
+        rng.shuffle(words)
+        # Каждое двадцатое описание относится к "чужой" категории - шум разметки
+        if rng.random() < 0.05:
+            category_id = rng.choice(list(SYNTHETIC_CATEGORIES))
+        history.append((" ".join(words), category_id))
+    return history
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Оценка локального классификатора категорий")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--telegram-id", type=int, help="Проиграть историю пользователя из базы")
+    source.add_argument("--synthetic", type=int, help="Проиграть синтетическую историю такого размера")
+    parser.add_argument("--min-documents", type=int, default=config.CLASSIFIER_MIN_DOCUMENTS)
+    parser.add_argument("--min-probability", type=float, default=config.CLASSIFIER_MIN_PROBABILITY)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    history = load_history(args.telegram_id) if args.telegram_id else synthetic_history(args.synthetic, args.seed)
+    if not history:
+        print("❌ Нет расходов с категорией и описанием")
+        sys.exit(1)
+
+    classifier = CategoryClassifier(min_documents=args.min_documents, min_probability=args.min_probability)
+    model = NaiveBayesModel()
+    category_ids = {category_id for _, category_id in history}
+
+    answered = 0
+    correct = 0
+    timings = []
+    for description, category_id in history:
+        features = classifier.features(description)
+        if not features:
+            continue
+
+        started = time.perf_counter()
+        prediction = model.predict(features, category_ids) if model.documents_count >= args.min_documents else None
+        timings.append((time.perf_counter() - started) * 1_000_000)
+
+        if prediction and prediction[1] >= args.min_probability:
+            answered += 1
+            correct += prediction[0] == category_id
+        model.learn(features, category_id)
+
+    print("🧠 Budget Bot - Оценка классификатора категорий")
+    print("=" * 60)
+    print(f"Описаний в истории:           {len(history):,}")
+    print(f"Ответил классификатор:        {answered:,} ({answered / len(history):.1%})")
+    print(f"Точность ответов:             {correct / answered:.1%}" if answered else "Точность ответов:             -")
+    print(f"Предсказание, медиана:        {statistics.median(timings):.0f} мкс")
+    print(f"Строк счетчиков в базе:       {model.rows_count:,}")
+
+
+if __name__ == "__main__":
+    main()
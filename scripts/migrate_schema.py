@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Применение версионных миграций схемы (см. migrations.py)
+
+Использование:
+    python scripts/migrate_schema.py          # применить недостающие миграции
+    python scripts/migrate_schema.py --status # показать состояние без изменений
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import engine, Base
+from migrations import MIGRATIONS, get_applied_versions, run_migrations
+
+
+def show_status():
+    """Показать примененные и ожидающие миграции"""
+    applied = get_applied_versions(engine)
+
+    for item in sorted(MIGRATIONS, key=lambda m: m.version):
+        status = "✅" if item.version in applied else "⏳"
+        print(f"  {status} {item.version:03d} {item.name}")
+
+
+def main():
+    """Основная функция"""
+    print("🗄️ Budget Bot - Миграции схемы")
+    print("=" * 40)
+
+    if "--status" in sys.argv:
+        show_status()
+        return
+
+    Base.metadata.create_all(bind=engine)
+    newly_applied = run_migrations(engine)
+
+    if newly_applied:
+        print(f"✅ Применено миграций: {len(newly_applied)} ({', '.join(map(str, newly_applied))})")
+    else:
+        print("✅ Схема актуальна, новых миграций нет")
+
+    show_status()
+
+
+if __name__ == "__main__":
+    main()
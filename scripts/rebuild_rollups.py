@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Пересчет агрегатов транзакций из таблицы transactions
+
+Перестраивает дневные сводки (daily_rollups) и месячные счетчики расходов
+(spend_counters), например после ручной правки transactions в БД.
+
+Использование:
+    python scripts/rebuild_rollups.py                   # все пользователи
+    python scripts/rebuild_rollups.py --telegram-id 123 # один пользователь
+"""
+
+import sys
+import os
+import argparse
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select
+
+from database import engine, Base, User
+from services.rollup_service import rebuild_daily_rollups, rebuild_spend_counters
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Пересчет daily_rollups и spend_counters")
+    parser.add_argument("--telegram-id", type=int, help="Пересчитать только этого пользователя")
+    args = parser.parse_args()
+
+    print("🔄 Budget Bot - Пересчет агрегатов")
+    print("=" * 40)
+
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+
+    with engine.begin() as conn:
+        user_id = None
+        if args.telegram_id is not None:
+            user_id = conn.execute(select(User.id).where(User.telegram_id == args.telegram_id)).scalar()
+            if user_id is None:
+                print(f"❌ Пользователь {args.telegram_id} не найден")
+                sys.exit(1)
+
+        rollups = rebuild_daily_rollups(conn, user_id)
+        counters = rebuild_spend_counters(conn, user_id)
+
+    print(f"✅ Дневных сводок: {rollups}")
+    print(f"✅ Месячных счетчиков: {counters}")
+    print(f"⏱️ {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
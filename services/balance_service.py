@@ -1,5 +1,8 @@
 from datetime import datetime
-from database import get_db_session, User, Balance, Transaction
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import async_session_scope, increment_upsert, User, Balance, Transaction
 
 
 class BalanceService:
@@ -8,15 +11,14 @@ class BalanceService:
     def __init__(self):
         pass
     
-    def get_or_create_balance(self, user_id: int, currency: str = "EUR") -> Balance:
+    async def get_or_create_balance(self, user_id: int, currency: str = "EUR", db: Optional[AsyncSession] = None) -> Balance:
         """Получить или создать баланс пользователя"""
-        db = get_db_session()
-        try:
+        async with async_session_scope(db) as db:
             # Ищем существующий баланс
-            balance = db.query(Balance).filter(
+            balance = (await db.execute(select(Balance).filter(
                 Balance.user_id == user_id,
                 Balance.currency == currency
-            ).first()
+            ))).scalars().first()
             
             if not balance:
                 # Создаем новый баланс
@@ -26,108 +28,81 @@ class BalanceService:
                     currency=currency
                 )
                 db.add(balance)
-                db.commit()
-                db.refresh(balance)
+                await db.commit()
+                await db.refresh(balance)
             
             return balance
-        finally:
-            db.close()
     
-    def add_income(self, user_id: int, amount: float, currency: str = "EUR") -> Balance:
-        """Добавить доход к балансу"""
-        db = get_db_session()
-        try:
-            balance = db.query(Balance).filter(
+    async def add_delta(self, db: AsyncSession, user_id: int, currency: str, delta: float) -> None:
+        """
+        Изменить баланс на delta одним атомарным upsert (amount = amount + delta)
+        в сессии вызывающего кода, без commit. Одновременные изменения не
+        теряются: строка не читается в Python.
+        """
+        await db.execute(increment_upsert(
+            db.bind.dialect.name,
+            Balance.__table__,
+            key={"user_id": user_id, "currency": currency},
+            increments={"amount": delta},
+            assignments={"last_updated": datetime.utcnow()}
+        ))
+
+    async def _apply_and_fetch(self, user_id: int, currency: str, delta: float, db: Optional[AsyncSession]) -> Balance:
+        async with async_session_scope(db) as db:
+            await self.add_delta(db, user_id, currency, delta)
+            # Вместе с изменением баланса фиксируются и несохраненные изменения вызывающего кода
+            await db.commit()
+
+            # Объект в сессии мог остаться со старой суммой
+            return (await db.execute(select(Balance).filter(
                 Balance.user_id == user_id,
                 Balance.currency == currency
-            ).first()
-            
-            if not balance:
-                balance = Balance(
-                    user_id=user_id,
-                    amount=amount,
-                    currency=currency
-                )
-                db.add(balance)
-            else:
-                balance.amount += amount
-                balance.last_updated = datetime.utcnow()
-            
-            db.commit()
-            db.refresh(balance)
-            return balance
-        finally:
-            db.close()
+            ).execution_options(populate_existing=True))).scalars().first()
+
+    async def add_income(self, user_id: int, amount: float, currency: str = "EUR", db: Optional[AsyncSession] = None) -> Balance:
+        """Добавить доход к балансу"""
+        return await self._apply_and_fetch(user_id, currency, amount, db)
     
-    def subtract_expense(self, user_id: int, amount: float, currency: str = "EUR") -> Balance:
+    async def subtract_expense(self, user_id: int, amount: float, currency: str = "EUR", db: Optional[AsyncSession] = None) -> Balance:
         """Вычесть расход из баланса"""
-        db = get_db_session()
-        try:
-            balance = db.query(Balance).filter(
-                Balance.user_id == user_id,
-                Balance.currency == currency
-            ).first()
-            
-            if not balance:
-                balance = Balance(
-                    user_id=user_id,
-                    amount=-amount,
-                    currency=currency
-                )
-                db.add(balance)
-            else:
-                balance.amount -= amount
-                balance.last_updated = datetime.utcnow()
-            
-            db.commit()
-            db.refresh(balance)
-            return balance
-        finally:
-            db.close()
+        return await self._apply_and_fetch(user_id, currency, -amount, db)
     
-    def get_balance(self, user_id: int, currency: str = "EUR") -> float:
+    async def get_balance(self, user_id: int, currency: str = "EUR", db: Optional[AsyncSession] = None) -> float:
         """Получить текущий баланс пользователя"""
-        db = get_db_session()
-        try:
-            balance = db.query(Balance).filter(
+        async with async_session_scope(db) as db:
+            balance = (await db.execute(select(Balance).filter(
                 Balance.user_id == user_id,
                 Balance.currency == currency
-            ).first()
+            ))).scalars().first()
             
             return balance.amount if balance else 0.0
-        finally:
-            db.close()
     
-    def get_all_balances(self, user_id: int) -> list:
+    async def get_all_balances(self, user_id: int, db: Optional[AsyncSession] = None) -> list:
         """Получить все балансы пользователя по валютам"""
-        db = get_db_session()
-        try:
-            balances = db.query(Balance).filter(
+        async with async_session_scope(db) as db:
+            balances = (await db.execute(select(Balance).filter(
                 Balance.user_id == user_id
-            ).all()
+            ))).scalars().all()
             
             return balances
-        finally:
-            db.close()
     
-    def recalculate_balance(self, user_id: int, currency: str = "EUR") -> Balance:
+    async def recalculate_balance(self, user_id: int, currency: str = "EUR", db: Optional[AsyncSession] = None) -> Balance:
         """Пересчитать баланс на основе всех транзакций"""
-        db = get_db_session()
-        try:
+        async with async_session_scope(db) as db:
             # Получаем все транзакции пользователя в данной валюте
-            transactions = db.query(Transaction).filter(
+            transactions = (await db.execute(select(Transaction).filter(
                 Transaction.user_id == user_id,
                 Transaction.currency == currency
-            ).all()
+            ))).scalars().all()
             
             # Суммируем все транзакции
             total_amount = sum(transaction.amount for transaction in transactions)
             
             # Получаем или создаем баланс
-            balance = db.query(Balance).filter(
+            balance = (await db.execute(select(Balance).filter(
                 Balance.user_id == user_id,
                 Balance.currency == currency
-            ).first()
+            ))).scalars().first()
             
             if not balance:
                 balance = Balance(
@@ -140,12 +115,10 @@ class BalanceService:
                 balance.amount = total_amount
                 balance.last_updated = datetime.utcnow()
             
-            db.commit()
-            db.refresh(balance)
+            await db.commit()
+            await db.refresh(balance)
             return balance
-        finally:
-            db.close()
     
-    def update_balance_from_transaction(self, transaction: Transaction) -> Balance:
+    async def update_balance_from_transaction(self, transaction: Transaction, db: Optional[AsyncSession] = None) -> Balance:
         """Обновить баланс на основе транзакции"""
-        return self.add_income(transaction.user_id, transaction.amount, transaction.currency)
\ No newline at end of file
+        return await self.add_income(transaction.user_id, transaction.amount, transaction.currency, db=db)
\ No newline at end of file
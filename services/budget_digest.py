@@ -0,0 +1,186 @@
+"""
+Сводка по бюджету до зарплаты (статус бюджета в уведомлениях) для
+пачки пользователей одним запросом
+"""
+
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import pytz
+from sqlalchemy import and_, func, or_, select
+
+from database import Category, DailyRollup, Limit, SpendCounter, User
+from services.rollup_service import MONTH, next_month
+
+logger = logging.getLogger(__name__)
+
+# Сколько пользователей обрабатывается одним запросом
+DIGEST_BATCH_SIZE = 500
+
+
+class LimitProgress(NamedTuple):
+    category_name: str
+    category_emoji: Optional[str]
+    amount: float
+    currency: str
+    spent: float
+
+
+class BudgetDigest(NamedTuple):
+    today: date
+    next_salary: date
+    limits: List[LimitProgress]
+
+    @property
+    def days_until_salary(self) -> int:
+        return (self.next_salary - self.today).days
+
+
+def _salary_in_month(year: int, month: int, salary_day: int) -> date:
+    """День зарплаты в месяце; если месяц короче, последний день месяца"""
+    return date(year, month, min(salary_day, calendar.monthrange(year, month)[1]))
+
+
+def next_salary_date(today: date, salary_day: int) -> date:
+    """Ближайшая дата зарплаты после today"""
+    salary = _salary_in_month(today.year, today.month, salary_day)
+    if salary > today:
+        return salary
+    following = next_month(today)
+    return _salary_in_month(following.year, following.month, salary_day)
+
+
+def last_salary_date(today: date, salary_day: int) -> date:
+    """Последняя дата зарплаты не позже today"""
+    salary = _salary_in_month(today.year, today.month, salary_day)
+    if salary <= today:
+        return salary
+    previous = today.replace(day=1) - timedelta(days=1)
+    return _salary_in_month(previous.year, previous.month, salary_day)
+
+
+class BudgetDigestService:
+    """
+    Остаток по лимитам с последней зарплаты.
+
+    Расходы берутся из агрегатов (services/rollup_service.py): дни до конца
+    месяца последней зарплаты - из daily_rollups, следующие месяцы - из
+    spend_counters. Для пачки пользователей лимиты, категории и суммы
+    расходов читаются одним сгруппированным запросом; пользователи с
+    одинаковым периодом (тот же день последней зарплаты) делят одно
+    условие, как в NotificationScheduler._users_with_transactions_today.
+    """
+
+    async def build(self, db, users: List[User], now: datetime) -> Dict[int, BudgetDigest]:
+        """
+        Сводки для пользователей с заданной датой зарплаты: {user_id: BudgetDigest}.
+        now - текущее время UTC с tzinfo; "сегодня" берется в часовом поясе
+        пользователя. Пользователи без лимитов в результат не попадают.
+        """
+        digests = {}
+        for offset in range(0, len(users), DIGEST_BATCH_SIZE):
+            digests.update(await self._build_batch(db, users[offset:offset + DIGEST_BATCH_SIZE], now))
+        return digests
+
+    async def _build_batch(self, db, users: List[User], now: datetime) -> Dict[int, BudgetDigest]:
+        periods = {}
+        by_since = defaultdict(list)
+        for user in users:
+            if user.salary_date is None:
+                continue
+            try:
+                today = now.astimezone(pytz.timezone(user.timezone)).date()
+            except pytz.UnknownTimeZoneError:
+                logger.error(f"Неизвестный часовой пояс {user.timezone} у пользователя {user.telegram_id}")
+                continue
+            periods[user.id] = (today, next_salary_date(today, user.salary_date))
+            by_since[last_salary_date(today, user.salary_date)].append(user.id)
+
+        if not periods:
+            return {}
+
+        rollup_conditions = []
+        counter_conditions = []
+        for since, user_ids in by_since.items():
+            first_month = since if since.day == 1 else next_month(since)
+            if since < first_month:
+                rollup_conditions.append(and_(
+                    DailyRollup.user_id.in_(user_ids),
+                    DailyRollup.date >= since,
+                    DailyRollup.date < first_month
+                ))
+            counter_conditions.append(and_(
+                SpendCounter.user_id.in_(user_ids),
+                SpendCounter.period_start >= first_month
+            ))
+
+        spent_parts = []
+        if rollup_conditions:
+            spent_parts.append(select(
+                DailyRollup.user_id.label("user_id"),
+                DailyRollup.category_id.label("category_id"),
+                DailyRollup.currency.label("currency"),
+                DailyRollup.expense_sum.label("spent")
+            ).where(or_(*rollup_conditions)))
+        spent_parts.append(select(
+            SpendCounter.user_id.label("user_id"),
+            SpendCounter.category_id.label("category_id"),
+            SpendCounter.currency.label("currency"),
+            SpendCounter.spent.label("spent")
+        ).where(SpendCounter.period_type == MONTH, or_(*counter_conditions)))
+
+        parts = spent_parts[0].union_all(*spent_parts[1:]).subquery()
+        spent = select(
+            parts.c.user_id, parts.c.category_id, parts.c.currency,
+            func.sum(parts.c.spent).label("spent")
+        ).group_by(parts.c.user_id, parts.c.category_id, parts.c.currency).subquery()
+
+        rows = await db.execute(
+            select(
+                Limit.user_id, Limit.amount, Limit.currency, Category.name, Category.emoji,
+                func.coalesce(spent.c.spent, 0.0)
+            )
+            .join(Category, Category.id == Limit.category_id)
+            .outerjoin(spent, and_(
+                spent.c.user_id == Limit.user_id,
+                spent.c.category_id == Limit.category_id,
+                spent.c.currency == Limit.currency
+            ))
+            .where(Limit.user_id.in_(list(periods)))
+            .order_by(Limit.user_id, Limit.id)
+        )
+
+        limits = defaultdict(list)
+        for user_id, amount, currency, name, emoji, spent_sum in rows:
+            limits[user_id].append(LimitProgress(name, emoji, amount, currency, float(spent_sum)))
+
+        return {
+            user_id: BudgetDigest(today, next_salary, limits[user_id])
+            for user_id, (today, next_salary) in periods.items()
+            if limits[user_id]
+        }
+
+
+def render_budget_digest(digest: BudgetDigest) -> str:
+    """Текст уведомления о статусе бюджета"""
+    days_until_salary = digest.days_until_salary
+    message_parts = [
+        "💰 **Статус бюджета**\n",
+        f"📅 До зарплаты: {days_until_salary} дней\n"
+    ]
+
+    for limit in digest.limits:
+        remaining = limit.amount - limit.spent
+        daily_budget = remaining / max(days_until_salary, 1) if days_until_salary > 0 else 0
+        category_emoji = limit.category_emoji or "📁"
+
+        message_parts.append(
+            f"{category_emoji} **{limit.category_name}**\n"
+            f"   Осталось: {remaining:.2f} {limit.currency}\n"
+            f"   Можно тратить в день: {daily_budget:.2f} {limit.currency}\n"
+        )
+
+    return "\n".join(message_parts)
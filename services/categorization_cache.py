@@ -0,0 +1,187 @@
+"""
+Кэш ответов OpenAI при категоризации: LRU в памяти + SQLite на диске
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import config
+from services.category_memory_service import CategoryMemoryService
+
+logger = logging.getLogger(__name__)
+
+# Возвращается get() при промахе: None - допустимый закэшированный ответ
+MISS = object()
+
+# Как часто (в записях) проверять размер дискового уровня
+EVICTION_CHECK_INTERVAL = 100
+
+
+class CategorizationCache:
+    """
+    Двухуровневый кэш ответов модели.
+
+    Ключ - нормализованное описание (как в памяти категорий) и хэш набора
+    вариантов, из которых модель выбирала: при изменении списка категорий
+    пользователя старые ответы просто перестают совпадать. Первый уровень -
+    LRU в памяти процесса, второй - SQLite-файл, переживающий перезапуск.
+    Записи старше ttl_seconds считаются промахом; на диске хранится не
+    больше max_rows записей, лишние удаляются по давности обращения.
+    Операции с SQLite выполняются в отдельном потоке.
+    """
+
+    def __init__(self, path: str, memory_size: int = 5000, max_rows: int = 100000,
+                 ttl_seconds: float = 30 * 86400):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+        self._normalizer = CategoryMemoryService()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def make_key(self, kind: str, description: str, choices: List[str]) -> Optional[str]:
+        """Ключ кэша или None, если описание пустое после нормализации"""
+        normalized = self._normalizer.normalize_description(description)
+        if not normalized:
+            return None
+
+        choices_hash = hashlib.sha1("\x1f".join(sorted(choices)).encode("utf-8")).hexdigest()[:16]
+        return f"{kind}:{choices_hash}:{normalized}"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+            self._connection.commit()
+        return self._connection
+
+    def _disk_get(self, key: str, now: float):
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return MISS, None
+
+            value, created_at = row
+            if created_at + self.ttl_seconds <= now:
+                connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                connection.commit()
+                return MISS, created_at
+
+            connection.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            connection.commit()
+            return value, created_at
+
+    def _disk_put(self, key: str, value: Optional[str], now: float) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+
+            self._writes_since_check += 1
+            if self._writes_since_check >= EVICTION_CHECK_INTERVAL:
+                self._writes_since_check = 0
+                connection.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl_seconds,))
+                excess = connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_rows
+                if excess > 0:
+                    connection.execute(
+                        "DELETE FROM llm_cache WHERE key IN "
+                        "(SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                        (excess,)
+                    )
+                    self.evictions += excess
+
+            connection.commit()
+
+    def _remember(self, key: str, value: Optional[str], created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str):
+        """Закэшированный ответ (может быть None) или MISS"""
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, created_at = entry
+            if created_at + self.ttl_seconds > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self._memory[key]
+
+        try:
+            value, created_at = await asyncio.to_thread(self._disk_get, key, now)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения кэша категоризации: {e}")
+            value, created_at = MISS, None
+
+        if value is MISS:
+            if created_at is not None:
+                self.expired += 1
+            self.misses += 1
+            return MISS
+
+        self._remember(key, value, created_at)
+        self.disk_hits += 1
+        return value
+
+    async def put(self, key: str, value: Optional[str]) -> None:
+        """Сохранить ответ модели в оба уровня"""
+        now = time.time()
+        self._remember(key, value, now)
+        try:
+            await asyncio.to_thread(self._disk_put, key, value, now)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи кэша категоризации: {e}")
+
+    def stats(self) -> dict:
+        """Попадания по уровням (каждое - несостоявшийся запрос к OpenAI)"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_size": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+categorization_cache = CategorizationCache(
+    path=config.CATEGORIZATION_CACHE_PATH,
+    memory_size=config.CATEGORIZATION_CACHE_MEMORY_SIZE,
+    max_rows=config.CATEGORIZATION_CACHE_MAX_ROWS,
+    ttl_seconds=config.CATEGORIZATION_CACHE_TTL
+)
@@ -0,0 +1,438 @@
+"""
+Локальный классификатор категорий: мультиномиальный наивный Байес по словам
+и символьным триграммам, обучаемый на истории пользователя
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database import async_session_scope, Transaction, CategoryMemory, CategoryModel, CategoryFeatureCount
+from services.category_memory_service import CategoryMemoryService
+
+logger = logging.getLogger(__name__)
+
+WORD_PREFIX = "w:"
+# Признак, под которым в category_feature_counts хранится число описаний
+# категории (после нормализации в описаниях нет символа "#")
+DOCUMENTS_FEATURE = "#documents"
+
+
+class NaiveBayesModel:
+    """
+    Счетчики признаков по категориям. Обучение - прибавление счетчиков,
+    поэтому модель дообучается на каждой подтвержденной категории без
+    пересчета истории.
+    """
+
+    def __init__(self, documents: Optional[Dict[int, int]] = None,
+                 features: Optional[Dict[int, Dict[str, int]]] = None):
+        self.documents: Dict[int, int] = documents or {}
+        self.features: Dict[int, Dict[str, int]] = features or {}
+        self.totals = {category_id: sum(counts.values()) for category_id, counts in self.features.items()}
+        self.vocabulary: Set[str] = set()
+        for counts in self.features.values():
+            self.vocabulary.update(counts)
+
+    @property
+    def documents_count(self) -> int:
+        return sum(self.documents.values())
+
+    @staticmethod
+    def extract_features(normalized: str) -> List[str]:
+        """Слова целиком и триграммы символов каждого слова (с границами)"""
+        features = []
+        for word in normalized.split():
+            features.append(WORD_PREFIX + word)
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def learn(self, features: List[str], category_id: int) -> None:
+        counts = self.features.setdefault(category_id, {})
+        for feature in features:
+            counts[feature] = counts.get(feature, 0) + 1
+        self.vocabulary.update(features)
+        self.totals[category_id] = self.totals.get(category_id, 0) + len(features)
+        self.documents[category_id] = self.documents.get(category_id, 0) + 1
+
+    def predict(self, features: List[str], allowed: Optional[Set[int]] = None) -> Optional[Tuple[int, float]]:
+        """
+        (category_id, вероятность) лучшей категории или None.
+
+        Категория предлагается, только если хотя бы одно слово описания
+        уже встречалось в ней: по одним триграммам незнакомого слова Байес
+        слишком уверенно угадывает.
+        """
+        classes = [category_id for category_id in self.documents if allowed is None or category_id in allowed]
+        if not classes or not features:
+            return None
+
+        total_documents = sum(self.documents[category_id] for category_id in classes)
+        vocabulary_size = len(self.vocabulary) + 1
+
+        scores = {}
+        for category_id in classes:
+            counts = self.features.get(category_id, {})
+            denominator = math.log(self.totals.get(category_id, 0) + vocabulary_size)
+            score = math.log(self.documents[category_id] / total_documents)
+            for feature in features:
+                score += math.log(counts.get(feature, 0) + 1) - denominator
+            scores[category_id] = score
+
+        best = max(scores, key=scores.get)
+        best_counts = self.features.get(best, {})
+        if not any(feature in best_counts for feature in features if feature.startswith(WORD_PREFIX)):
+            return None
+
+        # Softmax по логарифмам апостериорных вероятностей
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+    @property
+    def rows_count(self) -> int:
+        """Сколько строк модель занимает в category_feature_counts"""
+        return len(self.documents) + sum(len(counts) for counts in self.features.values())
+
+    @classmethod
+    def from_counts(cls, rows: Iterable[Tuple[int, str, int]]) -> "NaiveBayesModel":
+        """Модель из строк (category_id, feature, count) таблицы category_feature_counts"""
+        documents: Dict[int, int] = {}
+        features: Dict[int, Dict[str, int]] = {}
+        for category_id, feature, count in rows:
+            if feature == DOCUMENTS_FEATURE:
+                documents[category_id] = count
+            else:
+                features.setdefault(category_id, {})[feature] = count
+        return cls(documents=documents, features=features)
+
+    def to_counts(self) -> List[Tuple[int, str, int]]:
+        rows = [(category_id, DOCUMENTS_FEATURE, count) for category_id, count in self.documents.items()]
+        for category_id, counts in self.features.items():
+            rows.extend((category_id, feature, count) for feature, count in counts.items())
+        return rows
+
+
+def _after_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """
+    Вызвать callback после commit текущей транзакции сессии вызывающего
+    кода; при rollback или закрытии сессии без commit он не вызывается
+    """
+    sync_session = session.sync_session
+    state = {"committed": False, "done": False}
+
+    def on_commit(_session):
+        # Фиксация точки сохранения (begin_nested) - еще не commit транзакции
+        if not state["done"] and not sync_session.in_nested_transaction():
+            state["committed"] = True
+
+    def on_transaction_end(_session, transaction):
+        if state["done"] or transaction.parent is not None:
+            return
+        state["done"] = True
+        if state["committed"]:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка обновления классификатора после commit: {e}")
+
+    # Слушатели нельзя снять во время рассылки события: после транзакции они ничего не делают
+    event.listen(sync_session, "after_commit", on_commit)
+    event.listen(sync_session, "after_transaction_end", on_transaction_end)
+
+
+class CategoryClassifier:
+    """
+    Модели пользователей: LRU в памяти процесса и счетчики признаков в
+    таблице category_feature_counts.
+
+    Модель, которой еще нет в базе, обучается на расходах пользователя с
+    категорией и на паттернах памяти категорий в фоновой задаче; пока
+    обучение не закончено, классификатор не отвечает. Дальше каждая
+    подтвержденная категория атомарно прибавляет счетчики в транзакции
+    вызывающего кода. Модель в памяти перечитывается из базы через max_age
+    секунд, чтобы подхватить дообучение в других экземплярах бота.
+    Предсказания выдаются только после min_documents описаний в обучении.
+    """
+
+    def __init__(self, min_documents: int = 30, min_probability: float = 0.9, cache_size: int = 1000,
+                 max_age: float = 600):
+        self.min_documents = min_documents
+        self.min_probability = min_probability
+        self.cache_size = cache_size
+        self.max_age = max_age
+        self._models: "OrderedDict[int, Tuple[NaiveBayesModel, float]]" = OrderedDict()
+        self._training: Dict[int, asyncio.Task] = {}
+        # Траты, зафиксированные, пока модели не было: время последнего commit
+        self._unlearned: Dict[int, datetime] = {}
+        self._rechecks: Dict[int, asyncio.Task] = {}
+        self._normalizer = CategoryMemoryService()
+
+        self.predictions = 0
+        self.abstentions = 0
+        self.trained = 0
+
+    def features(self, description: str) -> List[str]:
+        return NaiveBayesModel.extract_features(self._normalizer.normalize_description(description))
+
+    def _remember(self, user_id: int, model: NaiveBayesModel) -> None:
+        self._models[user_id] = (model, time.monotonic())
+        self._models.move_to_end(user_id)
+        while len(self._models) > self.cache_size:
+            self._models.popitem(last=False)
+
+    def _cached(self, user_id: int) -> Optional[NaiveBayesModel]:
+        entry = self._models.get(user_id)
+        if entry is None:
+            return None
+        model, loaded_at = entry
+        if time.monotonic() - loaded_at > self.max_age:
+            del self._models[user_id]
+            return None
+        self._models.move_to_end(user_id)
+        return model
+
+    async def _train_from_history(self, db: AsyncSession, user_id: int) -> NaiveBayesModel:
+        model = NaiveBayesModel()
+
+        transactions = (await db.execute(select(Transaction.description, Transaction.category_id).filter(
+            Transaction.user_id == user_id,
+            Transaction.amount < 0,
+            Transaction.category_id.isnot(None),
+            Transaction.description.isnot(None)
+        ))).all()
+        patterns = (await db.execute(select(CategoryMemory.description_pattern, CategoryMemory.category_id).filter(
+            CategoryMemory.user_id == user_id,
+            CategoryMemory.category_id.isnot(None)
+        ))).all()
+
+        for description, category_id in list(transactions) + list(patterns):
+            features = self.features(description)
+            if features:
+                model.learn(features, category_id)
+        return model
+
+    async def train(self, user_id: int, db: Optional[AsyncSession] = None,
+                    trained_before: Optional[datetime] = None) -> bool:
+        """
+        Обучить модель пользователя на истории и сохранить счетчики.
+        False, если модель уже обучена (в том числе другим экземпляром бота).
+        С trained_before модель, наоборот, переобучается заново, если ее
+        снимок истории взят раньше этого момента; иначе False.
+        """
+        async with async_session_scope(db) as db:
+            try:
+                # Запись в category_models - отметка, что история уже учтена, и время
+                # снимка истории: обучение выполняется один раз, переобучение - только
+                # если отметка старше trained_before
+                now = datetime.utcnow()
+                if trained_before is None:
+                    insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+                    claimed = await db.execute(
+                        insert(CategoryModel.__table__)
+                        .values(user_id=user_id, documents=0, trained_at=now, updated_at=now)
+                        .on_conflict_do_nothing(index_elements=["user_id"])
+                    )
+                else:
+                    claimed = await db.execute(
+                        update(CategoryModel)
+                        .where(CategoryModel.user_id == user_id, CategoryModel.trained_at < trained_before)
+                        .values(documents=0, trained_at=now, updated_at=now)
+                        .execution_options(synchronize_session=False)
+                    )
+                if claimed.rowcount != 1:
+                    await db.rollback()
+                    return False
+                if trained_before is not None:
+                    await db.execute(delete(CategoryFeatureCount).where(CategoryFeatureCount.user_id == user_id))
+
+                model = await self._train_from_history(db, user_id)
+                rows = model.to_counts()
+                if rows:
+                    await db.execute(CategoryFeatureCount.__table__.insert(), [
+                        {"user_id": user_id, "category_id": category_id, "feature": feature, "count": count}
+                        for category_id, feature, count in rows
+                    ])
+                await db.execute(update(CategoryModel).where(CategoryModel.user_id == user_id).values(
+                    documents=model.documents_count
+                ).execution_options(synchronize_session=False))
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+        self.trained += 1
+        self._remember(user_id, model)
+        logger.info(f"Классификатор пользователя {user_id} обучен на {model.documents_count} описаниях")
+        return True
+
+    async def _train_in_background(self, user_id: int) -> None:
+        try:
+            await self.train(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка обучения классификатора пользователя {user_id}: {e}")
+        finally:
+            self._training.pop(user_id, None)
+
+    def _schedule_training(self, user_id: int) -> None:
+        if user_id not in self._training:
+            self._training[user_id] = asyncio.get_running_loop().create_task(self._train_in_background(user_id))
+
+    def _recheck_training(self, user_id: int) -> None:
+        """
+        Трата зафиксирована, пока модели не было (обучение не начато или
+        идет): если снимок истории взят до этого commit, модель переобучается
+        """
+        self._unlearned[user_id] = datetime.utcnow()
+        if user_id not in self._rechecks:
+            self._rechecks[user_id] = asyncio.get_running_loop().create_task(self._recheck_in_background(user_id))
+
+    async def _recheck_in_background(self, user_id: int) -> None:
+        try:
+            while user_id in self._unlearned:
+                training = self._training.get(user_id)
+                if training is not None:
+                    await asyncio.gather(training, return_exceptions=True)
+                # Модели в базе еще нет: будущее обучение прочитает уже зафиксированную трату
+                await self.train(user_id, trained_before=self._unlearned.pop(user_id))
+        except Exception as e:
+            logger.error(f"Ошибка переобучения классификатора пользователя {user_id}: {e}")
+        finally:
+            self._rechecks.pop(user_id, None)
+
+    async def _load(self, db: AsyncSession, user_id: int) -> Optional[NaiveBayesModel]:
+        """Модель из памяти или из базы; None (и обучение в фоне), если ее еще нет"""
+        model = self._cached(user_id)
+        if model is not None:
+            return model
+
+        if await db.get(CategoryModel, user_id) is None:
+            self._schedule_training(user_id)
+            return None
+
+        rows = (await db.execute(select(
+            CategoryFeatureCount.category_id, CategoryFeatureCount.feature, CategoryFeatureCount.count
+        ).filter(CategoryFeatureCount.user_id == user_id))).all()
+        model = NaiveBayesModel.from_counts(rows)
+        self._remember(user_id, model)
+        return model
+
+    async def predict(self, user_id: int, description: str, allowed_category_ids: Iterable[int],
+                      db: Optional[AsyncSession] = None) -> Optional[Tuple[int, float]]:
+        """
+        (category_id, вероятность) среди allowed_category_ids или None, если
+        модель еще не обучена, мала или не уверена
+        """
+        features = self.features(description)
+        if not features:
+            return None
+
+        async with async_session_scope(db) as db:
+            try:
+                model = await self._load(db, user_id)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки классификатора пользователя {user_id}: {e}")
+                return None
+
+        prediction = None
+        if model is not None and model.documents_count >= self.min_documents:
+            prediction = model.predict(features, set(allowed_category_ids))
+
+        if prediction is None or prediction[1] < self.min_probability:
+            self.abstentions += 1
+            return None
+
+        self.predictions += 1
+        return prediction
+
+    async def learn(self, user_id: int, description: str, category_id: int,
+                    db: Optional[AsyncSession] = None) -> None:
+        """
+        Дообучить модель на подтвержденной категории. Счетчики прибавляются
+        в сессии вызывающего кода и фиксируются его commit (в той же
+        транзакции, что и сама трата); без сессии - собственным commit.
+        Модель в памяти меняется только после commit: при rollback она
+        остается равной счетчикам в базе.
+        """
+        features = self.features(description)
+        if not features or not category_id:
+            return
+
+        own_session = db is None
+        async with async_session_scope(db) as session:
+            try:
+                model = await self._load(session, user_id)
+                if model is None:
+                    # Модель обучается на истории в фоне: трату, которую снимок истории
+                    # мог не застать, учтет переобучение после commit
+                    if own_session:
+                        self._recheck_training(user_id)
+                    else:
+                        _after_commit(session, lambda: self._recheck_training(user_id))
+                    return
+
+                table = CategoryFeatureCount.__table__
+                insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+                stmt = insert(table).values([
+                    {"user_id": user_id, "category_id": category_id, "feature": feature, "count": count}
+                    for feature, count in Counter(features + [DOCUMENTS_FEATURE]).items()
+                ])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["user_id", "category_id", "feature"],
+                    set_={"count": table.c.count + stmt.excluded.count}
+                )
+
+                if session.bind.dialect.name == "postgresql":
+                    # Точка сохранения: ошибка счетчиков не отменяет транзакцию вызывающего кода.
+                    # В SQLite ошибка оператора транзакцию и так не прерывает, а SAVEPOINT до
+                    # первого изменения в транзакции драйвер фиксирует сразу
+                    async with session.begin_nested():
+                        await self._add_counts(session, stmt, user_id)
+                else:
+                    await self._add_counts(session, stmt, user_id)
+                if own_session:
+                    await session.commit()
+                    model.learn(features, category_id)
+                else:
+                    _after_commit(session, lambda: model.learn(features, category_id))
+            except Exception as e:
+                logger.error(f"Ошибка дообучения классификатора пользователя {user_id}: {e}")
+
+    @staticmethod
+    async def _add_counts(session: AsyncSession, stmt, user_id: int) -> None:
+        await session.execute(stmt)
+        await session.execute(update(CategoryModel).where(CategoryModel.user_id == user_id).values(
+            documents=CategoryModel.documents + 1, updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False))
+
+    def invalidate(self, user_id: int) -> None:
+        self._models.pop(user_id, None)
+
+    def stats(self) -> dict:
+        """Сколько раз классификатор ответил вместо OpenAI"""
+        total = self.predictions + self.abstentions
+        return {
+            "models_in_memory": len(self._models),
+            "trained": self.trained,
+            "training": len(self._training),
+            "rechecks": len(self._rechecks),
+            "predictions": self.predictions,
+            "abstentions": self.abstentions,
+            "coverage": self.predictions / total if total else 0.0,
+        }
+
+
+category_classifier = CategoryClassifier(
+    min_documents=config.CLASSIFIER_MIN_DOCUMENTS,
+    min_probability=config.CLASSIFIER_MIN_PROBABILITY,
+    cache_size=config.CLASSIFIER_CACHE_SIZE
+)
@@ -1,13 +1,123 @@
 import re
+import time
 import logging
-from typing import Optional, List, Tuple
+from collections import OrderedDict
+from typing import Dict, Optional, List, Set, Tuple
 from datetime import datetime, timedelta
 from difflib import SequenceMatcher
-from database import get_db_session, CategoryMemory, Category
-from sqlalchemy import func, and_, or_
+import config
+from database import async_session_scope, CategoryMemory, Category
+from services.trigram_similarity import TrigramSimilarityIndex
+from sqlalchemy import select, delete, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = logging.getLogger(__name__)
 
+
+class _IndexedPattern:
+    """Данные паттерна, нужные для оценки совпадения"""
+
+    __slots__ = ('pattern', 'keywords', 'category_id', 'usage_count', 'confidence')
+
+    def __init__(self, pattern: str, keywords: Set[str], category_id: int, usage_count: int, confidence: float):
+        self.pattern = pattern
+        self.keywords = keywords
+        self.category_id = category_id
+        self.usage_count = usage_count
+        self.confidence = confidence
+
+
+class _UserIndex:
+    def __init__(self):
+        self.patterns: Dict[int, _IndexedPattern] = {}
+        self.postings: Dict[str, Set[int]] = {}
+        self.trigrams = TrigramSimilarityIndex()
+        self.loaded_at = time.monotonic()
+
+    def put(self, pattern_id: int, entry: _IndexedPattern) -> None:
+        old = self.patterns.get(pattern_id)
+        if old is None or old.pattern != entry.pattern:
+            self.trigrams.add(pattern_id, entry.pattern)
+        if old is not None:
+            for keyword in old.keywords - entry.keywords:
+                ids = self.postings.get(keyword)
+                if ids is not None:
+                    ids.discard(pattern_id)
+                    if not ids:
+                        del self.postings[keyword]
+
+        self.patterns[pattern_id] = entry
+        for keyword in entry.keywords:
+            self.postings.setdefault(keyword, set()).add(pattern_id)
+
+    def candidates(self, keywords: List[str]) -> Set[int]:
+        ids = set()
+        for keyword in keywords:
+            ids |= self.postings.get(keyword, set())
+        return ids
+
+
+class CategoryKeywordIndex:
+    """
+    Инвертированный индекс паттернов памяти категорий: ключевое слово ->
+    id паттернов, в которых оно встречается, и триграммная матрица для
+    поиска похожих написаний.
+
+    Индекс пользователя строится одним запросом при первом обращении и
+    дальше поддерживается remember_category. Через max_age секунд он
+    перечитывается из базы, чтобы подхватить изменения из других процессов.
+    В памяти хранятся индексы не больше max_users пользователей, давно не
+    обращавшиеся вытесняются первыми.
+    """
+
+    def __init__(self, max_age: float = 600, max_users: int = 1000):
+        self.max_age = max_age
+        self.max_users = max_users
+        self._users: "OrderedDict[int, _UserIndex]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[_UserIndex]:
+        index = self._users.get(user_id)
+        if index is None:
+            return None
+        if time.monotonic() - index.loaded_at > self.max_age:
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return index
+
+    def set(self, user_id: int, index: _UserIndex) -> None:
+        self._users[user_id] = index
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, user_id: int, pattern_id: int, entry: _IndexedPattern) -> None:
+        """Обновить паттерн, если индекс пользователя уже загружен"""
+        index = self._users.get(user_id)
+        if index is not None:
+            index.put(pattern_id, entry)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Сбросить индекс пользователя (или всех пользователей)"""
+        if user_id is None:
+            self._users.clear()
+        else:
+            self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "max_users": self.max_users,
+            "evictions": self.evictions,
+            "patterns": sum(len(index.patterns) for index in self._users.values()),
+        }
+
+
+category_keyword_index = CategoryKeywordIndex(max_users=config.CATEGORY_INDEX_MAX_USERS)
+
+
 class CategoryMemoryService:
     """
     Сервис для запоминания и предсказания категорий на основе описаний
@@ -16,6 +126,7 @@ class CategoryMemoryService:
     def __init__(self):
         self.min_confidence = 0.7  # Минимальная уверенность для автоматического предложения
         self.similarity_threshold = 0.8  # Порог схожести для считания паттернов похожими
+        self.similarity_top_k = 10  # Сколько ближайших по триграммам паттернов проверять точно
     
     def normalize_description(self, description: str) -> str:
         """
@@ -67,192 +178,241 @@ class CategoryMemoryService:
         # Используем SequenceMatcher для вычисления схожести
         return SequenceMatcher(None, text1, text2).ratio()
     
-    def find_best_match(self, user_id: int, description: str) -> Optional[Tuple[int, float]]:
+    def _index_entry(self, record: CategoryMemory) -> _IndexedPattern:
+        return _IndexedPattern(
+            record.description_pattern,
+            set(self.extract_keywords(record.description_pattern)),
+            record.category_id,
+            record.usage_count or 0,
+            record.confidence if record.confidence is not None else 1.0
+        )
+
+    async def _get_user_index(self, db: AsyncSession, user_id: int) -> _UserIndex:
+        index = category_keyword_index.get(user_id)
+        if index is not None:
+            return index
+
+        index = _UserIndex()
+        records = (await db.execute(select(
+            CategoryMemory.id,
+            CategoryMemory.description_pattern,
+            CategoryMemory.category_id,
+            CategoryMemory.usage_count,
+            CategoryMemory.confidence
+        ).filter(CategoryMemory.user_id == user_id))).all()
+
+        for record in records:
+            index.put(record.id, self._index_entry(record))
+
+        category_keyword_index.set(user_id, index)
+        return index
+
+    async def find_best_match(self, user_id: int, description: str, db: Optional[AsyncSession] = None) -> Optional[Tuple[int, float]]:
         """
         Находит лучшее совпадение категории для описания
         Возвращает (category_id, confidence) или None
+
+        Оцениваются не все паттерны пользователя, а только кандидаты: паттерны
+        с общим ключевым словом (инвертированный индекс) и top-k ближайших по
+        триграммам (опечатки, слитное написание).
         """
         if not description:
             return None
         
-        db = get_db_session()
-        try:
-            normalized_desc = self.normalize_description(description)
-            keywords = self.extract_keywords(description)
-            
-            # Получаем все записи памяти для пользователя
-            memory_records = db.query(CategoryMemory).filter(
-                CategoryMemory.user_id == user_id
-            ).all()
+        async with async_session_scope(db) as db:
+            try:
+                normalized_desc = self.normalize_description(description)
+                keywords = self.extract_keywords(description)
+                if not normalized_desc:
+                    return None
+
+                index = await self._get_user_index(db, user_id)
+                candidates = index.candidates(keywords)
+                candidates.update(
+                    pattern_id for pattern_id, _ in index.trigrams.top_k(normalized_desc, self.similarity_top_k)
+                )
             
-            best_match = None
-            best_score = 0.0
+                best_match = None
+                best_score = 0.0
             
-            for record in memory_records:
-                # Проверяем точное совпадение нормализованного описания
-                pattern_similarity = self.calculate_similarity(
-                    normalized_desc, 
-                    record.description_pattern
-                )
+                for pattern_id in candidates:
+                    record = index.patterns[pattern_id]
+
+                    # Проверяем точное совпадение нормализованного описания
+                    pattern_similarity = self.calculate_similarity(
+                        normalized_desc, 
+                        record.pattern
+                    )
                 
-                # Проверяем совпадение ключевых слов
-                record_keywords = self.extract_keywords(record.description_pattern)
-                keyword_matches = sum(1 for kw in keywords if kw in record_keywords)
-                keyword_score = keyword_matches / max(len(keywords), 1) if keywords else 0
+                    # Проверяем совпадение ключевых слов
+                    keyword_matches = sum(1 for kw in keywords if kw in record.keywords)
+                    keyword_score = keyword_matches / len(keywords) if keywords else 0
                 
-                # Комбинированный скор с учетом популярности паттерна
-                popularity_boost = min(record.usage_count / 10, 0.2)  # Бонус до 20% за популярность
-                combined_score = (pattern_similarity * 0.6 + keyword_score * 0.4 + popularity_boost) * record.confidence
+                    # Комбинированный скор с учетом популярности паттерна
+                    popularity_boost = min(record.usage_count / 10, 0.2)  # Бонус до 20% за популярность
+                    combined_score = (pattern_similarity * 0.6 + keyword_score * 0.4 + popularity_boost) * record.confidence
                 
-                if combined_score > best_score and combined_score > self.min_confidence:
-                    best_score = combined_score
-                    best_match = (record.category_id, combined_score)
+                    if combined_score > best_score and combined_score > self.min_confidence:
+                        best_score = combined_score
+                        best_match = (record.category_id, combined_score)
             
-            return best_match
+                return best_match
             
-        except Exception as e:
-            logger.error(f"Ошибка при поиске совпадения категории: {e}")
-            return None
-        finally:
-            db.close()
+            except Exception as e:
+                logger.error(f"Ошибка при поиске совпадения категории: {e}")
+                return None
     
-    def remember_category(self, user_id: int, description: str, category_id: int, confidence: float = 1.0):
+    async def remember_category(self, user_id: int, description: str, category_id: int, confidence: float = 1.0, db: Optional[AsyncSession] = None):
         """
         Запоминает связь описания с категорией
         """
         if not description or not category_id:
             return
         
-        db = get_db_session()
-        try:
-            normalized_desc = self.normalize_description(description)
-            
-            # Ищем существующий паттерн
-            existing = db.query(CategoryMemory).filter(
-                and_(
-                    CategoryMemory.user_id == user_id,
-                    CategoryMemory.description_pattern == normalized_desc,
-                    CategoryMemory.category_id == category_id
-                )
-            ).first()
-            
-            if existing:
-                # Обновляем существующую запись
-                existing.usage_count += 1
-                existing.last_used = datetime.utcnow()
-                existing.confidence = min(existing.confidence + 0.1, 1.0)  # Увеличиваем уверенность
-            else:
-                # Проверяем, есть ли похожие паттерны
-                similar_pattern = self.find_similar_pattern(db, user_id, normalized_desc)
-                
-                if similar_pattern and similar_pattern.category_id == category_id:
-                    # Обновляем похожий паттерн
-                    similar_pattern.usage_count += 1
-                    similar_pattern.last_used = datetime.utcnow()
-                    similar_pattern.confidence = min(similar_pattern.confidence + 0.05, 1.0)
-                else:
-                    # Создаем новую запись
-                    new_memory = CategoryMemory(
-                        user_id=user_id,
-                        description_pattern=normalized_desc,
-                        category_id=category_id,
-                        confidence=confidence,
-                        usage_count=1,
-                        last_used=datetime.utcnow()
-                    )
-                    db.add(new_memory)
+        async with async_session_scope(db) as db:
+            try:
+                record = await self.stage_category(db, user_id, description, category_id, confidence)
+                await db.commit()
+                self.index_records(user_id, [record])
+                logger.info(f"Запомнена категория {category_id} для паттерна '{record.description_pattern}'")
             
-            db.commit()
-            logger.info(f"Запомнена категория {category_id} для паттерна '{normalized_desc}'")
-            
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Ошибка при сохранении в память: {e}")
-        finally:
-            db.close()
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Ошибка при сохранении в память: {e}")
+
+    async def stage_category(self, db: AsyncSession, user_id: int, description: str, category_id: int,
+                             confidence: float = 1.0) -> CategoryMemory:
+        """
+        Связь описания с категорией в сессии вызывающего кода, без commit.
+        После commit записи нужно передать в index_records.
+        """
+        normalized_desc = self.normalize_description(description)
+
+        # Ищем существующий паттерн
+        existing = (await db.execute(select(CategoryMemory).filter(
+            and_(
+                CategoryMemory.user_id == user_id,
+                CategoryMemory.description_pattern == normalized_desc,
+                CategoryMemory.category_id == category_id
+            )
+        ))).scalars().first()
+
+        if existing:
+            # Обновляем существующую запись
+            existing.usage_count += 1
+            existing.last_used = datetime.utcnow()
+            existing.confidence = min(existing.confidence + 0.1, 1.0)  # Увеличиваем уверенность
+            return existing
+
+        # Проверяем, есть ли похожие паттерны
+        similar_pattern = await self.find_similar_pattern(db, user_id, normalized_desc)
+
+        if similar_pattern and similar_pattern.category_id == category_id:
+            # Обновляем похожий паттерн
+            similar_pattern.usage_count += 1
+            similar_pattern.last_used = datetime.utcnow()
+            similar_pattern.confidence = min(similar_pattern.confidence + 0.05, 1.0)
+            return similar_pattern
+
+        # Создаем новую запись
+        new_memory = CategoryMemory(
+            user_id=user_id,
+            description_pattern=normalized_desc,
+            category_id=category_id,
+            confidence=confidence,
+            usage_count=1,
+            last_used=datetime.utcnow()
+        )
+        db.add(new_memory)
+        return new_memory
+
+    def index_records(self, user_id: int, records: List[CategoryMemory]) -> None:
+        """Обновить индекс ключевых слов сохраненными (после commit) записями памяти"""
+        for record in records:
+            category_keyword_index.update(user_id, record.id, self._index_entry(record))
     
-    def find_similar_pattern(self, db, user_id: int, pattern: str) -> Optional[CategoryMemory]:
+    async def find_similar_pattern(self, db, user_id: int, pattern: str) -> Optional[CategoryMemory]:
         """
-        Находит похожий паттерн в памяти
+        Находит самый похожий паттерн в памяти (схожесть не ниже порога)
         """
-        memory_records = db.query(CategoryMemory).filter(
-            CategoryMemory.user_id == user_id
-        ).all()
-        
-        for record in memory_records:
-            similarity = self.calculate_similarity(pattern, record.description_pattern)
-            if similarity >= self.similarity_threshold:
-                return record
-        
-        return None
+        index = await self._get_user_index(db, user_id)
+
+        best_id = None
+        best_similarity = 0.0
+        for pattern_id, _ in index.trigrams.top_k(pattern, self.similarity_top_k):
+            similarity = self.calculate_similarity(pattern, index.patterns[pattern_id].pattern)
+            if similarity >= self.similarity_threshold and similarity > best_similarity:
+                best_id = pattern_id
+                best_similarity = similarity
+
+        if best_id is None:
+            return None
+        return await db.get(CategoryMemory, best_id)
     
-    def get_user_patterns(self, user_id: int) -> List[dict]:
+    async def get_user_patterns(self, user_id: int, db: Optional[AsyncSession] = None) -> List[dict]:
         """
         Получает все паттерны пользователя для анализа
         """
-        db = get_db_session()
-        try:
-            patterns = db.query(
-                CategoryMemory.description_pattern,
-                Category.name.label('category_name'),
-                CategoryMemory.usage_count,
-                CategoryMemory.confidence,
-                CategoryMemory.last_used
-            ).join(
-                Category, CategoryMemory.category_id == Category.id
-            ).filter(
-                CategoryMemory.user_id == user_id
-            ).order_by(CategoryMemory.usage_count.desc()).all()
+        async with async_session_scope(db) as db:
+            try:
+                patterns = (await db.execute(select(
+                    CategoryMemory.description_pattern,
+                    Category.name.label('category_name'),
+                    CategoryMemory.usage_count,
+                    CategoryMemory.confidence,
+                    CategoryMemory.last_used
+                ).join(
+                    Category, CategoryMemory.category_id == Category.id
+                ).filter(
+                    CategoryMemory.user_id == user_id
+                ).order_by(CategoryMemory.usage_count.desc()))).all()
             
-            return [
-                {
-                    'pattern': p.description_pattern,
-                    'category': p.category_name,
-                    'usage_count': p.usage_count,
-                    'confidence': p.confidence,
-                    'last_used': p.last_used
-                }
-                for p in patterns
-            ]
-        except Exception as e:
-            logger.error(f"Ошибка при получении паттернов: {e}")
-            return []
-        finally:
-            db.close()
+                return [
+                    {
+                        'pattern': p.description_pattern,
+                        'category': p.category_name,
+                        'usage_count': p.usage_count,
+                        'confidence': p.confidence,
+                        'last_used': p.last_used
+                    }
+                    for p in patterns
+                ]
+            except Exception as e:
+                logger.error(f"Ошибка при получении паттернов: {e}")
+                return []
     
-    def cleanup_old_patterns(self, user_id: int, days_threshold: int = 90):
+    async def cleanup_old_patterns(self, user_id: int, days_threshold: int = 90, db: Optional[AsyncSession] = None):
         """
         Очищает старые неиспользуемые паттерны
         """
-        db = get_db_session()
-        try:
-            threshold_date = datetime.utcnow() - timedelta(days=days_threshold)
+        async with async_session_scope(db) as db:
+            try:
+                threshold_date = datetime.utcnow() - timedelta(days=days_threshold)
             
-            # Удаляем паттерны с низкой уверенностью и редким использованием
-            deleted = db.query(CategoryMemory).filter(
-                and_(
-                    CategoryMemory.user_id == user_id,
-                    CategoryMemory.last_used < threshold_date,
-                    CategoryMemory.confidence < 0.5,
-                    CategoryMemory.usage_count < 3
-                )
-            ).delete()
+                # Удаляем паттерны с низкой уверенностью и редким использованием
+                deleted = (await db.execute(delete(CategoryMemory).filter(
+                    and_(
+                        CategoryMemory.user_id == user_id,
+                        CategoryMemory.last_used < threshold_date,
+                        CategoryMemory.confidence < 0.5,
+                        CategoryMemory.usage_count < 3
+                    )
+                ))).rowcount
             
-            db.commit()
-            logger.info(f"Удалено {deleted} устаревших паттернов для пользователя {user_id}")
+                await db.commit()
+                category_keyword_index.invalidate(user_id)
+                logger.info(f"Удалено {deleted} устаревших паттернов для пользователя {user_id}")
             
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Ошибка при очистке паттернов: {e}")
-        finally:
-            db.close()
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Ошибка при очистке паттернов: {e}")
     
-    def suggest_category(self, user_id: int, description: str) -> Optional[dict]:
+    async def suggest_category(self, user_id: int, description: str, db: Optional[AsyncSession] = None) -> Optional[dict]:
         """
         Предлагает категорию на основе описания
         Возвращает словарь с информацией о предложении или None
         """
-        match = self.find_best_match(user_id, description)
+        match = await self.find_best_match(user_id, description, db=db)
         
         if not match:
             return None
@@ -260,9 +420,8 @@ class CategoryMemoryService:
         category_id, confidence = match
         
         # Получаем информацию о категории
-        db = get_db_session()
-        try:
-            category = db.query(Category).filter(Category.id == category_id).first()
+        async with async_session_scope(db) as db:
+            category = (await db.execute(select(Category).filter(Category.id == category_id))).scalars().first()
             if not category:
                 return None
             
@@ -272,6 +431,4 @@ class CategoryMemoryService:
                 'category_emoji': category.emoji,
                 'confidence': confidence,
                 'auto_suggest': confidence >= 0.9  # Автоматически предлагать при высокой уверенности
-            }
-        finally:
-            db.close()
\ No newline at end of file
+            }
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+Пул процессов для отрисовки графиков matplotlib вне цикла событий
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class ChartRenderQueueFull(Exception):
+    """Очередь отрисовки заполнена, новый график не принят"""
+
+
+def _init_worker() -> None:
+    # Процесс пула настраивает стиль один раз при старте
+    from services.chart_service import apply_chart_style
+    apply_chart_style()
+
+
+def _timed_render(func: Callable, args: tuple):
+    started = time.perf_counter()
+    png = func(*args)
+    return png, time.perf_counter() - started
+
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ChartRenderPool:
+    """
+    Ограниченная очередь перед пулом процессов отрисовки.
+
+    Одновременно в пул передается не больше workers графиков, остальные
+    ждут своей очереди, не блокируя цикл событий. Если ожидающих уже
+    max_queue, render() сразу выбрасывает ChartRenderQueueFull. Пул
+    создается при первом графике; процессы запускаются через spawn, чтобы
+    не копировать состояние работающего бота.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 20):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.queued = 0
+        self.in_flight = 0
+        self.rendered = 0
+        self.failed = 0
+        self.rejected = 0
+        self._render_times = deque(maxlen=200)
+        self._wait_times = deque(maxlen=200)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return self._executor
+
+    async def render(self, func: Callable, *args) -> bytes:
+        """
+        Выполнить func(*args) в процессе пула и вернуть PNG.
+        func и аргументы должны сериализоваться pickle.
+        """
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ChartRenderQueueFull(f"В очереди отрисовки уже {self.queued} графиков")
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        enqueued_at = time.monotonic()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        wait_seconds = time.monotonic() - enqueued_at
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            png, render_seconds = await loop.run_in_executor(executor, _timed_render, func, args)
+        except BrokenProcessPool:
+            # Процесс пула упал - останавливаем остальные процессы пула,
+            # следующий график создаст пул заново
+            self.failed += 1
+            if self._executor is executor:
+                self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+        self.rendered += 1
+        self._wait_times.append(wait_seconds)
+        self._render_times.append(render_seconds)
+        logger.info(
+            f"График отрисован за {render_seconds:.2f} с "
+            f"(ожидание {wait_seconds:.2f} с, в очереди {self.queued})"
+        )
+        return png
+
+    def stats(self) -> dict:
+        """Глубина очереди и время отрисовки (по последним 200 графикам)"""
+        render_times = list(self._render_times)
+        wait_times = list(self._wait_times)
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "render_avg_seconds": sum(render_times) / len(render_times) if render_times else 0.0,
+            "render_p95_seconds": _percentile(render_times, 0.95),
+            "render_max_seconds": max(render_times, default=0.0),
+            "wait_avg_seconds": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        """Остановить процессы пула (при остановке бота)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+chart_render_pool = ChartRenderPool(
+    workers=config.CHART_RENDER_WORKERS,
+    max_queue=config.CHART_RENDER_QUEUE_SIZE
+)
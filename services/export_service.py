@@ -0,0 +1,185 @@
+"""
+Сервис потокового экспорта транзакций в Excel и CSV
+"""
+
+import asyncio
+import csv
+import gzip
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from openpyxl import Workbook
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database import async_session_scope, Transaction, Category
+
+logger = logging.getLogger(__name__)
+
+XLSX = "xlsx"
+CSV = "csv"
+CSV_GZ = "csv_gz"
+
+# Формат -> (расширение файла, название для пользователя)
+FORMATS = {
+    XLSX: ("xlsx", "Excel"),
+    CSV: ("csv", "CSV"),
+    CSV_GZ: ("csv.gz", "CSV (gzip)"),
+}
+
+COLUMNS = ['Дата', 'Тип', 'Сумма', 'Валюта', 'Категория', 'Описание']
+SUMMARY_CURRENCIES = ['EUR', 'USD']
+
+
+class ExportResult(NamedTuple):
+    path: str  # Временный файл, удаляет вызывающий код
+    filename: str
+    transactions_count: int
+
+
+class _Summary:
+    """Итоги для листов статистики, накапливаемые по мере записи строк"""
+
+    def __init__(self):
+        self.totals = {}  # (тип, валюта) -> сумма
+        self.categories = {}  # категория -> сумма расходов
+        self.count = 0
+
+    def add(self, rows) -> None:
+        for _, kind, amount, currency, category, _ in rows:
+            self.totals[(kind, currency)] = self.totals.get((kind, currency), 0.0) + amount
+            if kind == 'Расход':
+                self.categories[category] = self.categories.get(category, 0.0) + amount
+        self.count += len(rows)
+
+
+class _CsvWriter:
+    def __init__(self, path: str, compress: bool):
+        # utf-8-sig: Excel корректно открывает кириллицу
+        if compress:
+            self.file = gzip.open(path, 'wt', encoding='utf-8-sig', newline='')
+        else:
+            self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write_rows(self, rows) -> None:
+        self.writer.writerows(rows)
+
+    def close(self, summary: _Summary) -> None:
+        self.file.close()
+
+    def abort(self) -> None:
+        self.file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path: str):
+        # write-only книга сбрасывает строки во временные XML-файлы, а не держит их в памяти
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet('Транзакции')
+        self.sheet.append(COLUMNS)
+
+    def write_rows(self, rows) -> None:
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self, summary: _Summary) -> None:
+        stats_sheet = self.workbook.create_sheet('Статистика')
+        stats_sheet.append(['Показатель'] + SUMMARY_CURRENCIES)
+        for title, kind in (('Общий доход', 'Доход'), ('Общие расходы', 'Расход')):
+            stats_sheet.append([title] + [summary.totals.get((kind, currency), 0.0) for currency in SUMMARY_CURRENCIES])
+
+        if summary.categories:
+            categories_sheet = self.workbook.create_sheet('По категориям')
+            categories_sheet.append(['Категория', 'Сумма'])
+            for category, amount in sorted(summary.categories.items(), key=lambda item: item[1], reverse=True):
+                categories_sheet.append([category, amount])
+
+        self.workbook.save(self.path)
+
+    def abort(self) -> None:
+        # Лист write-only книги пишет строки во временный XML-файл, который удаляется
+        # только при сохранении книги: сохраняем недописанный файл, его удалит export()
+        self.workbook.save(self.path)
+
+
+class ExportService:
+    """
+    Экспорт всех транзакций пользователя одним запросом с join к categories.
+
+    Строки читаются серверным курсором порциями по chunk_size и сразу
+    пишутся во временный файл (запись идет в отдельном потоке, чтобы не
+    блокировать цикл событий), поэтому память не зависит от длины истории.
+    """
+
+    def __init__(self, chunk_size: int = config.EXPORT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def _open_writer(self, export_format: str, path: str):
+        if export_format == XLSX:
+            return _XlsxWriter(path)
+        return _CsvWriter(path, compress=export_format == CSV_GZ)
+
+    @staticmethod
+    def _format_row(created_at, amount, currency, category_name, description) -> tuple:
+        return (
+            created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'Доход' if amount > 0 else 'Расход',
+            abs(amount),
+            currency,
+            category_name or 'Неизвестно',
+            description,
+        )
+
+    async def export(self, user_id: int, export_format: str = XLSX,
+                     db: Optional[AsyncSession] = None) -> ExportResult:
+        """Записать транзакции пользователя во временный файл выбранного формата"""
+        if export_format not in FORMATS:
+            raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+
+        extension = FORMATS[export_format][0]
+        fd, path = tempfile.mkstemp(prefix="budget_export_", suffix=f".{extension}")
+        os.close(fd)
+
+        query = select(
+            Transaction.created_at,
+            Transaction.amount,
+            Transaction.currency,
+            Category.name,
+            Transaction.description
+        ).outerjoin(
+            Category, Category.id == Transaction.category_id
+        ).filter(
+            Transaction.user_id == user_id
+        ).order_by(Transaction.created_at).execution_options(yield_per=self.chunk_size)
+
+        summary = _Summary()
+        writer = None
+        try:
+            writer = await asyncio.to_thread(self._open_writer, export_format, path)
+            async with async_session_scope(db) as db:
+                result = await db.stream(query)
+                async for partition in result.partitions(self.chunk_size):
+                    rows = [self._format_row(*row) for row in partition]
+                    summary.add(rows)
+                    await asyncio.to_thread(writer.write_rows, rows)
+            await asyncio.to_thread(writer.close, summary)
+        except Exception:
+            if writer is not None:
+                try:
+                    await asyncio.to_thread(writer.abort)
+                except Exception as e:
+                    logger.warning(f"Не удалось закрыть файл экспорта: {e}")
+            os.remove(path)
+            raise
+
+        logger.info(f"Экспорт {export_format}: {summary.count} транзакций пользователя {user_id}")
+
+        filename = f"budget_export_{datetime.now().strftime('%Y-%m-%d')}.{extension}"
+        return ExportResult(path, filename, summary.count)
@@ -0,0 +1,73 @@
+"""
+Поиск множества ключевых слов за один проход по строке (автомат Ахо-Корасик)
+"""
+
+from collections import deque
+from typing import Dict, Hashable, Iterable, List, Mapping
+
+
+class KeywordMatcher:
+    """
+    Автомат Ахо-Корасик над ключевыми словами нескольких групп.
+
+    Строится один раз; match() проходит описание посимвольно и возвращает
+    битовую маску групп, хотя бы одно ключевое слово которых встречается в
+    тексте как подстрока (в том числе перекрывающиеся вхождения) - то же,
+    что проверка `keyword in text` для каждого слова, но за один проход.
+    Группы в маске нумеруются в порядке передачи.
+    """
+
+    def __init__(self, groups: Mapping[Hashable, Iterable[str]]):
+        self.labels: List[Hashable] = list(groups)
+
+        goto: List[Dict[str, int]] = [{}]
+        output: List[int] = [0]
+        for position, label in enumerate(self.labels):
+            for keyword in groups[label]:
+                state = 0
+                for char in keyword:
+                    next_state = goto[state].get(char)
+                    if next_state is None:
+                        next_state = len(goto)
+                        goto[state][char] = next_state
+                        goto.append({})
+                        output.append(0)
+                    state = next_state
+                output[state] |= 1 << position
+
+        # Переходы детерминированного автомата. В таблице состояния хранятся
+        # только переходы, отличные от переходов корня: остальные берутся из root
+        root = goto[0]
+        transitions: List[Dict[str, int]] = [{} for _ in goto]
+        fail = [0] * len(goto)
+        queue = deque(root.values())
+        while queue:
+            state = queue.popleft()
+            inherited = transitions[fail[state]] if fail[state] else {}
+            transitions[state] = {**inherited, **goto[state]}
+            for char, child in goto[state].items():
+                fail[child] = transitions[fail[state]].get(char) or root.get(char, 0)
+                output[child] |= output[fail[child]]
+                queue.append(child)
+
+        self._root = root
+        self._transitions = transitions
+        self._output = output
+
+    def match(self, text: str) -> int:
+        """Маска групп, ключевые слова которых есть в text"""
+        root = self._root
+        transitions = self._transitions
+        output = self._output
+
+        state = 0
+        found = 0
+        for char in text:
+            state = transitions[state].get(char) or root.get(char, 0)
+            found |= output[state]
+        return found
+
+    def find(self, text: str) -> List[Hashable]:
+        """Найденные группы в порядке передачи"""
+        found = self.match(text)
+        return [label for position, label in enumerate(self.labels) if found >> position & 1]
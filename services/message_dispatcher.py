@@ -0,0 +1,263 @@
+"""
+Общая очередь исходящих сообщений бота с ограничением скорости
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from telegram import Bot
+from telegram.error import NetworkError, RetryAfter
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Через сколько записей проверять, не пора ли забыть неактивные чаты
+CHAT_BUCKETS_PRUNE_INTERVAL = 1000
+# Окно, по которому считается пропускная способность
+THROUGHPUT_WINDOW = 60.0
+
+
+class TokenBucket:
+    """Маркерное ведро: rate маркеров в секунду, не больше capacity в запасе"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится маркер (0 - уже есть)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "kwargs", "future", "attempt", "enqueued_at")
+
+    def __init__(self, chat_id: int, kwargs: dict, future: asyncio.Future, enqueued_at: float):
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.attempt = 0
+        self.enqueued_at = enqueued_at
+
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class MessageDispatcher:
+    """
+    Очередь исходящих сообщений с несколькими отправителями.
+
+    Перед каждой отправкой берется маркер из общего ведра (global_rate
+    сообщений в секунду на бота) и из ведра чата (chat_rate в секунду,
+    до chat_burst подряд), поэтому рассылка не упирается в flood-лимиты
+    Telegram, а медленная отправка одному пользователю не задерживает
+    остальных. RetryAfter приостанавливает все отправки на указанное
+    Telegram время, сетевые ошибки повторяются с экспоненциальной паузой
+    до max_retries раз, остальные ошибки (бот заблокирован, неверный
+    запрос) передаются вызывающему коду без повторов.
+    """
+
+    def __init__(self, workers: int = 4, global_rate: float = 25, chat_rate: float = 1, chat_burst: int = 3,
+                 max_retries: int = 3, queue_size: int = 10000):
+        self.workers = workers
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+
+        self.bot: Optional[Bot] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._since_prune = 0
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.flood_waits = 0
+        # Отправки по секундам за последние THROUGHPUT_WINDOW секунд: [секунда, число]
+        self._sent_per_second = deque(maxlen=int(THROUGHPUT_WINDOW) + 1)
+        self._wait_times = deque(maxlen=500)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, bot: Bot) -> None:
+        """Запустить отправителей (в цикле событий бота)"""
+        if self.running:
+            return
+        self.bot = bot
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._global = TokenBucket(self.global_rate, self.global_rate, time.monotonic())
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Очередь исходящих сообщений запущена: {self.workers} отправителей")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дождаться отправки поставленных сообщений (не дольше timeout) и остановить отправителей"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Очередь исходящих сообщений остановлена, не отправлено: {self._queue.qsize()}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """
+        Поставить сообщение в очередь, не дожидаясь отправки. Future
+        завершается отправленным Message или исключением последней попытки.
+        Если очередь заполнена, выбрасывается asyncio.QueueFull.
+        """
+        if not self.running:
+            raise RuntimeError("Очередь исходящих сообщений не запущена")
+
+        future = asyncio.get_running_loop().create_future()
+        kwargs["text"] = text
+        self._queue.put_nowait(_Outgoing(chat_id, kwargs, future, time.monotonic()))
+        return future
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        """Отправить сообщение через очередь и дождаться результата"""
+        return await self.submit(chat_id, text, **kwargs)
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            self._since_prune += 1
+            if self._since_prune >= CHAT_BUCKETS_PRUNE_INTERVAL:
+                # Полное ведро ничем не отличается от нового
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full(now)}
+                self._since_prune = 0
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    async def _acquire(self, chat_id: int) -> None:
+        """Дождаться маркеров общего ведра и ведра чата и забрать их"""
+        while True:
+            now = time.monotonic()
+            chat_bucket = self._chat_bucket(chat_id, now)
+            delay = max(self._paused_until - now, self._global.wait_time(now), chat_bucket.wait_time(now))
+            if delay <= 0:
+                self._global.consume(now)
+                chat_bucket.consume(now)
+                return
+            await asyncio.sleep(delay)
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._deliver(item)
+            except Exception as e:
+                logger.error(f"Ошибка очереди исходящих сообщений: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, item: _Outgoing) -> None:
+        while True:
+            await self._acquire(item.chat_id)
+            try:
+                message = await self.bot.send_message(chat_id=item.chat_id, **item.kwargs)
+            except RetryAfter as e:
+                # Flood-лимит: паузу Telegram соблюдают все отправители
+                self.flood_waits += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+                logger.warning(f"Flood control Telegram: пауза {e.retry_after} с")
+                if item.attempt >= self.max_retries:
+                    self._fail(item, e)
+                    return
+            except NetworkError as e:
+                if item.attempt >= self.max_retries:
+                    self._fail(item, e)
+                    return
+                await asyncio.sleep(random.uniform(0, min(30.0, 2 ** item.attempt)))
+            except Exception as e:
+                self._fail(item, e)
+                return
+            else:
+                now = time.monotonic()
+                self.sent += 1
+                self._count_sent(now)
+                self._wait_times.append(now - item.enqueued_at)
+                if not item.future.done():
+                    item.future.set_result(message)
+                return
+
+            item.attempt += 1
+            self.retried += 1
+
+    def _count_sent(self, now: float) -> None:
+        second = int(now)
+        if self._sent_per_second and self._sent_per_second[-1][0] == second:
+            self._sent_per_second[-1][1] += 1
+        else:
+            self._sent_per_second.append([second, 1])
+
+    def _fail(self, item: _Outgoing, error: Exception) -> None:
+        self.failed += 1
+        logger.warning(f"Не удалось отправить сообщение в чат {item.chat_id}: {error}")
+        if not item.future.done():
+            item.future.set_exception(error)
+            # Результат submit() часто никто не ждет: ошибка уже записана в лог
+            item.future.exception()
+
+    def stats(self) -> dict:
+        """Счетчики отправки, пропускная способность за минуту и время в очереди"""
+        since = time.monotonic() - THROUGHPUT_WINDOW
+        sent_in_window = sum(count for second, count in self._sent_per_second if second >= since)
+        wait_times = list(self._wait_times)
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "flood_waits": self.flood_waits,
+            "messages_per_second": sent_in_window / THROUGHPUT_WINDOW,
+            "wait_avg_seconds": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+            "wait_p95_seconds": _percentile(wait_times, 0.95),
+        }
+
+
+message_dispatcher = MessageDispatcher(
+    workers=config.DISPATCHER_WORKERS,
+    global_rate=config.DISPATCHER_GLOBAL_RATE,
+    chat_rate=config.DISPATCHER_CHAT_RATE,
+    chat_burst=config.DISPATCHER_CHAT_BURST,
+    max_retries=config.DISPATCHER_MAX_RETRIES,
+    queue_size=config.DISPATCHER_QUEUE_SIZE
+)
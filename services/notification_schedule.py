@@ -0,0 +1,71 @@
+"""
+Время следующего срабатывания уведомлений пользователя в UTC
+(колонки users.next_daily_reminder_utc и users.next_budget_notification_utc)
+"""
+
+import logging
+from datetime import datetime, time, timedelta
+from typing import Optional
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+# Еженедельный статус бюджета отправляется в понедельник
+WEEKLY_BUDGET_WEEKDAY = 0
+
+
+def next_fire_utc(timezone: str, local_time: time, after: datetime, weekday: Optional[int] = None) -> Optional[datetime]:
+    """
+    Ближайший момент позже after (UTC без tzinfo), когда в часовом поясе
+    timezone наступает local_time (в день недели weekday, если задан).
+
+    Смещение пояса берется на дату срабатывания, поэтому переходы на летнее
+    и зимнее время учитываются. Время, которого нет из-за перевода часов
+    вперед, сдвигается на час позже; повторяющееся при переводе назад
+    срабатывает один раз (по второму вхождению).
+    """
+    try:
+        user_tz = pytz.timezone(timezone)
+    except pytz.UnknownTimeZoneError:
+        logger.error(f"Неизвестный часовой пояс {timezone}")
+        return None
+
+    local_time = local_time.replace(second=0, microsecond=0)
+    local_day = pytz.utc.localize(after).astimezone(user_tz).date()
+    # Сегодня и семь следующих дней: хватает и для еженедельных уведомлений
+    for offset in range(8):
+        day = local_day + timedelta(days=offset)
+        if weekday is not None and day.weekday() != weekday:
+            continue
+        fire = user_tz.normalize(user_tz.localize(datetime.combine(day, local_time), is_dst=False))
+        fire = fire.astimezone(pytz.utc).replace(tzinfo=None)
+        if fire > after:
+            return fire
+    return None
+
+
+def next_daily_reminder_utc(user, after: datetime) -> Optional[datetime]:
+    """Следующее напоминание о тратах или None, если оно выключено"""
+    if not user.daily_reminder_enabled or not user.daily_reminder_time:
+        return None
+    return next_fire_utc(user.timezone, user.daily_reminder_time, after)
+
+
+def next_budget_notification_utc(user, after: datetime) -> Optional[datetime]:
+    """Следующий статус бюджета или None, если уведомления выключены"""
+    if (not user.budget_notifications_enabled or not user.budget_notification_time
+            or user.salary_date is None):
+        return None
+    if user.budget_notification_frequency == "daily":
+        return next_fire_utc(user.timezone, user.budget_notification_time, after)
+    if user.budget_notification_frequency == "weekly":
+        return next_fire_utc(user.timezone, user.budget_notification_time, after, weekday=WEEKLY_BUDGET_WEEKDAY)
+    return None
+
+
+def refresh_notification_schedule(user, now: Optional[datetime] = None) -> None:
+    """Пересчитать время следующих уведомлений после изменения настроек пользователя"""
+    now = now or datetime.utcnow()
+    user.next_daily_reminder_utc = next_daily_reminder_utc(user, now)
+    user.next_budget_notification_utc = next_budget_notification_utc(user, now)
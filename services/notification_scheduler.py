@@ -4,280 +4,285 @@
 import asyncio
 import logging
 from datetime import datetime, time, timedelta
-from typing import List, Optional
+from collections import defaultdict
+from typing import Callable, List, Optional, Set, Tuple
 import pytz
 from telegram import Bot
-from telegram.error import TelegramError
+import config
 
-from database import get_db_session, User, Category, Transaction, Limit
+from sqlalchemy import func, select, update, and_, or_
+
+from database import get_async_db_session, User, Transaction
+from services.budget_digest import BudgetDigestService, render_budget_digest
+from services.notification_schedule import next_daily_reminder_utc, next_budget_notification_utc
+from services.message_dispatcher import message_dispatcher, MessageDispatcher
+from services.scheduler_leases import ShardLeaseManager
 from utils.localization import get_message
 
 logger = logging.getLogger(__name__)
 
+# Сколько пользователей проверяется одним запросом "были ли траты сегодня"
+REMINDER_BATCH_SIZE = 500
+# Насколько может опоздать уведомление, чтобы его еще стоило отправлять
+NOTIFICATION_GRACE_PERIOD = timedelta(minutes=30)
+# Пределы паузы между проходами планировщика, с
+MIN_SLEEP_SECONDS = 1
+MAX_SLEEP_SECONDS = 60
+
+
 class NotificationScheduler:
-    """Планировщик уведомлений"""
+    """
+    Планировщик уведомлений.
+
+    Можно запускать несколько экземпляров (реплики бота, процессы):
+    пользователи разбиты на шарды, и каждый экземпляр обрабатывает только
+    арендованные им шарды (см. ShardLeaseManager), поэтому уведомление
+    не отправляется дважды.
+
+    Время следующего уведомления хранится в users.next_*_utc, поэтому
+    проход выбирает только пользователей, которым пора, а между проходами
+    планировщик спит до ближайшего уведомления.
+    """
     
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, dispatcher: Optional[MessageDispatcher] = None,
+                 leases: Optional[ShardLeaseManager] = None):
         self.bot = bot
+        # Сообщения ставятся в общую очередь: медленная отправка не задерживает остальных
+        self.dispatcher = dispatcher or message_dispatcher
+        self.leases = leases or ShardLeaseManager(
+            shards=config.SCHEDULER_SHARDS,
+            ttl=config.SCHEDULER_LEASE_TTL,
+            worker_id=config.SCHEDULER_WORKER_ID
+        )
         self.running = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self.digests = BudgetDigestService()
         
     async def start(self):
         """Запуск планировщика"""
         self.running = True
-        logger.info("Запуск планировщика уведомлений")
+        self._wakeup = asyncio.Event()
+        logger.info(f"Запуск планировщика уведомлений ({self.leases.worker_id})")
         
         while self.running:
+            delay = MAX_SLEEP_SECONDS
             try:
-                await self._check_daily_reminders()
-                await self._check_budget_notifications()
-                # Проверяем каждую минуту
-                await asyncio.sleep(60)
+                shards = await self._claim_shards()
+                if shards:
+                    await self._check_daily_reminders(shards)
+                    await self._check_budget_notifications(shards)
+                    delay = await self._seconds_until_next(shards)
             except Exception as e:
                 logger.error(f"Ошибка в планировщике: {e}")
-                await asyncio.sleep(60)
+            if not self.running:
+                break
+            try:
+                # stop() будит планировщик, не дожидаясь конца паузы
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
     
-    async def stop(self):
-        """Остановка планировщика"""
+    async def stop(self, task: Optional[asyncio.Task] = None, timeout: float = 30.0):
+        """
+        Остановка планировщика. Текущий проход (task - задача start())
+        завершается: сообщения, поставленные в очередь, успевают отметиться
+        в next_*_utc. Только после этого шарды освобождаются, иначе
+        экземпляр, забравший их, отправил бы те же уведомления повторно.
+        """
         self.running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        
+        if task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                # Незавершенный проход мог поставить сообщения в очередь без переноса времени:
+                # шарды не освобождаются и перейдут к другим экземплярам по истечении аренды
+                logger.warning("Проход планировщика не завершился, шарды не освобождены")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return
+            except Exception as e:
+                logger.error(f"Ошибка в планировщике при остановке: {e}")
+        
+        db = get_async_db_session()
+        try:
+            # Шарды сразу переходят к другим экземплярам, не дожидаясь истечения аренды
+            await self.leases.release(db)
+        except Exception as e:
+            logger.error(f"Ошибка освобождения шардов планировщика: {e}")
+        finally:
+            await db.close()
         logger.info("Остановка планировщика уведомлений")
     
-    async def _check_daily_reminders(self):
-        """Проверка напоминаний о добавлении трат"""
-        db = get_db_session()
+    async def _claim_shards(self) -> List[int]:
+        """Продлить аренду и получить шарды пользователей этого экземпляра"""
+        db = get_async_db_session()
         try:
-            # Получаем пользователей с включенными напоминаниями
-            users = db.query(User).filter(
-                User.daily_reminder_enabled == True,
-                User.daily_reminder_time.isnot(None)
-            ).all()
-            
-            for user in users:
-                await self._send_daily_reminder_if_needed(user)
-                
+            return await self.leases.claim(db)
         finally:
-            db.close()
+            await db.close()
     
-    async def _send_daily_reminder_if_needed(self, user: User):
-        """Отправка напоминания о тратах если нужно"""
+    async def _seconds_until_next(self, shards: List[int]) -> float:
+        """
+        Пауза до ближайшего уведомления в своих шардах, но не дольше
+        MAX_SLEEP_SECONDS: за это время нужно продлить аренду и заметить
+        уведомления, время которых пользователи только что изменили
+        """
+        db = get_async_db_session()
         try:
-            # Получаем текущее время в часовом поясе пользователя
-            user_tz = pytz.timezone(user.timezone)
-            current_time = datetime.now(user_tz).time()
+            row = (await db.execute(select(
+                func.min(User.next_daily_reminder_utc),
+                func.min(User.next_budget_notification_utc)
+            ).filter(self.leases.shard_filter(User.id, shards)))).one()
+        finally:
+            await db.close()
+        
+        upcoming = [moment for moment in row if moment is not None]
+        if not upcoming:
+            return MAX_SLEEP_SECONDS
+        delay = (min(upcoming) - datetime.utcnow()).total_seconds()
+        return min(max(delay, MIN_SLEEP_SECONDS), MAX_SLEEP_SECONDS)
+    
+    async def _select_due(self, db, column, shards: List[int], now: datetime) -> Tuple[List[User], List[User]]:
+        """
+        Пользователи своих шардов, у которых наступило время уведомления column:
+        (кому отправлять, устаревшие). Уведомления, опоздавшие больше чем на
+        NOTIFICATION_GRACE_PERIOD (бот был остановлен), не отправляются,
+        а только переносятся.
+        """
+        users = (await db.execute(select(User).filter(
+            column <= now,
+            self.leases.shard_filter(User.id, shards)
+        ).order_by(column))).scalars().all()
+        
+        due_users, stale_users = [], []
+        for user in users:
+            if now - getattr(user, column.key) > NOTIFICATION_GRACE_PERIOD:
+                logger.info(f"Пропущено устаревшее уведомление {column.key} пользователя {user.telegram_id}")
+                stale_users.append(user)
+            else:
+                due_users.append(user)
+        return due_users, stale_users
+    
+    async def _advance(self, db, column, next_fire: Callable[[User, datetime], Optional[datetime]],
+                       users: List[User], now: datetime) -> None:
+        """
+        Перенести время уведомления column на следующее срабатывание для
+        обработанных пользователей (сообщение поставлено в очередь или не
+        нужно). Вызывается после постановки в очередь: пользователи, которых
+        не удалось обработать, остаются в ожидании и повторяются следующим
+        проходом. Пользователи с одинаковыми текущим и следующим временем
+        переносятся одним UPDATE; время меняется, только если его не
+        изменили после выборки (пользователь сменил настройки).
+        """
+        groups = defaultdict(list)
+        for user in users:
+            groups[(getattr(user, column.key), next_fire(user, now))].append(user.id)
+        
+        for (scheduled, following), user_ids in groups.items():
+            for offset in range(0, len(user_ids), REMINDER_BATCH_SIZE):
+                await db.execute(
+                    update(User)
+                    .where(User.id.in_(user_ids[offset:offset + REMINDER_BATCH_SIZE]), column == scheduled)
+                    .values({column.key: following})
+                    .execution_options(synchronize_session=False)
+                )
+        await db.commit()
+    
+    async def _check_daily_reminders(self, shards: List[int]):
+        """Проверка напоминаний о добавлении трат"""
+        db = get_async_db_session()
+        try:
+            now = datetime.utcnow()
+            due_users, handled = await self._select_due(db, User.next_daily_reminder_utc, shards, now)
             
-            # Проверяем, что текущее время соответствует времени напоминания
-            # (с точностью до минуты)
-            reminder_time = user.daily_reminder_time
-            if (current_time.hour == reminder_time.hour and 
-                current_time.minute == reminder_time.minute):
-                
-                # Проверяем, добавлял ли пользователь траты сегодня
-                today = datetime.now(user_tz).date()
-                today_start = datetime.combine(today, time.min).replace(tzinfo=user_tz)
-                today_end = datetime.combine(today, time.max).replace(tzinfo=user_tz)
+            if due_users:
+                # Одним запросом для всей волны: кто уже добавлял траты сегодня
+                active_user_ids = await self._users_with_transactions_today(db, due_users, pytz.utc.localize(now))
                 
-                db = get_db_session()
-                try:
-                    today_transactions = db.query(Transaction).filter(
-                        Transaction.user_id == user.id,
-                        Transaction.created_at >= today_start,
-                        Transaction.created_at <= today_end
-                    ).count()
-                    
-                    # Если нет трат за сегодня, отправляем напоминание
-                    if today_transactions == 0:
+                for user in due_users:
+                    if user.id not in active_user_ids:
                         message = get_message("daily_reminder", user.language)
-                        await self.bot.send_message(
-                            chat_id=user.telegram_id,
-                            text=message,
-                            parse_mode='Markdown'
-                        )
-                        logger.info(f"Отправлено напоминание пользователю {user.telegram_id}")
-                        
-                finally:
-                    db.close()
-                    
-        except Exception as e:
-            logger.error(f"Ошибка отправки напоминания пользователю {user.telegram_id}: {e}")
-    
-    async def _check_budget_notifications(self):
-        """Проверка уведомлений о бюджете"""
-        db = get_db_session()
-        try:
-            # Получаем пользователей с включенными уведомлениями о бюджете
-            users = db.query(User).filter(
-                User.budget_notifications_enabled == True,
-                User.budget_notification_time.isnot(None),
-                User.salary_date.isnot(None)
-            ).all()
+                        try:
+                            self.dispatcher.submit(user.telegram_id, message, parse_mode='Markdown')
+                        except asyncio.QueueFull:
+                            logger.warning("Очередь исходящих сообщений заполнена, напоминания отложены")
+                            break
+                        logger.info(f"Напоминание пользователю {user.telegram_id} поставлено в очередь")
+                    handled.append(user)
             
-            for user in users:
-                await self._send_budget_notification_if_needed(user)
+            await self._advance(db, User.next_daily_reminder_utc, next_daily_reminder_utc, handled, now)
                 
+        except Exception as e:
+            logger.error(f"Ошибка отправки напоминаний: {e}")
         finally:
-            db.close()
+            await db.close()
     
-    async def _send_budget_notification_if_needed(self, user: User):
-        """Отправка уведомления о бюджете если нужно"""
-        try:
-            # Получаем текущее время в часовом поясе пользователя
-            user_tz = pytz.timezone(user.timezone)
-            current_time = datetime.now(user_tz).time()
-            current_date = datetime.now(user_tz).date()
+    @staticmethod
+    def _local_day_bounds(timezone: str, now: datetime) -> Tuple[datetime, datetime]:
+        """Начало и конец текущего дня в часовом поясе, в UTC без tzinfo (как created_at)"""
+        user_tz = pytz.timezone(timezone)
+        today = now.astimezone(user_tz).date()
+        today_start = user_tz.localize(datetime.combine(today, time.min)).astimezone(pytz.utc).replace(tzinfo=None)
+        today_end = user_tz.localize(datetime.combine(today, time.max)).astimezone(pytz.utc).replace(tzinfo=None)
+        return today_start, today_end
+    
+    async def _users_with_transactions_today(self, db, users: List[User], now: datetime) -> Set[int]:
+        """
+        id пользователей, у которых есть транзакции за текущий местный день.
+        Пользователи группируются по часовому поясу (у группы общие границы
+        дня), все группы проверяются одним запросом; большие волны делятся
+        на части по REMINDER_BATCH_SIZE пользователей.
+        """
+        active_user_ids = set()
+        for offset in range(0, len(users), REMINDER_BATCH_SIZE):
+            by_timezone = defaultdict(list)
+            for user in users[offset:offset + REMINDER_BATCH_SIZE]:
+                by_timezone[user.timezone].append(user.id)
             
-            # Проверяем, что текущее время соответствует времени уведомления
-            notification_time = user.budget_notification_time
-            if (current_time.hour == notification_time.hour and 
-                current_time.minute == notification_time.minute):
-                
-                # Проверяем частоту уведомлений
-                should_send = False
-                
-                if user.budget_notification_frequency == "daily":
-                    should_send = True
-                elif user.budget_notification_frequency == "weekly":
-                    # Отправляем раз в неделю в понедельник
-                    should_send = current_date.weekday() == 0
-                
-                if should_send:
-                    await self._send_budget_status(user)
-                    
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления о бюджете пользователю {user.telegram_id}: {e}")
+            conditions = []
+            for timezone, user_ids in by_timezone.items():
+                today_start, today_end = self._local_day_bounds(timezone, now)
+                conditions.append(and_(
+                    Transaction.user_id.in_(user_ids),
+                    Transaction.created_at >= today_start,
+                    Transaction.created_at <= today_end
+                ))
+            
+            rows = await db.execute(select(Transaction.user_id).filter(or_(*conditions)).distinct())
+            active_user_ids.update(rows.scalars().all())
+        
+        return active_user_ids
     
-    async def _send_budget_status(self, user: User):
-        """Отправка статуса бюджета"""
+    async def _check_budget_notifications(self, shards: List[int]):
+        """Проверка уведомлений о бюджете"""
+        db = get_async_db_session()
         try:
-            db = get_db_session()
-            try:
-                # Вычисляем дни до зарплаты
-                user_tz = pytz.timezone(user.timezone)
-                today = datetime.now(user_tz).date()
-                
-                # Находим следующую дату зарплаты
-                next_salary_date = self._get_next_salary_date(today, user.salary_date)
-                days_until_salary = (next_salary_date - today).days
-                
-                # Получаем лимиты пользователя
-                limits = db.query(Limit).filter(Limit.user_id == user.id).all()
-                
-                if not limits:
-                    return
-                
-                message_parts = [
-                    f"💰 **Статус бюджета**\n",
-                    f"📅 До зарплаты: {days_until_salary} дней\n"
-                ]
-                
-                for limit in limits:
-                    category = db.query(Category).filter(Category.id == limit.category_id).first()
-                    if not category:
-                        continue
-                    
-                    # Вычисляем потраченную сумму с последней зарплаты
-                    last_salary_date = self._get_last_salary_date(today, user.salary_date)
-                    spent = self._calculate_spent_since_date(db, user.id, limit.category_id, last_salary_date, limit.currency)
-                    
-                    remaining = limit.amount - spent
-                    daily_budget = remaining / max(days_until_salary, 1) if days_until_salary > 0 else 0
-                    
-                    category_emoji = category.emoji if hasattr(category, 'emoji') and category.emoji else "📁"
-                    
-                    message_parts.append(
-                        f"{category_emoji} **{category.name}**\n"
-                        f"   Осталось: {remaining:.2f} {limit.currency}\n"
-                        f"   Можно тратить в день: {daily_budget:.2f} {limit.currency}\n"
-                    )
-                
-                message = "\n".join(message_parts)
-                
-                await self.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=message,
-                    parse_mode='Markdown'
-                )
-                
-                logger.info(f"Отправлен статус бюджета пользователю {user.telegram_id}")
+            now = datetime.utcnow()
+            due_users, handled = await self._select_due(db, User.next_budget_notification_utc, shards, now)
+            
+            if due_users:
+                # Лимиты и расходы всей волны - одним запросом на пачку пользователей
+                digests = await self.digests.build(db, due_users, pytz.utc.localize(now))
                 
-            finally:
-                db.close()
+                for user in due_users:
+                    digest = digests.get(user.id)
+                    if digest is not None:
+                        try:
+                            self.dispatcher.submit(
+                                user.telegram_id, render_budget_digest(digest), parse_mode='Markdown'
+                            )
+                        except asyncio.QueueFull:
+                            logger.warning("Очередь исходящих сообщений заполнена, уведомления о бюджете отложены")
+                            break
+                        logger.info(f"Статус бюджета пользователю {user.telegram_id} поставлен в очередь")
+                    handled.append(user)
+            
+            await self._advance(db, User.next_budget_notification_utc, next_budget_notification_utc, handled, now)
                 
         except Exception as e:
-            logger.error(f"Ошибка отправки статуса бюджета пользователю {user.telegram_id}: {e}")
-    
-    def _get_next_salary_date(self, current_date: datetime.date, salary_day: int) -> datetime.date:
-        """Получить следующую дату зарплаты"""
-        current_month = current_date.month
-        current_year = current_date.year
-        
-        # Пробуем текущий месяц
-        try:
-            next_salary = current_date.replace(day=salary_day)
-            if next_salary > current_date:
-                return next_salary
-        except ValueError:
-            # Если day больше количества дней в месяце, берем последний день
-            import calendar
-            last_day = calendar.monthrange(current_year, current_month)[1]
-            next_salary = current_date.replace(day=min(salary_day, last_day))
-            if next_salary > current_date:
-                return next_salary
-        
-        # Если не подходит текущий месяц, берем следующий
-        next_month = current_month + 1
-        next_year = current_year
-        if next_month > 12:
-            next_month = 1
-            next_year += 1
-        
-        try:
-            return datetime.date(next_year, next_month, salary_day)
-        except ValueError:
-            import calendar
-            last_day = calendar.monthrange(next_year, next_month)[1]
-            return datetime.date(next_year, next_month, min(salary_day, last_day))
-    
-    def _get_last_salary_date(self, current_date: datetime.date, salary_day: int) -> datetime.date:
-        """Получить последнюю дату зарплаты"""
-        current_month = current_date.month
-        current_year = current_date.year
-        
-        # Пробуем текущий месяц
-        try:
-            last_salary = current_date.replace(day=salary_day)
-            if last_salary <= current_date:
-                return last_salary
-        except ValueError:
-            # Если day больше количества дней в месяце, берем последний день
-            import calendar
-            last_day = calendar.monthrange(current_year, current_month)[1]
-            last_salary = current_date.replace(day=min(salary_day, last_day))
-            if last_salary <= current_date:
-                return last_salary
-        
-        # Если не подходит текущий месяц, берем предыдущий
-        prev_month = current_month - 1
-        prev_year = current_year
-        if prev_month < 1:
-            prev_month = 12
-            prev_year -= 1
-        
-        try:
-            return datetime.date(prev_year, prev_month, salary_day)
-        except ValueError:
-            import calendar
-            last_day = calendar.monthrange(prev_year, prev_month)[1]
-            return datetime.date(prev_year, prev_month, min(salary_day, last_day))
-    
-    def _calculate_spent_since_date(self, db, user_id: int, category_id: int, since_date: datetime.date, currency: str) -> float:
-        """Вычислить потраченную сумму с определенной даты"""
-        since_datetime = datetime.combine(since_date, time.min)
-        
-        transactions = db.query(Transaction).filter(
-            Transaction.user_id == user_id,
-            Transaction.category_id == category_id,
-            Transaction.currency == currency,
-            Transaction.amount < 0,  # Только расходы
-            Transaction.created_at >= since_datetime
-        ).all()
-        
-        return sum(abs(transaction.amount) for transaction in transactions)
\ No newline at end of file
+            logger.error(f"Ошибка отправки уведомлений о бюджете: {e}")
+        finally:
+            await db.close()
@@ -1,19 +1,156 @@
 import openai
+import asyncio
 import json
+import random
 import config
 from typing import List, Dict, Optional
 import logging
 import base64
 
+from services.categorization_cache import categorization_cache, MISS
+from services.category_memory_service import CategoryMemoryService
+from services.keyword_matcher import KeywordMatcher
+from services.receipt_image_service import receipt_image_service
+
 logger = logging.getLogger(__name__)
 
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# Сколько описаний отправляется модели в одном запросе пакетной категоризации
+CATEGORIZE_BATCH_SIZE = 40
+# Минимальная уверенность памяти категорий, при которой модель не спрашивается
+MEMORY_MIN_CONFIDENCE = 0.8
+# Допустимое расхождение суммы позиций чека с итогом - на округление каждой позиции
+RECEIPT_ITEM_ROUNDING = 0.01
+
+# Ключевые слова базовых категорий (порядок важен: побеждает первая подходящая)
+CATEGORY_KEYWORDS = {
+    'продукты': ['продукты', 'еда', 'пища', 'супермаркет', 'магазин', 'food', 'grocery', 'auchan', 'silpo', 'atb', 'novus', 'сільпо', 'ашан', 'новус', 'хлеб', 'молоко', 'мясо', 'овощи', 'фрукты', 'lidl', 'metro', 'kaufland', 'billa', 'spar', 'rewe', 'edeka', 'penny', 'netto', 'dm', 'rossmann'],
+    'транспорт': ['транспорт', 'автобус', 'такси', 'uber', 'bolt', 'taxi', 'бензин', 'газ', 'заправка', 'fuel', 'petrol', 'gas', 'parking', 'парковка', 'метро', 'metro', 'поезд', 'train', 'билет', 'ticket', 'проезд', 'пересадка', 'мост', 'toll', 'платная дорога', 'автомобиль', 'car', 'машина', 'авто', 'transport', 'bus', 'tram', 'трамвай', 'троллейбус', 'trolleybus'],
+    'развлечения': ['развлечения', 'кино', 'cinema', 'театр', 'theatre', 'концерт', 'concert', 'игры', 'games', 'спорт', 'sport', 'фитнес', 'fitness', 'gym', 'зал', 'бассейн', 'pool', 'парк', 'park', 'музей', 'museum', 'выставка', 'exhibition', 'клуб', 'club', 'бар', 'bar', 'pub', 'паб', 'entertainment', 'leisure', 'досуг', 'отдых', 'rest', 'vacation', 'отпуск', 'туризм', 'tourism', 'путешествие', 'travel', 'hotel', 'отель', 'hostel', 'хостел'],
+    'здоровье': ['здоровье', 'аптека', 'pharmacy', 'лекарство', 'medicine', 'врач', 'doctor', 'больница', 'hospital', 'поликлиника', 'clinic', 'медицина', 'medical', 'лечение', 'treatment', 'анализы', 'tests', 'стоматолог', 'dentist', 'зубы', 'teeth', 'окулист', 'оптика', 'optics', 'glasses', 'очки', 'витамины', 'vitamins', 'добавки', 'supplements', 'массаж', 'massage', 'physio', 'физио', 'терапия', 'therapy', 'health', 'медосмотр', 'checkup'],
+    'одежда': ['одежда', 'clothes', 'clothing', 'магазин одежды', 'fashion', 'мода', 'обувь', 'shoes', 'boots', 'сапоги', 'кроссовки', 'sneakers', 'платье', 'dress', 'рубашка', 'shirt', 'брюки', 'pants', 'джинсы', 'jeans', 'куртка', 'jacket', 'пальто', 'coat', 'шапка', 'hat', 'шарф', 'scarf', 'перчатки', 'gloves', 'носки', 'socks', 'белье', 'underwear', 'h&m', 'zara', 'mango', 'bershka', 'pull&bear', 'massimo dutti', 'stradivarius', 'reserved', 'c&a', 'primark', 'uniqlo', 'nike', 'adidas', 'puma', 'reebok'],
+    'коммунальные услуги': ['коммунальные', 'utilities', 'электричество', 'electricity', 'газ', 'gas', 'вода', 'water', 'отопление', 'heating', 'интернет', 'internet', 'телефон', 'phone', 'мобильная связь', 'mobile', 'kyivstar', 'vodafone', 'lifecell', 'телеком', 'telecom', 'кабельное', 'cable', 'тв', 'tv', 'телевидение', 'television', 'домофон', 'intercom', 'управляющая компания', 'management', 'жкх', 'housing', 'коммуналка', 'communal', 'счетчики', 'meters', 'квартплата', 'rent', 'аренда'],
+    'ресторан': ['ресторан', 'restaurant', 'кафе', 'cafe', 'coffee', 'кофе', 'starbucks', 'mcdonalds', 'kfc', 'burger', 'бургер', 'pizza', 'пицца', 'sushi', 'суши', 'delivery', 'доставка', 'glovo', 'uber eats', 'wolt', 'foodpanda', 'завтрак', 'breakfast', 'обед', 'lunch', 'ужин', 'dinner', 'столовая', 'canteen', 'фастфуд', 'fastfood', 'еда на вынос', 'takeaway', 'бар', 'bar', 'pub', 'паб', 'напитки', 'drinks', 'алкоголь', 'alcohol', 'пиво', 'beer', 'вино', 'wine', 'коктейль', 'cocktail', 'чай', 'tea', 'сок', 'juice', 'food court', 'фуд корт'],
+    'прочее': ['прочее', 'other', 'разное', 'misc', 'miscellaneous', 'другое', 'прочие', 'various', 'общие', 'general']
+}
+
+# Ключевые слова подкатегорий по категориям
+SUBCATEGORY_KEYWORDS = {
+    "продукты": {
+        "мясо": ["мясо", "колбаса", "курица", "говядина", "свинина", "рыба"],
+        "молочные": ["молоко", "сыр", "творог", "йогурт", "сметана", "кефир"],
+        "овощи": ["овощи", "картошка", "морковь", "лук", "помидоры", "огурцы"],
+        "фрукты": ["фрукты", "яблоки", "бананы", "апельсины", "груши"],
+        "хлеб": ["хлеб", "булка", "батон", "выпечка", "хлебобулочные"],
+        "сладости": ["конфеты", "шоколад", "торт", "печенье", "мороженое"]
+    },
+    "транспорт": {
+        "топливо": ["бензин", "дизель", "газ", "заправка", "азс"],
+        "общественный": ["автобус", "метро", "трамвай", "троллейбус", "билет"],
+        "такси": ["такси", "uber", "яндекс", "bolt", "поездка"],
+        "парковка": ["парковка", "паркинг", "стоянка"],
+        "ремонт": ["ремонт", "сервис", "шины", "масло", "запчасти"]
+    },
+    "развлечения": {
+        "кино": ["кино", "театр", "концерт", "билет", "спектакль"],
+        "спорт": ["спорт", "фитнес", "зал", "тренажерный", "бассейн"],
+        "игры": ["игра", "игры", "консоль", "steam", "playstation"],
+        "книги": ["книга", "книги", "литература", "роман"],
+        "музыка": ["музыка", "spotify", "apple music", "концерт"]
+    },
+    "здоровье": {
+        "лекарства": ["лекарство", "таблетки", "аптека", "медикаменты"],
+        "врач": ["врач", "доктор", "прием", "консультация"],
+        "стоматология": ["стоматолог", "зубы", "зубной", "стоматология"],
+        "анализы": ["анализы", "обследование", "узи", "рентген"]
+    },
+    "ресторан": {
+        "фастфуд": ["макдональдс", "kfc", "бургер", "пицца", "фастфуд"],
+        "кафе": ["кафе", "кофе", "чай", "starbucks", "coffee"],
+        "ресторан": ["ресторан", "ужин", "обед", "банкет"],
+        "доставка": ["доставка", "delivery", "яндекс еда", "uber eats"]
+    }
+}
+
+# Автоматы ключевых слов строятся один раз при импорте
+_CATEGORY_MATCHER = KeywordMatcher(CATEGORY_KEYWORDS)
+_SUBCATEGORY_MATCHERS = {
+    category_key: KeywordMatcher(subcategories)
+    for category_key, subcategories in SUBCATEGORY_KEYWORDS.items()
+}
+
+# Клиент и семафор общие для всех экземпляров сервиса: обработчики создают
+# OpenAIService на каждый запрос, а ограничение должно быть глобальным
+_client: Optional[openai.AsyncOpenAI] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_client() -> openai.AsyncOpenAI:
+    global _client
+    if _client is None:
+        # Повторы выполняет сервис (с джиттером и освобождением семафора)
+        _client = openai.AsyncOpenAI(api_key=config.OPENAI_API_KEY, max_retries=0)
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(config.OPENAI_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Пауза перед повтором: Retry-After от API или экспоненциальная с полным джиттером"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), config.OPENAI_BACKOFF_MAX)
+            except ValueError:
+                pass
+
+    return random.uniform(0, min(config.OPENAI_BACKOFF_MAX, config.OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+
 class OpenAIService:
     def __init__(self):
-        self.client = openai.OpenAI(api_key=config.OPENAI_API_KEY)
+        self.client = _get_client()
     
-    async def categorize_transaction(self, description: str, existing_categories: List[str]) -> str:
-        """Определяет категорию транзакции на основе описания."""
+    async def _create_chat_completion(self, timeout: float, **kwargs):
+        """
+        Асинхронный вызов chat.completions с глобальным ограничением числа
+        одновременных запросов, таймаутом на попытку и повторами при
+        rate limit, таймаутах и ошибках сервера. Во время паузы между
+        попытками семафор свободен для других пользователей.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with _get_semaphore():
+                    return await self.client.chat.completions.create(timeout=timeout, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= config.OPENAI_MAX_RETRIES:
+                    raise
 
+                delay = _retry_delay(e, attempt)
+                attempt += 1
+                logger.warning(
+                    f"OpenAI: {type(e).__name__}, повтор {attempt}/{config.OPENAI_MAX_RETRIES} через {delay:.1f} с"
+                )
+                await asyncio.sleep(delay)
+    
+    @staticmethod
+    def _match_existing_category(description: str, existing_categories: List[str]) -> Optional[str]:
+        """Категория без запроса к модели: по названию категории или ключевым словам"""
         desc_lower = description.lower().strip()
 
         # Сначала проверяем точное совпадение с существующей категорией
@@ -27,10 +164,22 @@ class OpenAIService:
                 return cat
 
         # Продвинутая местная категоризация на основе ключевых слов
-        local_category = OpenAIService._categorize_locally(desc_lower, existing_categories)
+        return OpenAIService._categorize_locally(desc_lower, existing_categories)
+
+    async def categorize_transaction(self, description: str, existing_categories: List[str]) -> str:
+        """Определяет категорию транзакции на основе описания."""
+
+        local_category = OpenAIService._match_existing_category(description, existing_categories)
         if local_category:
             return local_category
 
+        # Тот же вопрос с тем же списком категорий уже задавали модели
+        cache_key = categorization_cache.make_key("category", description, existing_categories)
+        if cache_key:
+            cached = await categorization_cache.get(cache_key)
+            if cached is not MISS:
+                return cached
+
         # Если локальная категоризация не дала результата, обращаемся к OpenAI
         prompt = f"""
         Определи наиболее подходящую категорию для транзакции: "{description}"
@@ -42,7 +191,8 @@ class OpenAIService:
         """
 
         try:
-            response = self.client.chat.completions.create(
+            response = await self._create_chat_completion(
+                timeout=config.OPENAI_TIMEOUT,
                 model="gpt-3.5-turbo",
                 messages=[
                     {
@@ -56,8 +206,12 @@ class OpenAIService:
             )
 
             category = response.choices[0].message.content.strip()
-            if category in existing_categories:
-                return category
+            if category not in existing_categories:
+                category = "Прочее"
+
+            if cache_key:
+                await categorization_cache.put(cache_key, category)
+            return category
 
         except Exception as e:
             logger.error(f"Ошибка при обращении к OpenAI: {e}")
@@ -65,11 +219,111 @@ class OpenAIService:
         # Fallback
         return "Прочее"
     
+    async def categorize_transactions(self, descriptions: List[str], existing_categories: List[str],
+                                      user_id: Optional[int] = None, db=None) -> List[str]:
+        """
+        Категории для нескольких описаний (позиции одного чека) в том же порядке.
+
+        Сначала каждое описание проверяется локально, по памяти категорий
+        пользователя (если передан user_id) и по кэшу ответов. Оставшиеся
+        уникальные описания отправляются модели одним запросом со списком
+        и JSON-ответом, так что время обработки чека не растет с числом позиций.
+        """
+        categories: List[Optional[str]] = [None] * len(descriptions)
+        pending: Dict[str, List[int]] = {}
+        memory_service = CategoryMemoryService() if user_id is not None else None
+
+        for position, description in enumerate(descriptions):
+            category = OpenAIService._match_existing_category(description, existing_categories)
+
+            if category is None and memory_service:
+                suggestion = await memory_service.suggest_category(user_id, description, db=db)
+                if (suggestion and suggestion['confidence'] >= MEMORY_MIN_CONFIDENCE
+                        and suggestion['category_name'] in existing_categories):
+                    category = suggestion['category_name']
+
+            if category is None:
+                pending.setdefault(description, []).append(position)
+            else:
+                categories[position] = category
+
+        cache_keys = {}
+        for description in list(pending):
+            cache_key = categorization_cache.make_key("category", description, existing_categories)
+            if not cache_key:
+                continue
+            cached = await categorization_cache.get(cache_key)
+            if cached is MISS:
+                cache_keys[description] = cache_key
+            else:
+                for position in pending.pop(description):
+                    categories[position] = cached
+
+        if pending:
+            batches = [list(pending)[start:start + CATEGORIZE_BATCH_SIZE]
+                       for start in range(0, len(pending), CATEGORIZE_BATCH_SIZE)]
+            results = await asyncio.gather(
+                *(self._categorize_batch(batch, existing_categories) for batch in batches)
+            )
+            for batch, answers in zip(batches, results):
+                for number, description in enumerate(batch):
+                    # Fallback без кэширования, если модель не ответила
+                    category = answers[number] if answers else "Прочее"
+                    for position in pending[description]:
+                        categories[position] = category
+                    if answers and description in cache_keys:
+                        await categorization_cache.put(cache_keys[description], category)
+
+        return categories
+
+    async def _categorize_batch(self, descriptions: List[str], existing_categories: List[str]) -> Optional[List[str]]:
+        """Один запрос к модели для списка описаний; None, если ответ не получен"""
+        numbered = "\n".join(f"{number}. {description}" for number, description in enumerate(descriptions, 1))
+        prompt = f"""
+        Определи наиболее подходящую категорию для каждой транзакции:
+        {numbered}
+
+        Доступные категории: {', '.join(existing_categories)}
+
+        Верни JSON вида {{"categories": ["категория 1", "категория 2", ...]}} -
+        по одному названию из списка доступных категорий на каждую транзакцию,
+        в том же порядке. Если ни одна не подходит, укажи "Прочее".
+        """
+
+        try:
+            response = await self._create_chat_completion(
+                timeout=config.OPENAI_TIMEOUT,
+                model="gpt-3.5-turbo",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "Ты помощник для категоризации транзакций. Всегда отвечай в JSON формате."
+                    },
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.3,
+                max_tokens=50 + 20 * len(descriptions)
+            )
+
+            answers = json.loads(response.choices[0].message.content).get("categories")
+            if not isinstance(answers, list) or len(answers) != len(descriptions):
+                logger.error(f"Некорректный ответ пакетной категоризации: {answers}")
+                return None
+        except Exception as e:
+            logger.error(f"Ошибка при пакетной категоризации через OpenAI: {e}")
+            return None
+
+        return [answer if answer in existing_categories else "Прочее" for answer in answers]
+
     async def analyze_receipt_image(self, image_data: bytes) -> List[Dict]:
         """
         Анализирует изображение чека и извлекает транзакции
         """
         try:
+            # Уменьшенный серый JPEG без полей: меньше загрузка и токенов изображения
+            image_data = await receipt_image_service.prepare(image_data)
+
             # Конвертируем изображение в base64
             base64_image = base64.b64encode(image_data).decode('utf-8')
             
@@ -84,18 +338,18 @@ class OpenAIService:
                 "items": [
                     {
                         "name": "название_товара",
-                        "price": цена,
-                        "quantity": количество,
-                        "category": "предполагаемая_категория"
+                        "amount": сумма_позиции
                     }
                 ]
             }
             
+            amount - итоговая сумма позиции: цена, умноженная на количество, с учетом скидок.
+            Скидки на весь чек распредели по позициям, чтобы сумма позиций равнялась total_amount.
             Если не удается определить какое-либо поле, укажи null.
-            Категории: Продукты, Транспорт, Развлечения, Здоровье, Одежда, Коммунальные услуги, Ресторан, Прочее.
             """
             
-            response = self.client.chat.completions.create(
+            response = await self._create_chat_completion(
+                timeout=config.OPENAI_VISION_TIMEOUT,
                 model="gpt-4o",  # Модель с поддержкой изображений
                 messages=[
                     {
@@ -119,7 +373,7 @@ class OpenAIService:
                     }
                 ],
                 temperature=0.1,
-                max_tokens=1000
+                max_tokens=2000  # Длинный чек: несколько десятков позиций
             )
             
             content = response.choices[0].message.content
@@ -137,25 +391,7 @@ class OpenAIService:
                 logger.error(f"Некорректный формат ответа: {result}")
                 return []
             
-            # Нормализуем данные
-            transactions = []
-            
-            # Если есть общая сумма, создаем одну транзакцию
-            if result.get('total_amount'):
-                store_name = result.get('store_name', 'Магазин')
-                description = f"{store_name} (чек)"
-                
-                transactions.append({
-                    'amount': float(result['total_amount']),
-                    'currency': OpenAIService._normalize_currency_from_receipt(result.get('currency', 'EUR')),
-                    'description': description,
-                    'is_income': False
-                })
-            
-            # Альтернативно - создаем отдельные транзакции для каждого товара
-            # (!выключено по умолчанию, чтобы не дублировать)
-            
-            return transactions
+            return OpenAIService._receipt_transactions(result)
             
         except json.JSONDecodeError as e:
             logger.error(f"Ошибка парсинга JSON: {e}")
@@ -164,6 +400,56 @@ class OpenAIService:
             logger.error(f"Ошибка при анализе чека: {e}")
             return []
     
+    @staticmethod
+    def _receipt_amount(value) -> Optional[float]:
+        """Сумма из ответа модели: число или строка с запятой; None если не читается"""
+        try:
+            return round(float(str(value).replace(',', '.')), 2)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _receipt_transactions(result: Dict) -> List[Dict]:
+        """
+        Транзакция на каждую позицию чека. Если позиции не читаются или их
+        сумма расходится с итогом чека, - одна транзакция на весь чек
+        """
+        currency = OpenAIService._normalize_currency_from_receipt(result.get('currency', 'EUR'))
+        total_amount = OpenAIService._receipt_amount(result.get('total_amount'))
+
+        items = []
+        for item in result.get('items') or []:
+            name = item.get('name') if isinstance(item, dict) else None
+            amount = OpenAIService._receipt_amount(item.get('amount')) if name else None
+            if amount is None or amount < 0:
+                # Позиция без названия, суммы или отдельной строкой скидки: на позиции не делим
+                items = []
+                break
+            if amount > 0:
+                items.append({
+                    'amount': amount,
+                    'currency': currency,
+                    'description': str(name).strip(),
+                    'is_income': False
+                })
+
+        items_total = sum(item['amount'] for item in items)
+        if items and (not total_amount or abs(items_total - total_amount) <= RECEIPT_ITEM_ROUNDING * len(items)):
+            return items
+
+        if items:
+            logger.warning(f"Сумма позиций чека {items_total:.2f} не совпадает с итогом {total_amount}")
+        if not total_amount:
+            return []
+
+        store_name = result.get('store_name') or 'Магазин'
+        return [{
+            'amount': total_amount,
+            'currency': currency,
+            'description': f"{store_name} (чек)",
+            'is_income': False
+        }]
+
     @staticmethod
     def _normalize_currency_from_receipt(currency: str) -> str:
         """Нормализация валюты из чека"""
@@ -185,43 +471,20 @@ class OpenAIService:
     def _categorize_locally(description: str, existing_categories: List[str]) -> Optional[str]:
         """Локальная категоризация на основе ключевых слов без ChatGPT"""
         
-        # Словарь ключевых слов для категоризации
-        keywords_mapping = {
-            'продукты': ['продукты', 'еда', 'пища', 'супермаркет', 'магазин', 'food', 'grocery', 'auchan', 'silpo', 'atb', 'novus', 'сільпо', 'ашан', 'новус', 'хлеб', 'молоко', 'мясо', 'овощи', 'фрукты', 'lidl', 'metro', 'kaufland', 'billa', 'spar', 'rewe', 'edeka', 'penny', 'netto', 'dm', 'rossmann'],
-            'транспорт': ['транспорт', 'автобус', 'такси', 'uber', 'bolt', 'taxi', 'бензин', 'газ', 'заправка', 'fuel', 'petrol', 'gas', 'parking', 'парковка', 'метро', 'metro', 'поезд', 'train', 'билет', 'ticket', 'проезд', 'пересадка', 'мост', 'toll', 'платная дорога', 'автомобиль', 'car', 'машина', 'авто', 'transport', 'bus', 'tram', 'трамвай', 'троллейбус', 'trolleybus'],
-            'развлечения': ['развлечения', 'кино', 'cinema', 'театр', 'theatre', 'концерт', 'concert', 'игры', 'games', 'спорт', 'sport', 'фитнес', 'fitness', 'gym', 'зал', 'бассейн', 'pool', 'парк', 'park', 'музей', 'museum', 'выставка', 'exhibition', 'клуб', 'club', 'бар', 'bar', 'pub', 'паб', 'entertainment', 'leisure', 'досуг', 'отдых', 'rest', 'vacation', 'отпуск', 'туризм', 'tourism', 'путешествие', 'travel', 'hotel', 'отель', 'hostel', 'хостел'],
-            'здоровье': ['здоровье', 'аптека', 'pharmacy', 'лекарство', 'medicine', 'врач', 'doctor', 'больница', 'hospital', 'поликлиника', 'clinic', 'медицина', 'medical', 'лечение', 'treatment', 'анализы', 'tests', 'стоматолог', 'dentist', 'зубы', 'teeth', 'окулист', 'оптика', 'optics', 'glasses', 'очки', 'витамины', 'vitamins', 'добавки', 'supplements', 'массаж', 'massage', 'physio', 'физио', 'терапия', 'therapy', 'health', 'медосмотр', 'checkup'],
-            'одежда': ['одежда', 'clothes', 'clothing', 'магазин одежды', 'fashion', 'мода', 'обувь', 'shoes', 'boots', 'сапоги', 'кроссовки', 'sneakers', 'платье', 'dress', 'рубашка', 'shirt', 'брюки', 'pants', 'джинсы', 'jeans', 'куртка', 'jacket', 'пальто', 'coat', 'шапка', 'hat', 'шарф', 'scarf', 'перчатки', 'gloves', 'носки', 'socks', 'белье', 'underwear', 'h&m', 'zara', 'mango', 'bershka', 'pull&bear', 'massimo dutti', 'stradivarius', 'reserved', 'c&a', 'primark', 'uniqlo', 'nike', 'adidas', 'puma', 'reebok'],
-            'коммунальные услуги': ['коммунальные', 'utilities', 'электричество', 'electricity', 'газ', 'gas', 'вода', 'water', 'отопление', 'heating', 'интернет', 'internet', 'телефон', 'phone', 'мобильная связь', 'mobile', 'kyivstar', 'vodafone', 'lifecell', 'телеком', 'telecom', 'кабельное', 'cable', 'тв', 'tv', 'телевидение', 'television', 'домофон', 'intercom', 'управляющая компания', 'management', 'жкх', 'housing', 'коммуналка', 'communal', 'счетчики', 'meters', 'квартплата', 'rent', 'аренда'],
-            'ресторан': ['ресторан', 'restaurant', 'кафе', 'cafe', 'coffee', 'кофе', 'starbucks', 'mcdonalds', 'kfc', 'burger', 'бургер', 'pizza', 'пицца', 'sushi', 'суши', 'delivery', 'доставка', 'glovo', 'uber eats', 'wolt', 'foodpanda', 'завтрак', 'breakfast', 'обед', 'lunch', 'ужин', 'dinner', 'столовая', 'canteen', 'фастфуд', 'fastfood', 'еда на вынос', 'takeaway', 'бар', 'bar', 'pub', 'паб', 'напитки', 'drinks', 'алкоголь', 'alcohol', 'пиво', 'beer', 'вино', 'wine', 'коктейль', 'cocktail', 'чай', 'tea', 'сок', 'juice', 'food court', 'фуд корт'],
-            'прочее': ['прочее', 'other', 'разное', 'misc', 'miscellaneous', 'другое', 'прочие', 'various', 'общие', 'general']
-        }
-        
         # Нормализуем названия существующих категорий
         normalized_categories = {cat.lower(): cat for cat in existing_categories}
         
-        # Проверяем каждую категорию
-        for category_key, keywords in keywords_mapping.items():
+        # Базовые категории, ключевые слова которых есть в описании, - за один проход
+        for category_key in _CATEGORY_MATCHER.find(description):
             # Ищем соответствие среди существующих категорий пользователя
             for existing_cat_lower, existing_cat_original in normalized_categories.items():
                 if category_key in existing_cat_lower or existing_cat_lower in category_key:
-                    # Проверяем, есть ли ключевые слова в описании
-                    for keyword in keywords:
-                        if keyword in description:
-                            return existing_cat_original
-        
-        # Если нет соответствия с существующими категориями, проверяем базовые категории
-        for category_key, keywords in keywords_mapping.items():
-            for keyword in keywords:
-                if keyword in description:
-                    # Возвращаем категорию только если она есть в списке пользователя
-                    for cat in existing_categories:
-                        if category_key.lower() in cat.lower() or cat.lower() in category_key.lower():
-                            return cat
+                    return existing_cat_original
         
         return None
     
-    async def process_receipt_photo(self, image_data: bytes, user_categories: List[str]) -> List[Dict]:
+    async def process_receipt_photo(self, image_data: bytes, user_categories: List[str],
+                                    user_id: Optional[int] = None, db=None) -> List[Dict]:
         """
         Полная обработка фото чека с категоризацией
         """
@@ -232,17 +495,17 @@ class OpenAIService:
             if not transactions:
                 return []
             
-            # Категоризируем каждую транзакцию
-            categorized_transactions = []
-            for transaction in transactions:
-                category = await self.categorize_transaction(
-                    transaction['description'], 
-                    user_categories
-                )
+            # Категоризируем все транзакции чека одним запросом
+            categories = await self.categorize_transactions(
+                [transaction['description'] for transaction in transactions],
+                user_categories,
+                user_id=user_id,
+                db=db
+            )
+            for transaction, category in zip(transactions, categories):
                 transaction['category'] = category
-                categorized_transactions.append(transaction)
             
-            return categorized_transactions
+            return transactions
             
         except Exception as e:
             logger.error(f"Ошибка при обработке фото чека: {e}")
@@ -329,6 +592,13 @@ class OpenAIService:
         if local_subcategory:
             return local_subcategory
         
+        # Тот же вопрос с тем же списком подкатегорий уже задавали модели
+        cache_key = categorization_cache.make_key(f"subcategory:{category_name.lower()}", description, existing_subcategories)
+        if cache_key:
+            cached = await categorization_cache.get(cache_key)
+            if cached is not MISS:
+                return cached
+
         # Если локальная категоризация не дала результата, обращаемся к OpenAI
         prompt = f"""
         Определи наиболее подходящую подкатегорию для транзакции: "{description}"
@@ -341,7 +611,8 @@ class OpenAIService:
         """
         
         try:
-            response = self.client.chat.completions.create(
+            response = await self._create_chat_completion(
+                timeout=config.OPENAI_TIMEOUT,
                 model="gpt-3.5-turbo",
                 messages=[
                     {
@@ -360,10 +631,12 @@ class OpenAIService:
             suggested_subcategory = response.choices[0].message.content.strip()
             
             # Проверяем, что предложенная подкатегория существует
-            if suggested_subcategory in existing_subcategories:
-                return suggested_subcategory
+            if suggested_subcategory not in existing_subcategories:
+                suggested_subcategory = None
             
-            return None
+            if cache_key:
+                await categorization_cache.put(cache_key, suggested_subcategory)
+            return suggested_subcategory
             
         except Exception as e:
             logger.error(f"Ошибка при определении подкатегории через OpenAI: {e}")
@@ -372,63 +645,18 @@ class OpenAIService:
     def _categorize_subcategory_locally(self, description: str, category_name: str, existing_subcategories: List[str]) -> Optional[str]:
         """Локальная категоризация подкатегорий на основе ключевых слов"""
         
-        # Словарь ключевых слов для подкатегорий по категориям
-        subcategory_keywords = {
-            "продукты": {
-                "мясо": ["мясо", "колбаса", "курица", "говядина", "свинина", "рыба"],
-                "молочные": ["молоко", "сыр", "творог", "йогурт", "сметана", "кефир"],
-                "овощи": ["овощи", "картошка", "морковь", "лук", "помидоры", "огурцы"],
-                "фрукты": ["фрукты", "яблоки", "бананы", "апельсины", "груши"],
-                "хлеб": ["хлеб", "булка", "батон", "выпечка", "хлебобулочные"],
-                "сладости": ["конфеты", "шоколад", "торт", "печенье", "мороженое"]
-            },
-            "транспорт": {
-                "топливо": ["бензин", "дизель", "газ", "заправка", "азс"],
-                "общественный": ["автобус", "метро", "трамвай", "троллейбус", "билет"],
-                "такси": ["такси", "uber", "яндекс", "bolt", "поездка"],
-                "парковка": ["парковка", "паркинг", "стоянка"],
-                "ремонт": ["ремонт", "сервис", "шины", "масло", "запчасти"]
-            },
-            "развлечения": {
-                "кино": ["кино", "театр", "концерт", "билет", "спектакль"],
-                "спорт": ["спорт", "фитнес", "зал", "тренажерный", "бассейн"],
-                "игры": ["игра", "игры", "консоль", "steam", "playstation"],
-                "книги": ["книга", "книги", "литература", "роман"],
-                "музыка": ["музыка", "spotify", "apple music", "концерт"]
-            },
-            "здоровье": {
-                "лекарства": ["лекарство", "таблетки", "аптека", "медикаменты"],
-                "врач": ["врач", "доктор", "прием", "консультация"],
-                "стоматология": ["стоматолог", "зубы", "зубной", "стоматология"],
-                "анализы": ["анализы", "обследование", "узи", "рентген"]
-            },
-            "ресторан": {
-                "фастфуд": ["макдональдс", "kfc", "бургер", "пицца", "фастфуд"],
-                "кафе": ["кафе", "кофе", "чай", "starbucks", "coffee"],
-                "ресторан": ["ресторан", "ужин", "обед", "банкет"],
-                "доставка": ["доставка", "delivery", "яндекс еда", "uber eats"]
-            }
-        }
-        
         category_lower = category_name.lower()
         
         # Ищем подходящую категорию в словаре
-        for cat_key, subcats in subcategory_keywords.items():
+        for cat_key, matcher in _SUBCATEGORY_MATCHERS.items():
             if cat_key in category_lower:
-                for subcat_name, keywords in subcats.items():
+                # Подкатегории, ключевые слова которых есть в описании, - за один проход
+                for subcat_name in matcher.find(description):
                     # Проверяем, есть ли такая подкатегория в существующих
-                    matching_subcategory = None
                     for existing_subcat in existing_subcategories:
                         if subcat_name.lower() in existing_subcat.lower() or existing_subcat.lower() in subcat_name.lower():
-                            matching_subcategory = existing_subcat
-                            break
-                    
-                    if matching_subcategory:
-                        # Проверяем ключевые слова
-                        for keyword in keywords:
-                            if keyword in description:
-                                return matching_subcategory
+                            return existing_subcat
                 
                 break
         
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,165 @@
+"""
+Кэш распознанных чеков: повторно присланное фото не отправляется в OpenAI
+"""
+
+import asyncio
+import io
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from PIL import Image
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database import async_session_scope, ReceiptCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних чеков пользователя сравнивается по хэшу
+HASH_SCAN_LIMIT = 200
+# Сторона сетки перцептивного хэша (HASH_SIZE ** 2 бит)
+HASH_SIZE = 32
+
+
+class CachedReceipt(NamedTuple):
+    transactions: List[Dict]
+    created_at: datetime
+
+
+def perceptual_hash(data: bytes) -> str:
+    """
+    dHash 32x32: изображение (HASH_SIZE + 1) x HASH_SIZE в оттенках серого,
+    бит на каждую пару соседних пикселей в строке. Не меняется при
+    пересжатии и изменении размера, поэтому совпадает у того же снимка,
+    присланного файлом или фото. 1024 бита вместо обычных 64: чеки одного
+    магазина на одном столе слишком похожи в разрешении 9x8.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = list(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX).getdata())
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = value << 1 | (pixels[offset + column] > pixels[offset + column + 1])
+    return f"{value:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def _distance(hash1: str, hash2: str) -> int:
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count("1")
+
+
+class ReceiptCache:
+    """
+    Распознанные транзакции чеков пользователя в таблице receipt_cache.
+
+    Сначала чек ищется по file_unique_id (до скачивания файла), затем по
+    перцептивному хэшу среди последних чеков пользователя: расстояние
+    Хэмминга не больше max_distance бит. Записи старше ttl_seconds не
+    используются и удаляются при сохранении нового чека пользователя.
+    """
+
+    def __init__(self, ttl_seconds: float = 30 * 86400, max_distance: int = 48):
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+
+        self.file_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+
+    def _since(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+
+    @staticmethod
+    async def image_hash(data: bytes) -> Optional[str]:
+        """Перцептивный хэш в отдельном потоке; None, если изображение не читается"""
+        try:
+            return await asyncio.to_thread(perceptual_hash, data)
+        except Exception as e:
+            logger.warning(f"Не удалось вычислить хэш изображения чека: {e}")
+            return None
+
+    async def find(self, user_id: int, file_unique_id: Optional[str] = None, image_hash: Optional[str] = None,
+                   db: Optional[AsyncSession] = None) -> Optional[CachedReceipt]:
+        """Ранее распознанный чек по file_unique_id или по похожему изображению"""
+        async with async_session_scope(db) as db:
+            cached = await self.find_by_file(user_id, file_unique_id, db=db) if file_unique_id else None
+            return cached or await self.find_similar(user_id, image_hash, db=db)
+
+    async def find_by_file(self, user_id: int, file_unique_id: str,
+                           db: Optional[AsyncSession] = None) -> Optional[CachedReceipt]:
+        """Чек с тем же file_unique_id; не требует скачивания файла, промах не учитывается"""
+        async with async_session_scope(db) as db:
+            entry = (await db.execute(select(ReceiptCacheEntry).filter(
+                ReceiptCacheEntry.user_id == user_id,
+                ReceiptCacheEntry.file_unique_id == file_unique_id,
+                ReceiptCacheEntry.created_at >= self._since()
+            ).order_by(ReceiptCacheEntry.created_at.desc()))).scalars().first()
+            if entry is None:
+                return None
+            self.file_hits += 1
+            return CachedReceipt(json.loads(entry.transactions), entry.created_at)
+
+    async def find_similar(self, user_id: int, image_hash: Optional[str],
+                           db: Optional[AsyncSession] = None) -> Optional[CachedReceipt]:
+        """Чек с похожим перцептивным хэшем среди последних чеков пользователя"""
+        if image_hash:
+            async with async_session_scope(db) as db:
+                candidates = (await db.execute(select(
+                    ReceiptCacheEntry.id, ReceiptCacheEntry.image_hash
+                ).filter(
+                    ReceiptCacheEntry.user_id == user_id,
+                    ReceiptCacheEntry.image_hash.isnot(None),
+                    ReceiptCacheEntry.created_at >= self._since()
+                ).order_by(ReceiptCacheEntry.created_at.desc()).limit(HASH_SCAN_LIMIT))).all()
+
+                best_id, best_distance = None, self.max_distance + 1
+                for entry_id, entry_hash in candidates:
+                    distance = _distance(image_hash, entry_hash)
+                    if distance < best_distance:
+                        best_id, best_distance = entry_id, distance
+
+                if best_id is not None:
+                    entry = await db.get(ReceiptCacheEntry, best_id)
+                    self.hash_hits += 1
+                    return CachedReceipt(json.loads(entry.transactions), entry.created_at)
+
+        self.misses += 1
+        return None
+
+    async def put(self, user_id: int, file_unique_id: Optional[str], image_hash: Optional[str],
+                  transactions: List[Dict], db: Optional[AsyncSession] = None) -> None:
+        """Сохранить распознанные транзакции чека"""
+        async with async_session_scope(db) as db:
+            try:
+                await db.execute(delete(ReceiptCacheEntry).filter(
+                    ReceiptCacheEntry.user_id == user_id,
+                    ReceiptCacheEntry.created_at < self._since()
+                ))
+                db.add(ReceiptCacheEntry(
+                    user_id=user_id,
+                    file_unique_id=file_unique_id,
+                    image_hash=image_hash,
+                    transactions=json.dumps(transactions, ensure_ascii=False)
+                ))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Ошибка сохранения чека в кэш: {e}")
+
+    def stats(self) -> dict:
+        """Сколько чеков не пришлось распознавать заново"""
+        return {
+            "file_hits": self.file_hits,
+            "hash_hits": self.hash_hits,
+            "misses": self.misses,
+        }
+
+
+receipt_cache = ReceiptCache(
+    ttl_seconds=config.RECEIPT_CACHE_TTL,
+    max_distance=config.RECEIPT_CACHE_MAX_DISTANCE
+)
@@ -0,0 +1,156 @@
+"""
+Подготовка фото чека перед отправкой в OpenAI: уменьшение, оттенки серого,
+обрезка полей и JPEG
+"""
+
+import asyncio
+import io
+import logging
+import math
+from typing import NamedTuple, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Разрешение, на котором ищутся поля (точность обрезки не важна)
+CROP_PREVIEW_SIZE = 256
+# Насколько пиксель должен отличаться от фона по краям, чтобы считаться содержимым
+CROP_THRESHOLD = 40
+# Отступ вокруг найденного содержимого, доля стороны
+CROP_PADDING = 0.02
+# Обрезка применяется, только если убирает хотя бы такую долю площади
+CROP_MIN_GAIN = 0.05
+# Сторона плитки, на которые OpenAI делит изображение при detail=high
+VISION_TILE = 512
+# Насколько можно дополнительно уменьшить изображение, чтобы уложиться в меньшее число плиток
+TILE_SNAP_MIN_SCALE = 0.7
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    original_size: Tuple[int, int]
+    size: Tuple[int, int]
+
+
+def _vision_size(width: float, height: float) -> Tuple[float, float]:
+    # Картинка вписывается в 2048x2048, затем короткая сторона уменьшается до 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    return width * scale, height * scale
+
+
+def estimate_vision_tokens(width: int, height: int) -> int:
+    """Оценка стоимости изображения в токенах для detail=high: 85 + 170 за плитку 512x512"""
+    width, height = _vision_size(width, height)
+    return 85 + 170 * math.ceil(width / VISION_TILE) * math.ceil(height / VISION_TILE)
+
+
+def _tile_snap_scale(width: int, height: int) -> float:
+    """
+    Дополнительное уменьшение (не меньше TILE_SNAP_MIN_SCALE), при котором
+    изображение занимает меньше плиток. Узкий обрезанный чек шириной 600-700
+    пикселей иначе тратит целый второй ряд плиток на несколько столбцов.
+    """
+    best_scale, best_tokens = 1.0, estimate_vision_tokens(width, height)
+    for side in _vision_size(width, height):
+        tiles = math.ceil(side / VISION_TILE)
+        if tiles < 2:
+            continue
+        scale = (tiles - 1) * VISION_TILE / side
+        if scale < TILE_SNAP_MIN_SCALE:
+            continue
+        tokens = estimate_vision_tokens(int(width * scale), int(height * scale))
+        if tokens < best_tokens:
+            best_scale, best_tokens = scale, tokens
+    return best_scale
+
+
+def _content_box(image: Image.Image) -> Tuple[int, int, int, int]:
+    """Прямоугольник без однородных полей (фон определяется по краям кадра)"""
+    preview = image.copy()
+    preview.thumbnail((CROP_PREVIEW_SIZE, CROP_PREVIEW_SIZE))
+    width, height = preview.size
+
+    pixels = preview.load()
+    border = [pixels[x, 0] for x in range(width)] + [pixels[x, height - 1] for x in range(width)]
+    border += [pixels[0, y] for y in range(height)] + [pixels[width - 1, y] for y in range(height)]
+    background = sorted(border)[len(border) // 2]
+
+    mask = ImageChops.difference(preview, Image.new("L", preview.size, background))
+    mask = mask.point(lambda value: 255 if value > CROP_THRESHOLD else 0).filter(ImageFilter.MedianFilter(3))
+    box = mask.getbbox()
+    if box is None:
+        return (0, 0) + image.size
+
+    scale_x, scale_y = image.width / width, image.height / height
+    pad_x, pad_y = image.width * CROP_PADDING, image.height * CROP_PADDING
+    left, top, right, bottom = box
+    return (
+        max(0, int(left * scale_x - pad_x)),
+        max(0, int(top * scale_y - pad_y)),
+        min(image.width, int(math.ceil(right * scale_x + pad_x))),
+        min(image.height, int(math.ceil(bottom * scale_y + pad_y))),
+    )
+
+
+def preprocess_receipt_image(data: bytes, long_edge: int = 1600, quality: int = 80, crop: bool = True) -> PreparedImage:
+    """
+    Повернуть по EXIF, перевести в оттенки серого, обрезать поля, уменьшить
+    до long_edge по длинной стороне (и чуть сильнее, если это экономит
+    плитку изображения) и сохранить в JPEG с качеством quality
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        original_size = source.size
+        image = ImageOps.exif_transpose(source).convert("L")
+
+    if crop:
+        box = _content_box(image)
+        cropped_area = (box[2] - box[0]) * (box[3] - box[1])
+        if cropped_area < image.width * image.height * (1 - CROP_MIN_GAIN):
+            image = image.crop(box)
+
+    if max(image.size) > long_edge:
+        image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+
+    scale = _tile_snap_scale(*image.size)
+    if scale < 1.0:
+        image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    return PreparedImage(output.getvalue(), original_size, image.size)
+
+
+class ReceiptImageService:
+    """Подготовка изображений чеков в отдельном потоке, чтобы не блокировать цикл событий"""
+
+    def __init__(self, long_edge: int = 1600, quality: int = 80, crop: bool = True):
+        self.long_edge = long_edge
+        self.quality = quality
+        self.crop = crop
+
+    async def prepare(self, data: bytes) -> bytes:
+        """JPEG для отправки в OpenAI; при ошибке возвращаются исходные байты"""
+        try:
+            prepared = await asyncio.to_thread(preprocess_receipt_image, data, self.long_edge, self.quality, self.crop)
+        except Exception as e:
+            logger.warning(f"Не удалось подготовить изображение чека, отправляем как есть: {e}")
+            return data
+
+        logger.info(
+            f"Чек подготовлен: {len(data) / 1024:.0f} -> {len(prepared.data) / 1024:.0f} КБ, "
+            f"{prepared.original_size[0]}x{prepared.original_size[1]} -> {prepared.size[0]}x{prepared.size[1]}, "
+            f"~{estimate_vision_tokens(*prepared.size)} токенов"
+        )
+        return prepared.data
+
+
+receipt_image_service = ReceiptImageService(
+    long_edge=config.RECEIPT_IMAGE_LONG_EDGE,
+    quality=config.RECEIPT_IMAGE_JPEG_QUALITY,
+    crop=config.RECEIPT_IMAGE_CROP
+)
@@ -0,0 +1,98 @@
+"""
+Сохранение всех транзакций чека одной транзакцией БД
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Category, Transaction
+from services.balance_service import BalanceService
+from services.category_memory_service import CategoryMemoryService
+from services.rollup_service import RollupService
+
+logger = logging.getLogger(__name__)
+
+# Уверенность памяти категорий для автоматически распознанных позиций
+RECEIPT_MEMORY_CONFIDENCE = 0.8
+
+
+class ReceiptIngestService:
+    """
+    Пакетное сохранение распознанных транзакций чека.
+
+    Транзакции, агрегаты (одно обновление на день, категорию и валюту),
+    баланс (одно обновление на валюту) и память категорий записываются в
+    сессии вызывающего кода и фиксируются одним commit: чек сохраняется
+    целиком или не сохраняется вовсе.
+    """
+
+    def __init__(self):
+        self.balance_service = BalanceService()
+        self.memory_service = CategoryMemoryService()
+        self.rollups = RollupService()
+
+    async def ingest(self, db: AsyncSession, user_id: int, categories: List[Category],
+                     transactions: List[Dict]) -> Tuple[List[Transaction], Optional[Category]]:
+        """
+        Сохранить транзакции чека (расходы). Возвращает (транзакции,
+        категория последней транзакции)
+        """
+        categories_by_name = {category.name: category for category in categories}
+        default_category = categories[0] if categories else None
+
+        try:
+            if default_category is None and transactions:
+                # Создаем категорию "Прочее" если нет категорий
+                default_category = Category(name="Прочее", user_id=user_id, is_default=True)
+                db.add(default_category)
+                await db.flush()
+
+            saved_transactions = []
+            category = None
+            balance_deltas = defaultdict(float)
+            now = datetime.now()
+            for transaction_data in transactions:
+                category = categories_by_name.get(transaction_data.get('category'), default_category)
+                amount = -abs(transaction_data['amount'])  # Расходы всегда отрицательные
+
+                saved_transactions.append(Transaction(
+                    user_id=user_id,
+                    amount=amount,
+                    currency=transaction_data['currency'],
+                    description=transaction_data['description'],
+                    category_id=category.id,
+                    created_at=now
+                ))
+                balance_deltas[transaction_data['currency']] += amount
+
+            db.add_all(saved_transactions)
+            await self.rollups.add_transactions(db, saved_transactions)
+
+            for currency, delta in balance_deltas.items():
+                await self.balance_service.add_delta(db, user_id, currency, delta)
+
+            # Повторяющиеся в чеке позиции запоминаются один раз: сессия без autoflush
+            # не видит еще не записанные паттерны
+            memory_records = []
+            remembered = set()
+            for transaction in saved_transactions:
+                key = (self.memory_service.normalize_description(transaction.description or ""), transaction.category_id)
+                if not key[0] or key in remembered:
+                    continue
+                remembered.add(key)
+                memory_records.append(await self.memory_service.stage_category(
+                    db, user_id, transaction.description, transaction.category_id, RECEIPT_MEMORY_CONFIDENCE
+                ))
+
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        self.memory_service.index_records(user_id, memory_records)
+        logger.info(f"Сохранен чек пользователя {user_id}: {len(saved_transactions)} транзакций")
+        return saved_transactions, category
@@ -0,0 +1,280 @@
+"""
+Сервис агрегатов транзакций: дневные сводки (daily_rollups) и месячные
+счетчики расходов по категориям (spend_counters)
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import select, func, case, literal
+
+from database import DailyRollup, SpendCounter, Transaction, increment_upsert
+
+logger = logging.getLogger(__name__)
+
+MONTH = "month"
+NO_CATEGORY = 0
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    """Первое число следующего месяца"""
+    return (_month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def _as_date(value) -> date:
+    # SQLite возвращает date() строкой, PostgreSQL - объектом date
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _deltas(amount: float, sign: int) -> dict:
+    """Приращения колонок сводки для суммы транзакции (sign: +1 учесть, -1 убрать)"""
+    if amount < 0:
+        return {"expense_sum": sign * abs(amount), "expense_count": sign}
+    return {"income_sum": sign * amount, "income_count": sign}
+
+
+class RollupService:
+    """
+    Поддерживает агрегаты транзакций:
+    - daily_rollups: суммы и количество расходов и доходов по
+      (пользователь, день, категория, валюта) - для статистики, графиков
+      и уведомлений;
+    - spend_counters: месячные суммы расходов по категориям - для лимитов.
+
+    Обновления выполняются в сессии вызывающего кода, до его commit,
+    поэтому агрегаты меняются в одной транзакции с самой тратой.
+    """
+
+    async def _apply(self, db, transaction: Transaction, created_at: datetime, increments: dict) -> None:
+        day = created_at.date()
+        dialect_name = db.bind.dialect.name
+
+        await db.execute(increment_upsert(
+            dialect_name,
+            DailyRollup.__table__,
+            key={
+                "user_id": transaction.user_id,
+                "date": day,
+                "category_id": transaction.category_id or NO_CATEGORY,
+                "currency": transaction.currency,
+            },
+            increments=increments
+        ))
+
+        # Лимиты проверяют только расходы с категорией
+        if transaction.category_id is None or ("expense_sum" not in increments and "expense_count" not in increments):
+            return
+
+        await db.execute(increment_upsert(
+            dialect_name,
+            SpendCounter.__table__,
+            key={
+                "user_id": transaction.user_id,
+                "category_id": transaction.category_id,
+                "currency": transaction.currency,
+                "period_type": MONTH,
+                "period_start": _month_start(day),
+            },
+            increments={
+                "spent": increments.get("expense_sum", 0.0),
+                "transactions_count": increments.get("expense_count", 0),
+            }
+        ))
+
+    async def add_transaction(self, db, transaction: Transaction) -> None:
+        """Учесть новую транзакцию"""
+        if transaction.amount is None:
+            return
+        await self._apply(
+            db, transaction, transaction.created_at or datetime.utcnow(),
+            _deltas(transaction.amount, 1)
+        )
+
+    async def add_transactions(self, db, transactions: list) -> None:
+        """Учесть несколько новых транзакций: одно обновление на (день, категория, валюта)"""
+        groups = {}
+        for transaction in transactions:
+            if transaction.amount is None:
+                continue
+            created_at = transaction.created_at or datetime.utcnow()
+            key = (created_at.date(), transaction.category_id, transaction.currency)
+            group = groups.setdefault(key, [transaction, created_at, defaultdict(int)])
+            for name, value in _deltas(transaction.amount, 1).items():
+                group[2][name] += value
+
+        for transaction, created_at, increments in groups.values():
+            await self._apply(db, transaction, created_at, dict(increments))
+
+    async def remove_transaction(self, db, transaction: Transaction) -> None:
+        """Убрать удаляемую транзакцию из агрегатов"""
+        if transaction.amount is None:
+            return
+        await self._apply(db, transaction, transaction.created_at, _deltas(transaction.amount, -1))
+
+    async def change_amount(self, db, transaction: Transaction, old_amount: float) -> None:
+        """Учесть изменение суммы транзакции (transaction.amount уже новая)"""
+        increments = defaultdict(int)
+        for amount, sign in ((old_amount, -1), (transaction.amount, 1)):
+            for name, value in _deltas(amount, sign).items():
+                increments[name] += value
+
+        increments = {name: value for name, value in increments.items() if value}
+        if not increments:
+            return
+        await self._apply(db, transaction, transaction.created_at, increments)
+
+    async def get_spent_since(self, db, user_id: int, category_id: int, currency: str,
+                              since: datetime) -> float:
+        """
+        Сумма расходов категории начиная с since (как created_at >= since).
+
+        Неполный первый день читается из transactions (не больше суток
+        истории), дни до конца первого месяца - из daily_rollups, следующие
+        месяцы - из месячных счетчиков. Все части считаются одним запросом,
+        стоимость не зависит от длины истории.
+        """
+        parts = []
+        first_full_day = since.date()
+
+        if since.time() != time.min:
+            next_midnight = datetime.combine(first_full_day + timedelta(days=1), time.min)
+            parts.append(select(func.coalesce(func.sum(func.abs(Transaction.amount)), 0.0)).where(
+                Transaction.user_id == user_id,
+                Transaction.category_id == category_id,
+                Transaction.currency == currency,
+                Transaction.amount < 0,
+                Transaction.created_at >= since,
+                Transaction.created_at < next_midnight
+            ).scalar_subquery())
+            first_full_day += timedelta(days=1)
+
+        first_month = first_full_day if first_full_day.day == 1 else next_month(first_full_day)
+
+        if first_full_day < first_month:
+            parts.append(select(func.coalesce(func.sum(DailyRollup.expense_sum), 0.0)).where(
+                DailyRollup.user_id == user_id,
+                DailyRollup.category_id == category_id,
+                DailyRollup.currency == currency,
+                DailyRollup.date >= first_full_day,
+                DailyRollup.date < first_month
+            ).scalar_subquery())
+
+        parts.append(select(func.coalesce(func.sum(SpendCounter.spent), 0.0)).where(
+            SpendCounter.user_id == user_id,
+            SpendCounter.category_id == category_id,
+            SpendCounter.currency == currency,
+            SpendCounter.period_type == MONTH,
+            SpendCounter.period_start >= first_month
+        ).scalar_subquery())
+
+        total = literal(0.0)
+        for part in parts:
+            total = total + part
+
+        return float((await db.execute(select(total))).scalar() or 0.0)
+
+
+def _daily_aggregates(connection, user_id: Optional[int] = None):
+    """Дневные суммы из transactions, сгруппированные как в daily_rollups"""
+    day = func.date(Transaction.created_at)
+    is_expense = Transaction.amount < 0
+
+    query = select(
+        Transaction.user_id,
+        day.label("day"),
+        func.coalesce(Transaction.category_id, NO_CATEGORY).label("category_id"),
+        Transaction.currency,
+        func.sum(case((is_expense, -Transaction.amount), else_=0.0)),
+        func.sum(case((is_expense, 1), else_=0)),
+        func.sum(case((is_expense, 0.0), else_=Transaction.amount)),
+        func.sum(case((is_expense, 0), else_=1))
+    ).where(
+        Transaction.amount.isnot(None)
+    ).group_by(
+        Transaction.user_id, day, func.coalesce(Transaction.category_id, NO_CATEGORY), Transaction.currency
+    )
+
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+
+    for row in connection.execute(query):
+        yield (row[0], _as_date(row[1]), *row[2:])
+
+
+def rebuild_daily_rollups(connection, user_id: Optional[int] = None) -> int:
+    """
+    Пересчитать daily_rollups из transactions (синхронно: миграции и скрипты).
+    Возвращает количество записанных строк.
+    """
+    table = DailyRollup.__table__
+    rows = [
+        {
+            "user_id": row_user_id,
+            "date": row_day,
+            "category_id": category_id,
+            "currency": currency,
+            "expense_sum": expense_sum,
+            "expense_count": expense_count,
+            "income_sum": income_sum,
+            "income_count": income_count,
+        }
+        for row_user_id, row_day, category_id, currency, expense_sum, expense_count, income_sum, income_count
+        in _daily_aggregates(connection, user_id)
+    ]
+
+    delete_stmt = table.delete()
+    if user_id is not None:
+        delete_stmt = delete_stmt.where(table.c.user_id == user_id)
+
+    connection.execute(delete_stmt)
+    if rows:
+        connection.execute(table.insert(), rows)
+
+    logger.info(f"Дневные сводки пересчитаны: {len(rows)} строк")
+    return len(rows)
+
+
+def rebuild_spend_counters(connection, user_id: Optional[int] = None) -> int:
+    """
+    Пересчитать месячные счетчики расходов из transactions (синхронно:
+    миграции и скрипты). Возвращает количество записанных корзин.
+    """
+    table = SpendCounter.__table__
+
+    buckets = defaultdict(lambda: [0.0, 0])
+    for row_user_id, row_day, category_id, currency, expense_sum, expense_count, _, _ in _daily_aggregates(connection, user_id):
+        if category_id == NO_CATEGORY or not expense_count:
+            continue
+        key = (row_user_id, category_id, currency, _month_start(row_day))
+        buckets[key][0] += expense_sum
+        buckets[key][1] += expense_count
+
+    delete_stmt = table.delete()
+    if user_id is not None:
+        delete_stmt = delete_stmt.where(table.c.user_id == user_id)
+
+    connection.execute(delete_stmt)
+    if buckets:
+        connection.execute(table.insert(), [
+            {
+                "user_id": key[0],
+                "category_id": key[1],
+                "currency": key[2],
+                "period_type": MONTH,
+                "period_start": key[3],
+                "spent": spent,
+                "transactions_count": count,
+            }
+            for key, (spent, count) in buckets.items()
+        ])
+
+    logger.info(f"Счетчики расходов пересчитаны: {len(buckets)} корзин")
+    return len(buckets)
@@ -0,0 +1,127 @@
+"""
+Распределение пользователей между экземплярами планировщика уведомлений
+через аренду шардов в базе данных
+"""
+
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SchedulerLease, SchedulerWorker, increment_upsert
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ShardLeaseManager:
+    """
+    Аренда шардов пользователей (user_id % shards) экземплярами планировщика.
+
+    Каждый экземпляр на каждом такте продлевает запись о себе в
+    scheduler_workers и по отсортированному списку живых экземпляров
+    вычисляет свою долю шардов (shard % число живых == свой номер). Чужие
+    шарды, не входящие в долю, освобождаются; свои захватываются условным
+    UPDATE, который срабатывает, только если шард свободен, уже принадлежит
+    этому экземпляру или аренда истекла. Поэтому в каждый момент у шарда
+    не больше одного владельца, а шарды упавшего экземпляра переходят к
+    остальным через ttl секунд после его последнего такта.
+
+    ttl должен заметно превышать интервал между тактами.
+    """
+
+    def __init__(self, shards: int = 16, ttl: float = 180, worker_id: Optional[str] = None):
+        self.shards = shards
+        self.ttl = ttl
+        self.worker_id = worker_id or default_worker_id()
+        self._shards_created = False
+
+    async def _create_shards(self, db: AsyncSession) -> None:
+        insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        await db.execute(
+            insert(SchedulerLease.__table__)
+            .values([{"shard": shard} for shard in range(self.shards)])
+            .on_conflict_do_nothing(index_elements=["shard"])
+        )
+        self._shards_created = True
+
+    async def claim(self, db: AsyncSession) -> List[int]:
+        """Продлить аренду, перераспределить шарды и вернуть номера своих шардов"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+
+        try:
+            if not self._shards_created:
+                await self._create_shards(db)
+
+            await db.execute(increment_upsert(
+                db.bind.dialect.name,
+                SchedulerWorker.__table__,
+                key={"worker_id": self.worker_id},
+                increments={},
+                assignments={"expires_at": expires_at}
+            ))
+            # Записи давно упавших экземпляров больше не нужны
+            await db.execute(delete(SchedulerWorker).where(
+                SchedulerWorker.expires_at < now - timedelta(seconds=self.ttl)
+            ))
+
+            workers = (await db.execute(select(SchedulerWorker.worker_id).where(
+                SchedulerWorker.expires_at >= now
+            ).order_by(SchedulerWorker.worker_id))).scalars().all()
+            position = workers.index(self.worker_id)
+            wanted = [shard for shard in range(self.shards) if shard % len(workers) == position]
+
+            # Отдаем шарды, которые теперь принадлежат другим экземплярам
+            await db.execute(update(SchedulerLease).where(
+                SchedulerLease.owner == self.worker_id,
+                SchedulerLease.shard.notin_(wanted)
+            ).values(owner=None, expires_at=None).execution_options(synchronize_session=False))
+
+            await db.execute(update(SchedulerLease).where(
+                SchedulerLease.shard.in_(wanted),
+                or_(
+                    SchedulerLease.owner.is_(None),
+                    SchedulerLease.owner == self.worker_id,
+                    SchedulerLease.expires_at < now
+                )
+            ).values(owner=self.worker_id, expires_at=expires_at).execution_options(synchronize_session=False))
+
+            owned = (await db.execute(select(SchedulerLease.shard).where(
+                SchedulerLease.owner == self.worker_id
+            ).order_by(SchedulerLease.shard))).scalars().all()
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        if len(owned) < len(wanted):
+            logger.info(
+                f"Планировщик {self.worker_id}: шарды {owned}, ожидают освобождения "
+                f"{sorted(set(wanted) - set(owned))}"
+            )
+        return list(owned)
+
+    async def release(self, db: AsyncSession) -> None:
+        """Освободить все шарды экземпляра (при штатной остановке)"""
+        try:
+            await db.execute(update(SchedulerLease).where(
+                SchedulerLease.owner == self.worker_id
+            ).values(owner=None, expires_at=None).execution_options(synchronize_session=False))
+            await db.execute(delete(SchedulerWorker).where(SchedulerWorker.worker_id == self.worker_id))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+    def shard_filter(self, column, shards: List[int]):
+        """Условие "id пользователя попадает в один из шардов" для запросов планировщика"""
+        return (column % self.shards).in_(shards)
@@ -0,0 +1,98 @@
+"""
+Сервис статистики доходов и расходов за период (/stats)
+"""
+
+import logging
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session_scope, Category, DailyRollup
+from services.rollup_service import NO_CATEGORY
+
+logger = logging.getLogger(__name__)
+
+
+class CurrencyTotals(NamedTuple):
+    currency: str
+    income: float
+    expenses: float
+
+
+class CategoryTotals(NamedTuple):
+    name: str
+    total: float  # Сумма по всем валютам - по ней строится топ
+    amounts: Dict[str, float]  # Валюта -> сумма расходов
+
+
+class PeriodStats(NamedTuple):
+    currencies: List[CurrencyTotals]
+    top_categories: List[CategoryTotals]
+
+
+class StatsService:
+    """
+    Считает статистику агрегатными запросами к daily_rollups: один запрос
+    для итогов по валютам и один для топа категорий (с join к categories).
+    Количество запросов не зависит от числа транзакций за период.
+    """
+
+    async def get_period_stats(self, user_id: int, since: date, top_limit: int = 5,
+                               db: Optional[AsyncSession] = None) -> PeriodStats:
+        """Итоги по валютам и топ категорий расходов с даты since"""
+        async with async_session_scope(db) as db:
+            in_period = (
+                DailyRollup.user_id == user_id,
+                DailyRollup.date >= since,
+            )
+
+            currency_rows = (await db.execute(select(
+                DailyRollup.currency,
+                func.sum(DailyRollup.income_sum),
+                func.sum(DailyRollup.expense_sum)
+            ).filter(*in_period).group_by(DailyRollup.currency).having(
+                func.sum(DailyRollup.expense_count + DailyRollup.income_count) > 0
+            ).order_by(DailyRollup.currency))).all()
+
+            if not currency_rows:
+                return PeriodStats([], [])
+
+            # Топ категорий по сумме всех валют, затем разбивка топа по валютам
+            top = select(
+                DailyRollup.category_id,
+                func.sum(DailyRollup.expense_sum).label("total")
+            ).filter(*in_period, DailyRollup.category_id != NO_CATEGORY).group_by(DailyRollup.category_id).having(
+                func.sum(DailyRollup.expense_count) > 0
+            ).order_by(func.sum(DailyRollup.expense_sum).desc()).limit(top_limit).subquery()
+
+            category_rows = (await db.execute(select(
+                Category.id,
+                Category.name,
+                top.c.total,
+                DailyRollup.currency,
+                func.sum(DailyRollup.expense_sum)
+            ).select_from(DailyRollup).join(
+                top, top.c.category_id == DailyRollup.category_id
+            ).join(
+                Category, Category.id == DailyRollup.category_id
+            ).filter(*in_period).group_by(
+                Category.id, Category.name, top.c.total, DailyRollup.currency
+            ).having(
+                func.sum(DailyRollup.expense_count) > 0
+            ).order_by(top.c.total.desc(), Category.id, DailyRollup.currency))).all()
+
+        top_categories = []
+        previous_id = None
+        for category_id, name, total, currency, amount in category_rows:
+            if category_id != previous_id:
+                top_categories.append(CategoryTotals(name, float(total), {}))
+                previous_id = category_id
+            top_categories[-1].amounts[currency] = float(amount)
+
+        return PeriodStats(
+            currencies=[CurrencyTotals(currency, float(income), float(expenses))
+                        for currency, income, expenses in currency_rows],
+            top_categories=top_categories
+        )
@@ -0,0 +1,197 @@
+"""
+Векторизованная похожесть строк по символьным триграммам
+"""
+
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+
+
+def _trigrams(text: str) -> List[str]:
+    padded = f" {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)] if text else []
+
+
+def trigram_similarity(text1: str, text2: str) -> float:
+    """Оценка одной пары строк - то же, что TrigramSimilarityIndex.scores()"""
+    a, b = _trigrams(text1), _trigrams(text2)
+    if not a or not b:
+        return 0.0
+
+    remaining: Dict[str, int] = {}
+    for trigram in b:
+        remaining[trigram] = remaining.get(trigram, 0) + 1
+    common = 0
+    for trigram in a:
+        if remaining.get(trigram):
+            remaining[trigram] -= 1
+            common += 1
+    return 2 * common / (len(a) + len(b))
+
+
+# Сколько строк можно добавить, заменить или удалить после построения
+# матрицы, прежде чем перестроить ее; до этого новые строки оцениваются
+# отдельно от матрицы
+REBUILD_MIN_CHANGES = 32
+REBUILD_CHANGES_SHARE = 0.1
+
+
+class TrigramSimilarityIndex:
+    """
+    Набор строк в виде разреженной матрицы "строка x триграмма" (счетчики).
+
+    Запрос сравнивается со всеми строками сразу: пересечение мультимножеств
+    триграмм считается одной операцией NumPy по столбцам матрицы, оценка -
+    коэффициент Дайса 2*|A∩B| / (|A| + |B|), как и ratio() у difflib.
+
+    Матрица в формате CSC (по триграммам) строится при первом запросе.
+    Строки, добавленные после этого, оцениваются по отдельности, а их
+    прежние версии в матрице исключаются; матрица перестраивается, когда
+    таких изменений становится больше REBUILD_MIN_CHANGES и
+    REBUILD_CHANGES_SHARE от числа строк.
+
+    Оценка приближает SequenceMatcher.ratio(), но не совпадает с ним:
+    опечатка ломает до трех триграмм, поэтому на парах с ratio >= 0.8
+    триграммная оценка в среднем ниже примерно на 0.1. Поэтому индекс
+    используется для отбора top-k кандидатов, а окончательная оценка
+    кандидатов считается через difflib (tests/test_trigram_similarity.py
+    проверяет, что так находится тот же лучший паттерн, что и перебором).
+    """
+
+    def __init__(self):
+        self._vocabulary: Dict[str, int] = {}
+        self._rows: Dict[Hashable, Tuple[np.ndarray, np.ndarray]] = {}
+        # Строки, добавленные после построения матрицы
+        self._pending: Dict[Hashable, Tuple[np.ndarray, np.ndarray]] = {}
+
+        self._keys: List[Hashable] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._stale = np.zeros(0, dtype=bool)  # замененные или удаленные строки матрицы
+        self._stale_count = 0
+        self._row_totals = np.zeros(0)
+        self._column_starts = np.zeros(1, dtype=np.int64)
+        self._row_index = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _encode(self, text: str, grow: bool) -> Tuple[np.ndarray, np.ndarray]:
+        counts: Dict[int, int] = {}
+        for trigram in _trigrams(text):
+            trigram_id = self._vocabulary.get(trigram)
+            if trigram_id is None:
+                if not grow:
+                    # Триграммы, которых нет ни в одной строке, не дают пересечений,
+                    # но учитываются в длине запроса
+                    counts[-1] = counts.get(-1, 0) + 1
+                    continue
+                trigram_id = self._vocabulary[trigram] = len(self._vocabulary)
+            counts[trigram_id] = counts.get(trigram_id, 0) + 1
+        return np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)), \
+            np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+
+    def _exclude_from_matrix(self, key: Hashable) -> None:
+        position = self._positions.pop(key, None)
+        if position is not None:
+            self._stale[position] = True
+            self._stale_count += 1
+
+    def add(self, key: Hashable, text: str) -> None:
+        """Добавить строку или заменить строку с тем же ключом"""
+        row = self._encode(text, grow=True)
+        self._rows[key] = row
+        self._pending[key] = row
+        self._exclude_from_matrix(key)
+
+    def remove(self, key: Hashable) -> None:
+        if self._rows.pop(key, None) is not None:
+            self._pending.pop(key, None)
+            self._exclude_from_matrix(key)
+
+    def _needs_rebuild(self) -> bool:
+        changes = len(self._pending) + self._stale_count
+        return changes > max(REBUILD_MIN_CHANGES, REBUILD_CHANGES_SHARE * len(self._rows))
+
+    def _build(self) -> None:
+        self._keys = list(self._rows)
+        self._positions = {key: position for position, key in enumerate(self._keys)}
+        self._stale = np.zeros(len(self._keys), dtype=bool)
+        self._stale_count = 0
+        self._pending = {}
+        rows = [self._rows[key] for key in self._keys]
+
+        lengths = np.fromiter((len(ids) for ids, _ in rows), dtype=np.int64, count=len(rows))
+        trigram_ids = np.concatenate([ids for ids, _ in rows]) if rows else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate([row_counts for _, row_counts in rows]) if rows else np.zeros(0)
+        row_index = np.repeat(np.arange(len(rows), dtype=np.int64), lengths)
+
+        order = np.argsort(trigram_ids, kind="stable")
+        self._row_index = row_index[order]
+        self._counts = counts[order]
+        self._column_starts = np.concatenate((
+            [0], np.cumsum(np.bincount(trigram_ids, minlength=len(self._vocabulary)))
+        )).astype(np.int64)
+        self._row_totals = np.bincount(row_index, weights=counts, minlength=len(rows))
+
+    def _matrix_scores(self, query_ids: np.ndarray, query_counts: np.ndarray, query_total: float) -> np.ndarray:
+        # Триграммы, появившиеся после построения, в матрице не встречаются
+        in_matrix = query_ids < len(self._column_starts) - 1
+        query_ids, query_counts = query_ids[in_matrix], query_counts[in_matrix]
+
+        # Позиции всех ненулевых элементов нужных столбцов одним массивом
+        starts = self._column_starts[query_ids]
+        lengths = self._column_starts[query_ids + 1] - starts
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = offsets + np.arange(lengths.sum())
+
+        intersection = np.bincount(
+            self._row_index[positions],
+            weights=np.minimum(self._counts[positions], np.repeat(query_counts, lengths)),
+            minlength=len(self._keys)
+        )
+        return 2 * intersection / (query_total + self._row_totals)
+
+    def scores(self, text: str) -> Tuple[List[Hashable], np.ndarray]:
+        """Ключи всех строк и их оценки похожести с text (0..1)"""
+        if self._needs_rebuild():
+            self._build()
+
+        keys = self._keys
+        if self._stale_count:
+            keys = [key for key, stale in zip(self._keys, self._stale) if not stale]
+        keys = keys + list(self._pending)
+
+        query_ids, query_counts = self._encode(text, grow=False)
+        query_total = query_counts.sum()
+        if not keys or not query_total:
+            return keys, np.zeros(len(keys))
+
+        known = query_ids >= 0
+        query_ids, query_counts = query_ids[known], query_counts[known]
+
+        matrix_scores = self._matrix_scores(query_ids, query_counts, query_total)
+        if self._stale_count:
+            matrix_scores = matrix_scores[~self._stale]
+
+        pending_scores = np.zeros(len(self._pending))
+        for position, (ids, counts) in enumerate(self._pending.values()):
+            _, row_positions, query_positions = np.intersect1d(ids, query_ids, assume_unique=True, return_indices=True)
+            intersection = np.minimum(counts[row_positions], query_counts[query_positions]).sum()
+            pending_scores[position] = 2 * intersection / (query_total + counts.sum())
+
+        return keys, np.concatenate((matrix_scores, pending_scores))
+
+    def top_k(self, text: str, k: int = 10, min_score: float = 0.0) -> List[Tuple[Hashable, float]]:
+        """До k самых похожих строк с оценкой не ниже min_score, по убыванию оценки"""
+        keys, scores = self.scores(text)
+        if not keys or k <= 0:
+            return []
+
+        if k < len(keys):
+            selected = np.argpartition(-scores, k - 1)[:k]
+        else:
+            selected = np.arange(len(keys))
+        selected = selected[np.argsort(-scores[selected], kind="stable")]
+
+        return [(keys[i], float(scores[i])) for i in selected if scores[i] > 0 and scores[i] >= min_score]
@@ -0,0 +1,69 @@
+"""
+Параллельная обработка обновлений Telegram с очередностью внутри чата
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных пользователей обрабатываются одновременно (не больше
+    max_concurrent_updates), обновления одного пользователя - по очереди.
+
+    Обработчики хранят состояние диалога в context.user_data (ожидаемый
+    ввод, выбранная категория, незавершенная транзакция) и сбрасывают
+    кэш профиля после изменения пользователя: два обновления одного
+    пользователя, выполняемые вперемешку, перезаписали бы это состояние.
+    Пока обновление пользователя обрабатывается, следующее ждет, не
+    задерживая других пользователей.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # Замок и число обновлений, которые его держат или ждут
+        self._users: Dict[int, list] = {}
+
+    @staticmethod
+    def _user_key(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        key = self._user_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        """Сколько пользователей сейчас обрабатывается и сколько обновлений ждут своей очереди"""
+        return {
+            "max_concurrent_updates": self.max_concurrent_updates,
+            "active_users": len(self._users),
+            "waiting_updates": sum(count - 1 for _, count in self._users.values()),
+        }
@@ -0,0 +1,144 @@
+"""
+Кэш профилей пользователей по telegram_id
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from datetime import time as dt_time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+
+import config
+from database import User
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfile(NamedTuple):
+    """Неизменяемый снимок пользователя: только поля, нужные обработчикам"""
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    name: Optional[str]
+    language: str
+    timezone: str
+    daily_reminder_enabled: bool
+    daily_reminder_time: Optional[dt_time]
+    budget_notifications_enabled: bool
+    budget_notification_frequency: Optional[str]
+    budget_notification_time: Optional[dt_time]
+    salary_date: Optional[int]
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserProfile":
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            username=user.username,
+            name=user.name,
+            language=user.language or "ru",
+            timezone=user.timezone or "Europe/Amsterdam",
+            daily_reminder_enabled=bool(user.daily_reminder_enabled),
+            daily_reminder_time=user.daily_reminder_time,
+            budget_notifications_enabled=bool(user.budget_notifications_enabled),
+            budget_notification_frequency=user.budget_notification_frequency,
+            budget_notification_time=user.budget_notification_time,
+            salary_date=user.salary_date,
+        )
+
+
+class UserProfileCache:
+    """
+    Ограниченный LRU-кэш профилей с TTL.
+
+    Кэш живет внутри процесса: обработчики, изменяющие пользователя, вызывают
+    invalidate(), а TTL ограничивает устаревание, если пользователя изменил
+    другой процесс. Незарегистрированные пользователи не кэшируются, чтобы
+    /start сразу увидел созданную запись.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Растет при каждом invalidate(): загрузка, начатая до сброса, не кэшируется
+        self._generation = 0
+
+    def get(self, telegram_id: int) -> Optional[UserProfile]:
+        """Профиль из кэша или None, если его нет или он устарел"""
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        profile, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[telegram_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return profile
+
+    def put(self, user: User) -> UserProfile:
+        """Сохранить снимок пользователя и вернуть его"""
+        profile = UserProfile.from_user(user)
+        self._entries[profile.telegram_id] = (profile, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(profile.telegram_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        return profile
+
+    def invalidate(self, telegram_id: int) -> None:
+        """Сбросить профиль после изменения пользователя"""
+        self._generation += 1
+        if self._entries.pop(telegram_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_load(self, db, telegram_id: int) -> Optional[UserProfile]:
+        """Профиль из кэша, при промахе - один запрос к users"""
+        profile = self.get(telegram_id)
+        if profile is not None:
+            return profile
+
+        generation = self._generation
+        user = (await db.execute(select(User).filter(User.telegram_id == telegram_id))).scalars().first()
+        if not user:
+            return None
+
+        # Пока шел запрос, другое обновление изменило пользователя: снимок может быть устаревшим
+        if generation != self._generation:
+            return UserProfile.from_user(user)
+        return self.put(user)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов (каждый hit - сэкономленный запрос к БД)"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+user_profile_cache = UserProfileCache(
+    max_size=config.USER_PROFILE_CACHE_SIZE,
+    ttl_seconds=config.USER_PROFILE_CACHE_TTL
+)
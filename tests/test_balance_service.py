@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Тесты атомарного изменения баланса: создание строки, прибавление к
+существующей, отдельные валюты и свежая сумма в возвращаемом объекте
+"""
+
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Balance, Base, User
+from services.balance_service import BalanceService
+import unittest
+
+
+class TestBalanceService(unittest.TestCase):
+    """Тесты BalanceService.add_delta и _apply_and_fetch"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "balances.db")
+        engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def tearDown(self):
+        asyncio.run(self.engine.dispose())
+        shutil.rmtree(self.directory)
+
+    async def create_user(self) -> int:
+        async with self.session_factory() as db:
+            user = User(telegram_id=1)
+            db.add(user)
+            await db.commit()
+            return user.id
+
+    def test_insert_update_and_currencies(self):
+        """Первое изменение создает строку, следующие прибавляются к ней; валюты не смешиваются"""
+        async def scenario():
+            user_id = await self.create_user()
+            service = BalanceService()
+            async with self.session_factory() as db:
+                created = await service.add_income(user_id, 100.0, "EUR", db=db)
+                self.assertEqual(created.amount, 100.0)
+
+                updated = await service.subtract_expense(user_id, 30.5, "EUR", db=db)
+                self.assertIs(updated, created)
+                self.assertAlmostEqual(updated.amount, 69.5)
+
+                usd = await service.add_income(user_id, 5.0, "USD", db=db)
+                self.assertEqual(usd.amount, 5.0)
+                self.assertIsNot(usd, created)
+
+            async with self.session_factory() as db:
+                rows = (await db.execute(select(Balance.currency, Balance.amount).order_by(Balance.currency))).all()
+            self.assertEqual([(currency, round(amount, 6)) for currency, amount in rows], [("EUR", 69.5), ("USD", 5.0)])
+
+        asyncio.run(scenario())
+
+    def test_returned_balance_is_refreshed(self):
+        """Объект баланса, уже загруженный в сессию, получает сумму после upsert"""
+        async def scenario():
+            user_id = await self.create_user()
+            service = BalanceService()
+            async with self.session_factory() as db:
+                loaded = await service.get_or_create_balance(user_id, "EUR", db=db)
+                self.assertEqual(loaded.amount, 0.0)
+
+                # Другая сессия меняет баланс: в Python строка не читается
+                async with self.session_factory() as other:
+                    await service.add_income(user_id, 40.0, "EUR", db=other)
+
+                returned = await service.subtract_expense(user_id, 15.0, "EUR", db=db)
+                self.assertIs(returned, loaded)
+                self.assertAlmostEqual(loaded.amount, 25.0)
+
+        asyncio.run(scenario())
+
+    def test_concurrent_deltas_and_rollback(self):
+        """Одновременные изменения не теряются; add_delta без commit откатывается вместе с транзакцией"""
+        async def scenario():
+            user_id = await self.create_user()
+            service = BalanceService()
+
+            async def spend():
+                async with self.session_factory() as db:
+                    await service.subtract_expense(user_id, 1.0, "EUR", db=db)
+
+            await asyncio.gather(*(spend() for _ in range(20)))
+
+            async with self.session_factory() as db:
+                await service.add_delta(db, user_id, "EUR", 1000.0)
+                await db.rollback()
+                return await service.get_balance(user_id, "EUR", db=db)
+
+        self.assertAlmostEqual(asyncio.run(scenario()), -20.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
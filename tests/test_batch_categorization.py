@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Тесты пакетной категоризации позиций чека: локальные совпадения не
+отправляются модели, остальные описания уходят одним запросом
+"""
+
+import sys
+import os
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import openai_service as module
+from services.openai_service import OpenAIService, MISS
+import unittest
+
+USER_CATEGORIES = ["Продукты", "Транспорт", "Ресторан", "Подарки", "Прочее"]
+
+
+def completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class TestBatchCategorization(unittest.TestCase):
+    """Тесты OpenAIService.categorize_transactions"""
+
+    def setUp(self):
+        self.cache_get = mock.patch.object(module.categorization_cache, "get", mock.AsyncMock(return_value=MISS))
+        self.cache_put = mock.patch.object(module.categorization_cache, "put", mock.AsyncMock())
+        self.cache_get.start()
+        self.put = self.cache_put.start()
+        self.service = OpenAIService()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def categorize(self, descriptions, reply):
+        create = mock.AsyncMock(side_effect=reply)
+        with mock.patch.object(self.service, "_create_chat_completion", create):
+            categories = asyncio.run(self.service.categorize_transactions(descriptions, USER_CATEGORIES))
+        return categories, create
+
+    def test_single_request_for_unknown_items(self):
+        """Все неизвестные описания - один запрос, ответ раскладывается по позициям"""
+        descriptions = ["молоко", "букет цветов", "такси домой", "открытка", "букет цветов", "zzz"]
+        categories, create = self.categorize(
+            descriptions,
+            [completion(json.dumps({"categories": ["Подарки", "Подарки", "Нет такой"]}, ensure_ascii=False))]
+        )
+
+        self.assertEqual(create.await_count, 1)
+        self.assertEqual(categories, ["Продукты", "Подарки", "Транспорт", "Подарки", "Подарки", "Прочее"])
+
+        prompt = create.await_args.kwargs["messages"][1]["content"]
+        self.assertIn("1. букет цветов", prompt)
+        self.assertIn("3. zzz", prompt)
+        self.assertNotIn("молоко", prompt)
+        self.assertEqual(self.put.await_count, 3)
+
+    def test_no_request_when_resolved_locally(self):
+        """Если все позиции определены локально, модель не вызывается"""
+        categories, create = self.categorize(["хлеб", "метро", "ресторан у дома"], [])
+
+        self.assertEqual(create.await_count, 0)
+        self.assertEqual(categories, ["Продукты", "Транспорт", "Ресторан"])
+
+    def test_fallback_is_not_cached(self):
+        """Неполный ответ модели дает "Прочее" и не попадает в кэш"""
+        categories, create = self.categorize(
+            ["букет цветов", "открытка"],
+            [completion(json.dumps({"categories": ["Подарки"]}, ensure_ascii=False))]
+        )
+
+        self.assertEqual(categories, ["Прочее", "Прочее"])
+        self.assertEqual(self.put.await_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Тесты сводки по бюджету: суммы из одного запроса на пачку пользователей
+совпадают с RollupService.get_spent_since для каждого лимита
+"""
+
+import sys
+import os
+import asyncio
+import random
+import shutil
+import tempfile
+from datetime import date, datetime, time, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Category, Limit, Transaction, User
+from services import budget_digest
+from services.budget_digest import BudgetDigestService, last_salary_date, next_salary_date, render_budget_digest
+from services.rollup_service import RollupService
+import unittest
+
+NOW = pytz.utc.localize(datetime(2026, 3, 10, 21, 30))
+
+
+class TestBudgetDigest(unittest.TestCase):
+    """Тесты BudgetDigestService"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "digest.db")
+        engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def tearDown(self):
+        asyncio.run(self.engine.dispose())
+        shutil.rmtree(self.directory)
+
+    async def populate(self, db):
+        """Пользователи с разными днями зарплаты и часовыми поясами, траты за три месяца"""
+        rng = random.Random(3)
+        rollups = RollupService()
+        users = []
+        for number, (salary_day, timezone) in enumerate([
+            (1, "Europe/Amsterdam"), (10, "Europe/Amsterdam"), (10, "Asia/Tokyo"),
+            (25, "Europe/Moscow"), (31, "America/New_York"), (15, "Europe/Amsterdam")
+        ]):
+            user = User(telegram_id=1000 + number, timezone=timezone, salary_date=salary_day)
+            db.add(user)
+            await db.flush()
+            categories = [Category(name=f"Категория {n}", emoji="🛒" if n else None, user_id=user.id) for n in range(3)]
+            db.add_all(categories)
+            await db.flush()
+            users.append(user)
+
+            # У последнего пользователя нет лимитов
+            if number < 5:
+                for category in categories[:2]:
+                    db.add(Limit(user_id=user.id, category_id=category.id, amount=500.0, currency="EUR"))
+                db.add(Limit(user_id=user.id, category_id=categories[2].id, amount=300.0, currency="USD"))
+
+            transactions = []
+            for _ in range(60):
+                transactions.append(Transaction(
+                    user_id=user.id,
+                    category_id=rng.choice(categories).id,
+                    amount=rng.choice([-1, -1, -1, 1]) * round(rng.uniform(1, 50), 2),
+                    currency=rng.choice(["EUR", "EUR", "USD"]),
+                    created_at=datetime(2026, 1, 1) + timedelta(minutes=rng.randrange(0, 69 * 24 * 60))
+                ))
+            db.add_all(transactions)
+            await rollups.add_transactions(db, transactions)
+        await db.commit()
+        return users
+
+    def test_matches_per_limit_queries(self):
+        """Остаток по каждому лимиту такой же, как при подсчете по одному лимиту"""
+        async def scenario():
+            async with self.session_factory() as db:
+                users = await self.populate(db)
+                digests = await BudgetDigestService().build(db, users, NOW)
+
+                expected = {}
+                rollups = RollupService()
+                for user in users:
+                    today = NOW.astimezone(pytz.timezone(user.timezone)).date()
+                    since = datetime.combine(last_salary_date(today, user.salary_date), time.min)
+                    limits = await db.execute(
+                        Limit.__table__.select().where(Limit.user_id == user.id).order_by(Limit.id)
+                    )
+                    expected[user.id] = [
+                        round(await rollups.get_spent_since(db, user.id, limit.category_id, limit.currency, since), 6)
+                        for limit in limits
+                    ]
+                return users, digests, expected
+
+        users, digests, expected = asyncio.run(scenario())
+
+        self.assertNotIn(users[-1].id, digests)
+        for user in users[:-1]:
+            digest = digests[user.id]
+            self.assertEqual([round(limit.spent, 6) for limit in digest.limits], expected[user.id])
+            self.assertEqual(len(digest.limits), 3)
+        self.assertTrue(any(limit.spent > 0 for digest in digests.values() for limit in digest.limits))
+
+        # В Амстердаме еще 10 марта (день зарплаты), в Токио уже 11-е
+        self.assertEqual(digests[users[1].id].next_salary, date(2026, 4, 10))
+        self.assertEqual(digests[users[2].id].next_salary, date(2026, 4, 10))
+        self.assertEqual(digests[users[2].id].today, date(2026, 3, 11))
+        self.assertIn("Статус бюджета", render_budget_digest(digests[users[0].id]))
+
+    def test_batches(self):
+        """Большие волны делятся на пачки без потери пользователей"""
+        async def scenario():
+            async with self.session_factory() as db:
+                users = await self.populate(db)
+                original = budget_digest.DIGEST_BATCH_SIZE
+                budget_digest.DIGEST_BATCH_SIZE = 2
+                try:
+                    return await BudgetDigestService().build(db, users, NOW)
+                finally:
+                    budget_digest.DIGEST_BATCH_SIZE = original
+
+        self.assertEqual(len(asyncio.run(scenario())), 5)
+
+    def test_salary_dates(self):
+        """День зарплаты больше длины месяца переносится на последний день"""
+        self.assertEqual(next_salary_date(date(2026, 1, 31), 31), date(2026, 2, 28))
+        self.assertEqual(next_salary_date(date(2026, 12, 20), 10), date(2027, 1, 10))
+        self.assertEqual(last_salary_date(date(2026, 3, 5), 31), date(2026, 2, 28))
+        self.assertEqual(last_salary_date(date(2026, 1, 5), 10), date(2025, 12, 10))
+        self.assertEqual(last_salary_date(date(2026, 3, 10), 10), date(2026, 3, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
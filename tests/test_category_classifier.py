@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Тесты локального классификатора категорий: обучение на истории в фоне,
+предсказание и дообучение счетчиками в транзакции вызывающего кода
+"""
+
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Category, CategoryFeatureCount, CategoryModel, Transaction, User
+from services.category_classifier import CategoryClassifier, DOCUMENTS_FEATURE, NaiveBayesModel
+import unittest
+
+HISTORY = [
+    ("пятерочка продукты", 0), ("продукты перекресток", 0), ("молоко хлеб пятерочка", 0),
+    ("такси домой", 1), ("такси в аэропорт", 1), ("яндекс такси", 1),
+]
+
+
+class TestCategoryClassifier(unittest.TestCase):
+    """Тесты NaiveBayesModel и CategoryClassifier"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "classifier.db")
+        engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def tearDown(self):
+        asyncio.run(self.engine.dispose())
+        shutil.rmtree(self.directory)
+
+    def test_model_predicts_and_round_trips(self):
+        """Модель предсказывает категорию и восстанавливается из строк счетчиков"""
+        classifier = CategoryClassifier()
+        model = NaiveBayesModel()
+        for description, category_id in HISTORY * 5:
+            model.learn(classifier.features(description), category_id)
+
+        category_id, probability = model.predict(classifier.features("такси до работы"))
+        self.assertEqual(category_id, 1)
+        self.assertGreater(probability, 0.9)
+        # Незнакомые слова: категория не предлагается
+        self.assertIsNone(model.predict(classifier.features("кинотеатр")))
+
+        restored = NaiveBayesModel.from_counts(model.to_counts())
+        self.assertEqual(restored.documents, model.documents)
+        self.assertEqual(restored.predict(classifier.features("продукты")), model.predict(classifier.features("продукты")))
+
+    def test_background_training_and_learning(self):
+        """Первое обращение обучает модель в фоне, дообучение видно другим экземплярам"""
+        async def scenario():
+            async with self.session_factory() as db:
+                user_id, category_ids = await self._populate(db)
+
+            classifier = CategoryClassifier(min_documents=30)
+            classifier.train = self._bind(classifier)
+            async with self.session_factory() as db:
+                # Модели еще нет: ответа нет, обучение запущено в фоне
+                self.assertIsNone(await classifier.predict(user_id, "такси до работы", category_ids, db=db))
+            await asyncio.gather(*classifier._training.values())
+
+            async with self.session_factory() as db:
+                prediction = await classifier.predict(user_id, "такси до работы", category_ids, db=db)
+                self.assertEqual(prediction[0], category_ids[1])
+                # Повторное обучение не выполняется: история уже учтена
+                self.assertFalse(await classifier.train(user_id, db=db))
+
+                # Дообучение фиксируется commit вызывающего кода; модель в памяти
+                # после rollback остается равной счетчикам в базе
+                await classifier.learn(user_id, "самокат", category_ids[1], db=db)
+                await db.rollback()
+                self.assertEqual(await self._documents(db, user_id, category_ids[1]), 18)
+                self.assertEqual(classifier._models[user_id][0].documents[category_ids[1]], 18)
+
+                await classifier.learn(user_id, "самокат", category_ids[1], db=db)
+                self.assertEqual(classifier._models[user_id][0].documents[category_ids[1]], 18)
+                await db.commit()
+                self.assertEqual(await self._documents(db, user_id, category_ids[1]), 19)
+                self.assertEqual(classifier._models[user_id][0].documents[category_ids[1]], 19)
+                self.assertEqual((await db.get(CategoryModel, user_id)).documents, 37)
+
+            # Другой экземпляр бота загружает модель из счетчиков
+            replica = CategoryClassifier(min_documents=30)
+            async with self.session_factory() as db:
+                prediction = await replica.predict(user_id, "самокат такси", category_ids, db=db)
+            self.assertEqual(prediction[0], category_ids[1])
+            self.assertEqual(replica._models[user_id][0].documents[category_ids[1]], 19)
+
+        asyncio.run(scenario())
+
+    def test_expense_committed_after_training_snapshot(self):
+        """Трата, зафиксированная после снимка истории фонового обучения, попадает в модель"""
+        async def scenario():
+            async with self.session_factory() as db:
+                user_id, category_ids = await self._populate(db)
+
+            classifier = CategoryClassifier(min_documents=30)
+            classifier.train = self._bind(classifier)
+            async with self.session_factory() as db:
+                # Модели нет: трата не учитывается сразу, обучение запускается в фоне
+                await classifier.learn(user_id, "самокат", category_ids[1], db=db)
+                await asyncio.gather(*classifier._training.values())
+                self.assertEqual(await self._documents(db, user_id, category_ids[1]), 18)
+
+                # Снимок истории взят до commit траты: после commit модель переобучается
+                db.add(Transaction(user_id=user_id, amount=-3.0, currency="EUR", description="самокат",
+                                   category_id=category_ids[1], created_at=datetime.utcnow()))
+                await db.commit()
+                await asyncio.gather(*classifier._rechecks.values())
+                self.assertEqual(await self._documents(db, user_id, category_ids[1]), 19)
+                self.assertEqual((await db.get(CategoryModel, user_id)).documents, 37)
+            self.assertEqual(classifier._models[user_id][0].documents[category_ids[1]], 19)
+            self.assertEqual(classifier.stats()["trained"], 2)
+
+        asyncio.run(scenario())
+
+    @staticmethod
+    async def _populate(db):
+        user = User(telegram_id=1)
+        db.add(user)
+        await db.flush()
+        categories = [Category(name=name, user_id=user.id) for name in ("Продукты", "Транспорт")]
+        db.add_all(categories)
+        await db.flush()
+        category_ids = [category.id for category in categories]
+        for description, index in HISTORY * 6:
+            db.add(Transaction(user_id=user.id, amount=-10.0, currency="EUR", description=description,
+                               category_id=category_ids[index], created_at=datetime.utcnow()))
+        await db.commit()
+        return user.id, category_ids
+
+    def _bind(self, classifier):
+        """train() в фоне открывает свою сессию: подставляем тестовую базу"""
+        train = classifier.train
+
+        async def train_in_test_database(user_id, db=None, **options):
+            if db is not None:
+                return await train(user_id, db=db, **options)
+            async with self.session_factory() as session:
+                return await train(user_id, db=session, **options)
+        return train_in_test_database
+
+    @staticmethod
+    async def _documents(db, user_id, category_id):
+        return (await db.execute(select(func.coalesce(func.sum(CategoryFeatureCount.count), 0)).where(
+            CategoryFeatureCount.user_id == user_id,
+            CategoryFeatureCount.category_id == category_id,
+            CategoryFeatureCount.feature == DOCUMENTS_FEATURE
+        ))).scalar()
+
+
+if __name__ == '__main__':
+    unittest.main()
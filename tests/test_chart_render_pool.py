@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Тесты пула отрисовки графиков: при параллельной обработке обновлений
+очередь заполняется и лишние графики отклоняются
+"""
+
+import sys
+import os
+import asyncio
+import time
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, ExtBot, TypeHandler
+
+from services.chart_render_pool import ChartRenderPool, ChartRenderQueueFull
+from services.update_processor import PerUserUpdateProcessor
+import unittest
+
+
+class OfflineBot(ExtBot):
+    """Бот без обращений к Telegram при инициализации"""
+
+    async def initialize(self):
+        self._bot_user = User(1, "Bot", True, username="test_bot")
+        self._initialized = True
+
+    async def shutdown(self):
+        self._initialized = False
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, f"user{user_id}", False)
+    message = Message(update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=user, text="/charts")
+    return Update(update_id, message=message)
+
+
+class TestChartRenderPool(unittest.TestCase):
+    """Тесты ChartRenderPool"""
+
+    def test_queue_full_through_application(self):
+        """Шесть пользователей одновременно: один график в работе, два в очереди, три отклонены"""
+        pool = ChartRenderPool(workers=1, max_queue=2)
+        results = {}
+
+        async def handle(update, context):
+            try:
+                # Отрисовка заменена паузой в процессе пула
+                await pool.render(time.sleep, 1.0)
+                results[update.update_id] = "rendered"
+            except ChartRenderQueueFull:
+                results[update.update_id] = "rejected"
+
+        async def scenario():
+            application = (
+                Application.builder()
+                .bot(OfflineBot("1:test"))
+                .updater(None)
+                .concurrent_updates(PerUserUpdateProcessor(8))
+                .build()
+            )
+            application.add_handler(TypeHandler(Update, handle))
+            async with application:
+                await application.start()
+                for number in range(6):
+                    await application.update_queue.put(make_update(number + 1, 100 + number))
+                while len(results) < 6:
+                    await asyncio.sleep(0.05)
+                await application.stop()
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            pool.shutdown()
+
+        self.assertEqual(sorted(results.values()), ["rejected"] * 3 + ["rendered"] * 3)
+        stats = pool.stats()
+        self.assertEqual(stats["rejected"], 3)
+        self.assertEqual(stats["rendered"], 3)
+        self.assertEqual(stats["queue_depth"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Тесты потокового экспорта: CSV, CSV (gzip) и Excel порциями курсора,
+удаление временных файлов при ошибке записи
+"""
+
+import sys
+import os
+import asyncio
+import csv
+import gzip
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Category, Transaction, User
+from services.export_service import COLUMNS, CSV, CSV_GZ, XLSX, ExportService, _XlsxWriter
+import unittest
+
+START = datetime(2026, 3, 1, 9, 30)
+
+
+class TestExportService(unittest.TestCase):
+    """Тесты ExportService.export"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "export.db")
+        engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+        # Временные файлы экспорта и openpyxl создаются в каталоге теста
+        self.export_directory = os.path.join(self.directory, "tmp")
+        os.mkdir(self.export_directory)
+        self.tempdir = patch.object(tempfile, "tempdir", self.export_directory)
+        self.tempdir.start()
+
+    def tearDown(self):
+        self.tempdir.stop()
+        asyncio.run(self.engine.dispose())
+        shutil.rmtree(self.directory)
+
+    async def populate(self) -> int:
+        """25 транзакций: расходы, доходы, без категории; плюс транзакция другого пользователя"""
+        async with self.session_factory() as db:
+            user, other = User(telegram_id=1), User(telegram_id=2)
+            db.add_all([user, other])
+            await db.flush()
+            food = Category(name="Продукты", user_id=user.id)
+            db.add(food)
+            await db.flush()
+            for number in range(25):
+                db.add(Transaction(
+                    user_id=user.id,
+                    category_id=None if number % 5 == 4 else food.id,
+                    amount=100.0 if number % 10 == 0 else -(number + 0.5),
+                    currency="USD" if number % 3 == 0 else "EUR",
+                    description=f"Покупка {number}",
+                    created_at=START + timedelta(hours=number)
+                ))
+            db.add(Transaction(user_id=other.id, amount=-1.0, currency="EUR", description="Чужая", created_at=START))
+            await db.commit()
+            return user.id
+
+    def export(self, user_id: int, export_format: str):
+        async def scenario():
+            async with self.session_factory() as db:
+                # Маленькая порция: файл пишется в несколько приемов
+                return await ExportService(chunk_size=7).export(user_id, export_format, db=db)
+
+        return asyncio.run(scenario())
+
+    def expected_rows(self):
+        rows = []
+        for number in range(25):
+            income = number % 10 == 0
+            rows.append([
+                (START + timedelta(hours=number)).strftime('%Y-%m-%d %H:%M:%S'),
+                'Доход' if income else 'Расход',
+                100.0 if income else number + 0.5,
+                "USD" if number % 3 == 0 else "EUR",
+                'Неизвестно' if number % 5 == 4 else "Продукты",
+                f"Покупка {number}",
+            ])
+        return rows
+
+    def test_csv_and_gzip(self):
+        """CSV и CSV (gzip): заголовок, все строки пользователя в порядке времени"""
+        user_id = asyncio.run(self.populate())
+        for export_format, opener in ((CSV, open), (CSV_GZ, gzip.open)):
+            result = self.export(user_id, export_format)
+            try:
+                self.assertEqual(result.transactions_count, 25)
+                self.assertTrue(result.filename.endswith(".csv.gz" if export_format == CSV_GZ else ".csv"))
+                with opener(result.path, 'rt', encoding='utf-8-sig', newline='') as file:
+                    rows = list(csv.reader(file))
+            finally:
+                os.remove(result.path)
+            self.assertEqual(rows[0], COLUMNS)
+            expected = [[str(value) for value in row] for row in self.expected_rows()]
+            self.assertEqual(rows[1:], expected)
+
+    def test_xlsx(self):
+        """Excel: лист транзакций, статистика по валютам и расходы по категориям"""
+        user_id = asyncio.run(self.populate())
+        result = self.export(user_id, XLSX)
+        try:
+            workbook = load_workbook(result.path, read_only=True)
+            sheets = {name: [list(row) for row in workbook[name].iter_rows(values_only=True)] for name in workbook.sheetnames}
+            workbook.close()
+        finally:
+            os.remove(result.path)
+
+        self.assertEqual(list(sheets), ['Транзакции', 'Статистика', 'По категориям'])
+        self.assertEqual(sheets['Транзакции'], [COLUMNS] + self.expected_rows())
+
+        expenses = [row for row in self.expected_rows() if row[1] == 'Расход']
+        statistics = {row[0]: row[1:] for row in sheets['Статистика'][1:]}
+        self.assertEqual(statistics['Общий доход'], [200, 100])  # EUR, USD
+        self.assertAlmostEqual(statistics['Общие расходы'][0], sum(row[2] for row in expenses if row[3] == "EUR"))
+        self.assertAlmostEqual(statistics['Общие расходы'][1], sum(row[2] for row in expenses if row[3] == "USD"))
+        self.assertEqual([row[0] for row in sheets['По категориям'][1:]], ["Продукты", "Неизвестно"])
+
+    def test_failure_removes_files(self):
+        """Ошибка на середине записи: исключение передается, файл экспорта и временные XML удаляются"""
+        user_id = asyncio.run(self.populate())
+        for export_format in (XLSX, CSV, CSV_GZ):
+            calls = []
+            original = ExportService._format_row
+
+            def failing_format_row(*row):
+                calls.append(row)
+                if len(calls) == 10:
+                    raise RuntimeError("сбой чтения")
+                return original(*row)
+
+            with patch.object(ExportService, "_format_row", staticmethod(failing_format_row)), \
+                    patch.object(_XlsxWriter, "abort", autospec=True, side_effect=_XlsxWriter.abort) as abort:
+                with self.assertRaises(RuntimeError):
+                    self.export(user_id, export_format)
+            self.assertEqual(abort.call_count, 1 if export_format == XLSX else 0)
+            self.assertEqual(os.listdir(self.export_directory), [], export_format)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Тесты локальной категоризации по ключевым словам: автомат Ахо-Корасик
+должен давать те же ответы, что и прежний перебор категорий x слов
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.openai_service import OpenAIService, CATEGORY_KEYWORDS, SUBCATEGORY_KEYWORDS
+from services.keyword_matcher import KeywordMatcher
+import unittest
+
+USER_CATEGORIES = [
+    "Продукты", "Транспорт", "Развлечения", "Здоровье", "Одежда", "Коммунальные услуги",
+    "Ресторан", "Прочее", "Кафе и рестораны", "Продукты питания", "Такси", "Одежда и обувь",
+    "Дом", "Подарки", "Путешествия", "газ",
+]
+USER_SUBCATEGORIES = [
+    "Мясо", "Молочные", "Овощи", "Фрукты", "Хлеб", "Сладости", "Топливо", "Общественный", "Такси",
+    "Парковка", "Ремонт", "Кино", "Спорт", "Игры", "Книги", "Музыка", "Лекарства", "Врач",
+    "Стоматология", "Анализы", "Фастфуд", "Кафе", "Ресторан", "Доставка", "Алкоголь",
+]
+NOISE = ["оплата", "покупка", "чек", "вечером", "с друзьями", "в центре", "онлайн", "12.50", "eur", "x"]
+
+
+def legacy_categorize_locally(description, existing_categories):
+    """Прежняя реализация: каждое ключевое слово каждой категории через `in`"""
+    normalized_categories = {cat.lower(): cat for cat in existing_categories}
+    for category_key, keywords in CATEGORY_KEYWORDS.items():
+        for existing_cat_lower, existing_cat_original in normalized_categories.items():
+            if category_key in existing_cat_lower or existing_cat_lower in category_key:
+                for keyword in keywords:
+                    if keyword in description:
+                        return existing_cat_original
+    for category_key, keywords in CATEGORY_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword in description:
+                for cat in existing_categories:
+                    if category_key.lower() in cat.lower() or cat.lower() in category_key.lower():
+                        return cat
+    return None
+
+
+def legacy_categorize_subcategory_locally(description, category_name, existing_subcategories):
+    category_lower = category_name.lower()
+    for cat_key, subcats in SUBCATEGORY_KEYWORDS.items():
+        if cat_key in category_lower:
+            for subcat_name, keywords in subcats.items():
+                matching_subcategory = None
+                for existing_subcat in existing_subcategories:
+                    if subcat_name.lower() in existing_subcat.lower() or existing_subcat.lower() in subcat_name.lower():
+                        matching_subcategory = existing_subcat
+                        break
+                if matching_subcategory:
+                    for keyword in keywords:
+                        if keyword in description:
+                            return matching_subcategory
+            break
+    return None
+
+
+class TestLocalCategorization(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(14)
+        self.service = OpenAIService.__new__(OpenAIService)
+        keywords = [kw for words in CATEGORY_KEYWORDS.values() for kw in words]
+        keywords += [kw for subcats in SUBCATEGORY_KEYWORDS.values() for words in subcats.values() for kw in words]
+        self.keywords = sorted(set(keywords))
+
+    def _descriptions(self, count):
+        # Каждое ключевое слово отдельно и случайные сочетания с шумом и склейками
+        yield from self.keywords
+        for _ in range(count):
+            parts = self.rng.sample(self.keywords, self.rng.randint(0, 3)) + self.rng.sample(NOISE, self.rng.randint(0, 2))
+            self.rng.shuffle(parts)
+            yield self.rng.choice([" ", "", "-"]).join(parts)
+
+    def test_keyword_matcher_finds_overlapping_keywords(self):
+        """Находятся все группы, включая перекрывающиеся и вложенные слова"""
+        matcher = KeywordMatcher({"a": ["магазин одежды"], "b": ["магазин"], "c": ["зин"], "d": ["нет"]})
+        self.assertEqual(matcher.find("магазин одежды"), ["a", "b", "c"])
+        self.assertEqual(matcher.find("мой магазинчик"), ["b", "c"])
+        self.assertEqual(matcher.find(""), [])
+
+    def test_categorize_locally_matches_legacy(self):
+        """Ответы совпадают с прежним перебором"""
+        for description in self._descriptions(3000):
+            categories = self.rng.sample(USER_CATEGORIES, self.rng.randint(1, len(USER_CATEGORIES)))
+            self.assertEqual(
+                OpenAIService._categorize_locally(description, categories),
+                legacy_categorize_locally(description, categories),
+                f"'{description}' / {categories}"
+            )
+
+    def test_categorize_subcategory_locally_matches_legacy(self):
+        """Ответы для подкатегорий совпадают с прежним перебором"""
+        for description in self._descriptions(3000):
+            category = self.rng.choice(USER_CATEGORIES)
+            subcategories = self.rng.sample(USER_SUBCATEGORIES, self.rng.randint(1, 8))
+            self.assertEqual(
+                self.service._categorize_subcategory_locally(description, category, subcategories),
+                legacy_categorize_subcategory_locally(description, category, subcategories),
+                f"'{description}' / {category} / {subcategories}"
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,11 +7,11 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from services.category_memory_service import CategoryMemoryService
-from database import get_db_session, CategoryMemory
+from services.category_memory_service import CategoryMemoryService, CategoryKeywordIndex, category_keyword_index, _UserIndex
+from database import get_db_session, async_engine, CategoryMemory
 import unittest
 
-class TestMemorySystem(unittest.TestCase):
+class TestMemorySystem(unittest.IsolatedAsyncioTestCase):
     
     def setUp(self):
         """Настройка тестов"""
@@ -25,6 +25,7 @@ class TestMemorySystem(unittest.TestCase):
             db.commit()
         finally:
             db.close()
+        category_keyword_index.invalidate(self.test_user_id)
     
     def tearDown(self):
         """Очистка после тестов"""
@@ -35,6 +36,10 @@ class TestMemorySystem(unittest.TestCase):
         finally:
             db.close()
     
+    async def asyncTearDown(self):
+        """Закрываем соединения асинхронного движка, привязанные к циклу событий теста"""
+        await async_engine.dispose()
+    
     def test_normalize_description(self):
         """Тест нормализации описаний"""
         test_cases = [
@@ -49,7 +54,7 @@ class TestMemorySystem(unittest.TestCase):
             result = self.memory_service.normalize_description(input_text)
             self.assertEqual(result, expected, f"Ошибка для '{input_text}': ожидалось '{expected}', получено '{result}'")
     
-    def test_remember_and_suggest(self):
+    async def test_remember_and_suggest(self):
         """Тест запоминания и предложения категорий"""
         # Временно понижаем порог для теста
         original_threshold = self.memory_service.min_confidence
@@ -57,7 +62,7 @@ class TestMemorySystem(unittest.TestCase):
         
         try:
             # Запоминаем связь
-            self.memory_service.remember_category(
+            await self.memory_service.remember_category(
                 user_id=self.test_user_id,
                 description="продукты в супермаркете",
                 category_id=1,
@@ -65,7 +70,7 @@ class TestMemorySystem(unittest.TestCase):
             )
             
             # Проверяем предложение для похожего описания
-            suggestion = self.memory_service.suggest_category(
+            suggestion = await self.memory_service.suggest_category(
                 user_id=self.test_user_id,
                 description="продукты в магазине"
             )
@@ -97,6 +102,19 @@ class TestMemorySystem(unittest.TestCase):
         text3 = "совсем другой текст"
         similarity2 = self.memory_service.calculate_similarity(text1, text3)
         self.assertLess(similarity2, 0.3, "Разные тексты должны иметь низкую схожесть")
+    
+    def test_keyword_index_lru(self):
+        """Индексы давно не обращавшихся пользователей вытесняются первыми"""
+        index = CategoryKeywordIndex(max_users=2)
+        index.set(1, _UserIndex())
+        index.set(2, _UserIndex())
+        index.get(1)
+        index.set(3, _UserIndex())
+        
+        self.assertIsNotNone(index.get(1))
+        self.assertIsNone(index.get(2))
+        self.assertIsNotNone(index.get(3))
+        self.assertEqual(index.stats()["evictions"], 1)
 
 def run_tests():
     """Запуск всех тестов"""
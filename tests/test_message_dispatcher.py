@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Тесты очереди исходящих сообщений: ограничения скорости, RetryAfter и повторы
+"""
+
+import sys
+import os
+import asyncio
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import Forbidden, RetryAfter, TimedOut
+
+from services.message_dispatcher import MessageDispatcher
+import unittest
+
+
+class FakeBot:
+    """Записывает время отправок; errors[chat_id] - исключения для первых попыток"""
+
+    def __init__(self, errors=None, delay=0.0):
+        self.errors = errors or {}
+        self.delay = delay
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.delay)
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+        return text
+
+
+class TestMessageDispatcher(unittest.TestCase):
+    """Тесты MessageDispatcher"""
+
+    def run_dispatcher(self, bot, messages, **options):
+        async def scenario():
+            dispatcher = MessageDispatcher(**options)
+            dispatcher.start(bot)
+            started = time.monotonic()
+            results = await asyncio.gather(
+                *(dispatcher.send(chat_id, text) for chat_id, text in messages), return_exceptions=True
+            )
+            await dispatcher.stop()
+            return results, time.monotonic() - started, dispatcher.stats()
+        return asyncio.run(scenario())
+
+    def test_global_rate(self):
+        """Не больше global_rate сообщений в секунду после начального запаса"""
+        messages = [(chat_id, "hi") for chat_id in range(30)]
+        results, elapsed, stats = self.run_dispatcher(FakeBot(), messages, workers=8, global_rate=50)
+
+        self.assertEqual(results, ["hi"] * 30)
+        self.assertEqual(stats["sent"], 30)
+        # 50 маркеров в запасе: ограничение начинает действовать только с 51-го
+        self.assertLess(elapsed, 0.5)
+
+        messages = [(chat_id, "hi") for chat_id in range(40)]
+        _, elapsed, _ = self.run_dispatcher(FakeBot(), messages, workers=8, global_rate=20)
+        self.assertGreaterEqual(elapsed, 0.9)
+
+    def test_chat_rate(self):
+        """Сообщения в один чат идут не чаще chat_rate после chat_burst подряд"""
+        bot = FakeBot()
+        messages = [(1, f"m{n}") for n in range(5)] + [(2, "other")]
+        _, elapsed, _ = self.run_dispatcher(bot, messages, workers=4, chat_rate=10, chat_burst=2)
+
+        times = [sent_at for chat_id, _, sent_at in bot.sent if chat_id == 1]
+        self.assertEqual(len(times), 5)
+        self.assertGreaterEqual(times[-1] - times[0], 0.25)
+        # Другой чат не ждет очереди первого
+        other = next(sent_at for chat_id, _, sent_at in bot.sent if chat_id == 2)
+        self.assertLess(other - times[0], 0.05)
+
+    def test_retry_after_and_network_errors(self):
+        """RetryAfter и сетевые ошибки повторяются, остальные ошибки - нет"""
+        bot = FakeBot(errors={1: [RetryAfter(1)], 2: [TimedOut(), TimedOut()], 3: [Forbidden("blocked")]})
+        results, elapsed, stats = self.run_dispatcher(
+            bot, [(1, "a"), (2, "b"), (3, "c")], workers=3, max_retries=3
+        )
+
+        self.assertEqual(results[:2], ["a", "b"])
+        self.assertIsInstance(results[2], Forbidden)
+        self.assertGreaterEqual(elapsed, 1.0)
+        self.assertEqual(stats["flood_waits"], 1)
+        self.assertEqual(stats["retried"], 3)
+        self.assertEqual(stats["failed"], 1)
+
+    def test_retries_exhausted(self):
+        """После max_retries повторов ошибка передается вызывающему коду"""
+        bot = FakeBot(errors={1: [TimedOut(), TimedOut(), TimedOut()]})
+        results, _, stats = self.run_dispatcher(bot, [(1, "a")], max_retries=1)
+
+        self.assertIsInstance(results[0], TimedOut)
+        self.assertEqual(stats["sent"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Тесты миграций схемы: баланс в каждой валюте (миграция 6) на SQLite со
+старой схемой balances и замена ограничения в PostgreSQL
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from database import Base, SchemaMigration
+from migrations import MIGRATIONS, run_migrations
+import unittest
+
+# balances до миграции 6: один баланс на пользователя
+OLD_BALANCES = """
+CREATE TABLE balances (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER UNIQUE REFERENCES users (id),
+    amount FLOAT,
+    currency VARCHAR,
+    last_updated DATETIME
+)
+"""
+
+
+class TestBalancesPerCurrency(unittest.TestCase):
+    """Тесты миграции 6"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory, 'old.db')}")
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_sqlite_rebuild(self):
+        """Таблица пересоздается: строки сохраняются, уникален (user_id, currency)"""
+        Base.metadata.create_all(
+            bind=self.engine, tables=[table for table in Base.metadata.sorted_tables if table.name != "balances"]
+        )
+        with self.engine.begin() as conn:
+            conn.execute(text(OLD_BALANCES))
+            conn.execute(text("CREATE INDEX ix_balances_id ON balances (id)"))
+            conn.execute(text("INSERT INTO users (id, telegram_id) VALUES (1, 101), (2, 102)"))
+            conn.execute(text(
+                "INSERT INTO balances (id, user_id, amount, currency, last_updated) VALUES "
+                "(5, 1, 120.5, 'EUR', :now), (9, 2, -3.0, 'USD', :now)"
+            ), {"now": datetime(2026, 1, 1)})
+            with self.assertRaises(IntegrityError):
+                with conn.begin_nested():
+                    conn.execute(text("INSERT INTO balances (user_id, amount, currency) VALUES (1, 1.0, 'USD')"))
+            # Остальные миграции уже применены
+            conn.execute(SchemaMigration.__table__.insert(), [
+                {"version": item.version, "name": item.name} for item in MIGRATIONS if item.version != 6
+            ])
+
+        self.assertEqual(run_migrations(self.engine), [6])
+
+        with self.engine.begin() as conn:
+            rows = conn.execute(text("SELECT id, user_id, amount, currency FROM balances ORDER BY id")).all()
+            self.assertEqual([tuple(row) for row in rows], [(5, 1, 120.5, "EUR"), (9, 2, -3.0, "USD")])
+
+            # Второй баланс пользователя в другой валюте теперь создается, в той же - нет
+            conn.execute(text("INSERT INTO balances (user_id, amount, currency) VALUES (1, 1.0, 'USD')"))
+            with self.assertRaises(IntegrityError):
+                with conn.begin_nested():
+                    conn.execute(text("INSERT INTO balances (user_id, amount, currency) VALUES (1, 2.0, 'EUR')"))
+
+        inspector = inspect(self.engine)
+        self.assertNotIn("balances_old", inspector.get_table_names())
+        unique_columns = [sorted(constraint["column_names"]) for constraint in inspector.get_unique_constraints("balances")]
+        self.assertEqual(unique_columns, [["currency", "user_id"]])
+        self.assertIn("ix_balances_id", {index["name"] for index in inspector.get_indexes("balances")})
+
+    def test_postgresql_constraint_swap(self):
+        """В PostgreSQL снимается уникальность user_id и добавляется (user_id, currency), таблица не пересоздается"""
+        statements = []
+
+        class Connection:
+            def execute(self, statement, *args):
+                statements.append(str(statement))
+
+        @contextmanager
+        def begin():
+            yield Connection()
+
+        engine = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"), begin=begin)
+        next(item for item in MIGRATIONS if item.version == 6).apply(engine)
+
+        self.assertEqual(statements, [
+            "ALTER TABLE balances DROP CONSTRAINT IF EXISTS balances_user_id_key",
+            "ALTER TABLE balances DROP CONSTRAINT IF EXISTS uq_balances_user_currency",
+            "ALTER TABLE balances ADD CONSTRAINT uq_balances_user_currency UNIQUE (user_id, currency)",
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Тесты расчета времени следующих уведомлений в UTC, включая переходы
+на летнее и зимнее время
+"""
+
+import sys
+import os
+from datetime import datetime, time
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.notification_schedule import next_fire_utc, next_budget_notification_utc, refresh_notification_schedule
+import unittest
+
+
+class TestNotificationSchedule(unittest.TestCase):
+    """Тесты next_fire_utc и refresh_notification_schedule"""
+
+    def test_offset_changes_with_dst(self):
+        """Местное время одно и то же, время в UTC сдвигается после перевода часов"""
+        # Europe/Amsterdam: 29.03.2026 переход на летнее время (UTC+1 -> UTC+2)
+        self.assertEqual(next_fire_utc("Europe/Amsterdam", time(20, 0), datetime(2026, 3, 28, 12, 0)),
+                         datetime(2026, 3, 28, 19, 0))
+        self.assertEqual(next_fire_utc("Europe/Amsterdam", time(20, 0), datetime(2026, 3, 28, 19, 0)),
+                         datetime(2026, 3, 29, 18, 0))
+        # 25.10.2026 переход на зимнее время (UTC+2 -> UTC+1)
+        self.assertEqual(next_fire_utc("Europe/Amsterdam", time(20, 0), datetime(2026, 10, 24, 18, 0)),
+                         datetime(2026, 10, 25, 19, 0))
+
+    def test_skipped_and_repeated_local_time(self):
+        """Несуществующее время сдвигается на час, повторяющееся срабатывает один раз"""
+        # 02:30 29.03 нет: срабатывает в 03:30 по летнему времени
+        self.assertEqual(next_fire_utc("Europe/Amsterdam", time(2, 30), datetime(2026, 3, 28, 23, 0)),
+                         datetime(2026, 3, 29, 1, 30))
+        # 02:30 25.10 бывает дважды: срабатывает по второму вхождению
+        fire = next_fire_utc("Europe/Amsterdam", time(2, 30), datetime(2026, 10, 24, 23, 0))
+        self.assertEqual(fire, datetime(2026, 10, 25, 1, 30))
+        self.assertEqual(next_fire_utc("Europe/Amsterdam", time(2, 30), fire), datetime(2026, 10, 26, 1, 30))
+
+    def test_weekly_and_disabled(self):
+        """Еженедельный статус бюджета - в понедельник; выключенные уведомления - None"""
+        user = SimpleNamespace(
+            timezone="Europe/Moscow", daily_reminder_enabled=False, daily_reminder_time=time(21, 0),
+            budget_notifications_enabled=True, budget_notification_time=time(9, 0),
+            budget_notification_frequency="weekly", salary_date=5
+        )
+        # Суббота 17.10.2026 -> понедельник 19.10, 09:00 MSK = 06:00 UTC
+        self.assertEqual(next_budget_notification_utc(user, datetime(2026, 10, 17, 5, 0)), datetime(2026, 10, 19, 6, 0))
+
+        refresh_notification_schedule(user, now=datetime(2026, 10, 17, 5, 0))
+        self.assertIsNone(user.next_daily_reminder_utc)
+        self.assertEqual(user.next_budget_notification_utc, datetime(2026, 10, 19, 6, 0))
+
+        self.assertIsNone(next_fire_utc("Unknown/Zone", time(9, 0), datetime(2026, 10, 17, 5, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Тесты планировщика уведомлений: переполнение очереди исходящих сообщений
+не теряет уведомления, перенос времени не затирает новые настройки,
+остановка не освобождает шарды посреди прохода
+"""
+
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+from datetime import datetime, time, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, User
+from services import notification_scheduler
+from services.message_dispatcher import MessageDispatcher
+from services.notification_scheduler import NotificationScheduler
+from services.scheduler_leases import ShardLeaseManager
+import unittest
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+        return text
+
+
+class TestNotificationScheduler(unittest.TestCase):
+    """Тесты NotificationScheduler"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "scheduler.db")
+        engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+        # Планировщик открывает свои сессии: подставляем тестовую базу
+        self.original_session = notification_scheduler.get_async_db_session
+        notification_scheduler.get_async_db_session = self.session_factory
+
+    def tearDown(self):
+        notification_scheduler.get_async_db_session = self.original_session
+        asyncio.run(self.engine.dispose())
+        shutil.rmtree(self.directory)
+
+    def test_queue_full_keeps_reminders_due(self):
+        """Напоминания, не поместившиеся в очередь, уходят на следующих проходах"""
+        async def scenario():
+            due = datetime.utcnow() - timedelta(minutes=1)
+            async with self.session_factory() as db:
+                db.add_all([
+                    User(telegram_id=100 + number, daily_reminder_enabled=True, daily_reminder_time=time(20, 0),
+                         next_daily_reminder_utc=due)
+                    for number in range(5)
+                ])
+                await db.commit()
+
+            bot = FakeBot()
+            dispatcher = MessageDispatcher(workers=1, global_rate=1000, queue_size=2)
+            dispatcher.start(bot)
+            scheduler = NotificationScheduler(bot, dispatcher=dispatcher, leases=ShardLeaseManager(shards=1))
+
+            # Очередь вмещает два сообщения: остальные три пользователя остаются в ожидании
+            await scheduler._check_daily_reminders([0])
+            async with self.session_factory() as db:
+                waiting = (await db.execute(select(User.telegram_id).filter(
+                    User.next_daily_reminder_utc <= datetime.utcnow()
+                ))).scalars().all()
+            self.assertEqual(len(waiting), 3)
+
+            for _ in range(3):
+                await dispatcher._queue.join()
+                await scheduler._check_daily_reminders([0])
+            await dispatcher.stop()
+
+            self.assertEqual(sorted(bot.sent), [100 + number for number in range(5)])
+            async with self.session_factory() as db:
+                upcoming = (await db.execute(select(User.next_daily_reminder_utc))).scalars().all()
+            self.assertTrue(all(moment > datetime.utcnow() for moment in upcoming))
+
+        asyncio.run(scenario())
+
+    def test_advance_keeps_changed_settings(self):
+        """Перенос не затирает время, которое пользователь изменил после выборки"""
+        async def scenario():
+            now = datetime.utcnow()
+            async with self.session_factory() as db:
+                db.add_all([
+                    User(telegram_id=200 + number, daily_reminder_enabled=True, daily_reminder_time=time(20, 0),
+                         next_daily_reminder_utc=now - timedelta(minutes=1))
+                    for number in range(3)
+                ])
+                await db.commit()
+
+            scheduler = NotificationScheduler(FakeBot(), dispatcher=MessageDispatcher(),
+                                              leases=ShardLeaseManager(shards=1))
+            changed = now + timedelta(hours=5)
+            async with self.session_factory() as db:
+                due_users, _ = await scheduler._select_due(db, User.next_daily_reminder_utc, [0], now)
+                async with self.session_factory() as other:
+                    user = await other.get(User, due_users[0].id)
+                    user.next_daily_reminder_utc = changed
+                    await other.commit()
+                await scheduler._advance(
+                    db, User.next_daily_reminder_utc, notification_scheduler.next_daily_reminder_utc, due_users, now
+                )
+
+            async with self.session_factory() as db:
+                upcoming = (await db.execute(
+                    select(User.next_daily_reminder_utc).order_by(User.id)
+                )).scalars().all()
+            self.assertEqual(upcoming[0], changed)
+            self.assertTrue(all(now < moment < now + timedelta(days=1) for moment in upcoming[1:]))
+            self.assertEqual(upcoming[1], upcoming[2])
+
+        asyncio.run(scenario())
+
+    def test_stop_finishes_pass_before_releasing_shards(self):
+        """Шарды освобождаются только после завершения текущего прохода"""
+        async def scenario():
+            events = []
+            scheduler = NotificationScheduler(FakeBot(), dispatcher=MessageDispatcher(),
+                                              leases=ShardLeaseManager(shards=1, worker_id="test"))
+            in_pass = asyncio.Event()
+
+            async def slow_pass(shards):
+                events.append("pass started")
+                in_pass.set()
+                await asyncio.sleep(0.2)
+                events.append("pass finished")
+
+            async def release(db):
+                events.append("released")
+
+            scheduler._check_daily_reminders = slow_pass
+            scheduler.leases.release = release
+
+            task = asyncio.create_task(scheduler.start())
+            await in_pass.wait()
+            await scheduler.stop(task)
+            self.assertTrue(task.done())
+            return events
+
+        events = asyncio.run(scenario())
+        self.assertEqual(events, ["pass started", "pass finished", "released"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Тесты кэша распознанных чеков: перцептивный хэш, поиск по file_unique_id
+и по похожему снимку, срок жизни записей
+"""
+
+import sys
+import os
+import asyncio
+import io
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, ReceiptCacheEntry, User
+from services.receipt_cache import ReceiptCache, _distance, perceptual_hash
+import unittest
+
+TRANSACTIONS = [{"amount": -12.5, "currency": "EUR", "description": "Продукты"}]
+
+
+def receipt_image(seed: int) -> Image.Image:
+    """Снимок чека: строки "текста" разной длины, размытые, как на фото"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (600, 1200), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(40, 1160, 30):
+        x = 40
+        while x < 520:
+            width = rng.randint(10, 120)
+            draw.rectangle([x, row, x + width, row + 14], fill="black")
+            x += width + rng.randint(10, 40)
+    return image.filter(ImageFilter.GaussianBlur(2))
+
+
+def encode(image: Image.Image, image_format: str = "PNG", **options) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+class TestReceiptCache(unittest.TestCase):
+    """Тесты perceptual_hash и ReceiptCache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "receipts.db")
+        engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def tearDown(self):
+        asyncio.run(self.engine.dispose())
+        shutil.rmtree(self.directory)
+
+    def test_perceptual_hash(self):
+        """Пересжатый и уменьшенный снимок близок к исходному, другой чек - далек"""
+        original = receipt_image(1)
+        original_hash = perceptual_hash(encode(original))
+        self.assertEqual(len(original_hash), 256)
+
+        resent = original.resize((300, 600))
+        self.assertLessEqual(_distance(original_hash, perceptual_hash(encode(resent, "JPEG", quality=60))), 48)
+        self.assertGreater(_distance(original_hash, perceptual_hash(encode(receipt_image(2)))), 200)
+
+    def test_find_and_put(self):
+        """Поиск по file_unique_id, по похожему снимку и промах; записи других пользователей не видны"""
+        async def scenario():
+            cache = ReceiptCache(max_distance=48)
+            async with self.session_factory() as db:
+                users = [User(telegram_id=1), User(telegram_id=2)]
+                db.add_all(users)
+                await db.commit()
+                user_id, other_id = users[0].id, users[1].id
+
+                image_hash = await cache.image_hash(encode(receipt_image(1)))
+                await cache.put(user_id, "file-1", image_hash, TRANSACTIONS, db=db)
+
+                by_file = await cache.find_by_file(user_id, "file-1", db=db)
+                self.assertEqual(by_file.transactions, TRANSACTIONS)
+                self.assertIsNone(await cache.find_by_file(user_id, "file-2", db=db))
+                self.assertIsNone(await cache.find_by_file(other_id, "file-1", db=db))
+
+                resent_hash = await cache.image_hash(encode(receipt_image(1).resize((300, 600)), "JPEG", quality=60))
+                similar = await cache.find_similar(user_id, resent_hash, db=db)
+                self.assertEqual(similar.transactions, TRANSACTIONS)
+
+                other_hash = await cache.image_hash(encode(receipt_image(2)))
+                self.assertIsNone(await cache.find_similar(user_id, other_hash, db=db))
+                self.assertIsNone(await cache.find_similar(other_id, resent_hash, db=db))
+                # Нечитаемое изображение: хэша нет, поиск по снимку - промах
+                self.assertIsNone(await cache.image_hash(b"not an image"))
+                self.assertIsNone(await cache.find_similar(user_id, None, db=db))
+
+                # find() сначала ищет по файлу, затем по снимку
+                self.assertIsNotNone(await cache.find(user_id, file_unique_id="file-3", image_hash=resent_hash, db=db))
+            return cache.stats()
+
+        stats = asyncio.run(scenario())
+        # Промахи find_by_file не считаются: за ним следует поиск по снимку
+        self.assertEqual(stats, {"file_hits": 1, "hash_hits": 2, "misses": 3})
+
+    def test_expired_entries(self):
+        """Записи старше ttl_seconds не находятся и удаляются при сохранении нового чека"""
+        async def scenario():
+            cache = ReceiptCache(ttl_seconds=3600)
+            async with self.session_factory() as db:
+                user = User(telegram_id=1)
+                db.add(user)
+                await db.commit()
+
+                db.add(ReceiptCacheEntry(
+                    user_id=user.id, file_unique_id="old", image_hash=None, transactions="[]",
+                    created_at=datetime.utcnow() - timedelta(hours=2)
+                ))
+                await db.commit()
+                self.assertIsNone(await cache.find_by_file(user.id, "old", db=db))
+
+                await cache.put(user.id, "new", None, TRANSACTIONS, db=db)
+                files = (await db.execute(select(ReceiptCacheEntry.file_unique_id))).scalars().all()
+                self.assertEqual(files, ["new"])
+                return (await db.execute(select(func.count(ReceiptCacheEntry.id)))).scalar()
+
+        self.assertEqual(asyncio.run(scenario()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Тесты сохранения чека: все транзакции, агрегаты, баланс и память категорий
+фиксируются одним commit, ошибка на середине откатывает все
+"""
+
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+from unittest.mock import patch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Balance, Base, Category, CategoryMemory, DailyRollup, SpendCounter, Transaction, User
+from services.receipt_ingest_service import ReceiptIngestService
+import unittest
+
+RECEIPT = [
+    {"amount": 3.2, "currency": "EUR", "description": "Молоко", "category": "Продукты"},
+    {"amount": 1.5, "currency": "EUR", "description": "Хлеб", "category": "Продукты"},
+    {"amount": 12.0, "currency": "EUR", "description": "Шампунь", "category": "Неизвестная"},
+]
+
+
+class TestReceiptIngestService(unittest.TestCase):
+    """Тесты ReceiptIngestService.ingest"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "receipts.db")
+        engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def tearDown(self):
+        asyncio.run(self.engine.dispose())
+        shutil.rmtree(self.directory)
+
+    async def create_user(self) -> int:
+        async with self.session_factory() as db:
+            user = User(telegram_id=1)
+            db.add(user)
+            await db.commit()
+            return user.id
+
+    async def counts(self):
+        async with self.session_factory() as db:
+            return {
+                model.__tablename__: (await db.execute(select(func.count()).select_from(model))).scalar()
+                for model in (Category, Transaction, DailyRollup, SpendCounter, Balance, CategoryMemory)
+            }
+
+    def test_ingest(self):
+        """Позиции сохраняются с категориями, баланс уменьшается на сумму чека"""
+        async def scenario():
+            user_id = await self.create_user()
+            async with self.session_factory() as db:
+                other = Category(name="Разное", user_id=user_id)
+                groceries = Category(name="Продукты", user_id=user_id)
+                db.add_all([other, groceries])
+                await db.commit()
+                saved, category = await ReceiptIngestService().ingest(db, user_id, [other, groceries], RECEIPT)
+                balance = await db.scalar(select(Balance.amount).where(Balance.user_id == user_id))
+            return [t.category_id for t in saved], category.id, (other.id, groceries.id), balance
+
+        category_ids, last_category_id, (other_id, groceries_id), balance = asyncio.run(scenario())
+        # Неизвестная категория заменяется первой категорией пользователя
+        self.assertEqual(category_ids, [groceries_id, groceries_id, other_id])
+        self.assertEqual(last_category_id, other_id)
+        self.assertAlmostEqual(balance, -16.7)
+        counts = asyncio.run(self.counts())
+        self.assertEqual(counts["transactions"], 3)
+        self.assertEqual(counts["category_memory"], 3)
+
+    def test_failure_rolls_back_everything(self):
+        """Ошибка после записи транзакций, агрегатов и баланса: в БД не остается ничего из чека"""
+        async def scenario():
+            user_id = await self.create_user()
+            service = ReceiptIngestService()
+            stage_category = service.memory_service.stage_category
+            calls = []
+
+            async def failing_stage(*args, **kwargs):
+                calls.append(args)
+                if len(calls) == 2:
+                    raise RuntimeError("сбой памяти категорий")
+                return await stage_category(*args, **kwargs)
+
+            with patch.object(service.memory_service, "stage_category", failing_stage), \
+                    patch.object(service.memory_service, "index_records") as index_records:
+                async with self.session_factory() as db:
+                    # Без категорий: "Прочее" создается в той же транзакции
+                    with self.assertRaises(RuntimeError):
+                        await service.ingest(db, user_id, [], RECEIPT)
+                    self.assertFalse(db.in_transaction())
+            index_records.assert_not_called()
+            return len(calls)
+
+        self.assertEqual(asyncio.run(scenario()), 2)
+        self.assertEqual(asyncio.run(self.counts()), {
+            "categories": 0, "transactions": 0, "daily_rollups": 0,
+            "spend_counters": 0, "balances": 0, "category_memory": 0,
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
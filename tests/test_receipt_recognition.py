@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Тесты распознавания чека: транзакция на каждую позицию, категоризация
+позиций одним запросом, один итог чека при нечитаемых позициях
+"""
+
+import sys
+import os
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import openai_service as module
+from services.openai_service import OpenAIService, MISS
+import unittest
+
+USER_CATEGORIES = ["Продукты", "Бытовая химия", "Прочее"]
+
+
+def completion(content) -> SimpleNamespace:
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def receipt(items, total_amount=16.7):
+    return {"currency": "eur", "total_amount": total_amount, "store_name": "Lidl", "date": "2026-03-01", "items": items}
+
+
+class TestReceiptRecognition(unittest.TestCase):
+    """Тесты OpenAIService.process_receipt_photo"""
+
+    def setUp(self):
+        mock.patch.object(module.categorization_cache, "get", mock.AsyncMock(return_value=MISS)).start()
+        mock.patch.object(module.categorization_cache, "put", mock.AsyncMock()).start()
+        mock.patch.object(module.receipt_image_service, "prepare", mock.AsyncMock(return_value=b"jpeg")).start()
+        self.service = OpenAIService()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def process(self, replies):
+        create = mock.AsyncMock(side_effect=replies)
+        with mock.patch.object(self.service, "_create_chat_completion", create):
+            transactions = asyncio.run(self.service.process_receipt_photo(b"photo", USER_CATEGORIES))
+        return transactions, create
+
+    def test_line_items(self):
+        """Каждая позиция - отдельная транзакция; неизвестные позиции категоризируются одним запросом"""
+        items = [
+            {"name": "Молоко", "amount": 3.2},
+            {"name": "Хлеб", "amount": "1,50"},
+            {"name": "Пакет", "amount": 0},
+            {"name": "Шампунь", "amount": 12.0},
+        ]
+        transactions, create = self.process([
+            completion(receipt(items)),
+            completion({"categories": ["Бытовая химия"]}),
+        ])
+
+        self.assertEqual(create.await_count, 2)
+        self.assertEqual(
+            [(t["description"], t["amount"], t["currency"], t["category"]) for t in transactions],
+            [("Молоко", 3.2, "EUR", "Продукты"), ("Хлеб", 1.5, "EUR", "Продукты"),
+             ("Шампунь", 12.0, "EUR", "Бытовая химия")]
+        )
+        # Молоко и хлеб определены локально, модели уходит только шампунь
+        prompt = create.await_args.kwargs["messages"][1]["content"]
+        self.assertIn("1. Шампунь", prompt)
+        self.assertNotIn("Молоко", prompt)
+
+    def test_total_when_items_unusable(self):
+        """Расхождение с итогом, строка скидки или позиции без суммы - одна транзакция на весь чек"""
+        for items in (
+            [{"name": "Молоко", "amount": 3.2}, {"name": "Шампунь", "amount": 12.0}],
+            [{"name": "Молоко", "amount": 3.2}, {"name": "Шампунь", "amount": 14.0}, {"name": "Скидка", "amount": -0.5}],
+            [{"name": "Молоко", "amount": None}],
+            [],
+        ):
+            transactions, create = self.process([completion(receipt(items)), completion({"categories": ["Продукты"]})])
+            self.assertEqual(
+                [(t["description"], t["amount"], t["category"]) for t in transactions],
+                [("Lidl (чек)", 16.7, "Продукты")],
+                items
+            )
+
+    def test_unreadable_receipt(self):
+        """Нет ни позиций, ни итога - транзакций нет, категоризация не вызывается"""
+        transactions, create = self.process([completion(receipt([{"name": "Молоко"}], total_amount=None))])
+        self.assertEqual(transactions, [])
+        self.assertEqual(create.await_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Тесты агрегатов транзакций: инкрементальные daily_rollups и spend_counters
+после добавления, изменения и удаления транзакций совпадают с пересчетом
+из transactions, get_spent_since - с прямой суммой
+"""
+
+import sys
+import os
+import asyncio
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Category, DailyRollup, SpendCounter, Transaction, User
+from services.rollup_service import RollupService, rebuild_daily_rollups, rebuild_spend_counters
+import unittest
+
+START = datetime(2025, 11, 1)
+
+
+class TestRollupService(unittest.TestCase):
+    """Тесты RollupService"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database_path = os.path.join(self.directory, "rollups.db")
+        self.sync_engine = create_engine(f"sqlite:///{database_path}")
+        Base.metadata.create_all(bind=self.sync_engine)
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def tearDown(self):
+        asyncio.run(self.engine.dispose())
+        self.sync_engine.dispose()
+        shutil.rmtree(self.directory)
+
+    async def populate(self, db, rollups):
+        """Транзакции за четыре месяца, затем изменения сумм и удаления"""
+        rng = random.Random(6)
+        user = User(telegram_id=1)
+        db.add(user)
+        await db.flush()
+        categories = [Category(name=f"Категория {n}", user_id=user.id) for n in range(3)]
+        db.add_all(categories)
+        await db.flush()
+
+        transactions = []
+        for number in range(300):
+            # Часть транзакций без категории: они есть в сводках, но не в счетчиках лимитов
+            category = rng.choice(categories) if rng.random() > 0.1 else None
+            transaction = Transaction(
+                user_id=user.id,
+                category_id=category.id if category else None,
+                amount=rng.choice([-1, -1, -1, 1]) * round(rng.uniform(1, 80), 2),
+                currency=rng.choice(["EUR", "EUR", "USD"]),
+                created_at=START + timedelta(minutes=rng.randrange(0, 120 * 24 * 60))
+            )
+            db.add(transaction)
+            transactions.append(transaction)
+            # Одиночное добавление и добавление пачкой
+            if number < 100:
+                await rollups.add_transaction(db, transaction)
+        await rollups.add_transactions(db, transactions[100:])
+        await db.commit()
+
+        for transaction in rng.sample(transactions, 40):
+            old_amount = transaction.amount
+            # В том числе смена знака: расход становится доходом и наоборот
+            transaction.amount = round(rng.uniform(-80, 80), 2) or -1.0
+            await rollups.change_amount(db, transaction, old_amount)
+        for transaction in rng.sample(transactions, 30):
+            await rollups.remove_transaction(db, transaction)
+            await db.delete(transaction)
+        await db.commit()
+        return user, categories
+
+    @staticmethod
+    async def snapshot(db):
+        """Ненулевые строки сводок и счетчиков с округленными суммами"""
+        rollups = {
+            (row.date, row.category_id, row.currency): (
+                round(row.expense_sum, 6), row.expense_count, round(row.income_sum, 6), row.income_count
+            )
+            for row in (await db.execute(select(DailyRollup))).scalars()
+            if row.expense_count or row.income_count
+        }
+        counters = {
+            (row.category_id, row.currency, row.period_start): (round(row.spent, 6), row.transactions_count)
+            for row in (await db.execute(select(SpendCounter))).scalars()
+            if row.transactions_count
+        }
+        return rollups, counters
+
+    def test_matches_rebuild(self):
+        """Инкрементальные агрегаты совпадают с пересчетом из transactions"""
+        async def incremental():
+            async with self.session_factory() as db:
+                await self.populate(db, RollupService())
+                return await self.snapshot(db)
+
+        async def rebuilt():
+            async with self.session_factory() as db:
+                return await self.snapshot(db)
+
+        rollups, counters = asyncio.run(incremental())
+        with self.sync_engine.begin() as connection:
+            rebuild_daily_rollups(connection)
+            rebuild_spend_counters(connection)
+        expected_rollups, expected_counters = asyncio.run(rebuilt())
+
+        self.assertGreater(len(expected_rollups), 100)
+        self.assertEqual(rollups, expected_rollups)
+        self.assertEqual(counters, expected_counters)
+
+    def test_spent_since(self):
+        """Неполный первый день, остаток месяца и несколько полных месяцев"""
+        async def scenario():
+            async with self.session_factory() as db:
+                rollups = RollupService()
+                user, categories = await self.populate(db, rollups)
+                transactions = (await db.execute(select(Transaction))).scalars().all()
+
+                results = []
+                for since in (
+                    datetime(2025, 11, 20, 13, 45),  # середина дня, три с лишним месяца
+                    datetime(2025, 12, 1),  # первое число месяца
+                    datetime(2026, 1, 31, 18, 30),  # середина последнего дня месяца
+                    datetime(2026, 2, 10),  # полночь внутри месяца
+                    datetime(2026, 6, 1),  # после всех транзакций
+                ):
+                    for category in categories:
+                        for currency in ("EUR", "USD"):
+                            expected = sum(
+                                -t.amount for t in transactions
+                                if t.category_id == category.id and t.currency == currency
+                                and t.amount < 0 and t.created_at >= since
+                            )
+                            spent = await rollups.get_spent_since(db, user.id, category.id, currency, since)
+                            results.append((since, spent, expected))
+                return results
+
+        results = asyncio.run(scenario())
+        self.assertTrue(any(expected > 0 for _, _, expected in results))
+        for since, spent, expected in results:
+            self.assertAlmostEqual(spent, expected, places=6, msg=str(since))
+
+
+if __name__ == '__main__':
+    unittest.main()
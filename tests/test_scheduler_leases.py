@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Тесты аренды шардов планировщика: несколько процессов с одним SQLite-файлом
+делят шарды без пересечений, шарды упавшего процесса переходят к остальным
+после истечения аренды, остановленного - сразу
+"""
+
+import sys
+import os
+import asyncio
+import multiprocessing
+import queue
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import SchedulerLease, SchedulerWorker
+from services.scheduler_leases import ShardLeaseManager
+import unittest
+
+SHARDS = 8
+TTL = 2.0
+INTERVAL = 0.1
+
+
+async def _worker_loop(worker_id, database_path, stop, reports):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}", connect_args={"timeout": 30})
+    session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    leases = ShardLeaseManager(shards=SHARDS, ttl=TTL, worker_id=worker_id)
+
+    while not stop.is_set():
+        started = time.time()
+        async with session_factory() as db:
+            owned = await leases.claim(db)
+        reports.put((worker_id, started, time.time(), tuple(owned)))
+        await asyncio.sleep(INTERVAL)
+
+    async with session_factory() as db:
+        await leases.release(db)
+    reports.put((worker_id, time.time(), time.time(), ()))
+    await engine.dispose()
+
+
+def run_worker(worker_id, database_path, stop, reports):
+    """Экземпляр планировщика в отдельном процессе: только аренда шардов"""
+    asyncio.run(_worker_loop(worker_id, database_path, stop, reports))
+
+
+class TestSchedulerLeases(unittest.TestCase):
+    """Тесты ShardLeaseManager с несколькими процессами"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.directory, "leases.db")
+        engine = create_engine(f"sqlite:///{self.database_path}")
+        SchedulerWorker.__table__.create(bind=engine)
+        SchedulerLease.__table__.create(bind=engine)
+        self.engine = engine
+
+        self.context = multiprocessing.get_context("spawn")
+        self.reports = self.context.Queue()
+        self.collected = []
+        self.processes = {}
+
+    def tearDown(self):
+        for process, _ in self.processes.values():
+            process.kill()
+            process.join()
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def start_worker(self, worker_id):
+        stop = self.context.Event()
+        process = self.context.Process(target=run_worker, args=(worker_id, self.database_path, stop, self.reports))
+        process.start()
+        self.processes[worker_id] = (process, stop)
+
+    def drain(self):
+        while True:
+            try:
+                self.collected.append(self.reports.get_nowait())
+            except queue.Empty:
+                return
+
+    def owners(self):
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(SchedulerLease.shard, SchedulerLease.owner)).all()
+        return {shard: owner for shard, owner in rows}
+
+    def wait_for_owners(self, expected, timeout=20.0):
+        """Дождаться, пока все шарды поровну разойдутся между expected"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self.drain()
+            owners = self.owners()
+            counts = defaultdict(int)
+            for owner in owners.values():
+                counts[owner] += 1
+            if (len(owners) == SHARDS and set(counts) == set(expected)
+                    and max(counts.values()) - min(counts.values()) <= 1):
+                return time.time()
+            time.sleep(INTERVAL)
+        self.fail(f"Шарды не распределились между {expected}: {self.owners()}")
+
+    def assert_no_double_ownership(self):
+        """
+        Шард переходит к новому владельцу, только если прежний успел отказаться
+        от него или его аренда истекла: по отчетам процессов (время начала и
+        конца каждого claim)
+        """
+        self.drain()
+        by_worker = defaultdict(list)
+        for worker_id, started, finished, owned in self.collected:
+            by_worker[worker_id].append((started, finished, set(owned)))
+
+        for shard in range(SHARDS):
+            holds = sorted(
+                (started, finished, worker_id)
+                for worker_id, worker_reports in by_worker.items()
+                for started, finished, owned in worker_reports if shard in owned
+            )
+            for (_, _, previous), (started, finished, worker_id) in zip(holds, holds[1:]):
+                if previous == worker_id:
+                    continue
+                previous_holds = [s for s, _, owned in by_worker[previous] if shard in owned and s < finished]
+                released = any(
+                    s < finished and shard not in owned and s > max(previous_holds)
+                    for s, _, owned in by_worker[previous]
+                )
+                expired = finished >= max(previous_holds) + TTL
+                self.assertTrue(
+                    released or expired,
+                    f"Шард {shard} захвачен {worker_id}, пока его держал {previous}"
+                )
+
+    def test_shards_split_and_handoff(self):
+        """Шарды делятся поровну и переходят при падении и остановке процесса"""
+        for worker_id in ("w1", "w2", "w3"):
+            self.start_worker(worker_id)
+        self.wait_for_owners({"w1", "w2", "w3"})
+
+        # Падение: процесс убит, аренда не освобождена
+        crashed_at = time.time()
+        process, _ = self.processes.pop("w2")
+        process.kill()
+        process.join()
+        handed_over_at = self.wait_for_owners({"w1", "w3"})
+        self.assertGreaterEqual(handed_over_at - crashed_at, TTL * 0.9)
+
+        # Штатная остановка: шарды освобождаются сразу
+        stopped_at = time.time()
+        process, stop = self.processes.pop("w3")
+        stop.set()
+        process.join(10)
+        self.wait_for_owners({"w1"})
+        # Быстрее, чем истекла бы аренда
+        self.assertLess(time.time() - stopped_at, TTL)
+
+        self.assert_no_double_ownership()
+
+
+if __name__ == '__main__':
+    unittest.main()
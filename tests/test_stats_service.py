@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Тесты статистики /stats: результаты и количество SQL-запросов
+"""
+
+import sys
+import os
+import random
+from datetime import date, datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from services.stats_service import StatsService
+from services.rollup_service import rebuild_daily_rollups
+from database import (
+    get_db_session, engine, async_engine, create_tables,
+    User, Category, Transaction, DailyRollup, SpendCounter
+)
+import unittest
+
+TEST_TELEGRAM_ID = 999998
+CURRENCIES = ["EUR", "USD"]
+
+
+class TestStatsService(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """Настройка тестов"""
+        create_tables()
+        self._cleanup()
+
+        db = get_db_session()
+        try:
+            user = User(telegram_id=TEST_TELEGRAM_ID, name="Stats test")
+            db.add(user)
+            db.flush()
+            self.user_id = user.id
+
+            self.categories = []
+            for n in range(8):
+                category = Category(user_id=user.id, name=f"Тест {n}")
+                db.add(category)
+                self.categories.append(category)
+            db.commit()
+            self.category_names = {category.id: category.name for category in self.categories}
+        finally:
+            db.close()
+
+        self.rng = random.Random(3)
+        self.transactions = []
+        self.stats_service = StatsService()
+
+    def tearDown(self):
+        """Очистка после тестов"""
+        self._cleanup()
+
+    async def asyncTearDown(self):
+        """Закрываем соединения асинхронного движка, привязанные к циклу событий теста"""
+        await async_engine.dispose()
+
+    def _cleanup(self):
+        db = get_db_session()
+        try:
+            user = db.query(User).filter(User.telegram_id == TEST_TELEGRAM_ID).first()
+            if user:
+                for model in (DailyRollup, SpendCounter, Transaction, Category):
+                    db.query(model).filter(model.user_id == user.id).delete()
+                db.delete(user)
+                db.commit()
+        finally:
+            db.close()
+
+    def _add_transactions(self, count: int):
+        """Добавить случайные транзакции за последние 60 дней и пересчитать сводки"""
+        now = datetime.utcnow()
+        rows = []
+        for _ in range(count):
+            is_income = self.rng.random() < 0.2
+            rows.append({
+                "user_id": self.user_id,
+                "category_id": None if is_income else self.rng.choice(self.categories).id,
+                "amount": self.rng.uniform(100, 500) if is_income else -self.rng.uniform(1, 50),
+                "currency": self.rng.choice(CURRENCIES),
+                "description": "тест",
+                "created_at": now - timedelta(seconds=self.rng.randint(0, 60 * 86400)),
+            })
+        self.transactions.extend(rows)
+
+        with engine.begin() as conn:
+            conn.execute(Transaction.__table__.insert(), rows)
+            rebuild_daily_rollups(conn, self.user_id)
+
+    async def _stats_with_statement_count(self, since: date):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+        try:
+            stats = await self.stats_service.get_period_stats(self.user_id, since)
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+
+        return stats, len(statements)
+
+    def _expected(self, since: date):
+        """Статистика, посчитанная напрямую по транзакциям"""
+        currencies = {}
+        categories = {}
+        for row in self.transactions:
+            if row["created_at"].date() < since:
+                continue
+            income, expenses = currencies.get(row["currency"], (0.0, 0.0))
+            if row["amount"] > 0:
+                income += row["amount"]
+            else:
+                expenses += -row["amount"]
+                amounts = categories.setdefault(self.category_names[row["category_id"]], {})
+                amounts[row["currency"]] = amounts.get(row["currency"], 0.0) + -row["amount"]
+            currencies[row["currency"]] = (income, expenses)
+
+        top = sorted(categories.items(), key=lambda item: sum(item[1].values()), reverse=True)[:5]
+        return currencies, top
+
+    async def test_statement_count_does_not_grow_with_history(self):
+        """Количество запросов не зависит от числа транзакций (нет N+1)"""
+        since = date(2020, 1, 1)
+
+        self._add_transactions(20)
+        _, small_count = await self._stats_with_statement_count(since)
+
+        self._add_transactions(500)
+        _, large_count = await self._stats_with_statement_count(since)
+
+        self.assertLessEqual(small_count, 2)
+        self.assertEqual(small_count, large_count)
+
+    async def test_empty_period(self):
+        """Период без транзакций - один запрос и пустой результат"""
+        self._add_transactions(20)
+        stats, statement_count = await self._stats_with_statement_count(date.today() + timedelta(days=2))
+
+        self.assertEqual(stats.currencies, [])
+        self.assertEqual(stats.top_categories, [])
+        self.assertEqual(statement_count, 1)
+
+    async def test_matches_transactions(self):
+        """Итоги по валютам и топ категорий совпадают с подсчетом по транзакциям"""
+        self._add_transactions(300)
+
+        for since in (date(2020, 1, 1), date.today() - timedelta(days=7)):
+            stats, _ = await self._stats_with_statement_count(since)
+            expected_currencies, expected_top = self._expected(since)
+
+            self.assertEqual({totals.currency for totals in stats.currencies}, set(expected_currencies))
+            for currency, income, expenses in stats.currencies:
+                self.assertAlmostEqual(income, expected_currencies[currency][0], places=6)
+                self.assertAlmostEqual(expenses, expected_currencies[currency][1], places=6)
+
+            self.assertEqual([category.name for category in stats.top_categories],
+                             [name for name, _ in expected_top])
+            for category, (_, amounts) in zip(stats.top_categories, expected_top):
+                self.assertAlmostEqual(category.total, sum(amounts.values()), places=6)
+                self.assertEqual(set(category.amounts), set(amounts))
+                for currency, amount in amounts.items():
+                    self.assertAlmostEqual(category.amounts[currency], amount, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Тесты векторизованной триграммной похожести
+
+Оценки матрицы сверяются с попарным вычислением до погрешности float,
+top-k - с полным перебором. Отбор кандидатов проверяется относительно
+SequenceMatcher.ratio() (difflib), которым память категорий оценивает
+паттерны: если у запроса есть паттерн с ratio >= 0.8, после переоценки
+top-10 по триграммам через difflib находится тот же лучший ratio, что и
+при переборе всех паттернов.
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from difflib import SequenceMatcher
+from services.trigram_similarity import TrigramSimilarityIndex, trigram_similarity
+import unittest
+
+WORDS = (
+    "продукты магазин магазине супермаркет пятерочка перекресток кофе кафе обед ужин такси метро "
+    "бензин аптека лекарства хлеб молоко сыр мясо курица рыба овощи фрукты подарок цветы кино театр "
+    "стрижка парикмахерская спортзал абонемент интернет телефон связь аренда квартира коммуналка "
+    "электричество вода газ ресторан бар пиво вино сигареты книги одежда обувь куртка джинсы"
+).split()
+
+TOP_K = 10
+
+
+class TestTrigramSimilarity(unittest.TestCase):
+
+    def setUp(self):
+        """Детерминированный набор паттернов и запросов"""
+        self.rng = random.Random(7)
+        self.patterns = sorted({self._description() for _ in range(600)})
+        self.index = TrigramSimilarityIndex()
+        for pattern_id, pattern in enumerate(self.patterns):
+            self.index.add(pattern_id, pattern)
+
+    def _description(self) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(1, 4)))
+
+    def _query(self) -> str:
+        base = self.rng.choice(self.patterns)
+        kind = self.rng.random()
+        if kind < 0.5:
+            # Опечатка: замена, пропуск или лишняя буква
+            chars = list(base)
+            position = self.rng.randrange(len(chars))
+            operation = self.rng.random()
+            if operation < 0.33:
+                chars[position] = self.rng.choice("абвгдеклмнопрст")
+            elif operation < 0.66:
+                del chars[position]
+            else:
+                chars.insert(position, self.rng.choice("абвгде"))
+            return "".join(chars)
+        if kind < 0.7:
+            return f"{base} {self.rng.choice(WORDS)}"
+        return self._description()
+
+    def test_matrix_matches_pairwise(self):
+        """Оценки матрицы совпадают с попарным вычислением"""
+        for _ in range(30):
+            query = self._query()
+            keys, scores = self.index.scores(query)
+            for position, pattern_id in enumerate(keys):
+                self.assertAlmostEqual(scores[position], trigram_similarity(query, self.patterns[pattern_id]), places=9)
+
+    def test_top_k_order_and_updates(self):
+        """top_k отсортирован, add заменяет строку, remove убирает ее"""
+        top = self.index.top_k("пятерочка хлеб", k=5)
+        self.assertLessEqual(len(top), 5)
+        self.assertEqual([score for _, score in top], sorted((score for _, score in top), reverse=True))
+
+        self.index.add("new", "пятерочка хлеб")
+        self.assertEqual(self.index.top_k("пятерочка хлеб", k=1), [("new", 1.0)])
+
+        self.index.add("new", "совсем другой текст")
+        self.assertNotEqual(self.index.top_k("пятерочка хлеб", k=1)[0][0], "new")
+
+        self.index.remove("new")
+        self.assertNotIn("new", self.index.scores("совсем другой текст")[0])
+
+    def test_updates_after_build(self):
+        """Строки, добавленные и замененные после построения матрицы, оцениваются без перестроения"""
+        self.index.scores("хлеб")
+        matrix = self.index._row_index
+
+        texts = dict(enumerate(self.patterns))
+        for step in range(20):
+            key = self.rng.choice([f"new{step}", self.rng.randrange(len(self.patterns))])
+            texts[key] = self._description() + " ёжик"
+            self.index.add(key, texts[key])
+        for key in list(texts)[:5]:
+            self.index.remove(key)
+            del texts[key]
+
+        for _ in range(10):
+            query = self._query() + " ёжик"
+            keys, scores = self.index.scores(query)
+            self.assertEqual(sorted(map(str, keys)), sorted(map(str, texts)))
+            for key, score in zip(keys, scores):
+                self.assertAlmostEqual(score, trigram_similarity(query, texts[key]), places=9)
+        self.assertIs(self.index._row_index, matrix)
+
+    def test_top_k_matches_brute_force(self):
+        """top_k выбирает те же строки, что и полный перебор попарных оценок"""
+        for _ in range(60):
+            query = self._query()
+            exact = sorted((trigram_similarity(query, pattern) for pattern in self.patterns), reverse=True)
+            kth = exact[TOP_K - 1]
+
+            top = self.index.top_k(query, k=TOP_K)
+            self.assertEqual(len(top), min(TOP_K, sum(score > 0 for score in exact)))
+            for (pattern_id, score), expected in zip(top, exact):
+                self.assertAlmostEqual(score, expected, places=9)
+            # Все строки с оценкой выше k-й попали в top-k (при равенстве выбор любой)
+            selected = {pattern_id for pattern_id, _ in top}
+            for pattern_id, pattern in enumerate(self.patterns):
+                if trigram_similarity(query, pattern) > kth + 1e-9:
+                    self.assertIn(pattern_id, selected, f"'{query}' / '{pattern}'")
+
+    def test_difflib_rerank_of_top_k(self):
+        """Переоценка top-k через difflib находит глобально лучший по ratio паттерн"""
+        checked = 0
+        for _ in range(120):
+            query = self._query()
+            ratios = [SequenceMatcher(None, query, pattern).ratio() for pattern in self.patterns]
+            best = max(ratios)
+            if best < 0.8:
+                continue
+            checked += 1
+            best_in_top = max(ratios[pattern_id] for pattern_id, _ in self.index.top_k(query, k=TOP_K))
+            self.assertAlmostEqual(best_in_top, best, places=9, msg=f"'{query}'")
+
+        self.assertGreater(checked, 50)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Тесты параллельной обработки обновлений: разные пользователи не ждут
+друг друга, обновления одного пользователя идут по очереди
+"""
+
+import sys
+import os
+import asyncio
+import time
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, ExtBot, TypeHandler
+
+from services.update_processor import PerUserUpdateProcessor
+import unittest
+
+
+class OfflineBot(ExtBot):
+    """Бот без обращений к Telegram при инициализации"""
+
+    async def initialize(self):
+        self._bot_user = User(1, "Bot", True, username="test_bot")
+        self._initialized = True
+
+    async def shutdown(self):
+        self._initialized = False
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, f"user{user_id}", False)
+    message = Message(update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=user, text="кофе 3")
+    return Update(update_id, message=message)
+
+
+class TestUpdateProcessor(unittest.TestCase):
+    """Тесты PerUserUpdateProcessor в Application"""
+
+    def test_users_in_parallel_and_user_in_order(self):
+        """Два пользователя обрабатываются одновременно, два обновления одного - последовательно"""
+        spans = {}
+
+        async def handle(update, context):
+            started = time.monotonic()
+            await asyncio.sleep(0.2)
+            spans[update.update_id] = (started, time.monotonic())
+
+        async def scenario():
+            application = (
+                Application.builder()
+                .bot(OfflineBot("1:test"))
+                .updater(None)
+                .concurrent_updates(PerUserUpdateProcessor(4))
+                .build()
+            )
+            application.add_handler(TypeHandler(Update, handle))
+            async with application:
+                await application.start()
+                started = time.monotonic()
+                for update in (make_update(1, 100), make_update(2, 100), make_update(3, 200)):
+                    await application.update_queue.put(update)
+                while len(spans) < 3:
+                    await asyncio.sleep(0.01)
+                elapsed = time.monotonic() - started
+                stats = application.update_processor.stats()
+                await application.stop()
+            return elapsed, stats
+
+        elapsed, stats = asyncio.run(scenario())
+
+        # Второй пользователь не ждет первого
+        self.assertLess(spans[3][0], spans[1][1])
+        # Второе обновление пользователя начинается после первого
+        self.assertGreaterEqual(spans[2][0], spans[1][1])
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual(stats["active_users"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()